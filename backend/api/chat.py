@@ -1,11 +1,10 @@
 """
 Chat Completions API
 """
-from typing import Dict, Any, Optional
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
-import asyncio
-from fastapi import APIRouter, HTTPException, status, Header, BackgroundTasks
+from fastapi import APIRouter, HTTPException, status, Header
 from fastapi.responses import StreamingResponse
 
 from config import settings
@@ -19,8 +18,10 @@ from core.llm_client import llm_client
 from core.embedding_client import embedding_client
 from core.memory_engine import memory_engine
 from core.response_adapter import response_adapter
-from services.auto_memory_service import get_auto_memory_service
+from core.sse_scanner import SSEDeltaScanner
+from services.extraction_scheduler import extraction_scheduler
 from services.persona_service import get_persona_service
+from services.memory_tool_service import memory_tool_service, ToolCallCollector
 from utils.logger import logger
 from utils.helpers import generate_id
 
@@ -28,87 +29,68 @@ from utils.helpers import generate_id
 router = APIRouter()
 
 
-async def _should_extract_memory_with_context(
-    user_message: str,
-    assistant_response: str,
-    injected_memories: list,
+def _inject_persona_prompt(
+    messages: list,
+    system_prompt: Optional[str],
     persona_id: str
-) -> bool:
+) -> None:
     """
-    结合已注入的记忆，判断是否需要提取新记忆
+    将persona的system_prompt注入到消息列表中（原地修改）
 
     Args:
-        user_message: 用户消息
-        assistant_response: 助手响应
-        injected_memories: 已注入到system prompt中的记忆
+        messages: 消息列表
+        system_prompt: persona的system_prompt
         persona_id: 记忆体ID
-
-    Returns:
-        是否需要提取记忆
     """
-    # 构建已有记忆的摘要
-    memory_summary = ""
-    if injected_memories:
-        memory_lines = []
-        for i, memory in enumerate(injected_memories, 1):
-            content = memory.get('content', '')
-            event_time = memory.get('event_time')
-            time_str = f" ({event_time})" if event_time else ""
-            memory_lines.append(f"{i}. {content}{time_str}")
-        memory_summary = "\n".join(memory_lines)
-    else:
-        memory_summary = "（无）"
-
-    # 构建判断提示词
-    judgment_prompt = f"""请判断以下最新对话是否包含值得记住的新信息。
-
-【已有记忆】
-{memory_summary}
-
-【最新对话】
-用户: {user_message}
-助手: {assistant_response}
-
-【判断标准】
-1. 最新对话中是否包含用户的个人信息（如姓名、电话、邮箱、地址、生日等）
-2. 最新对话中是否包含用户的偏好（如喜欢/不喜欢的东西）
-3. 最新对话中是否包含用户明确要求记住的信息
-4. 最新对话中的信息是否与已有记忆有冲突、补充或更新
-5. 最新对话中是否包含对未来对话有帮助的关键信息
-
-【回答格式】
-请以JSON格式回答，包含以下字段：
-{{
-  "should_extract": true/false,
-  "reason": "简短说明原因（1-2句话）"
-}}
-
-请只返回JSON，不要有其他内容。"""
-
-    # 使用低温度、少token的快速判断
-    try:
-        response = await llm_client.chat_completion(
-            messages=[{"role": "user", "content": judgment_prompt}],
-            temperature=0.1,
-            max_tokens=100,
-            stream=False,
-            response_format={"type": "json_object"}
-        )
-
-        result_text = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+    if not system_prompt:
+        return
+
+    # 查找是否已有system消息
+    has_system = False
+    for msg in messages:
+        if msg.get("role") == "system":
+            logger.info(f"[DEBUG] Found existing system message, appending persona prompt")
+            # 追加到现有的system消息，而不是覆盖
+            # 保留下游程序提供的系统提示词
+            msg["content"] = f"{msg['content']}\n\n{system_prompt}"
+            has_system = True
+            break
+
+    # 如果没有system消息，插入一条
+    if not has_system:
+        logger.info(f"[DEBUG] No system message found, inserting new one")
+        messages.insert(0, {
+            "role": "system",
+            "content": system_prompt
+        })
+
+    # 打印注入的系统提示词
+    logger.info(f"Injected system prompt for persona={persona_id}: {system_prompt}")
+
+
+def _conversation_id(request: ChatCompletionRequest, memory_config: Dict[str, Any]) -> Optional[str]:
+    """
+    读取客户端提供的对话ID（用于按对话批量提取记忆）
 
-        # 解析JSON结果
-        result = json.loads(result_text)
-        should_extract = result.get("should_extract", False)
-        reason = result.get("reason", "")
+    依次使用 memory_config.conversation_id、metadata.conversation_id 和 user 字段
 
-        logger.info(f"Memory extraction judgment: should_extract={should_extract}, reason='{reason}'")
-        return should_extract
+    Args:
+        request: 聊天请求
+        memory_config: 记忆配置
 
-    except Exception as e:
-        logger.error(f"Error in memory extraction judgment: {e}")
-        # 出错时保守处理，仍然提取
-        return True
+    Returns:
+        对话ID，客户端未提供时返回None
+    """
+    extra = request.model_extra or {}
+    metadata = extra.get("metadata")
+    for value in (
+        memory_config.get("conversation_id"),
+        metadata.get("conversation_id") if isinstance(metadata, dict) else None,
+        extra.get("user"),
+    ):
+        if value:
+            return str(value)
+    return None
 
 
 def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
@@ -139,7 +121,6 @@ def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
 @router.post("/chat/completions", response_model=ChatCompletionResponse)
 async def chat_completions(
     request: ChatCompletionRequest,
-    background_tasks: BackgroundTasks,
     authorization: Optional[str] = Header(None)
 ):
     """
@@ -198,12 +179,21 @@ async def chat_completions(
         # 检索相关记忆
         memory_config = request.memory_config or {}
         memories = []  # 初始化memories变量
+        enhanced_messages = [msg.dict() for msg in request.messages]
+
+        # stable模式下先注入persona的system_prompt，使静态内容位于记忆块之前，
+        # 尽可能延长跨轮次字节一致的前缀
+        stable_prefix = memory_engine.injection_order == "stable"
+        if stable_prefix:
+            _inject_persona_prompt(enhanced_messages, system_prompt, persona_id)
+
         if memory_config.get("enabled", True):
             # 检索记忆（内部会自动进行向量化）
             logger.info(f"[DEBUG] Starting memory retrieval: query='{user_message}', persona_id='{persona_id}'")
             memories = await memory_engine.retrieve_memories(
                 query=user_message,
-                persona_id=persona_id
+                persona_id=persona_id,
+                include_cold=memory_config.get("include_cold", False)
             )
             logger.info(f"[DEBUG] Retrieved {len(memories)} memories from memory_engine")
 
@@ -218,36 +208,17 @@ async def chat_completions(
             # 将记忆注入到消息中
             logger.info(f"[DEBUG] Injecting memories into messages")
             enhanced_messages = memory_engine.inject_memory(
-                [msg.dict() for msg in request.messages],
+                enhanced_messages,
                 memories
             )
             logger.info(f"[DEBUG] Enhanced messages count: {len(enhanced_messages)}")
-        else:
-            enhanced_messages = [msg.dict() for msg in request.messages]
 
         # 注入persona的system_prompt（如果有）
-        if system_prompt:
-            # 查找是否已有system消息
-            has_system = False
-            for msg in enhanced_messages:
-                if msg.get("role") == "system":
-                    logger.info(f"[DEBUG] Found existing system message, appending persona prompt")
-                    # 追加到现有的system消息，而不是覆盖
-                    # 保留下游程序提供的系统提示词
-                    msg["content"] = f"{msg['content']}\n\n{system_prompt}"
-                    has_system = True
-                    break
-
-            # 如果没有system消息，插入一条
-            if not has_system:
-                logger.info(f"[DEBUG] No system message found, inserting new one")
-                enhanced_messages.insert(0, {
-                    "role": "system",
-                    "content": system_prompt
-                })
-
-            # 打印注入的系统提示词
-            logger.info(f"Injected system prompt for persona={persona_id}: {system_prompt}")
+        if not stable_prefix:
+            _inject_persona_prompt(enhanced_messages, system_prompt, persona_id)
+
+        # 统计前缀稳定率
+        memory_engine.record_prefix_stability(f"{persona_id}/{llm_model}", enhanced_messages)
 
         # 打印发送给LLM的消息
         logger.info(f"[DEBUG] Sending messages to LLM (persona={persona_id}):")
@@ -263,6 +234,12 @@ async def chat_completions(
                     content = content[:200] + "..."
                 logger.info(f"  {i}. [{role}] {content}")
 
+        # 服务端执行LLM发起的记忆工具调用（memory_config.execute_tools，默认取配置），请求中补充记忆工具定义
+        tools = [tool.dict() for tool in request.tools] if request.tools else None
+        execute_tools = memory_config.get("execute_tools", memory_tool_service.execution_default)
+        if execute_tools:
+            tools = memory_tool_service.merge_tools(tools)
+
         # 调用LLM API
         if request.stream:
             # 流式响应
@@ -273,26 +250,28 @@ async def chat_completions(
                     messages=enhanced_messages,
                     temperature=request.temperature,
                     max_tokens=request.max_tokens,
-                    tools=[tool.dict() for tool in request.tools] if request.tools else None,
+                    tools=tools,
                     tool_choice=request.tool_choice,
                     original_messages=[msg.dict() for msg in request.messages],
                     persona_id=persona_id,
                     llm_model=llm_model,
                     memory_config=memory_config,
-                    user_message=user_message,
                     injected_memories=memories,
+                    execute_tools=execute_tools,
+                    conversation_id=_conversation_id(request, memory_config),
                     **request.model_dump(exclude={'model', 'messages', 'temperature', 'max_tokens', 'stream', 'tools', 'tool_choice', 'memory_config'})  # 透传额外参数
                 ),
                 media_type="text/event-stream"
             )
         else:
             # 非流式响应
-            response_data = await llm_client.chat_completion(
+            response_data = await _complete_chat(
                 messages=enhanced_messages,
+                persona_id=persona_id,
+                execute_tools=execute_tools,
                 temperature=request.temperature,
                 max_tokens=request.max_tokens,
-                stream=False,
-                tools=[tool.dict() for tool in request.tools] if request.tools else None,
+                tools=tools,
                 tool_choice=request.tool_choice,
                 model=llm_model,  # 使用解析出的LLM模型
                 **request.model_dump(exclude={'model', 'messages', 'temperature', 'max_tokens', 'stream', 'tools', 'tool_choice', 'memory_config'})  # 透传额外参数
@@ -317,31 +296,17 @@ async def chat_completions(
             if "choices" in response_data and len(response_data["choices"]) > 0:
                 assistant_response = response_data["choices"][0].get("message", {}).get("content", "")
 
-            # 判断是否需要提取记忆
+            # 按对话累积轮次，批量提交到持久化任务队列进行判断与提取，响应立即返回
             auto_save_enabled = memory_config.get("auto_save", True)
             if auto_save_enabled:
-                logger.info(f"Checking if memory extraction is needed (persona={persona_id})")
-
-                # 使用已注入的记忆进行判断
-                should_extract = await _should_extract_memory_with_context(
-                    user_message=user_message,
+                await extraction_scheduler.add_turn(
+                    messages=[msg.dict() for msg in request.messages],
                     assistant_response=assistant_response,
+                    persona_id=persona_id,
+                    auto_save_enabled=auto_save_enabled,
                     injected_memories=memories,
-                    persona_id=persona_id
+                    conversation_id=_conversation_id(request, memory_config)
                 )
-
-                if should_extract:
-                    logger.info(f"Scheduling memory extraction for persona={persona_id}")
-                    auto_memory_service = get_auto_memory_service()
-                    background_tasks.add_task(
-                        auto_memory_service.extract_and_save_memories,
-                        [msg.dict() for msg in request.messages],
-                        persona_id,
-                        auto_save_enabled
-                    )
-                    logger.info(f"Auto memory extraction task scheduled (persona={persona_id})")
-                else:
-                    logger.info(f"Skipping memory extraction (no new information) for persona={persona_id}")
             else:
                 logger.info(f"Auto memory extraction disabled (persona={persona_id})")
 
@@ -358,6 +323,63 @@ async def chat_completions(
         )
 
 
+def _only_memory_tools(tool_calls: List[Dict[str, Any]]) -> bool:
+    """
+    一轮工具调用是否全部为记忆工具（含客户端工具时整轮交还客户端处理）
+
+    Args:
+        tool_calls: assistant 消息中的工具调用列表
+
+    Returns:
+        是否可以在服务端执行
+    """
+    return bool(tool_calls) and all(
+        memory_tool_service.has_tool((call.get("function") or {}).get("name", ""))
+        for call in tool_calls
+    )
+
+
+async def _complete_chat(
+    messages: list,
+    persona_id: str,
+    execute_tools: bool = False,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    非流式聊天补全
+
+    execute_tools 时在服务端执行LLM发起的记忆工具调用，追加工具结果后继续补全，
+    直到LLM不再调用记忆工具；达到最大轮数时最后一轮以 tool_choice="none" 请求最终回答
+
+    Args:
+        messages: 消息列表
+        persona_id: 记忆体ID（记忆工具的作用范围）
+        execute_tools: 是否在服务端执行记忆工具调用
+        **kwargs: 传给 llm_client.chat_completion 的其他参数
+
+    Returns:
+        最后一轮的API响应
+    """
+    max_rounds = memory_tool_service.max_rounds if execute_tools else 0
+    messages = list(messages)
+    for round_index in range(max_rounds + 1):
+        if execute_tools and round_index == max_rounds:
+            kwargs["tool_choice"] = "none"
+        response_data = await llm_client.chat_completion(messages=messages, stream=False, **kwargs)
+        if round_index == max_rounds:
+            return response_data
+
+        choices = response_data.get("choices") or []
+        message = (choices[0].get("message") or {}) if choices else {}
+        tool_calls = message.get("tool_calls") or []
+        if not _only_memory_tools(tool_calls):
+            return response_data
+
+        messages.append({"role": "assistant", "content": message.get("content"), "tool_calls": tool_calls})
+        messages.extend(await memory_tool_service.execute_tool_calls(tool_calls, persona_id))
+        logger.info(f"Continuing completion after {len(tool_calls)} memory tool calls (persona={persona_id}, round={round_index + 1})")
+
+
 async def _stream_chat_completion(
     messages: list,
     temperature: Optional[float] = None,
@@ -368,8 +390,9 @@ async def _stream_chat_completion(
     persona_id: Optional[str] = None,
     llm_model: Optional[str] = None,
     memory_config: Optional[Dict[str, Any]] = None,
-    user_message: Optional[str] = None,
     injected_memories: Optional[list] = None,
+    execute_tools: bool = False,
+    conversation_id: Optional[str] = None,
     **kwargs  # 支持传递其他参数（如top_k, thinking等）
 ):
     """
@@ -385,40 +408,117 @@ async def _stream_chat_completion(
         persona_id: 记忆体ID（用于记忆提取）
         llm_model: LLM模型名称
         memory_config: 记忆配置（用于记忆提取）
-        user_message: 用户消息（用于记忆提取判断）
         injected_memories: 已注入的记忆（用于记忆提取判断）
+        execute_tools: 是否在服务端执行记忆工具调用（需要逐chunk解析，不使用透传模式）
+        conversation_id: 客户端提供的对话ID（用于记忆提取）
         **kwargs: 其他参数（如top_k, thinking等）
 
     Yields:
-        流式响应的文本片段
+        流式响应的文本片段（透传模式下为上游的原始字节块）
     """
-    assistant_response = ""
     finish_reason = None
     try:
-        async for chunk in llm_client.chat_completion_stream(
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            tools=tools,
-            tool_choice=tool_choice,
-            model=llm_model,
-            **kwargs
-        ):
-            # 直接返回原始chunk数据，保持工具调用信息
-            yield f"data: {json.dumps(chunk)}\n\n"
-            # 收集响应内容和finish_reason
-            if "choices" in chunk and len(chunk["choices"]) > 0:
-                choice = chunk["choices"][0]
-                delta = choice.get("delta", {})
-                if "content" in delta and delta["content"] is not None:
-                    assistant_response += delta["content"]
-                # 记录finish_reason
-                if "finish_reason" in choice and choice["finish_reason"] is not None:
-                    finish_reason = choice["finish_reason"]
-                    logger.info(f"Stream chunk with finish_reason: {finish_reason}")
-
-        # 发送结束标记
-        yield "data: [DONE]\n\n"
+        if execute_tools:
+            # 文本chunk照常转发；含工具调用或finish_reason的chunk先暂存，
+            # 本轮全部是记忆工具调用时在服务端执行并开始下一轮，否则原样转发给客户端
+            response_parts = []
+            round_messages = list(messages)
+            max_rounds = memory_tool_service.max_rounds
+            for round_index in range(max_rounds + 1):
+                collector = ToolCallCollector()
+                round_parts = []
+                held = []
+                round_finish_reason = None
+                async for chunk in llm_client.chat_completion_stream(
+                    messages=round_messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    tools=tools,
+                    tool_choice="none" if round_index == max_rounds else tool_choice,
+                    model=llm_model,
+                    **kwargs
+                ):
+                    if not chunk.get("choices"):
+                        # 无choices的chunk（如include_usage的用量统计）排在finish chunk之后，随暂存chunk一起转发
+                        held.append(chunk)
+                        continue
+                    choice = chunk["choices"][0]
+                    delta = choice.get("delta") or {}
+                    if delta.get("content") is not None:
+                        round_parts.append(delta["content"])
+                    if delta.get("tool_calls"):
+                        collector.add(delta["tool_calls"])
+                    if choice.get("finish_reason") is not None:
+                        round_finish_reason = choice["finish_reason"]
+                    if delta.get("tool_calls") or choice.get("finish_reason") is not None:
+                        held.append(chunk)
+                    else:
+                        yield f"data: {json.dumps(chunk)}\n\n"
+
+                response_parts.extend(round_parts)
+                tool_calls = collector.calls
+                if round_index < max_rounds and _only_memory_tools(tool_calls):
+                    round_messages.append({"role": "assistant", "content": "".join(round_parts) or None, "tool_calls": tool_calls})
+                    round_messages.extend(await memory_tool_service.execute_tool_calls(tool_calls, persona_id))
+                    logger.info(f"Continuing stream after {len(tool_calls)} memory tool calls (persona={persona_id}, round={round_index + 1})")
+                    continue
+
+                for chunk in held:
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                finish_reason = round_finish_reason
+                break
+            assistant_response = "".join(response_parts)
+
+            # 发送结束标记
+            yield "data: [DONE]\n\n"
+        elif llm_client.stream_passthrough:
+            # 透传上游SSE字节，只增量扫描助手文本和finish_reason
+            scanner = SSEDeltaScanner()
+            async for chunk in llm_client.chat_completion_stream_raw(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                tools=tools,
+                tool_choice=tool_choice,
+                model=llm_model,
+                **kwargs
+            ):
+                scanner.feed(chunk)
+                yield chunk
+            scanner.close()
+            assistant_response = scanner.text
+            finish_reason = scanner.finish_reason
+
+            # 上游没有发送结束标记时补发
+            if not scanner.done:
+                yield "data: [DONE]\n\n"
+        else:
+            response_parts = []
+            async for chunk in llm_client.chat_completion_stream(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                tools=tools,
+                tool_choice=tool_choice,
+                model=llm_model,
+                **kwargs
+            ):
+                # 直接返回原始chunk数据，保持工具调用信息
+                yield f"data: {json.dumps(chunk)}\n\n"
+                # 收集响应内容和finish_reason
+                if "choices" in chunk and len(chunk["choices"]) > 0:
+                    choice = chunk["choices"][0]
+                    delta = choice.get("delta", {})
+                    if "content" in delta and delta["content"] is not None:
+                        response_parts.append(delta["content"])
+                    # 记录finish_reason
+                    if "finish_reason" in choice and choice["finish_reason"] is not None:
+                        finish_reason = choice["finish_reason"]
+                        logger.info(f"Stream chunk with finish_reason: {finish_reason}")
+            assistant_response = "".join(response_parts)
+
+            # 发送结束标记
+            yield "data: [DONE]\n\n"
 
         # 只有在finish_reason为"stop"（正常结束）时才触发记忆提取
         # 如果finish_reason是"tool_calls"，说明还有工具调用需要处理，不应该提取记忆
@@ -426,16 +526,14 @@ async def _stream_chat_completion(
             auto_save_enabled = memory_config.get("auto_save", True) if memory_config else True
             if auto_save_enabled:
                 logger.info(f"Stream completed with finish_reason=stop, checking if memory extraction is needed (persona={persona_id})")
-                # 使用asyncio.create_task异步执行记忆提取判断和提取，不阻塞响应
-                asyncio.create_task(
-                    _extract_memory_after_stream(
-                        original_messages=original_messages,
-                        persona_id=persona_id,
-                        auto_save_enabled=auto_save_enabled,
-                        user_message=user_message,
-                        assistant_response=assistant_response,
-                        injected_memories=injected_memories
-                    )
+                # 按对话累积轮次，批量提交到持久化任务队列，不阻塞响应
+                await extraction_scheduler.add_turn(
+                    messages=original_messages,
+                    assistant_response=assistant_response,
+                    persona_id=persona_id,
+                    auto_save_enabled=auto_save_enabled,
+                    injected_memories=injected_memories,
+                    conversation_id=conversation_id
                 )
         elif finish_reason and finish_reason != "stop":
             logger.info(f"Stream completed with finish_reason={finish_reason}, skipping memory extraction (tool calls in progress)")
@@ -443,55 +541,3 @@ async def _stream_chat_completion(
     except Exception as e:
         logger.error(f"Error in streaming chat completion: {e}")
         raise
-
-
-async def _extract_memory_after_stream(
-    original_messages: list,
-    persona_id: str,
-    auto_save_enabled: bool,
-    user_message: Optional[str] = None,
-    assistant_response: Optional[str] = None,
-    injected_memories: Optional[list] = None
-):
-    """
-    流式响应完成后提取记忆
-
-    Args:
-        original_messages: 原始消息列表
-        persona_id: 记忆体ID
-        auto_save_enabled: 是否启用自动保存
-        user_message: 用户消息（用于记忆提取判断）
-        assistant_response: 助手响应（用于记忆提取判断）
-        injected_memories: 已注入的记忆（用于记忆提取判断）
-    """
-    try:
-        # 判断是否需要提取记忆
-        if user_message and assistant_response is not None:
-            should_extract = await _should_extract_memory_with_context(
-                user_message=user_message,
-                assistant_response=assistant_response,
-                injected_memories=injected_memories or [],
-                persona_id=persona_id
-            )
-
-            if should_extract:
-                logger.info(f"Extracting memory after stream (persona={persona_id})")
-                auto_memory_service = get_auto_memory_service()
-                await auto_memory_service.extract_and_save_memories(
-                    messages=original_messages,
-                    persona_id=persona_id,
-                    auto_save_enabled=auto_save_enabled
-                )
-            else:
-                logger.info(f"Skipping memory extraction after stream (no new information) for persona={persona_id}")
-        else:
-            # 如果没有用户消息或助手响应，保守处理，仍然提取
-            logger.info(f"Missing user_message or assistant_response, extracting memory (persona={persona_id})")
-            auto_memory_service = get_auto_memory_service()
-            await auto_memory_service.extract_and_save_memories(
-                messages=original_messages,
-                persona_id=persona_id,
-                auto_save_enabled=auto_save_enabled
-            )
-    except Exception as e:
-        logger.error(f"Error in post-stream memory extraction: {e}")
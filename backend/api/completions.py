@@ -2,45 +2,115 @@
 Completions API
 """
 from typing import Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Header
+from fastapi.responses import StreamingResponse
 
+from config import settings
 from models.schemas import ChatCompletionResponse
 from core.llm_client import llm_client
+from core.memory_engine import memory_engine
 from core.response_adapter import response_adapter
+from core.sse_scanner import SSEDeltaScanner
+from services.persona_service import persona_service
 from utils.logger import logger
 
 
 router = APIRouter()
 
 
+def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
+    """
+    验证API Key权限
+
+    Args:
+        authorization: 从Authorization header中获取的Bearer token
+
+    Raises:
+        HTTPException: 如果API Key验证失败
+    """
+    if settings.API_KEY:
+        # 从 Authorization header 中提取 Bearer token
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Missing or invalid Authorization header. Expected: 'Bearer <token>'"
+            )
+        token = authorization[7:]  # 移除 "Bearer " 前缀
+        if token != settings.API_KEY:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API Key"
+            )
+
+
 @router.post("/completions", response_model=ChatCompletionResponse)
 async def completions(
     prompt: str,
     model: str,
     temperature: Optional[float] = None,
     max_tokens: Optional[int] = None,
-    stream: Optional[bool] = False
+    stream: Optional[bool] = False,
+    persona_id: Optional[str] = None,
+    include_cold: bool = False,
+    authorization: Optional[str] = Header(None)
 ):
     """
     Completions API
     兼容OpenAI风格的文本补全接口
+
+    model参数格式与 /chat/completions 一致：persona_id/llm_model，或只有 persona_id（使用默认LLM模型）；
+    stream=true 时透传上游的SSE流；检索记忆体（persona_id 参数优先，其次为model中的记忆体）的相关记忆并注入到提示文本之前
     """
+    # 验证API Key
+    verify_api_key(authorization)
+
+    # 解析model参数：persona_id/llm_model 或 persona_id
+    model_param = model or settings.DEFAULT_PERSONA_ID
+    if "/" in model_param:
+        model_persona_id, llm_model = model_param.split("/", 1)
+    else:
+        model_persona_id = model_param
+        llm_model = settings.LLM_MODEL  # 使用默认LLM模型
+    persona_id = persona_id or model_persona_id
+
     try:
+        if persona_id:
+            if await persona_service.get_persona(persona_id) is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Persona '{persona_id}' not found. Please create the persona first or use an existing one."
+                )
+            memories = await memory_engine.retrieve_memories(
+                query=prompt,
+                persona_id=persona_id,
+                include_cold=include_cold
+            )
+            prompt = memory_engine.inject_prompt(prompt, memories)
+            logger.info(f"Injected {len(memories)} memories into completion prompt (persona={persona_id})")
+
+        if stream:
+            logger.info(f"Using streaming mode for completion: persona={persona_id}, llm_model={llm_model}")
+            return StreamingResponse(
+                _stream_completion(prompt=prompt, model=llm_model, temperature=temperature, max_tokens=max_tokens),
+                media_type="text/event-stream"
+            )
+
         # 调用LLM API
         response_data = await llm_client.completion(
             prompt=prompt,
             temperature=temperature,
             max_tokens=max_tokens,
-            stream=stream
+            stream=False,
+            model=llm_model
         )
         
         # 适配响应格式
         adapted_response = response_adapter.adapt_chat_completion(
             response_data,
-            model
+            llm_model
         )
         
-        logger.info(f"Completion successful: model={model}")
+        logger.info(f"Completion successful: persona={persona_id}, llm_model={llm_model}")
         return adapted_response
         
     except HTTPException:
@@ -51,3 +121,41 @@ async def completions(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+
+
+async def _stream_completion(
+    prompt: str,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None
+):
+    """
+    流式文本补全（透传上游SSE字节）
+
+    Args:
+        prompt: 提示文本（已注入记忆）
+        model: 模型名称
+        temperature: 温度参数
+        max_tokens: 最大token数
+
+    Yields:
+        上游响应的原始字节块，上游没有发送结束标记时最后补发 [DONE]
+    """
+    scanner = SSEDeltaScanner()
+    try:
+        async for chunk in llm_client.completion_stream_raw(
+            prompt=prompt,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens
+        ):
+            scanner.feed(chunk)
+            yield chunk
+        scanner.close()
+
+        if not scanner.done:
+            yield "data: [DONE]\n\n"
+
+    except Exception as e:
+        logger.error(f"Error in streaming completion: {e}")
+        raise
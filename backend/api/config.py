@@ -3,9 +3,10 @@
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Dict, Any, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from models.database import get_db, Configuration
+from repositories.configuration_repository import ConfigurationRepository
 from models.schemas import (
     ConfigurationCreate,
     ConfigurationResponse,
@@ -15,7 +16,8 @@ from models.schemas import (
 )
 from utils.logger import logger
 from utils.helpers import generate_id
-from config import get_configuration_from_db, update_configuration_in_db
+from config import get_configuration_from_db_async, update_configuration_in_db_async
+from services.config_cache import config_cache
 
 
 router = APIRouter()
@@ -24,18 +26,18 @@ router = APIRouter()
 @router.get("/config", response_model=SystemConfigResponse)
 async def get_system_config():
     """
-    获取系统配置
+    获取系统配置（读取进程内的配置缓存）
     """
     try:
         config = SystemConfigResponse(
-            llm=get_configuration_from_db("llm") or {},
-            embedding=get_configuration_from_db("embedding") or {},
-            memory_extraction=get_configuration_from_db("memory_extraction") or {},
-            memory_system=get_configuration_from_db("memory_system") or {},
-            memory_scoring=get_configuration_from_db("memory_scoring") or {},
-            milvus=get_configuration_from_db("milvus") or {},
-            kuzu=get_configuration_from_db("kuzu") or {},
-            cache=get_configuration_from_db("cache") or {},
+            llm=await get_configuration_from_db_async("llm") or {},
+            embedding=await get_configuration_from_db_async("embedding") or {},
+            memory_extraction=await get_configuration_from_db_async("memory_extraction") or {},
+            memory_system=await get_configuration_from_db_async("memory_system") or {},
+            memory_scoring=await get_configuration_from_db_async("memory_scoring") or {},
+            milvus=await get_configuration_from_db_async("milvus") or {},
+            kuzu=await get_configuration_from_db_async("kuzu") or {},
+            cache=await get_configuration_from_db_async("cache") or {},
         )
         return config
     except Exception as e:
@@ -54,28 +56,28 @@ async def update_system_config(config_update: SystemConfigUpdate):
     try:
         # 更新各个配置
         if config_update.llm is not None:
-            update_configuration_in_db("llm", config_update.llm)
+            await update_configuration_in_db_async("llm", config_update.llm)
         
         if config_update.embedding is not None:
-            update_configuration_in_db("embedding", config_update.embedding)
+            await update_configuration_in_db_async("embedding", config_update.embedding)
         
         if config_update.memory_extraction is not None:
-            update_configuration_in_db("memory_extraction", config_update.memory_extraction)
+            await update_configuration_in_db_async("memory_extraction", config_update.memory_extraction)
         
         if config_update.memory_system is not None:
-            update_configuration_in_db("memory_system", config_update.memory_system)
+            await update_configuration_in_db_async("memory_system", config_update.memory_system)
         
         if config_update.memory_scoring is not None:
-            update_configuration_in_db("memory_scoring", config_update.memory_scoring)
+            await update_configuration_in_db_async("memory_scoring", config_update.memory_scoring)
         
         if config_update.milvus is not None:
-            update_configuration_in_db("milvus", config_update.milvus)
+            await update_configuration_in_db_async("milvus", config_update.milvus)
         
         if config_update.kuzu is not None:
-            update_configuration_in_db("kuzu", config_update.kuzu)
+            await update_configuration_in_db_async("kuzu", config_update.kuzu)
         
         if config_update.cache is not None:
-            update_configuration_in_db("cache", config_update.cache)
+            await update_configuration_in_db_async("cache", config_update.cache)
         
         # 返回更新后的配置
         return await get_system_config()
@@ -94,7 +96,7 @@ async def get_config_by_key(config_key: str):
     根据配置键获取配置
     """
     try:
-        config_value = get_configuration_from_db(config_key)
+        config_value = await get_configuration_from_db_async(config_key)
         if config_value is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -117,7 +119,7 @@ async def update_config_by_key(config_key: str, config_value: Dict[str, Any]):
     根据配置键更新配置
     """
     try:
-        success = update_configuration_in_db(config_key, config_value)
+        success = await update_configuration_in_db_async(config_key, config_value)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -137,17 +139,13 @@ async def update_config_by_key(config_key: str, config_value: Dict[str, Any]):
 @router.get("/config/list", response_model=list[ConfigurationResponse])
 async def list_configurations(
     user_id: Optional[str] = "system",
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     列出所有配置
     """
     try:
-        query = db.query(Configuration)
-        if user_id:
-            query = query.filter(Configuration.user_id == user_id)
-        
-        configs = query.all()
+        configs = await ConfigurationRepository(db).list(user_id)
         
         # 解析配置值
         result = []
@@ -175,17 +173,16 @@ async def list_configurations(
 @router.post("/config", response_model=ConfigurationResponse, status_code=status.HTTP_201_CREATED)
 async def create_configuration(
     config_data: ConfigurationCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     创建新配置
     """
     try:
+        configs = ConfigurationRepository(db)
+
         # 检查配置是否已存在
-        existing_config = db.query(Configuration).filter(
-            Configuration.user_id == config_data.user_id,
-            Configuration.config_key == config_data.config_key
-        ).first()
+        existing_config = await configs.get(config_data.user_id, config_data.config_key)
         
         if existing_config:
             raise HTTPException(
@@ -202,9 +199,10 @@ async def create_configuration(
             description=config_data.description,
         )
         
-        db.add(config)
-        db.commit()
-        db.refresh(config)
+        await configs.add(config)
+        await configs.bump_version()
+        await db.commit()
+        await config_cache.refresh()
         
         logger.info(f"Created configuration: {config_data.config_key} for user {config_data.user_id}")
         
@@ -221,7 +219,7 @@ async def create_configuration(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to create configuration: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -232,15 +230,14 @@ async def create_configuration(
 @router.delete("/config/{config_id}")
 async def delete_configuration(
     config_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     删除配置
     """
     try:
-        config = db.query(Configuration).filter(
-            Configuration.id == config_id
-        ).first()
+        configs = ConfigurationRepository(db)
+        config = await configs.get_by_id(config_id)
         
         if not config:
             raise HTTPException(
@@ -248,8 +245,10 @@ async def delete_configuration(
                 detail=f"Configuration with id '{config_id}' not found"
             )
         
-        db.delete(config)
-        db.commit()
+        await configs.delete(config_id)
+        await configs.bump_version()
+        await db.commit()
+        await config_cache.refresh()
         
         logger.info(f"Deleted configuration: {config_id}")
         
@@ -258,7 +257,7 @@ async def delete_configuration(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to delete configuration: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -275,6 +274,7 @@ async def reinitialize_configurations():
     try:
         from config import initialize_configurations
         initialize_configurations()
+        await config_cache.refresh()
         return {"message": "Configurations reinitialized successfully"}
     except Exception as e:
         logger.error(f"Failed to reinitialize configurations: {e}")
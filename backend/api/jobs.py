@@ -0,0 +1,80 @@
+"""
+Jobs API - 后台任务队列接口
+"""
+from typing import Dict, Any, Optional
+from fastapi import APIRouter, HTTPException, status, Header
+
+from config import settings
+from services.job_queue import job_queue
+from services.store_outbox import store_outbox
+from utils.logger import logger
+
+
+router = APIRouter()
+
+
+def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
+    """
+    验证API Key权限
+
+    Args:
+        authorization: 从Authorization header中获取的Bearer token
+
+    Raises:
+        HTTPException: 如果API Key验证失败
+    """
+    if settings.API_KEY:
+        # 从 Authorization header 中提取 Bearer token
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Missing or invalid Authorization header. Expected: 'Bearer <token>'"
+            )
+        token = authorization[7:]  # 移除 "Bearer " 前缀
+        if token != settings.API_KEY:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API Key"
+            )
+
+
+@router.get("/jobs/metrics", response_model=Dict[str, Any])
+async def get_job_metrics(
+    authorization: Optional[str] = Header(None)
+):
+    """
+    获取后台任务队列指标
+
+    包括各类型任务的排队数和执行数、排队延迟、提交/丢弃/成功/失败/重试计数，以及跨存储发件箱的积压
+    """
+    verify_api_key(authorization)
+
+    try:
+        metrics = await job_queue.get_metrics()
+        metrics["outbox"] = {"pending": await store_outbox.pending_count(), **store_outbox.get_metrics()}
+        return metrics
+    except Exception as e:
+        logger.error(f"Error getting job metrics: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting job metrics: {str(e)}"
+        )
+
+
+@router.get("/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_job(
+    job_id: str,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    获取后台任务状态
+    """
+    verify_api_key(authorization)
+
+    job = await job_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
+        )
+    return job
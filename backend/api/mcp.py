@@ -3,13 +3,14 @@ MCP (Model Context Protocol) Streamable HTTP 实现
 基于 MCP Streamable HTTP 标准
 """
 import json
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Awaitable, Callable
 from fastapi import APIRouter, HTTPException, status, Header, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import asyncio
 
 from config import settings
+from services.memory_tool_service import memory_tool_service
 from utils.memory_tools import get_memory_tools
 from utils.logger import logger
 
@@ -92,9 +93,117 @@ class JSONRPCResponse(BaseModel):
     error: Optional[Dict[str, Any]] = None
 
 
+class JSONRPCError(Exception):
+    """JSON-RPC 错误（由方法处理函数抛出，转换为响应中的 error）"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+# 服务器信息
+MCP_SERVER_INFO = {
+    "name": "MemPoint Memory Server",
+    "version": "0.1.0"
+}
+MCP_PROTOCOL_VERSION = "2024-11-05"
+
+# 工具和资源定义是静态的，tools/list 与 resources/list 的结果只生成一次
+MCP_TOOLS: List[Dict[str, Any]] = [
+    MCPTool(
+        name=tool["function"]["name"],
+        description=tool["function"].get("description", ""),
+        inputSchema=tool["function"].get("parameters", {})
+    ).dict()
+    for tool in get_memory_tools()
+]
+MCP_RESOURCES: List[Dict[str, Any]] = [
+    {
+        "uri": "memory://list",
+        "name": "列出记忆",
+        "description": "列出所有记忆，支持按记忆体和类型过滤"
+    },
+    {
+        "uri": "memory://get",
+        "name": "获取记忆详情",
+        "description": "根据记忆ID获取详细信息"
+    },
+    {
+        "uri": "memory://search",
+        "name": "搜索记忆",
+        "description": "基于语义搜索相关记忆"
+    }
+]
+_TOOLS_LIST_RESULT = {"tools": MCP_TOOLS}
+_RESOURCES_LIST_RESULT = {"resources": MCP_RESOURCES}
+_INITIALIZE_RESULT = {
+    "protocolVersion": MCP_PROTOCOL_VERSION,
+    "serverInfo": MCP_SERVER_INFO,
+    "capabilities": {
+        "tools": {},
+        "resources": {}
+    }
+}
+
+
+async def _initialize(params: Dict[str, Any]) -> Dict[str, Any]:
+    """initialize: 初始化连接"""
+    return _INITIALIZE_RESULT
+
+
+async def _tools_list(params: Dict[str, Any]) -> Dict[str, Any]:
+    """tools/list: 列出工具"""
+    return _TOOLS_LIST_RESULT
+
+
+async def _resources_list(params: Dict[str, Any]) -> Dict[str, Any]:
+    """resources/list: 列出资源"""
+    return _RESOURCES_LIST_RESULT
+
+
+async def _tools_call(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    tools/call: 调用记忆工具（作用于默认记忆体）
+
+    Raises:
+        JSONRPCError: 工具不存在（-32601）、参数错误（-32602）、执行失败（-32603）
+    """
+    tool_name = params.get("name")
+    if not tool_name:
+        raise JSONRPCError(-32602, "Invalid params: tool name is required")
+    if not memory_tool_service.has_tool(tool_name):
+        raise JSONRPCError(-32601, f"Tool not found: {tool_name}")
+
+    try:
+        result = await memory_tool_service.call_tool(tool_name, params.get("arguments") or {})
+    except ValueError as e:
+        raise JSONRPCError(-32602, f"Invalid params: {e}")
+    except (LookupError, RuntimeError) as e:
+        raise JSONRPCError(-32603, str(e))
+
+    return {
+        "content": [
+            {
+                "type": "text",
+                "text": json.dumps(result, ensure_ascii=False, default=str)
+            }
+        ]
+    }
+
+
+# JSON-RPC 方法分发表
+JSONRPC_METHODS: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {
+    "initialize": _initialize,
+    "tools/list": _tools_list,
+    "resources/list": _resources_list,
+    "tools/call": _tools_call,
+}
+
+
 async def handle_jsonrpc_request(request: JSONRPCRequest) -> Optional[JSONRPCResponse]:
     """
-    处理 JSON-RPC 请求
+    处理 JSON-RPC 请求（按分发表调用方法处理函数）
 
     Args:
         request: JSON-RPC 请求对象
@@ -105,324 +214,54 @@ async def handle_jsonrpc_request(request: JSONRPCRequest) -> Optional[JSONRPCRes
     # 检查是否是通知类型（没有 id）
     is_notification = request.id is None
 
+    handler = JSONRPC_METHODS.get(request.method)
     try:
-        if request.method == "initialize":
-            # 初始化请求
-            result = {
-                "protocolVersion": "2024-11-05",
-                "serverInfo": {
-                    "name": "MemPoint Memory Server",
-                    "version": "0.1.0"
-                },
-                "capabilities": {
-                    "tools": {},
-                    "resources": {}
-                }
-            }
-            if is_notification:
-                logger.info("Initialize notification received (no response)")
-                return None
-            return JSONRPCResponse(id=request.id, result=result)
-
-        elif request.method == "tools/list":
-            # 列出工具
-            memory_tools = get_memory_tools()
-            mcp_tools = []
-            for tool in memory_tools:
-                function = tool.get("function", {})
-                mcp_tool = MCPTool(
-                    name=function.get("name"),
-                    description=function.get("description", ""),
-                    inputSchema=function.get("parameters", {})
-                )
-                mcp_tools.append(mcp_tool)
-
-            logger.info(f"Listed {len(mcp_tools)} MCP tools")
-            result = {"tools": [tool.dict() for tool in mcp_tools]}
-            if is_notification:
-                logger.info("tools/list notification received (no response)")
-                return None
-            return JSONRPCResponse(id=request.id, result=result)
-
-        elif request.method == "resources/list":
-            # 列出资源
-            resources = [
-                {
-                    "uri": "memory://list",
-                    "name": "列出记忆",
-                    "description": "列出所有记忆，支持按记忆体和类型过滤"
-                },
-                {
-                    "uri": "memory://get",
-                    "name": "获取记忆详情",
-                    "description": "根据记忆ID获取详细信息"
-                },
-                {
-                    "uri": "memory://search",
-                    "name": "搜索记忆",
-                    "description": "基于语义搜索相关记忆"
-                }
-            ]
-
-            logger.info(f"Listed {len(resources)} MCP resources")
-            result = {"resources": resources}
-            if is_notification:
-                logger.info("resources/list notification received (no response)")
-                return None
-            return JSONRPCResponse(id=request.id, result=result)
-
-        elif request.method == "tools/call":
-            # 调用工具
-            params = request.params or {}
-            tool_name = params.get("name")
-            arguments = params.get("arguments", {})
-
-            if not tool_name:
-                error = {
-                    "code": -32602,
-                    "message": "Invalid params: tool name is required"
-                }
-                if is_notification:
-                    logger.warning(f"tools/call notification failed: {error['message']}")
-                    return None
-                return JSONRPCResponse(id=request.id, error=error)
-
-            # 导入记忆服务
-            from services.memory_service import get_memory_service
-            memory_service = get_memory_service()
-
-            if tool_name == "save_memory":
-                content = arguments.get("content")
-                entity_id = arguments.get("entity_id")
-                importance = arguments.get("importance", 5)
-
-                if not content:
-                    error = {
-                        "code": -32602,
-                        "message": "Invalid params: content is required"
-                    }
-                    if is_notification:
-                        logger.warning(f"save_memory notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                # 创建记忆
-                from models.schemas import MemoryCreate
-                from utils.helpers import generate_id
-
-                memory_data = MemoryCreate(
-                    persona_id=settings.DEFAULT_PERSONA_ID,
-                    vector_id=generate_id(),
-                    type="long_term",
-                    content=content,
-                    entity_id=entity_id,
-                    metadata={"importance": importance}
-                )
-
-                memory = await memory_service.create_memory(
-                    memory_data=memory_data,
-                    content=content
-                )
-
-                if not memory:
-                    error = {
-                        "code": -32603,
-                        "message": "Failed to create memory"
-                    }
-                    if is_notification:
-                        logger.warning(f"save_memory notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                result = {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps({
-                                "success": True,
-                                "memory_id": memory.id,
-                                "message": "记忆已保存"
-                            }, ensure_ascii=False)
-                        }
-                    ]
-                }
-                if is_notification:
-                    logger.info("save_memory notification succeeded (no response)")
-                    return None
-                return JSONRPCResponse(id=request.id, result=result)
-
-            elif tool_name == "update_memory":
-                memory_id = arguments.get("memory_id")
-                new_content = arguments.get("new_content")
-
-                if not memory_id or not new_content:
-                    error = {
-                        "code": -32602,
-                        "message": "Invalid params: memory_id and new_content are required"
-                    }
-                    if is_notification:
-                        logger.warning(f"update_memory notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                # 更新记忆
-                from models.schemas import MemoryUpdate
-
-                memory = await memory_service.update_memory(
-                    memory_id=memory_id,
-                    memory_data=MemoryUpdate(content=new_content)
-                )
-
-                if not memory:
-                    error = {
-                        "code": -32603,
-                        "message": f"Memory not found: {memory_id}"
-                    }
-                    if is_notification:
-                        logger.warning(f"update_memory notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                result = {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps({
-                                "success": True,
-                                "memory_id": memory_id,
-                                "message": "记忆已更新"
-                            }, ensure_ascii=False)
-                        }
-                    ]
-                }
-                if is_notification:
-                    logger.info("update_memory notification succeeded (no response)")
-                    return None
-                return JSONRPCResponse(id=request.id, result=result)
-
-            elif tool_name == "delete_memory":
-                memory_id = arguments.get("memory_id")
-
-                if not memory_id:
-                    error = {
-                        "code": -32602,
-                        "message": "Invalid params: memory_id is required"
-                    }
-                    if is_notification:
-                        logger.warning(f"delete_memory notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                # 删除记忆
-                success = await memory_service.delete_memory(memory_id)
-
-                if not success:
-                    error = {
-                        "code": -32603,
-                        "message": f"Memory not found: {memory_id}"
-                    }
-                    if is_notification:
-                        logger.warning(f"delete_memory notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                result = {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps({
-                                "success": True,
-                                "memory_id": memory_id,
-                                "message": "记忆已删除"
-                            }, ensure_ascii=False)
-                        }
-                    ]
-                }
-                if is_notification:
-                    logger.info("delete_memory notification succeeded (no response)")
-                    return None
-                return JSONRPCResponse(id=request.id, result=result)
-
-            elif tool_name == "search_memories":
-                query = arguments.get("query")
-
-                if not query:
-                    error = {
-                        "code": -32602,
-                        "message": "Invalid params: query is required"
-                    }
-                    if is_notification:
-                        logger.warning(f"search_memories notification failed: {error['message']}")
-                        return None
-                    return JSONRPCResponse(id=request.id, error=error)
-
-                # 搜索记忆
-                from models.schemas import MemorySearchRequest
-
-                search_request = MemorySearchRequest(
-                    query=query,
-                    top_k=10,
-                    metadata={"persona_id": settings.DEFAULT_PERSONA_ID}
-                )
-
-                results = await memory_service.search_memories(search_request)
-
-                result = {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps({
-                                "success": True,
-                                "results": results,
-                                "count": len(results)
-                            }, ensure_ascii=False)
-                        }
-                    ]
-                }
-                if is_notification:
-                    logger.info("search_memories notification succeeded (no response)")
-                    return None
-                return JSONRPCResponse(id=request.id, result=result)
-
-            else:
-                error = {
-                    "code": -32601,
-                    "message": f"Tool not found: {tool_name}"
-                }
-                if is_notification:
-                    logger.warning(f"tools/call notification failed: {error['message']}")
-                    return None
-                return JSONRPCResponse(id=request.id, error=error)
-
-        else:
-            error = {
-                "code": -32601,
-                "message": f"Method not found: {request.method}"
-            }
-            if is_notification:
-                logger.warning(f"Notification for unknown method: {request.method}")
-                return None
-            return JSONRPCResponse(id=request.id, error=error)
-
-    except HTTPException as e:
-        error = {
-            "code": e.status_code,
-            "message": e.detail
-        }
+        if handler is None:
+            raise JSONRPCError(-32601, f"Method not found: {request.method}")
+        result = await handler(request.params or {})
+    except JSONRPCError as e:
         if is_notification:
-            logger.warning(f"Notification failed with HTTPException: {e.detail}")
+            logger.warning(f"{request.method} notification failed: {e.message}")
             return None
-        return JSONRPCResponse(id=request.id, error=error)
+        return JSONRPCResponse(id=request.id, error={"code": e.code, "message": e.message})
     except Exception as e:
         logger.error(f"Error handling JSON-RPC request: {e}")
-        error = {
-            "code": -32603,
-            "message": str(e)
-        }
         if is_notification:
             logger.warning(f"Notification failed with exception: {str(e)}")
             return None
-        return JSONRPCResponse(id=request.id, error=error)
+        return JSONRPCResponse(id=request.id, error={"code": -32603, "message": str(e)})
+
+    if is_notification:
+        logger.info(f"{request.method} notification handled (no response)")
+        return None
+    return JSONRPCResponse(id=request.id, result=result)
+
+
+async def _handle_raw_request(request_data: Any) -> Optional[JSONRPCResponse]:
+    """
+    校验并处理批量请求中的一项
+
+    Args:
+        request_data: 解析后的JSON值
+
+    Returns:
+        JSON-RPC 响应对象，通知类型返回 None
+    """
+    try:
+        jsonrpc_request = JSONRPCRequest(**request_data)
+    except Exception as e:
+        return JSONRPCResponse(error={"code": -32600, "message": f"Invalid Request: {e}"})
+    return await handle_jsonrpc_request(jsonrpc_request)
+
+
+def _sse_message(response: JSONRPCResponse) -> str:
+    """将 JSON-RPC 响应格式化为 SSE message 事件"""
+    data = response.dict(exclude_none=True)
+    if response.error is not None:
+        # 无法确定请求id时（如批量请求中的无效项）按规范返回 "id": null
+        data.setdefault("id", None)
+    event_data = json.dumps(data, ensure_ascii=False)
+    return f"event: message\ndata: {event_data}\n\n"
 
 
 async def sse_generator(response: JSONRPCResponse) -> AsyncGenerator[str, None]:
@@ -436,8 +275,7 @@ async def sse_generator(response: JSONRPCResponse) -> AsyncGenerator[str, None]:
         SSE 格式的字符串
     """
     # 发送事件
-    event_data = json.dumps(response.dict(exclude_none=True), ensure_ascii=False)
-    yield f"event: message\ndata: {event_data}\n\n"
+    yield _sse_message(response)
     # 结束事件
     yield "event: end\ndata: {}\n\n"
 
@@ -453,6 +291,42 @@ async def sse_generator_empty() -> AsyncGenerator[str, None]:
     yield "event: end\ndata: {}\n\n"
 
 
+async def sse_batch_generator(batch: List[Any]) -> AsyncGenerator[str, None]:
+    """
+    并发处理批量请求，按完成顺序逐条发送响应（同时执行的请求数受 MCP_BATCH_CONCURRENCY 限制）
+
+    Args:
+        batch: 批量请求数组
+
+    Yields:
+        SSE 格式的字符串
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.MCP_BATCH_CONCURRENCY))
+
+    async def run(request_data: Any) -> Optional[JSONRPCResponse]:
+        async with semaphore:
+            return await _handle_raw_request(request_data)
+
+    tasks = [asyncio.create_task(run(request_data)) for request_data in batch]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            response = await next_done
+            if response is not None:
+                yield _sse_message(response)
+        yield "event: end\ndata: {}\n\n"
+    finally:
+        # 客户端提前断开时取消尚未完成的请求
+        for task in tasks:
+            task.cancel()
+
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+
 @router.post("/mcp")
 async def mcp_streamable_http(
     request: Request,
@@ -471,6 +345,9 @@ async def mcp_streamable_http(
         "params": {}
     }
 
+    请求体也可以是 JSON-RPC 批量请求数组：数组中的请求并发执行，
+    每个请求完成后立即作为一条 message 事件发送（顺序与请求顺序无关，按 id 对应）
+
     支持的方法:
     - initialize: 初始化连接
     - tools/list: 列出可用工具
@@ -486,6 +363,20 @@ async def mcp_streamable_http(
         body = await request.body()
         request_data = json.loads(body.decode("utf-8"))
 
+        if isinstance(request_data, list):
+            logger.info(f"Received MCP batch request: {len(request_data)} requests")
+            if not request_data:
+                return StreamingResponse(
+                    sse_generator(JSONRPCResponse(error={"code": -32600, "message": "Invalid Request: empty batch"})),
+                    media_type="text/event-stream",
+                    headers=_SSE_HEADERS
+                )
+            return StreamingResponse(
+                sse_batch_generator(request_data),
+                media_type="text/event-stream",
+                headers=_SSE_HEADERS
+            )
+
         # 创建 JSON-RPC 请求对象
         jsonrpc_request = JSONRPCRequest(**request_data)
 
@@ -499,22 +390,14 @@ async def mcp_streamable_http(
             return StreamingResponse(
                 sse_generator_empty(),
                 media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no"
-                }
+                headers=_SSE_HEADERS
             )
 
         # 返回 SSE 流
         return StreamingResponse(
             sse_generator(jsonrpc_response),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
-            }
+            headers=_SSE_HEADERS
         )
 
     except json.JSONDecodeError as e:
@@ -542,22 +425,8 @@ async def list_mcp_tools(authorization: Optional[str] = Header(None)):
     verify_api_key(authorization)
 
     try:
-        # 获取记忆工具定义
-        memory_tools = get_memory_tools()
-
-        # 转换为 MCP 格式
-        mcp_tools = []
-        for tool in memory_tools:
-            function = tool.get("function", {})
-            mcp_tool = MCPTool(
-                name=function.get("name"),
-                description=function.get("description", ""),
-                inputSchema=function.get("parameters", {})
-            )
-            mcp_tools.append(mcp_tool)
-
-        logger.info(f"Listed {len(mcp_tools)} MCP tools")
-        return MCPListToolsResponse(tools=mcp_tools)
+        logger.info(f"Listed {len(MCP_TOOLS)} MCP tools")
+        return _TOOLS_LIST_RESULT
 
     except Exception as e:
         logger.error(f"Error listing MCP tools: {e}")
@@ -577,27 +446,8 @@ async def list_mcp_resources(authorization: Optional[str] = Header(None)):
     verify_api_key(authorization)
 
     try:
-        # 定义记忆资源
-        resources = [
-            MCPResource(
-                uri="memory://list",
-                name="列出记忆",
-                description="列出所有记忆，支持按记忆体和类型过滤"
-            ),
-            MCPResource(
-                uri="memory://get",
-                name="获取记忆详情",
-                description="根据记忆ID获取详细信息"
-            ),
-            MCPResource(
-                uri="memory://search",
-                name="搜索记忆",
-                description="基于语义搜索相关记忆"
-            )
-        ]
-
-        logger.info(f"Listed {len(resources)} MCP resources")
-        return MCPListResourcesResponse(resources=resources)
+        logger.info(f"Listed {len(MCP_RESOURCES)} MCP resources")
+        return _RESOURCES_LIST_RESULT
 
     except Exception as e:
         logger.error(f"Error listing MCP resources: {e}")
@@ -617,11 +467,7 @@ async def get_mcp_info(authorization: Optional[str] = Header(None)):
     verify_api_key(authorization)
 
     try:
-        info = MCPServerInfo(
-            name="MemPoint Memory Server",
-            version="0.1.0",
-            protocolVersion="2024-11-05"
-        )
+        info = MCPServerInfo(**MCP_SERVER_INFO, protocolVersion=MCP_PROTOCOL_VERSION)
 
         logger.info("MCP server info requested")
         return info
@@ -653,142 +499,24 @@ async def call_mcp_tool(
     """
     verify_api_key(authorization)
 
-    try:
-        # 导入记忆服务
-        from services.memory_service import get_memory_service
-
-        memory_service = get_memory_service()
-
-        # 根据工具名称调用相应的服务方法
-        if tool_name == "save_memory":
-            content = arguments.get("content")
-            entity_id = arguments.get("entity_id")
-            importance = arguments.get("importance", 5)
-
-            if not content:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="content is required"
-                )
-
-            # 创建记忆
-            from models.schemas import MemoryCreate
-            from utils.helpers import generate_id
-
-            memory_data = MemoryCreate(
-                persona_id=settings.DEFAULT_PERSONA_ID,  # 使用默认记忆体ID
-                vector_id=generate_id(),
-                type="long_term",
-                content=content,
-                entity_id=entity_id,
-                metadata={"importance": importance}
-            )
-
-            memory = await memory_service.create_memory(
-                memory_data=memory_data,
-                content=content
-            )
-
-            if not memory:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to create memory"
-                )
-
-            return {
-                "success": True,
-                "memory_id": memory.id,
-                "message": "记忆已保存"
-            }
-
-        elif tool_name == "update_memory":
-            memory_id = arguments.get("memory_id")
-            new_content = arguments.get("new_content")
-
-            if not memory_id or not new_content:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="memory_id and new_content are required"
-                )
-
-            # 更新记忆
-            from models.schemas import MemoryUpdate
-
-            memory = await memory_service.update_memory(
-                memory_id=memory_id,
-                memory_data=MemoryUpdate(content=new_content)
-            )
-
-            if not memory:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Memory not found: {memory_id}"
-                )
-
-            return {
-                "success": True,
-                "memory_id": memory_id,
-                "message": "记忆已更新"
-            }
-
-        elif tool_name == "delete_memory":
-            memory_id = arguments.get("memory_id")
-
-            if not memory_id:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="memory_id is required"
-                )
-
-            # 删除记忆
-            success = await memory_service.delete_memory(memory_id)
-
-            if not success:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Memory not found: {memory_id}"
-                )
-
-            return {
-                "success": True,
-                "memory_id": memory_id,
-                "message": "记忆已删除"
-            }
-
-        elif tool_name == "search_memories":
-            query = arguments.get("query")
-
-            if not query:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="query is required"
-                )
-
-            # 搜索记忆
-            from models.schemas import MemorySearchRequest
-
-            search_request = MemorySearchRequest(
-                query=query,
-                top_k=10,
-                metadata={"persona_id": settings.DEFAULT_PERSONA_ID}  # 使用默认记忆体ID
-            )
-
-            results = await memory_service.search_memories(search_request)
-
-            return {
-                "success": True,
-                "results": results,
-                "count": len(results)
-            }
-
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Tool not found: {tool_name}"
-            )
+    if not memory_tool_service.has_tool(tool_name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tool not found: {tool_name}"
+        )
 
-    except HTTPException:
-        raise
+    try:
+        return await memory_tool_service.call_tool(tool_name, arguments)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except LookupError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error calling MCP tool {tool_name}: {e}")
         raise HTTPException(
@@ -1,13 +1,18 @@
 """
 Memory Management API
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional
+from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Header, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from config import settings
 from models.schemas import MemoryCreate, MemoryUpdate, MemoryResponse, MemorySearchRequest
 from services.memory_service import get_memory_service
+from services.consolidation_service import get_consolidation_service
+from services.tiering_service import get_tiering_service
+from services.reconcile_service import get_reconcile_service
 from utils.logger import logger
 
 
@@ -46,6 +51,24 @@ class MemoryListRequest(BaseModel):
     limit: int = Field(100, ge=1, le=1000, description="返回数量限制")
 
 
+class MemoryConsolidateRequest(BaseModel):
+    """记忆合并请求"""
+    persona_id: str = Field(..., description="记忆体ID")
+    dry_run: bool = Field(True, description="是否只预览合并效果（不修改数据）")
+    threshold: Optional[float] = Field(None, ge=0.5, le=1.0, description="相似度阈值（默认使用配置）")
+
+
+class MemoryTieringRequest(BaseModel):
+    """记忆降级请求"""
+    persona_id: str = Field(..., description="记忆体ID")
+    dry_run: bool = Field(True, description="是否只预览降级效果（不修改数据）")
+
+
+class MemoryReconcileRequest(BaseModel):
+    """跨存储对账请求"""
+    dry_run: bool = Field(True, description="是否只统计差异（不修改数据）")
+
+
 @router.post("/memories", response_model=MemoryResponse, status_code=status.HTTP_201_CREATED)
 async def create_memory(
     memory_data: MemoryCreate,
@@ -90,41 +113,86 @@ async def create_memory(
         )
 
 
+# 流式序列化时每次输出的记忆条数
+_LIST_STREAM_CHUNK = 100
+
+
+def _stream_memory_list(memories: List[Any]) -> Iterator[str]:
+    """
+    逐块序列化记忆列表为JSON数组
+
+    Args:
+        memories: 记忆对象列表
+
+    Yields:
+        JSON数组片段
+    """
+    yield "["
+    for start in range(0, len(memories), _LIST_STREAM_CHUNK):
+        chunk = memories[start:start + _LIST_STREAM_CHUNK]
+        body = ",".join(MemoryResponse.model_validate(m).model_dump_json() for m in chunk)
+        yield ("," if start else "") + body
+    yield "]"
+
+
 @router.get("/memories", response_model=list[MemoryResponse])
 async def list_memories(
     persona_id: Optional[str] = Query(None, description="记忆体ID，用于过滤"),
     type: Optional[str] = Query(None, description="记忆类型，用于过滤"),
-    limit: int = Query(100, ge=1, le=1000, description="返回数量限制"),
+    created_after: Optional[datetime] = Query(None, description="创建时间下界（含）"),
+    created_before: Optional[datetime] = Query(None, description="创建时间上界（不含）"),
+    event_after: Optional[datetime] = Query(None, description="事件时间下界（含）"),
+    event_before: Optional[datetime] = Query(None, description="事件时间上界（不含）"),
+    order_by: str = Query("created_at", pattern="^(created_at|event_time)$", description="排序字段（倒序）"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    limit: int = Query(100, ge=1, le=1000, description="每页数量"),
     authorization: Optional[str] = Header(None)
 ):
     """
-    列出记忆
+    按游标分页列出记忆
+
+    过滤条件全部在SQL中完成，下一页游标通过响应头 X-Next-Cursor 返回（没有下一页时不返回）
 
     Args:
         persona_id: 记忆体ID，用于过滤
         type: 记忆类型，用于过滤
-        limit: 返回数量限制
+        created_after: 创建时间下界
+        created_before: 创建时间上界
+        event_after: 事件时间下界
+        event_before: 事件时间上界
+        order_by: 排序字段，'created_at' 或 'event_time'
+        cursor: 分页游标
+        limit: 每页数量
         authorization: Authorization header，格式为 'Bearer <token>'
 
     Returns:
-        记忆列表
+        记忆列表（流式输出的JSON数组）
     """
     verify_api_key(authorization)
 
     try:
         memory_service = get_memory_service()
-        memories = await memory_service.list_memories(
+        memories, next_cursor = await memory_service.list_memories_page(
+            persona_id=persona_id,
             type=type,
+            created_after=created_after,
+            created_before=created_before,
+            event_after=event_after,
+            event_before=event_before,
+            order_by=order_by,
+            cursor=cursor,
             limit=limit
         )
 
-        # 如果提供了persona_id，在内存中过滤
-        if persona_id:
-            memories = [m for m in memories if getattr(m, 'persona_id', None) == persona_id]
-
-        logger.debug(f"Listed {len(memories)} memories, persona_id={persona_id}")
-        return [MemoryResponse.from_orm(m) for m in memories]
+        logger.debug(f"Listed {len(memories)} memories, persona_id={persona_id}, has_next={next_cursor is not None}")
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return StreamingResponse(_stream_memory_list(memories), media_type="application/json", headers=headers)
 
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error listing memories: {e}")
         raise HTTPException(
@@ -288,3 +356,141 @@ async def search_memories(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+
+
+@router.post("/memories/consolidate", response_model=Dict[str, Any])
+async def consolidate_memories(
+    consolidate_request: MemoryConsolidateRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    合并近重复记忆
+
+    dry_run为true时同步返回预计的合并效果；否则提交后台合并任务并返回任务ID，
+    可通过 GET /jobs/{job_id} 查询进度
+
+    Args:
+        consolidate_request: 合并请求
+        authorization: Authorization header，格式为 'Bearer <token>'
+
+    Returns:
+        预览结果或任务信息
+    """
+    verify_api_key(authorization)
+
+    try:
+        consolidation_service = get_consolidation_service()
+
+        if consolidate_request.dry_run:
+            return await consolidation_service.dry_run(
+                persona_id=consolidate_request.persona_id,
+                threshold=consolidate_request.threshold
+            )
+
+        job_id = await consolidation_service.enqueue(
+            persona_id=consolidate_request.persona_id,
+            threshold=consolidate_request.threshold
+        )
+        if not job_id:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Consolidation job queue is full"
+            )
+
+        logger.info(f"Enqueued memory consolidation: job_id={job_id}, persona_id={consolidate_request.persona_id}")
+        return {"job_id": job_id, "persona_id": consolidate_request.persona_id, "dry_run": False}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error consolidating memories: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@router.post("/memories/tiering", response_model=Dict[str, Any])
+async def tier_memories(
+    tiering_request: MemoryTieringRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    将长期未访问的记忆降级到冷存储
+
+    dry_run为true时同步返回待降级的记忆数；否则提交后台降级任务并返回任务ID，
+    可通过 GET /jobs/{job_id} 查询进度
+
+    Args:
+        tiering_request: 降级请求
+        authorization: Authorization header，格式为 'Bearer <token>'
+
+    Returns:
+        预览结果或任务信息
+    """
+    verify_api_key(authorization)
+
+    try:
+        tiering_service = get_tiering_service()
+
+        if tiering_request.dry_run:
+            return await tiering_service.demote(persona_id=tiering_request.persona_id, dry_run=True)
+
+        job_id = await tiering_service.enqueue(persona_id=tiering_request.persona_id)
+        if not job_id:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Tiering job queue is full"
+            )
+
+        logger.info(f"Enqueued memory tiering: job_id={job_id}, persona_id={tiering_request.persona_id}")
+        return {"job_id": job_id, "persona_id": tiering_request.persona_id, "dry_run": False}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error tiering memories: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@router.post("/memories/reconcile", response_model=Dict[str, Any])
+async def reconcile_memories(
+    reconcile_request: MemoryReconcileRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    比对SQLite、向量库和图谱中的记忆数据，补写缺失的向量并回收孤立的向量和实体
+
+    全量扫描耗时较长，总是提交后台任务并返回任务ID，可通过 GET /jobs/{job_id} 查询进度和结果
+
+    Args:
+        reconcile_request: 对账请求
+        authorization: Authorization header，格式为 'Bearer <token>'
+
+    Returns:
+        任务信息
+    """
+    verify_api_key(authorization)
+
+    try:
+        job_id = await get_reconcile_service().enqueue(dry_run=reconcile_request.dry_run)
+        if not job_id:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Reconcile job queue is full"
+            )
+
+        logger.info(f"Enqueued store reconciliation: job_id={job_id}, dry_run={reconcile_request.dry_run}")
+        return {"job_id": job_id, "dry_run": reconcile_request.dry_run}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reconciling stores: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
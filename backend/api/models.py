@@ -2,13 +2,12 @@
 Models API
 """
 from typing import List, Dict, Any, Optional
-from datetime import datetime, timezone
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, Query, Request
+from fastapi.responses import Response, JSONResponse
 
 from config import settings
-from models.database import SessionLocal, Persona
 from models.schemas import PersonaResponse
-from core.llm_client import llm_client
+from services.model_catalog import model_catalog
 from core.embedding_client import embedding_client
 from core.response_adapter import response_adapter
 from utils.logger import logger
@@ -44,56 +43,51 @@ def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
 
 
 @router.get("/models")
-async def list_models(authorization: Optional[str] = Header(None)):
+async def list_models(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页数量，为空时返回完整列表"),
+    after: Optional[str] = Query(None, description="上一页最后一个模型的ID"),
+    authorization: Optional[str] = Header(None)
+):
     """
     Models API
     返回所有可用的模型（记忆体与LLM模型的组合）
     格式：persona_id/llm_model
+
+    从预先生成的快照返回，不访问数据库和LLM供应商；支持按模型ID游标分页，
+    响应带ETag，If-None-Match 匹配时返回304
     """
     # 验证API Key
     verify_api_key(authorization)
 
     try:
-        db = SessionLocal()
-        try:
-            # 获取所有记忆体
-            personas = db.query(Persona).all()
-
-            # 从LLM供应商获取模型列表
-            llm_models = []
-            try:
-                llm_models = await llm_client.list_models()
-                logger.info(f"Retrieved {len(llm_models)} models from LLM provider")
-            except Exception as e:
-                logger.warning(f"Failed to retrieve models from LLM provider: {e}")
-                # 如果无法获取LLM模型列表，使用默认模型
-                llm_models = [{
-                    "id": settings.LLM_MODEL,
-                    "object": "model",
-                    "created": int(datetime.now(timezone.utc).timestamp()),
-                    "owned_by": "llm_provider"
-                }]
-
-            # 将记忆体与LLM模型组合
-            model_list = []
-            for persona in personas:
-                for llm_model in llm_models:
-                    model_id = f"{persona.id}/{llm_model['id']}"
-                    model_list.append({
-                        "id": model_id,
-                        "object": "model",
-                        "created": int(persona.created_at.timestamp()),
-                        "owned_by": "you"
-                    })
-
-            logger.info(f"Listed {len(model_list)} combined models ({len(personas)} personas × {len(llm_models)} LLM models)")
-            return {
-                "object": "list",
-                "data": model_list
-            }
-
-        finally:
-            db.close()
+        data, index, body, etag = await model_catalog.snapshot()
+
+        if limit is None and after is None:
+            page_etag = etag
+        else:
+            start = 0
+            if after is not None:
+                if after not in index:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Unknown model id in 'after': {after}"
+                    )
+                start = index[after] + 1
+            end = len(data) if limit is None else start + limit
+            # 同一快照、同一分页参数的响应相同，ETag由快照ETag与分页位置组成
+            page_etag = f'"{etag[1:-1]}-{start}-{end}"'
+            body = None
+
+        if request.headers.get("if-none-match") == page_etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": page_etag})
+
+        if body is not None:
+            return Response(content=body, media_type="application/json", headers={"ETag": page_etag})
+        return JSONResponse(
+            content={"object": "list", "data": data[start:end], "has_more": end < len(data)},
+            headers={"ETag": page_etag}
+        )
 
     except HTTPException:
         raise
@@ -2,11 +2,13 @@
 Persona API
 """
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, Query, Request
+from fastapi.responses import StreamingResponse
 
 from config import settings
 from models.schemas import PersonaCreate, PersonaUpdate, PersonaResponse
 from services.persona_service import persona_service
+from services.transfer_service import transfer_service
 from utils.logger import logger
 
 
@@ -137,22 +139,31 @@ async def update_persona(persona_id: str, persona_data: PersonaUpdate, authoriza
         )
 
 
-@router.delete("/personas/{persona_id}")
+@router.delete("/personas/{persona_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_persona(persona_id: str, authorization: Optional[str] = Header(None)):
     """
-    删除记忆体
+    删除记忆体（提交后台任务批量删除记忆、向量、冷存储和图谱，通过 /jobs/{job_id} 查询进度）
     """
     # 验证API Key
     verify_api_key(authorization)
 
     try:
-        success = await persona_service.delete_persona(persona_id)
-        if not success:
+        persona = await persona_service.get_persona(persona_id)
+        if not persona:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Persona not found"
             )
-        return {"message": "Persona deleted successfully"}
+
+        job_id = await persona_service.enqueue_deletion(persona_id)
+        if not job_id:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Persona deletion job queue is full"
+            )
+
+        logger.info(f"Enqueued persona deletion: job_id={job_id}, persona_id={persona_id}")
+        return {"message": "Persona deletion scheduled", "job_id": job_id, "persona_id": persona_id}
     except HTTPException:
         raise
     except Exception as e:
@@ -161,3 +172,53 @@ async def delete_persona(persona_id: str, authorization: Optional[str] = Header(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+
+
+@router.get("/personas/{persona_id}/export")
+async def export_persona(
+    persona_id: str,
+    include_vectors: bool = Query(True, description="是否附带全精度向量（导入到相同Embedding模型时跳过向量化）"),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    以NDJSON流导出记忆体的记忆、向量和图谱
+    """
+    # 验证API Key
+    verify_api_key(authorization)
+
+    persona = await persona_service.get_persona(persona_id)
+    if not persona:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Persona not found"
+        )
+
+    return StreamingResponse(
+        transfer_service.export_persona(persona_id, include_vectors=include_vectors),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="persona-export.ndjson"'}
+    )
+
+
+@router.post("/personas/{persona_id}/import")
+async def import_persona(persona_id: str, request: Request, authorization: Optional[str] = Header(None)):
+    """
+    导入记忆体导出的NDJSON流（记忆体不存在时自动创建）
+    """
+    # 验证API Key
+    verify_api_key(authorization)
+
+    try:
+        stats = await transfer_service.import_persona(persona_id, request.stream())
+        return {"message": "Persona imported successfully", **stats}
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error in importing persona: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
@@ -27,6 +27,7 @@ class Settings(BaseSettings):
     LLM_API_KEY: Optional[str] = "sk-xxx"
     LLM_MODEL: str = "deepseek-ai/DeepSeek-V3.2"
     LLM_TIMEOUT: int = 60
+    LLM_STREAM_PASSTHROUGH: bool = True  # 流式对话透传上游SSE字节，只增量扫描助手文本和finish_reason（关闭时逐chunk解析后重新序列化）
 
     # Embedding API Configuration (独立于LLM配置)
     EMBEDDING_BASE_URL: str = "https://api.siliconflow.cn/v1"
@@ -40,12 +41,46 @@ class Settings(BaseSettings):
     MEMORY_EXTRACTION_API_KEY: Optional[str] = "sk-xxx"
     MEMORY_EXTRACTION_MODEL: str = "deepseek-ai/DeepSeek-V3.2"
     MEMORY_EXTRACTION_TIMEOUT: int = 60
+    MEMORY_EXTRACTION_PREFILTER: bool = True  # 是否启用本地预过滤（决定是否需要LLM判断）
+    MEMORY_EXTRACTION_MIN_LENGTH: int = 4  # 用户消息短于该长度时直接跳过提取
+    MEMORY_EXTRACTION_NOVELTY_THRESHOLD: float = 0.9  # 用户消息被已注入记忆覆盖的比例超过该值时跳过提取
+    MEMORY_EXTRACTION_BATCH_TURNS: int = 3  # 同一对话累计多少轮后合并提取一次（1表示每轮提取）
+    MEMORY_EXTRACTION_IDLE_SECONDS: float = 60.0  # 对话空闲多少秒后提取未处理的轮次
+    MEMORY_EXTRACTION_MAX_CONVERSATIONS: int = 10000  # 最多跟踪的对话数，超出时最久未活动的对话先提取再移除
 
     # Memory System Configuration
     MEMORY_ENABLED: bool = True
     MEMORY_MAX_LONG_TERM: int = 3
     MEMORY_INJECTION_MODE: str = "system"  # 'system', 'messages', 'mixed'
+    MEMORY_CONTEXT_FORMAT: str = "xml"  # 记忆上下文渲染格式：'xml', 'markdown', 'json'
+    MEMORY_INJECTION_ORDER: str = "score"  # 'score'（按综合评分排序）, 'stable'（按创建时间/ID稳定排序，提升上游前缀缓存命中率）
+    MEMORY_TOOL_EXECUTION: bool = False  # 对话请求未指定 memory_config.execute_tools 时，是否由服务端执行LLM发起的记忆工具调用
+    MEMORY_TOOL_MAX_ROUNDS: int = 4  # 服务端执行记忆工具调用后继续补全的最大轮数
     MEMORY_DEDUP_THRESHOLD: float = 0.85  # 记忆去重的相似度阈值（0-1）
+    MEMORY_HYBRID_SEARCH: bool = True  # 是否在向量检索之外同时做FTS5全文检索，并用倒数排名融合（RRF）合并结果
+    MEMORY_RRF_K: int = 60  # RRF融合的平滑常数k（融合分数 = Σ 1/(k + 排名)）
+    MEMORY_SIMHASH_DEDUP: bool = True  # 是否在向量化之前用SimHash本地拦截近乎原样的重复记忆
+    MEMORY_SIMHASH_MAX_DISTANCE: int = 3  # SimHash判定为重复的最大汉明距离（0-3，按4段分段检索，更大的值会被限制为3）
+    MEMORY_CONSOLIDATION_THRESHOLD: float = 0.8  # 记忆合并的相似度阈值（与簇中心的余弦相似度不低于该值的记忆合并为一条）
+    MEMORY_CONSOLIDATION_INTERVAL_HOURS: float = 0  # 定期为所有记忆体提交合并任务的间隔（小时），0表示不定期执行
+    MEMORY_CONSOLIDATION_MIN_MEMORIES: int = 20  # 定期合并时跳过记忆数少于该值的记忆体
+    MEMORY_LOCAL_INDEX_ENABLED: bool = True  # 小记忆体是否使用进程内精确向量索引（内存映射的float32矩阵）代替Milvus检索
+    MEMORY_LOCAL_INDEX_MAX_VECTORS: int = 5000  # 向量数不超过该值的记忆体使用进程内索引
+    MEMORY_LOCAL_INDEX_DIR: str = os.path.join(DATA_DIR, "local_index")  # 进程内索引文件目录
+    MEMORY_COLD_DIR: str = os.path.join(DATA_DIR, "cold")  # 冷存储向量文件目录
+    MEMORY_COLD_VECTOR_DTYPE: str = "int8"  # 冷存储向量编码：'int8'（每维1字节）, 'float16'（每维2字节），只影响新建的冷存储文件
+    MEMORY_COLD_DEMOTE_SCORE: float = 0.05  # 热度评分（访问次数与最近访问时间）低于该值的记忆降级到冷存储
+    MEMORY_COLD_MIN_AGE_DAYS: float = 30  # 创建和最近访问都早于该天数的记忆才会被降级
+    MEMORY_TIERING_INTERVAL_HOURS: float = 0  # 定期为所有记忆体提交降级任务的间隔（小时），0表示不定期执行
+    MEMORY_TRANSFER_BATCH_SIZE: int = 500  # 记忆体导出每页读取、导入每批写入的记忆数
+    MEMORY_IMPORT_EMBED_BATCH_SIZE: int = 64  # 导入时需要重新向量化的记忆每次请求Embedding API的文本数
+    MEMORY_OUTBOX_BATCH_SIZE: int = 256  # 后台补偿每批执行的发件箱操作数（向量库/图谱写入失败后重试）
+    MEMORY_OUTBOX_POLL_INTERVAL: float = 5.0  # 后台补偿检查发件箱的间隔（秒）
+    MEMORY_OUTBOX_RETRY_SECONDS: float = 30.0  # 发件箱操作首次重试的延迟（秒），之后每次失败翻倍
+    MEMORY_RECONCILE_PREFIX_LENGTH: int = 2  # 跨存储对账按向量ID前缀分桶的长度（2即256个桶，每桶约为总数的1/256）
+    MEMORY_RECONCILE_GRACE_SECONDS: float = 600  # 对账时忽略该时间内新写入的记录，避免误判正在写入的数据
+    MEMORY_RECONCILE_BATCH_SIZE: int = 500  # 对账时每批修复或回收的记录数
+    MEMORY_RECONCILE_INTERVAL_HOURS: float = 0  # 定期提交跨存储对账任务的间隔（小时），0表示不定期执行
 
     # Memory Extraction Prompt
     MEMORY_EXTRACTION_PROMPT: str = """分析对话，提取重要信息、实体和关系。
@@ -119,6 +154,25 @@ class Settings(BaseSettings):
     # Milvus Configuration
     MILVUS_COLLECTION_KNOWLEDGE: str = "knowledge_vectors"
     MILVUS_TOP_K: int = 10
+    MILVUS_VECTOR_DTYPE: str = "float32"  # 索引向量类型：'float32', 'float16'（FLOAT16_VECTOR，向量内存减半）
+    MILVUS_INDEX_TYPE: str = "IVF_FLAT"  # 'FLAT', 'IVF_FLAT', 'IVF_SQ8'（约1/4内存）, 'IVF_PQ'；Milvus Lite只支持FLAT/IVF_FLAT（float16只支持FLAT），不支持时自动回退
+    MILVUS_INDEX_NLIST: int = 128  # IVF索引的聚类数
+    MILVUS_PQ_M: int = 64  # IVF_PQ的子空间数（需整除索引维度）
+    MILVUS_INDEX_DIMENSIONS: int = 0  # 索引向量维度：小于EMBEDDING_DIMENSIONS时截取前N维并重新归一化（Matryoshka，仅适用于支持的模型），0表示不截断
+    MILVUS_RESCORE_FACTOR: int = 4  # 有损存储时按 top_k × 该值 取候选，再用全精度向量重新计算相似度，1表示不重排
+
+    # SQLite Configuration
+    SQLITE_POOL_SIZE: int = 10  # 连接池常驻连接数
+    SQLITE_POOL_MAX_OVERFLOW: int = 20  # 连接池允许临时超出的连接数
+    SQLITE_POOL_TIMEOUT: float = 30.0  # 等待空闲连接的超时（秒）
+    SQLITE_READ_POOL_SIZE: int = 10  # 只读连接池常驻连接数（WAL模式下读不阻塞写）
+    SQLITE_JOURNAL_MODE: str = "WAL"  # 日志模式：WAL 允许读写并发，DELETE 为SQLite默认的回滚日志
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL模式下NORMAL只在检查点时fsync，断电可能丢失最近的事务但不会损坏数据库
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # 内存映射读取的最大字节数，0表示关闭
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024  # 每个连接的页缓存大小（KB）
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # 等待写锁的超时（毫秒）
+    SQLITE_WRITER_MAX_BATCH: int = 256  # 写入队列单次组提交的最大操作数
+    SQLITE_WRITER_GROUP_WINDOW_MS: float = 2.0  # 写入队列收到第一个操作后等待更多操作合并提交的时间（毫秒）
 
     # KùzuDB Configuration
     KUZU_NODE_TABLE_USER: str = "User"
@@ -128,8 +182,25 @@ class Settings(BaseSettings):
     KUZU_REL_TABLE_RELATED_TO: str = "RELATED_TO"
     KUZU_REL_TABLE_BELONGS_TO: str = "BELONGS_TO"
 
+    # Background Job Queue Configuration
+    JOB_QUEUE_WORKERS: int = 2  # 后台任务worker数量
+    JOB_QUEUE_POLL_INTERVAL: float = 1.0  # 空闲时轮询任务表的间隔（秒）
+    JOB_QUEUE_MAX_ATTEMPTS: int = 3  # 任务最大执行次数（含首次）
+    JOB_QUEUE_RETRY_BASE_SECONDS: float = 5.0  # 重试退避基数（秒），按2的指数增长
+    JOB_QUEUE_RETRY_MAX_SECONDS: float = 300.0  # 重试退避上限（秒）
+    JOB_QUEUE_JOB_TIMEOUT: int = 600  # 单个任务的执行超时（秒）
+    JOB_QUEUE_LEASE_SECONDS: int = 60  # 任务租约时长（秒），执行中的进程定期续约，租约过期（进程已退出）的running任务会被重新调度
+    JOB_QUEUE_RETENTION_HOURS: int = 24  # 已结束任务的保留时长（小时）
+    MEMORY_EXTRACTION_QUEUE_MAX_DEPTH: int = 1000  # 记忆提取任务的最大排队数，超过后新任务被丢弃（削峰）
+
+    # MCP
+    MCP_BATCH_CONCURRENCY: int = 8  # JSON-RPC 批量请求中同时执行的请求数
+
     # Cache Configuration
     CACHE_TTL: int = 3600  # 缓存过期时间（秒）
+    CONFIG_CACHE_POLL_INTERVAL: float = 2.0  # 检查配置版本号的间隔（秒），用于感知其他工作进程写入的配置
+    PERSONA_REGISTRY_REFRESH_SECONDS: float = 30.0  # 整体重新加载记忆体注册表的间隔（秒），用于感知其他工作进程修改的记忆体
+    MODELS_CACHE_TTL: int = 300  # LLM供应商模型列表的缓存时间（秒），过期后在后台刷新
 
     class Config:
         case_sensitive = True
@@ -151,6 +222,7 @@ def get_default_configurations() -> Dict[str, Dict[str, Any]]:
                 "api_key": settings.LLM_API_KEY,
                 "model": settings.LLM_MODEL,
                 "timeout": settings.LLM_TIMEOUT,
+                "stream_passthrough": settings.LLM_STREAM_PASSTHROUGH,
             },
             "description": "LLM API 配置"
         },
@@ -171,6 +243,11 @@ def get_default_configurations() -> Dict[str, Dict[str, Any]]:
                 "model": settings.MEMORY_EXTRACTION_MODEL,
                 "timeout": settings.MEMORY_EXTRACTION_TIMEOUT,
                 "prompt": settings.MEMORY_EXTRACTION_PROMPT,
+                "prefilter": settings.MEMORY_EXTRACTION_PREFILTER,
+                "min_length": settings.MEMORY_EXTRACTION_MIN_LENGTH,
+                "novelty_threshold": settings.MEMORY_EXTRACTION_NOVELTY_THRESHOLD,
+                "batch_turns": settings.MEMORY_EXTRACTION_BATCH_TURNS,
+                "idle_seconds": settings.MEMORY_EXTRACTION_IDLE_SECONDS,
             },
             "description": "记忆提取 LLM 配置"
         },
@@ -179,7 +256,32 @@ def get_default_configurations() -> Dict[str, Dict[str, Any]]:
                 "enabled": settings.MEMORY_ENABLED,
                 "max_long_term": settings.MEMORY_MAX_LONG_TERM,
                 "injection_mode": settings.MEMORY_INJECTION_MODE,
+                "injection_order": settings.MEMORY_INJECTION_ORDER,
+                "context_format": settings.MEMORY_CONTEXT_FORMAT,
+                "tool_execution": settings.MEMORY_TOOL_EXECUTION,
+                "tool_max_rounds": settings.MEMORY_TOOL_MAX_ROUNDS,
                 "dedup_threshold": settings.MEMORY_DEDUP_THRESHOLD,
+                "hybrid_search": settings.MEMORY_HYBRID_SEARCH,
+                "rrf_k": settings.MEMORY_RRF_K,
+                "simhash_dedup": settings.MEMORY_SIMHASH_DEDUP,
+                "simhash_max_distance": settings.MEMORY_SIMHASH_MAX_DISTANCE,
+                "consolidation_threshold": settings.MEMORY_CONSOLIDATION_THRESHOLD,
+                "consolidation_interval_hours": settings.MEMORY_CONSOLIDATION_INTERVAL_HOURS,
+                "local_index_enabled": settings.MEMORY_LOCAL_INDEX_ENABLED,
+                "local_index_max_vectors": settings.MEMORY_LOCAL_INDEX_MAX_VECTORS,
+                "cold_vector_dtype": settings.MEMORY_COLD_VECTOR_DTYPE,
+                "cold_demote_score": settings.MEMORY_COLD_DEMOTE_SCORE,
+                "cold_min_age_days": settings.MEMORY_COLD_MIN_AGE_DAYS,
+                "tiering_interval_hours": settings.MEMORY_TIERING_INTERVAL_HOURS,
+                "transfer_batch_size": settings.MEMORY_TRANSFER_BATCH_SIZE,
+                "import_embed_batch_size": settings.MEMORY_IMPORT_EMBED_BATCH_SIZE,
+                "outbox_batch_size": settings.MEMORY_OUTBOX_BATCH_SIZE,
+                "outbox_poll_interval": settings.MEMORY_OUTBOX_POLL_INTERVAL,
+                "outbox_retry_seconds": settings.MEMORY_OUTBOX_RETRY_SECONDS,
+                "reconcile_prefix_length": settings.MEMORY_RECONCILE_PREFIX_LENGTH,
+                "reconcile_grace_seconds": settings.MEMORY_RECONCILE_GRACE_SECONDS,
+                "reconcile_batch_size": settings.MEMORY_RECONCILE_BATCH_SIZE,
+                "reconcile_interval_hours": settings.MEMORY_RECONCILE_INTERVAL_HOURS,
             },
             "description": "记忆系统配置"
         },
@@ -197,9 +299,29 @@ def get_default_configurations() -> Dict[str, Dict[str, Any]]:
             "value": {
                 "collection_knowledge": settings.MILVUS_COLLECTION_KNOWLEDGE,
                 "top_k": settings.MILVUS_TOP_K,
+                "vector_dtype": settings.MILVUS_VECTOR_DTYPE,
+                "index_type": settings.MILVUS_INDEX_TYPE,
+                "index_dimensions": settings.MILVUS_INDEX_DIMENSIONS,
+                "rescore_factor": settings.MILVUS_RESCORE_FACTOR,
             },
             "description": "Milvus 向量数据库配置"
         },
+        "sqlite": {
+            "value": {
+                "pool_size": settings.SQLITE_POOL_SIZE,
+                "pool_max_overflow": settings.SQLITE_POOL_MAX_OVERFLOW,
+                "pool_timeout": settings.SQLITE_POOL_TIMEOUT,
+                "read_pool_size": settings.SQLITE_READ_POOL_SIZE,
+                "journal_mode": settings.SQLITE_JOURNAL_MODE,
+                "synchronous": settings.SQLITE_SYNCHRONOUS,
+                "mmap_size": settings.SQLITE_MMAP_SIZE,
+                "cache_size_kb": settings.SQLITE_CACHE_SIZE_KB,
+                "busy_timeout_ms": settings.SQLITE_BUSY_TIMEOUT_MS,
+                "writer_max_batch": settings.SQLITE_WRITER_MAX_BATCH,
+                "writer_group_window_ms": settings.SQLITE_WRITER_GROUP_WINDOW_MS,
+            },
+            "description": "SQLite 连接池与存储调优配置"
+        },
         "kuzu": {
             "value": {
                 "node_table_user": settings.KUZU_NODE_TABLE_USER,
@@ -214,9 +336,23 @@ def get_default_configurations() -> Dict[str, Dict[str, Any]]:
         "cache": {
             "value": {
                 "ttl": settings.CACHE_TTL,
+                "config_poll_interval": settings.CONFIG_CACHE_POLL_INTERVAL,
+                "persona_registry_refresh_seconds": settings.PERSONA_REGISTRY_REFRESH_SECONDS,
+                "models_ttl": settings.MODELS_CACHE_TTL,
             },
             "description": "缓存配置"
         },
+        "job_queue": {
+            "value": {
+                "workers": settings.JOB_QUEUE_WORKERS,
+                "max_attempts": settings.JOB_QUEUE_MAX_ATTEMPTS,
+                "retry_base_seconds": settings.JOB_QUEUE_RETRY_BASE_SECONDS,
+                "retry_max_seconds": settings.JOB_QUEUE_RETRY_MAX_SECONDS,
+                "job_timeout": settings.JOB_QUEUE_JOB_TIMEOUT,
+                "extraction_max_depth": settings.MEMORY_EXTRACTION_QUEUE_MAX_DEPTH,
+            },
+            "description": "后台任务队列配置"
+        },
     }
 
 
@@ -232,6 +368,7 @@ def initialize_configurations():
     db = SessionLocal()
     try:
         default_configs = get_default_configurations()
+        added = 0
 
         for config_key, config_data in default_configs.items():
             # 检查配置是否已存在
@@ -255,8 +392,11 @@ def initialize_configurations():
                 updated_at=datetime.now()  # 使用本地时间（北京时间）
             )
             db.add(config)
+            added += 1
             logger.info(f"Initialized configuration: {config_key}")
 
+        if added:
+            _bump_configuration_version(db)
         db.commit()
         logger.info(f"Configuration initialization completed. Total configs: {len(default_configs)}")
 
@@ -268,41 +408,43 @@ def initialize_configurations():
         db.close()
 
 
+def _bump_configuration_version(db) -> None:
+    """在同步会话中递增配置版本号（与配置写入在同一事务中提交）"""
+    from models.database import ConfigurationVersion
+
+    version = db.get(ConfigurationVersion, 1)
+    if version:
+        version.version += 1
+    else:
+        db.add(ConfigurationVersion(id=1, version=1))
+
+
 def get_configuration_from_db(config_key: str) -> Optional[Dict[str, Any]]:
     """
-    从数据库获取配置
+    获取配置（读取进程内的配置缓存，不访问数据库）
     如果配置不存在，返回默认值
     """
-    from models.database import SessionLocal, Configuration
+    from services.config_cache import config_cache
     from utils.logger import logger
 
-    db = SessionLocal()
     try:
-        config = db.query(Configuration).filter(
-            Configuration.user_id == "system",
-            Configuration.config_key == config_key
-        ).first()
-
-        if config:
-            return config.get_value()
-        else:
-            # 返回默认配置
-            default_configs = get_default_configurations()
-            if config_key in default_configs:
-                logger.warning(f"Configuration '{config_key}' not found in database, using default value")
-                return default_configs[config_key]["value"]
-            return None
-
+        return config_cache.get(config_key)
     except Exception as e:
         logger.error(f"Failed to get configuration '{config_key}': {e}")
         return None
-    finally:
-        db.close()
+
+
+async def get_configuration_from_db_async(config_key: str) -> Optional[Dict[str, Any]]:
+    """
+    获取配置（异步版本，读取进程内的配置缓存，不访问数据库）
+    如果配置不存在，返回默认值
+    """
+    return get_configuration_from_db(config_key)
 
 
 def update_configuration_in_db(config_key: str, config_value: Dict[str, Any]) -> bool:
     """
-    更新数据库中的配置
+    更新数据库中的配置（同步版本，各进程的配置缓存通过版本号检查感知变化）
     """
     from models.database import SessionLocal, Configuration
     from utils.logger import logger
@@ -336,6 +478,7 @@ def update_configuration_in_db(config_key: str, config_value: Dict[str, Any]) ->
             db.add(config)
             logger.info(f"Created configuration: {config_key}")
 
+        _bump_configuration_version(db)
         db.commit()
         return True
 
@@ -347,6 +490,15 @@ def update_configuration_in_db(config_key: str, config_value: Dict[str, Any]) ->
         db.close()
 
 
+async def update_configuration_in_db_async(config_key: str, config_value: Dict[str, Any]) -> bool:
+    """
+    更新数据库中的配置（异步版本，立即提交并刷新配置缓存、通知订阅者）
+    """
+    from services.config_cache import config_cache
+
+    return await config_cache.set(config_key, config_value)
+
+
 def initialize_default_persona():
     """
     初始化默认人格
@@ -1,12 +1,14 @@
 """
 Embedding客户端 - OpenAI风格API
 """
-from typing import List, Optional
+from typing import List, Dict, Any, Optional
 import httpx
+import numpy as np
 
 from config import settings
 from utils.logger import logger
 from utils.cache import cache
+from services.config_cache import config_cache
 
 
 class EmbeddingClient:
@@ -52,10 +54,10 @@ class EmbeddingClient:
             向量表示
         """
         # 检查缓存
-        cache_key = f"embed:{hash(text)}"
+        cache_key = f"embed:{self.model}:{hash(text)}"
         cached_result = cache.get(cache_key)
         if cached_result is not None:
-            return cached_result
+            return cached_result.tolist()
         
         # 调用API
         try:
@@ -65,15 +67,16 @@ class EmbeddingClient:
                     "input": text,
                     "model": self.model
                 },
-                headers=self._get_headers()
+                headers=self._get_headers(),
+                timeout=self.timeout
             )
             response.raise_for_status()
             
             data = response.json()
             embedding = data["data"][0]["embedding"]
             
-            # 缓存结果
-            cache.set(cache_key, embedding)
+            # 缓存结果（以float32数组保存，约为Python浮点数列表的1/8内存）
+            cache.set(cache_key, np.asarray(embedding, dtype=np.float32))
             
             logger.debug(f"Successfully embedded text (length: {len(text)})")
             return embedding
@@ -101,10 +104,10 @@ class EmbeddingClient:
         uncached_indices = []
         
         for i, text in enumerate(texts):
-            cache_key = f"embed:{hash(text)}"
+            cache_key = f"embed:{self.model}:{hash(text)}"
             cached_result = cache.get(cache_key)
             if cached_result is not None:
-                results.append((i, cached_result))
+                results.append((i, cached_result.tolist()))
             else:
                 uncached_texts.append(text)
                 uncached_indices.append(i)
@@ -118,7 +121,8 @@ class EmbeddingClient:
                         "input": uncached_texts,
                         "model": self.model
                     },
-                    headers=self._get_headers()
+                    headers=self._get_headers(),
+                    timeout=self.timeout
                 )
                 response.raise_for_status()
                 
@@ -127,8 +131,8 @@ class EmbeddingClient:
                 
                 # 缓存结果
                 for text, embedding in zip(uncached_texts, embeddings):
-                    cache_key = f"embed:{hash(text)}"
-                    cache.set(cache_key, embedding)
+                    cache_key = f"embed:{self.model}:{hash(text)}"
+                    cache.set(cache_key, np.asarray(embedding, dtype=np.float32))
                 
                 # 合并结果
                 for idx, embedding in zip(uncached_indices, embeddings):
@@ -163,6 +167,23 @@ class EmbeddingClient:
         
         return headers
     
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者）
+
+        超时时间随每个请求传入，始终复用同一个HTTP客户端及其连接池；进行中的请求沿用发出时的超时时间
+
+        Args:
+            config_key: 配置键
+            value: 配置值（base_url, api_key, model, timeout；向量维度由向量库模式决定，变更需要重建索引，此处忽略）
+        """
+        self.base_url = value.get("base_url") or self.base_url
+        self.api_key = value.get("api_key", self.api_key)
+        self.model = value.get("model") or self.model
+        self.timeout = value.get("timeout") or self.timeout
+
+        logger.info(f"{type(self).__name__} reconfigured from '{config_key}': model={self.model}, base_url={self.base_url}")
+    
     def close(self):
         """关闭HTTP客户端"""
         self.client.close()
@@ -171,3 +192,6 @@ class EmbeddingClient:
 
 # 创建全局Embedding客户端实例
 embedding_client = EmbeddingClient()
+
+# 配置接口修改Embedding配置后即时生效
+config_cache.subscribe(embedding_client.apply_configuration, ["embedding"])
@@ -6,6 +6,7 @@ import httpx
 import json
 
 from config import settings
+from services.config_cache import config_cache
 from utils.logger import logger
 
 
@@ -35,9 +36,11 @@ class LLMClient:
         self.api_key = api_key or settings.LLM_API_KEY
         self.model = model or settings.LLM_MODEL
         self.timeout = timeout or settings.LLM_TIMEOUT
+        # 流式对话是否透传上游SSE字节（不逐chunk解析和重新序列化）
+        self.stream_passthrough = settings.LLM_STREAM_PASSTHROUGH
         
-        # 创建HTTP客户端
-        self.client = httpx.Client(timeout=self.timeout)
+        # 创建异步HTTP客户端（所有请求均经异步客户端发出，等待上游响应时不阻塞事件循环）
+        self.async_client = httpx.AsyncClient(timeout=self.timeout)
         
         logger.info(f"LLMClient initialized: model={self.model}, base_url={self.base_url}")
     
@@ -96,10 +99,11 @@ class LLMClient:
                 payload[key] = value
 
         try:
-            response = self.client.post(
+            response = await self.async_client.post(
                 f"{self.base_url}/chat/completions",
                 json=payload,
-                headers=self._get_headers()
+                headers=self._get_headers(),
+                timeout=self.timeout
             )
             response.raise_for_status()
 
@@ -160,15 +164,16 @@ class LLMClient:
                 payload[key] = value
 
         try:
-            with self.client.stream(
+            async with self.async_client.stream(
                 "POST",
                 f"{self.base_url}/chat/completions",
                 json=payload,
-                headers=self._get_headers()
+                headers=self._get_headers(),
+                timeout=self.timeout
             ) as response:
                 response.raise_for_status()
 
-                for line in response.iter_lines():
+                async for line in response.aiter_lines():
                     if line.startswith("data: "):
                         data_str = line[6:]
                         if data_str == "[DONE]":
@@ -189,13 +194,82 @@ class LLMClient:
         except Exception as e:
             logger.error(f"Error during streaming chat completion: {e}")
             raise
+
+    async def chat_completion_stream_raw(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Optional[Any] = None,
+        model: Optional[str] = None,
+        **kwargs  # 支持传递其他参数（如top_k, thinking等）
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        聊天补全（流式，透传上游SSE字节）
+
+        与 chat_completion_stream 不同，不解析每个chunk，按收到的字节块原样返回（包括上游的 [DONE] 标记）
+
+        Args:
+            messages: 消息列表
+            temperature: 温度参数
+            max_tokens: 最大token数
+            tools: 工具列表
+            tool_choice: 工具选择策略
+            model: 模型名称（可选，覆盖默认模型）
+            **kwargs: 其他参数（如top_k, thinking等）
+
+        Yields:
+            上游响应的原始字节块（块边界不保证与SSE事件对齐）
+        """
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": True
+        }
+
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        if tools is not None:
+            payload["tools"] = tools
+        if tool_choice is not None:
+            payload["tool_choice"] = tool_choice
+        # 添加其他参数（如top_k, thinking等）
+        for key, value in kwargs.items():
+            if value is not None:
+                payload[key] = value
+
+        try:
+            async with self.async_client.stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                json=payload,
+                headers=self._get_headers(),
+                timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+
+            logger.debug("Successfully completed streaming chat request (passthrough)")
+
+        except httpx.HTTPError as e:
+            logger.error(f"HTTP error during streaming chat completion: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during streaming chat completion: {e}")
+            raise
     
     async def completion(
         self,
         prompt: str,
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
-        stream: Optional[bool] = False
+        stream: Optional[bool] = False,
+        model: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         文本补全
@@ -205,12 +279,13 @@ class LLMClient:
             temperature: 温度参数
             max_tokens: 最大token数
             stream: 是否流式输出
+            model: 模型名称（可选，覆盖默认模型）
         
         Returns:
             API响应
         """
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "prompt": prompt,
             "stream": stream
         }
@@ -221,10 +296,11 @@ class LLMClient:
             payload["max_tokens"] = max_tokens
         
         try:
-            response = self.client.post(
+            response = await self.async_client.post(
                 f"{self.base_url}/completions",
                 json=payload,
-                headers=self._get_headers()
+                headers=self._get_headers(),
+                timeout=self.timeout
             )
             response.raise_for_status()
             
@@ -239,6 +315,63 @@ class LLMClient:
         except Exception as e:
             logger.error(f"Error during completion: {e}")
             raise
+
+    async def completion_stream_raw(
+        self,
+        prompt: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+        **kwargs
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        文本补全（流式，透传上游SSE字节）
+
+        Args:
+            prompt: 提示文本
+            temperature: 温度参数
+            max_tokens: 最大token数
+            model: 模型名称（可选，覆盖默认模型）
+            **kwargs: 其他参数
+
+        Yields:
+            上游响应的原始字节块（块边界不保证与SSE事件对齐）
+        """
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": True
+        }
+
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        for key, value in kwargs.items():
+            if value is not None:
+                payload[key] = value
+
+        try:
+            async with self.async_client.stream(
+                "POST",
+                f"{self.base_url}/completions",
+                json=payload,
+                headers=self._get_headers(),
+                timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+
+            logger.debug("Successfully completed streaming completion request")
+
+        except httpx.HTTPError as e:
+            logger.error(f"HTTP error during streaming completion: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during streaming completion: {e}")
+            raise
     
     async def list_models(self) -> List[Dict[str, Any]]:
         """
@@ -248,9 +381,10 @@ class LLMClient:
             模型列表
         """
         try:
-            response = self.client.get(
+            response = await self.async_client.get(
                 f"{self.base_url}/models",
-                headers=self._get_headers()
+                headers=self._get_headers(),
+                timeout=self.timeout
             )
             response.raise_for_status()
             
@@ -284,9 +418,27 @@ class LLMClient:
         
         return headers
     
-    def close(self):
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者）
+
+        超时时间随每个请求传入，始终复用同一个HTTP客户端及其连接池；进行中的请求沿用发出时的超时时间
+
+        Args:
+            config_key: 配置键
+            value: 配置值（base_url, api_key, model, timeout, stream_passthrough）
+        """
+        self.base_url = value.get("base_url") or self.base_url
+        self.api_key = value.get("api_key", self.api_key)
+        self.model = value.get("model") or self.model
+        self.stream_passthrough = value.get("stream_passthrough", self.stream_passthrough)
+        self.timeout = value.get("timeout") or self.timeout
+
+        logger.info(f"{type(self).__name__} reconfigured from '{config_key}': model={self.model}, base_url={self.base_url}")
+    
+    async def aclose(self):
         """关闭HTTP客户端"""
-        self.client.close()
+        await self.async_client.aclose()
         logger.info("LLMClient closed")
 
 
@@ -313,3 +465,7 @@ class MemoryExtractionLLMClient(LLMClient):
 
 
 memory_extraction_llm_client = MemoryExtractionLLMClient()
+
+# 配置接口修改LLM配置后即时生效
+config_cache.subscribe(llm_client.apply_configuration, ["llm"])
+config_cache.subscribe(memory_extraction_llm_client.apply_configuration, ["memory_extraction"])
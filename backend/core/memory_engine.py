@@ -1,14 +1,247 @@
 """
 记忆注入引擎
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime
+import hashlib
+import json
+import threading
 
 from config import settings
 from utils.logger import logger
 from utils.helpers import calculate_similarity_score, get_current_timestamp_ms
 from memory.retrieval import retrieval_strategy
 from core.embedding_client import embedding_client
+from services.config_cache import config_cache
+
+
+# XML特殊字符转义表（单次translate替代多次replace）
+_XML_ESCAPE_TABLE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&apos;",
+})
+
+
+def _escape_xml(text: str) -> str:
+    """
+    转义XML特殊字符
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        转义后的文本
+    """
+    if not text:
+        return text
+    return text.translate(_XML_ESCAPE_TABLE)
+
+
+def _format_event_time(event_time: Any) -> str:
+    """
+    将event_time格式化为展示字符串（精确到分钟）
+
+    Args:
+        event_time: ISO格式字符串或datetime
+
+    Returns:
+        格式化后的时间字符串，解析失败时返回原始字符串
+    """
+    try:
+        dt = event_time if isinstance(event_time, datetime) else datetime.fromisoformat(event_time)
+        return dt.strftime('%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return str(event_time)
+
+
+class MemoryContextRenderer:
+    """
+    记忆上下文渲染器
+    按 memory_id + 版本缓存每条记忆转义、格式化后的片段，
+    渲染时只需对缓存片段做一次拼接
+    """
+
+    FORMATS = ("xml", "markdown", "json")
+
+    def __init__(self, output_format: str = "xml", max_entries: int = 4096):
+        """
+        初始化渲染器
+
+        Args:
+            output_format: 输出格式（'xml', 'markdown', 'json'）
+            max_entries: 片段缓存的最大条目数（LRU淘汰）
+        """
+        if output_format not in self.FORMATS:
+            logger.warning(f"Unknown memory context format '{output_format}', falling back to xml")
+            output_format = "xml"
+        self.output_format = output_format
+        self.max_entries = max_entries
+
+        # (memory_id, format) -> (version, fragment)
+        self._fragments: "OrderedDict[Tuple[str, str], Tuple[Tuple[Any, Any], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(
+        self,
+        memories: List[Dict[str, Any]],
+        output_format: Optional[str] = None
+    ) -> str:
+        """
+        渲染记忆上下文
+
+        Args:
+            memories: 记忆列表（已按注入顺序排列）
+            output_format: 输出格式，默认使用渲染器的配置
+
+        Returns:
+            渲染后的记忆上下文，没有记忆时返回空字符串
+        """
+        if not memories:
+            return ""
+
+        fmt = output_format or self.output_format
+        fragments = [self._get_fragment(memory, fmt) for memory in memories]
+
+        if fmt == "json":
+            return "{\"memory_context\": [" + ", ".join(fragments) + "]}"
+
+        if fmt == "markdown":
+            return "## 相关记忆\n" + "\n".join(
+                f"{i}. {fragment}" for i, fragment in enumerate(fragments, 1)
+            )
+
+        return "<memory_context>\n  <related_knowledge>\n" + "\n".join(
+            f"    <memory index=\"{i}\">\n{fragment}\n    </memory>"
+            for i, fragment in enumerate(fragments, 1)
+        ) + "\n  </related_knowledge>\n</memory_context>"
+
+    def invalidate(self, memory_id: str):
+        """
+        使某条记忆的缓存片段失效（记忆更新或删除时调用）
+
+        Args:
+            memory_id: 记忆ID
+        """
+        with self._lock:
+            for fmt in self.FORMATS:
+                self._fragments.pop((memory_id, fmt), None)
+
+    def clear(self):
+        """清空片段缓存"""
+        with self._lock:
+            self._fragments.clear()
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者，片段缓存按格式区分，切换格式无需清空）
+
+        Args:
+            config_key: 配置键（memory_system）
+            value: 配置值
+        """
+        output_format = value.get("context_format", self.output_format)
+        if output_format not in self.FORMATS:
+            logger.warning(f"Ignoring unknown memory context format '{output_format}'")
+            return
+        self.output_format = output_format
+
+    def _get_fragment(self, memory: Dict[str, Any], fmt: str) -> str:
+        """
+        获取单条记忆的片段（优先从缓存读取）
+
+        Args:
+            memory: 记忆数据
+            fmt: 输出格式
+
+        Returns:
+            格式化后的片段
+        """
+        memory_id = memory.get("memory_id") or memory.get("id")
+        # 以内容和事件时间作为版本，内容变化时自动重新渲染
+        version = (memory.get("content", ""), memory.get("event_time"))
+
+        if memory_id is None:
+            return self._build_fragment(version[0], version[1], fmt)
+
+        key = (memory_id, fmt)
+        with self._lock:
+            cached = self._fragments.get(key)
+            if cached is not None and cached[0] == version:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+
+        fragment = self._build_fragment(version[0], version[1], fmt)
+        with self._lock:
+            self.misses += 1
+            self._fragments[key] = (version, fragment)
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    @staticmethod
+    def _build_fragment(content: str, event_time: Any, fmt: str) -> str:
+        """
+        构建单条记忆的片段
+
+        Args:
+            content: 记忆内容
+            event_time: 事件时间
+            fmt: 输出格式
+
+        Returns:
+            格式化后的片段
+        """
+        content = content or ""
+        time_str = _format_event_time(event_time) if event_time else None
+
+        if fmt == "json":
+            item = {"content": content}
+            if time_str:
+                item["event_time"] = time_str
+            return json.dumps(item, ensure_ascii=False)
+
+        if fmt == "markdown":
+            text = " ".join(content.split())
+            return f"[{time_str}] {text}" if time_str else text
+
+        fragment = f"      <content>{_escape_xml(content)}</content>"
+        if time_str:
+            fragment += f"\n      <event_time>{_escape_xml(time_str)}</event_time>"
+        return fragment
+
+
+# 创建全局记忆上下文渲染器实例
+memory_context_renderer = MemoryContextRenderer(output_format=settings.MEMORY_CONTEXT_FORMAT)
+
+
+# 前缀稳定率按块比较system prompt，每块的字符数
+_PREFIX_BLOCK_CHARS = 64
+
+
+def _prefix_signature(text: str) -> Tuple[int, List[bytes]]:
+    """
+    计算文本的前缀签名：长度 + 每个块边界处的累积摘要（第i个摘要覆盖文本的前 (i+1) 块）
+
+    Args:
+        text: 文本
+
+    Returns:
+        (长度, 累积摘要列表)
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digests = []
+    for start in range(0, len(text), _PREFIX_BLOCK_CHARS):
+        digest.update(text[start:start + _PREFIX_BLOCK_CHARS].encode("utf-8"))
+        digests.append(digest.digest())
+    return len(text), digests
 
 
 class MemoryEngine:
@@ -17,11 +250,21 @@ class MemoryEngine:
     负责从记忆系统中检索相关记忆并注入到LLM请求中
     """
     
-    def __init__(self):
-        """初始化记忆注入引擎"""
+    def __init__(self, max_prefix_keys: int = 1024):
+        """
+        初始化记忆注入引擎
+
+        Args:
+            max_prefix_keys: 前缀稳定率统计的最大维度数（LRU淘汰）
+        """
         self.enabled = settings.MEMORY_ENABLED
         self.max_long_term = settings.MEMORY_MAX_LONG_TERM
         self.injection_mode = settings.MEMORY_INJECTION_MODE
+        self.injection_order = settings.MEMORY_INJECTION_ORDER
+
+        # 前缀稳定性统计（key -> 上一轮system prompt的签名及累计比值），不保存prompt原文
+        self.max_prefix_keys = max_prefix_keys
+        self._prefix_stats: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         
         # 评分权重
         self.similarity_weight = settings.MEMORY_SCORE_SIMILARITY_WEIGHT
@@ -30,12 +273,34 @@ class MemoryEngine:
         self.graph_weight = settings.MEMORY_SCORE_GRAPH_WEIGHT
         self.lambda_decay = settings.MEMORY_RECENCY_DECAY_LAMBDA
         
-        logger.info(f"MemoryEngine initialized: enabled={self.enabled}, mode={self.injection_mode}")
+        logger.info(f"MemoryEngine initialized: enabled={self.enabled}, mode={self.injection_mode}, order={self.injection_order}")
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者）
+
+        Args:
+            config_key: 配置键（memory_system, memory_scoring）
+            value: 配置值
+        """
+        if config_key == "memory_system":
+            self.enabled = value.get("enabled", self.enabled)
+            self.max_long_term = value.get("max_long_term", self.max_long_term)
+            self.injection_mode = value.get("injection_mode", self.injection_mode)
+            self.injection_order = value.get("injection_order", self.injection_order)
+        elif config_key == "memory_scoring":
+            self.similarity_weight = value.get("similarity_weight", self.similarity_weight)
+            self.access_weight = value.get("access_weight", self.access_weight)
+            self.recency_weight = value.get("recency_weight", self.recency_weight)
+            self.graph_weight = value.get("graph_weight", self.graph_weight)
+            self.lambda_decay = value.get("recency_decay_lambda", self.lambda_decay)
+        logger.info(f"MemoryEngine reconfigured from '{config_key}': enabled={self.enabled}, mode={self.injection_mode}")
     
     async def retrieve_memories(
         self,
         query: str,
-        persona_id: Optional[str] = None
+        persona_id: Optional[str] = None,
+        include_cold: bool = False
     ) -> List[Dict[str, Any]]:
         """
         检索相关记忆
@@ -43,6 +308,7 @@ class MemoryEngine:
         Args:
             query: 查询文本
             persona_id: 记忆体ID（用于长期记忆过滤）
+            include_cold: 是否同时检索冷存储（命中的冷记忆会恢复到热存储）
 
         Returns:
             长期记忆列表
@@ -61,7 +327,8 @@ class MemoryEngine:
             memories = await retrieval_strategy.retrieve(
                 query_embedding=query_embedding,
                 query_text=query,
-                persona_id=persona_id
+                persona_id=persona_id,
+                include_cold=include_cold
             )
 
             logger.info(f"[DEBUG] MemoryEngine retrieved {len(memories)} long-term memories")
@@ -132,8 +399,8 @@ class MemoryEngine:
             return messages
 
         # 限制记忆数量
-        long_term_memories = memories[:self.max_long_term]
-        logger.info(f"[DEBUG] Limited to {len(long_term_memories)} memories (max={self.max_long_term})")
+        long_term_memories = self._select_memories(memories)
+        logger.info(f"[DEBUG] Limited to {len(long_term_memories)} memories (max={self.max_long_term}, order={self.injection_order})")
 
         # 根据注入模式处理
         if self.injection_mode == "system":
@@ -148,7 +415,124 @@ class MemoryEngine:
             # 混合模式（等同于system模式，因为已移除短期记忆）
             logger.info("[DEBUG] Using mixed injection mode (same as system)")
             return self._inject_to_system(messages, long_term_memories)
+
+    def inject_prompt(self, prompt: str, memories: List[Dict[str, Any]]) -> str:
+        """
+        将记忆注入到文本补全的提示文本中（记忆上下文置于提示文本之前）
+
+        Args:
+            prompt: 原始提示文本
+            memories: 长期记忆列表
+
+        Returns:
+            增强后的提示文本
+        """
+        if not self.enabled or not memories:
+            return prompt
+
+        memory_context = self._format_memory_context(self._select_memories(memories))
+        if not memory_context:
+            return prompt
+        return f"{memory_context}\n\n{prompt}"
     
+    def _select_memories(
+        self,
+        memories: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        选取需要注入的记忆
+
+        按综合评分选出前max_long_term条记忆；在stable模式下，
+        再按创建时间和记忆ID重新排序，使同一组记忆每轮渲染出的文本完全一致。
+
+        Args:
+            memories: 按综合评分降序排列的记忆列表
+
+        Returns:
+            待注入的记忆列表
+        """
+        selected = memories[:self.max_long_term]
+        if self.injection_order != "stable":
+            return selected
+
+        return sorted(
+            selected,
+            key=lambda m: (
+                m.get("created_at") or 0,
+                str(m.get("memory_id") or m.get("id") or "")
+            )
+        )
+
+    def record_prefix_stability(
+        self,
+        key: str,
+        messages: List[Dict[str, Any]]
+    ) -> float:
+        """
+        记录并计算前缀稳定率
+
+        前缀稳定率 = 本轮system prompt与上一轮的公共前缀长度 / 本轮system prompt长度。
+        比值越接近1，上游供应商的前缀缓存（prompt cache）命中越多。
+        只保存上一轮的长度和按块累积的摘要，公共前缀长度精确到块（_PREFIX_BLOCK_CHARS 个字符）。
+
+        Args:
+            key: 统计维度（通常为 persona_id/llm_model）
+            messages: 最终发送给LLM的消息列表
+
+        Returns:
+            本轮的前缀稳定率 (0-1)
+        """
+        prefix = ""
+        if messages and messages[0].get("role") == "system":
+            prefix = messages[0].get("content") or ""
+
+        length, digests = _prefix_signature(prefix)
+
+        stats = self._prefix_stats.get(key)
+        if stats is None:
+            stats = self._prefix_stats[key] = {"turns": 0, "ratio_sum": 0.0}
+            while len(self._prefix_stats) > self.max_prefix_keys:
+                self._prefix_stats.popitem(last=False)
+        else:
+            self._prefix_stats.move_to_end(key)
+
+        previous = stats.get("digests")
+        stats["digests"] = digests
+        if previous is None or not prefix:
+            return 0.0
+
+        matched = 0
+        for a, b in zip(previous, digests):
+            if a != b:
+                break
+            matched += 1
+        common = min(matched * _PREFIX_BLOCK_CHARS, length)
+        ratio = common / length
+
+        stats["turns"] += 1
+        stats["ratio_sum"] += ratio
+        stats["last_ratio"] = ratio
+
+        logger.info(f"Prefix stability for {key}: ratio={ratio:.3f}, common_prefix={common}/{len(prefix)}")
+        return ratio
+
+    def get_prefix_stability_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取前缀稳定率统计
+
+        Returns:
+            key -> {turns, last_ratio, avg_ratio}
+        """
+        return {
+            key: {
+                "turns": stats["turns"],
+                "last_ratio": stats.get("last_ratio"),
+                "avg_ratio": stats["ratio_sum"] / stats["turns"] if stats["turns"] else None
+            }
+            for key, stats in self._prefix_stats.items()
+            if stats["turns"]
+        }
+
     def _inject_to_system(
         self,
         messages: List[Dict[str, str]],
@@ -171,7 +555,7 @@ class MemoryEngine:
 
         # 打印注入的记忆上下文
         if memory_context:
-            logger.info(f"Memory context injected into system prompt:\n{memory_context}")
+            logger.debug(f"Memory context injected into system prompt:\n{memory_context}")
 
         # 查找或创建system消息
         system_message = None
@@ -233,6 +617,13 @@ class MemoryEngine:
                 "content": f"[记忆] {memory.get('content', '')}"
             })
         
+        if self.injection_order == "stable":
+            # stable模式：记忆消息放在开头的system消息之后，保持静态前缀不变
+            insert_at = 0
+            while insert_at < len(messages) and messages[insert_at].get("role") == "system":
+                insert_at += 1
+            return messages[:insert_at] + memory_messages + messages[insert_at:]
+
         # 将记忆消息插入到第一条消息之前
         return memory_messages + messages
     
@@ -248,55 +639,13 @@ class MemoryEngine:
             long_term_memories: 长期记忆列表
 
         Returns:
-            格式化后的记忆上下文（XML格式）
+            格式化后的记忆上下文（格式由MEMORY_CONTEXT_FORMAT决定，默认XML）
         """
-        logger.info(f"[DEBUG] _format_memory_context: received {len(long_term_memories)} memories")
-        
-        if not long_term_memories:
-            logger.info("[DEBUG] No long_term_memories to format")
-            return ""
-
-        # 构建XML格式的记忆上下文
-        xml_parts = ["<memory_context>"]
-        xml_parts.append("  <related_knowledge>")
-        
-        for i, memory in enumerate(long_term_memories, 1):
-            content = memory.get('content', '')
-            event_time = memory.get('event_time')
-            logger.info(f"[DEBUG] Formatting memory {i}: content='{content[:50]}...', event_time={event_time}")
-            
-            # 转义XML特殊字符
-            content_escaped = self._escape_xml(content)
-            
-            # 如果有event_time，格式化时间信息
-            if event_time:
-                # 尝试解析ISO格式并格式化显示
-                try:
-                    from datetime import datetime
-                    dt = datetime.fromisoformat(event_time)
-                    time_str = dt.strftime('%Y-%m-%d %H:%M')
-                    xml_parts.append(f"    <memory index=\"{i}\">")
-                    xml_parts.append(f"      <content>{content_escaped}</content>")
-                    xml_parts.append(f"      <event_time>{time_str}</event_time>")
-                    xml_parts.append(f"    </memory>")
-                except:
-                    # 解析失败，直接显示原始字符串
-                    xml_parts.append(f"    <memory index=\"{i}\">")
-                    xml_parts.append(f"      <content>{content_escaped}</content>")
-                    xml_parts.append(f"      <event_time>{event_time}</event_time>")
-                    xml_parts.append(f"    </memory>")
-            else:
-                xml_parts.append(f"    <memory index=\"{i}\">")
-                xml_parts.append(f"      <content>{content_escaped}</content>")
-                xml_parts.append(f"    </memory>")
-        
-        xml_parts.append("  </related_knowledge>")
-        xml_parts.append("</memory_context>")
-        
-        result = "\n".join(xml_parts)
-        logger.info(f"[DEBUG] Formatted memory context:\n{result}")
+        logger.debug(f"_format_memory_context: received {len(long_term_memories)} memories")
+        result = memory_context_renderer.render(long_term_memories)
+        logger.debug(f"Formatted memory context:\n{result}")
         return result
-    
+
     def _escape_xml(self, text: str) -> str:
         """
         转义XML特殊字符
@@ -307,16 +656,8 @@ class MemoryEngine:
         Returns:
             转义后的文本
         """
-        if not text:
-            return text
-        # 转义XML特殊字符
-        text = text.replace("&", "&amp;")
-        text = text.replace("<", "&lt;")
-        text = text.replace(">", "&gt;")
-        text = text.replace('"', "&quot;")
-        text = text.replace("'", "&apos;")
-        return text
-    
+        return _escape_xml(text)
+
     def _create_system_prompt_with_memory(
         self,
         base_prompt: str,
@@ -351,3 +692,7 @@ class MemoryEngine:
 
 # 创建全局记忆注入引擎实例
 memory_engine = MemoryEngine()
+
+# 配置接口修改记忆系统或评分配置后即时生效
+config_cache.subscribe(memory_context_renderer.apply_configuration, ["memory_system"])
+config_cache.subscribe(memory_engine.apply_configuration, ["memory_system", "memory_scoring"])
@@ -0,0 +1,116 @@
+"""
+SSE增量扫描器
+透传上游流式响应时，从原始字节帧中只提取助手文本（delta.content）和 finish_reason，不解析整个chunk
+"""
+from typing import List, Optional
+from json.decoder import scanstring
+
+from utils.logger import logger
+
+
+_DATA_PREFIX = b"data:"
+_DONE = b"[DONE]"
+_CONTENT_KEY = '"content"'
+_FINISH_REASON_KEY = '"finish_reason"'
+
+
+def _find_value(line: str, key: str) -> Optional[str]:
+    """
+    在一行JSON中查找第一个键为key的字符串值
+
+    只在值为字符串时返回，值为null或其他类型时返回None；
+    键以引号开头匹配，不会匹配到 reasoning_content 等同后缀的键，
+    也不会匹配到工具调用参数中转义过的 \\"content\\"
+
+    Args:
+        line: 一行JSON文本
+        key: 带引号的键名
+
+    Returns:
+        解码后的字符串值
+    """
+    position = line.find(key)
+    while position != -1:
+        index = position + len(key)
+        length = len(line)
+        while index < length and line[index] in " \t":
+            index += 1
+        if index < length and line[index] == ":":
+            index += 1
+            while index < length and line[index] in " \t":
+                index += 1
+            if index < length and line[index] == '"':
+                value, _ = scanstring(line, index + 1)
+                return value
+            return None
+        position = line.find(key, position + 1)
+    return None
+
+
+class SSEDeltaScanner:
+    """
+    SSE增量扫描器
+
+    按收到的字节块喂入（块边界可以落在任意位置），只扫描完整的 data 行；
+    助手文本按片段收集在列表中，结束时一次拼接
+    """
+
+    def __init__(self):
+        """初始化扫描器"""
+        self.finish_reason: Optional[str] = None
+        self.done = False
+        self._parts: List[str] = []
+        self._pending = b""
+
+    @property
+    def text(self) -> str:
+        """已收到的助手文本"""
+        return "".join(self._parts)
+
+    def feed(self, chunk: bytes):
+        """
+        喂入一个原始字节块
+
+        Args:
+            chunk: 上游响应的字节块
+        """
+        if self._pending:
+            chunk = self._pending + chunk
+        lines = chunk.split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._scan_line(line)
+
+    def close(self):
+        """处理最后一行（上游未以换行结尾时）"""
+        if self._pending:
+            self._scan_line(self._pending)
+            self._pending = b""
+
+    def _scan_line(self, line: bytes):
+        """
+        扫描一行SSE
+
+        Args:
+            line: 不含换行符的一行
+        """
+        if not line.startswith(_DATA_PREFIX):
+            return
+        payload = line[len(_DATA_PREFIX):].strip()
+        if payload == _DONE:
+            self.done = True
+            return
+
+        try:
+            text = payload.decode("utf-8")
+            content = _find_value(text, _CONTENT_KEY)
+            if content:
+                self._parts.append(content)
+            if _FINISH_REASON_KEY in text:
+                finish_reason = _find_value(text, _FINISH_REASON_KEY)
+                if finish_reason is not None:
+                    self.finish_reason = finish_reason
+                    logger.info(f"Stream chunk with finish_reason: {finish_reason}")
+        except ValueError:
+            # 非JSON或截断的行，透传时原样转发，这里只跳过
+            return
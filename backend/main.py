@@ -9,7 +9,7 @@ import importlib
 import os
 
 from config import settings, initialize_configurations, initialize_default_persona
-from models.database import init_db
+from models.database import init_db, engine, read_engine, async_engine, async_read_engine, UnitOfWorkMiddleware
 from utils.logger import logger
 from api import chat, completions, models, graph
 
@@ -59,6 +59,15 @@ except ImportError:
     logger.warning("Failed to import graph module")
 
 
+# 动态导入jobs模块
+try:
+    jobs_module = importlib.import_module("api.jobs")
+    jobs_router = jobs_module.router
+except ImportError:
+    jobs_router = None
+    logger.warning("Failed to import jobs module")
+
+
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -87,6 +96,9 @@ app.add_middleware(
     max_age=600,
 )
 
+# 请求级数据库工作单元（每个请求一个会话，响应发出前统一提交）
+app.add_middleware(UnitOfWorkMiddleware)
+
 # 注册路由
 app.include_router(chat.router, prefix=settings.API_V1_STR)
 app.include_router(completions.router, prefix=settings.API_V1_STR)
@@ -101,6 +113,8 @@ if graph_router:
     app.include_router(graph_router, prefix=settings.API_V1_STR)
 if config_router:
     app.include_router(config_router, prefix=settings.API_V1_STR)
+if jobs_router:
+    app.include_router(jobs_router, prefix=settings.API_V1_STR)
 
 # 静态文件服务 - 服务前端构建的dist目录
 FRONTEND_DIST_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend", "dist")
@@ -130,6 +144,11 @@ async def startup_event():
     
     # 初始化配置到数据库
     initialize_configurations()
+
+    # 加载配置缓存（数据库中的配置应用到各组件），并定期检查其他进程的配置变化
+    from services.config_cache import config_cache
+    config_cache.load()
+    config_cache.start()
     
     # 初始化默认人格
     initialize_default_persona()
@@ -155,6 +174,21 @@ async def startup_event():
         logger.error(f"Failed to initialize stores: {e}")
         raise
 
+    # 启动后台任务队列（继续执行上次未完成的任务）
+    from services.job_queue import job_queue
+    from services.consolidation_service import consolidation_service
+    from services.tiering_service import tiering_service
+    from services.reconcile_service import reconcile_service
+    from services.store_outbox import store_outbox
+    from services.persona_registry import persona_registry
+    await persona_registry.load()
+    persona_registry.start()
+    await job_queue.start()
+    consolidation_service.start_scheduler()
+    tiering_service.start_scheduler()
+    reconcile_service.start_scheduler()
+    store_outbox.start()
+
     logger.info(f"Server started. Data directory: {settings.DATA_DIR}")
     logger.info(f"SQLite DB path: {settings.SQLITE_DB_PATH}")
     logger.info(f"Milvus DB path: {settings.MILVUS_URI}")
@@ -166,12 +200,34 @@ async def startup_event():
     logger.info(f"MCP Tools API: GET {settings.API_V1_STR}/mcp/tools")
     logger.info(f"MCP Resources API: GET {settings.API_V1_STR}/mcp/resources")
     logger.info(f"MCP Tool Call API: POST {settings.API_V1_STR}/mcp/tools/{{tool_name}}")
+    logger.info(f"Job Queue API: GET {settings.API_V1_STR}/jobs/metrics")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
     logger.info("Shutdown signal received, closing connections...")
+
+    # 提交尚未达到批量轮次的对话，再停止后台任务队列，未完成的任务会在下次启动时继续执行
+    try:
+        from services.extraction_scheduler import extraction_scheduler
+        from services.job_queue import job_queue
+        from services.consolidation_service import consolidation_service
+        from services.tiering_service import tiering_service
+        from services.reconcile_service import reconcile_service
+        from services.store_outbox import store_outbox
+        from services.config_cache import config_cache
+        from services.persona_registry import persona_registry
+        await extraction_scheduler.flush_all()
+        await consolidation_service.stop_scheduler()
+        await tiering_service.stop_scheduler()
+        await reconcile_service.stop_scheduler()
+        await job_queue.stop()
+        await store_outbox.stop()
+        await config_cache.stop()
+        await persona_registry.stop()
+    except Exception as e:
+        logger.error(f"Error stopping job queue: {e}")
     
     # 关闭数据库连接
     try:
@@ -214,6 +270,20 @@ async def shutdown_event():
                 logger.info("Auto memory service closed")
         except ImportError:
             pass
+
+        # 关闭LLM客户端
+        from core.llm_client import llm_client, memory_extraction_llm_client
+        await llm_client.aclose()
+        await memory_extraction_llm_client.aclose()
+
+        # 写完已排队的SQLite写操作，再释放连接池中的连接
+        from models.db_writer import db_writer
+        await db_writer.stop()
+        engine.dispose()
+        read_engine.dispose()
+        await async_engine.dispose()
+        await async_read_engine.dispose()
+        logger.info("SQLite connection pool disposed")
             
     except Exception as e:
         logger.error(f"Error during shutdown: {e}")
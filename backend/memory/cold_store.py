@@ -0,0 +1,525 @@
+"""
+冷存储 - 长期未访问记忆的归档
+向量以float16或int8存放在按记忆体划分的内存映射文件中，内容和元数据存放在SQLite的cold_memories表中，
+只在显式请求时做精确的暴力检索
+"""
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from sqlalchemy import select, update, delete, func
+
+from config import settings
+from models.database import ColdMemory, async_read_session
+from models.db_writer import db_writer
+from memory.quantization import VECTOR_DTYPES, normalize, quantize, dequantize
+from utils.logger import logger
+
+
+# 冷存储文件每次扩容的行数
+_GROW_ROWS = 1024
+
+
+def _to_timestamp_ms(value: Optional[datetime]) -> Optional[int]:
+    """将datetime转换为毫秒时间戳（与向量存储中的时间字段一致）"""
+    return int(value.timestamp() * 1000) if value else None
+
+
+class ColdStore:
+    """
+    冷存储
+
+    每个记忆体一个内存映射文件，每行是一个归一化后的低精度向量，行号记录在cold_memories.slot中。
+    文件的编码类型记录在同名的元数据文件中，修改配置的编码类型只影响新建的文件，已有文件保持原编码。
+    删除记录后留下的空行在空行过半时通过压缩回收。
+    记录经写入队列写入；读写文件和行号的操作用一把异步锁串行，等待提交期间文件与行号不会被其他操作修改
+    """
+
+    def __init__(
+        self,
+        base_dir: str = settings.MEMORY_COLD_DIR,
+        dtype: str = settings.MEMORY_COLD_VECTOR_DTYPE,
+        dim: int = settings.EMBEDDING_DIMENSIONS
+    ):
+        """
+        初始化冷存储
+
+        Args:
+            base_dir: 冷存储文件目录
+            dtype: 向量编码类型（'float16' 或 'int8'）
+            dim: 向量维度
+        """
+        self.base_dir = base_dir
+        self.dtype = dtype
+        self.dim = dim
+        self._lock = asyncio.Lock()
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        logger.info(f"ColdStore initialized: dir={self.base_dir}, dtype={self.dtype}")
+
+    async def archive(
+        self,
+        memories: List[Dict[str, Any]],
+        embeddings: List[List[float]]
+    ) -> int:
+        """
+        归档记忆（调用方负责随后从热存储中删除）
+
+        Args:
+            memories: 记忆数据列表（字段与memories表一致），必须属于同一记忆体
+            embeddings: 与记忆一一对应的向量
+
+        Returns:
+            归档的记忆数
+        """
+        if not memories:
+            return 0
+
+        persona_id = memories[0]["persona_id"]
+
+        async with self._lock:
+            codes, scales = quantize(normalize(np.asarray(embeddings, dtype=np.float32)), self._dtype(persona_id))
+
+            async def operation(db):
+                next_slot = ((await db.execute(
+                    select(func.max(ColdMemory.slot)).where(ColdMemory.persona_id == persona_id)
+                )).scalar() or -1) + 1
+
+                # 先写向量再写记录：中断时只会留下未被引用的空行
+                matrix = self._open(persona_id, next_slot + len(memories))
+                matrix[next_slot:next_slot + len(memories)] = codes
+                matrix.flush()
+                del matrix
+
+                now = datetime.now()
+                db.add_all([
+                    ColdMemory(
+                        id=memory["id"],
+                        persona_id=persona_id,
+                        vector_id=memory["vector_id"],
+                        entity_id=memory.get("entity_id"),
+                        type=memory.get("type") or "long_term",
+                        content=memory["content"],
+                        created_at=memory.get("created_at"),
+                        event_time=memory.get("event_time"),
+                        last_accessed_at=memory.get("last_accessed_at"),
+                        access_count=memory.get("access_count") or 0,
+                        meta_data=memory.get("meta_data"),
+                        slot=next_slot + i,
+                        scale=float(scales[i]),
+                        archived_at=now
+                    )
+                    for i, memory in enumerate(memories)
+                ])
+                await db.flush()
+
+            try:
+                await db_writer.submit(operation)
+            except Exception as e:
+                logger.error(f"Failed to archive memories to cold store: {e}")
+                raise
+
+            logger.info(f"Archived {len(memories)} memories to cold store: persona_id={persona_id}")
+            return len(memories)
+
+    async def search(
+        self,
+        persona_id: str,
+        query_embedding: List[float],
+        top_k: int = 10
+    ) -> List[Dict[str, Any]]:
+        """
+        在记忆体的冷存储中做精确检索
+
+        Args:
+            persona_id: 记忆体ID
+            query_embedding: 查询向量
+            top_k: 返回结果数量
+
+        Returns:
+            检索结果列表（字段与热存储检索结果一致，tier为'cold'）
+        """
+        async with self._lock:
+            try:
+                async with async_read_session() as db:
+                    rows = list((await db.execute(
+                        select(ColdMemory).where(ColdMemory.persona_id == persona_id)
+                    )).scalars())
+                if not rows:
+                    return []
+
+                matrix = self._open(persona_id)
+                slots = np.asarray([row.slot for row in rows], dtype=np.int64)
+                vectors = dequantize(np.asarray(matrix[slots]), np.asarray([row.scale for row in rows]))
+                del matrix
+
+                query = normalize(np.asarray([query_embedding], dtype=np.float32))[0]
+                similarities = vectors @ query
+
+                top = np.argsort(-similarities)[:top_k]
+                results = []
+                for i in top:
+                    row = rows[i]
+                    event_time = row.event_time or row.created_at
+                    results.append({
+                        "memory_id": row.id,
+                        "vector_id": row.vector_id,
+                        "persona_id": row.persona_id,
+                        "content": row.content,
+                        "entity_id": row.entity_id,
+                        "created_at": _to_timestamp_ms(row.created_at),
+                        "last_accessed_at": _to_timestamp_ms(row.last_accessed_at),
+                        "access_count": row.access_count,
+                        "metadata": row.meta_data,
+                        "event_time": event_time.isoformat() if event_time else None,
+                        "similarity": float(similarities[i]),
+                        "tier": "cold",
+                    })
+
+                logger.debug(f"Cold store search: persona_id={persona_id}, scanned={len(rows)}, returned={len(results)}")
+                return results
+
+            except Exception as e:
+                logger.error(f"Failed to search cold store: {e}")
+                return []
+
+    async def get(self, memory_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        读取归档的记忆及其向量（用于恢复到热存储）
+
+        Args:
+            memory_ids: 记忆ID列表
+
+        Returns:
+            记忆数据列表，每项包含 embedding 字段
+        """
+        if not memory_ids:
+            return []
+
+        async with self._lock:
+            async with async_read_session() as db:
+                rows = list((await db.execute(select(ColdMemory).where(ColdMemory.id.in_(memory_ids)))).scalars())
+            return self._to_dicts(rows)
+
+    async def list_page(
+        self,
+        persona_id: str,
+        after: Optional[str] = None,
+        limit: int = 100,
+        include_vectors: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        按ID键集分页列出记忆体的归档记忆（用于导出）
+
+        Args:
+            persona_id: 记忆体ID
+            after: 上一页最后一条记忆的ID，为空时从第一页开始
+            limit: 返回数量限制
+            include_vectors: 是否附带反量化后的向量（已归一化，精度为冷存储的编码类型）
+
+        Returns:
+            记忆数据列表（字段与 get 一致，不附带向量时没有 embedding 字段）
+        """
+        statement = select(ColdMemory).where(ColdMemory.persona_id == persona_id)
+        if after is not None:
+            statement = statement.where(ColdMemory.id > after)
+        statement = statement.order_by(ColdMemory.id).limit(limit)
+
+        async with self._lock:
+            async with async_read_session() as db:
+                rows = list((await db.execute(statement)).scalars())
+            return self._to_dicts(rows, include_vectors)
+
+    def _to_dicts(self, rows: List[ColdMemory], include_vectors: bool = True) -> List[Dict[str, Any]]:
+        """
+        将归档记录转换为记忆数据，按需从文件中读取并反量化向量（调用方持有锁）
+
+        Args:
+            rows: 归档记录
+            include_vectors: 是否附带向量
+
+        Returns:
+            记忆数据列表，顺序与 rows 一致
+        """
+        vectors: Dict[str, List[float]] = {}
+        if include_vectors:
+            by_persona: Dict[str, List[ColdMemory]] = {}
+            for row in rows:
+                by_persona.setdefault(row.persona_id, []).append(row)
+
+            for persona_id, persona_rows in by_persona.items():
+                matrix = self._open(persona_id)
+                slots = np.asarray([row.slot for row in persona_rows], dtype=np.int64)
+                decoded = dequantize(np.asarray(matrix[slots]), np.asarray([row.scale for row in persona_rows]))
+                del matrix
+                for row, vector in zip(persona_rows, decoded):
+                    vectors[row.id] = vector.tolist()
+
+        memories = []
+        for row in rows:
+            memory = {
+                "id": row.id,
+                "persona_id": row.persona_id,
+                "vector_id": row.vector_id,
+                "entity_id": row.entity_id,
+                "type": row.type,
+                "content": row.content,
+                "created_at": row.created_at,
+                "event_time": row.event_time,
+                "last_accessed_at": row.last_accessed_at,
+                "access_count": row.access_count,
+                "meta_data": row.meta_data,
+            }
+            if row.id in vectors:
+                memory["embedding"] = vectors[row.id]
+            memories.append(memory)
+        return memories
+
+    async def delete(self, memory_ids: List[str]) -> int:
+        """
+        删除归档的记忆（恢复到热存储后调用）
+
+        Args:
+            memory_ids: 记忆ID列表
+
+        Returns:
+            删除的记录数
+        """
+        if not memory_ids:
+            return 0
+
+        async def operation(db):
+            persona_ids = list((await db.execute(
+                select(ColdMemory.persona_id).where(ColdMemory.id.in_(memory_ids)).distinct()
+            )).scalars())
+            result = await db.execute(delete(ColdMemory).where(ColdMemory.id.in_(memory_ids)))
+            return result.rowcount, persona_ids
+
+        async with self._lock:
+            try:
+                deleted, persona_ids = await db_writer.submit(operation)
+            except Exception as e:
+                logger.error(f"Failed to delete cold memories: {e}")
+                raise
+
+            for persona_id in persona_ids:
+                await self._maybe_compact(persona_id)
+
+            return deleted
+
+    async def delete_persona(self, persona_id: str) -> int:
+        """
+        删除记忆体的全部归档
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            删除的记录数
+        """
+        async with self._lock:
+            try:
+                result = await db_writer.submit(lambda db: db.execute(
+                    delete(ColdMemory).where(ColdMemory.persona_id == persona_id)
+                ))
+                deleted = result.rowcount
+            except Exception as e:
+                logger.error(f"Failed to delete cold memories for persona={persona_id}: {e}")
+                raise
+
+            for path in (self._path(persona_id), self._meta_path(persona_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+            return deleted
+
+    async def get_stats(self, persona_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        获取冷存储统计信息
+
+        Args:
+            persona_id: 记忆体ID（可选）
+
+        Returns:
+            统计信息字典
+        """
+        statement = select(func.count(ColdMemory.id))
+        if persona_id:
+            statement = statement.where(ColdMemory.persona_id == persona_id)
+        async with async_read_session() as db:
+            count = (await db.execute(statement)).scalar() or 0
+
+        return {
+            "memories": count,
+            "dtype": self.dtype,
+            "vector_bytes": count * self.dim * np.dtype(self.dtype).itemsize,
+        }
+
+    def _stem(self, persona_id: str) -> str:
+        """
+        记忆体冷存储文件的路径前缀（记忆体ID可能包含任意字符，使用其哈希作为文件名）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            不含扩展名的文件路径
+        """
+        digest = hashlib.md5(persona_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.base_dir, digest)
+
+    def _path(self, persona_id: str) -> str:
+        """记忆体冷存储向量文件路径"""
+        return f"{self._stem(persona_id)}.vectors"
+
+    def _meta_path(self, persona_id: str) -> str:
+        """记忆体冷存储元数据文件路径（记录向量文件的编码类型）"""
+        return f"{self._stem(persona_id)}.json"
+
+    def _dtype(self, persona_id: str) -> str:
+        """
+        记忆体冷存储文件的编码类型（调用方持有锁）
+
+        文件不存在时使用配置的编码类型并写入元数据；
+        旧版本按编码类型命名的文件（<哈希>.<编码类型>）在这里迁移到新的文件名
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            编码类型
+        """
+        meta_path = self._meta_path(persona_id)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)["dtype"]
+
+        dtype = self.dtype
+        path = self._path(persona_id)
+        if not os.path.exists(path):
+            for legacy_dtype in VECTOR_DTYPES:
+                legacy_path = f"{self._stem(persona_id)}.{legacy_dtype}"
+                if os.path.exists(legacy_path):
+                    os.replace(legacy_path, path)
+                    dtype = legacy_dtype
+                    logger.info(f"Migrated cold store file for persona={persona_id}: dtype={dtype}")
+                    break
+
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dtype": dtype, "dim": self.dim}, f)
+        os.replace(tmp_path, meta_path)
+        return dtype
+
+    def _open(self, persona_id: str, min_rows: int = 0) -> np.memmap:
+        """
+        打开记忆体的冷存储文件，必要时扩容（调用方持有锁）
+
+        Args:
+            persona_id: 记忆体ID
+            min_rows: 至少需要的行数
+
+        Returns:
+            形状为 (rows, dim) 的内存映射矩阵，元素类型为文件记录的编码类型
+        """
+        path = self._path(persona_id)
+        dtype = self._dtype(persona_id)
+        row_bytes = self.dim * np.dtype(dtype).itemsize
+
+        current_rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if current_rows < min_rows:
+            new_rows = ((min_rows + _GROW_ROWS - 1) // _GROW_ROWS) * _GROW_ROWS
+            with open(path, "ab") as f:
+                f.truncate(new_rows * row_bytes)
+            current_rows = new_rows
+
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(max(current_rows, 1), self.dim))
+
+    async def _maybe_compact(self, persona_id: str):
+        """
+        空行过半时压缩记忆体的冷存储文件（调用方持有锁）
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        path = self._path(persona_id)
+        if not os.path.exists(path):
+            return
+
+        try:
+            async with async_read_session() as db:
+                rows = (await db.execute(
+                    select(ColdMemory.id, ColdMemory.slot).where(
+                        ColdMemory.persona_id == persona_id
+                    ).order_by(ColdMemory.slot)
+                )).all()
+
+            if not rows:
+                os.remove(path)
+                if os.path.exists(self._meta_path(persona_id)):
+                    os.remove(self._meta_path(persona_id))
+                return
+
+            used_rows = rows[-1].slot + 1
+            if len(rows) * 2 > used_rows:
+                return
+
+            matrix = self._open(persona_id)
+            codes = np.asarray(matrix[np.asarray([row.slot for row in rows], dtype=np.int64)])
+            del matrix
+
+            tmp_path = f"{path}.tmp"
+            compacted = np.memmap(tmp_path, dtype=codes.dtype, mode="w+", shape=(len(rows), self.dim))
+            compacted[:] = codes
+            compacted.flush()
+            del compacted
+
+            # 先替换文件再提交新的行号；提交失败时换回原文件，行号与文件布局保持一致
+            backup_path = f"{path}.bak"
+            os.replace(path, backup_path)
+            os.replace(tmp_path, path)
+            try:
+                await db_writer.submit(lambda db: db.execute(
+                    update(ColdMemory),
+                    [{"id": row.id, "slot": new_slot} for new_slot, row in enumerate(rows)]
+                ))
+            except Exception:
+                os.replace(backup_path, path)
+                raise
+            os.remove(backup_path)
+
+            logger.info(f"Compacted cold store for persona={persona_id}: {used_rows} -> {len(rows)} rows")
+
+        except Exception as e:
+            logger.warning(f"Failed to compact cold store for persona={persona_id}: {e}")
+
+
+# 全局冷存储实例 - 使用懒加载
+_cold_store = None
+_cold_store_lock = threading.Lock()
+
+
+def get_cold_store() -> ColdStore:
+    """获取冷存储实例（线程安全的懒加载）"""
+    global _cold_store
+    if _cold_store is None:
+        with _cold_store_lock:
+            if _cold_store is None:  # 双重检查锁定
+                _cold_store = ColdStore()
+    return _cold_store
+
+
+# 向后兼容的属性访问器
+class ColdStoreProxy:
+    """冷存储代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_cold_store(), name)
+
+
+cold_store = ColdStoreProxy()
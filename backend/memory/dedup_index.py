@@ -0,0 +1,407 @@
+"""
+记忆近重复索引 - 基于SimHash的本地去重
+在调用向量化接口之前，用内容指纹拦截近乎原样复述的重复记忆
+"""
+from typing import Any, List, Dict, Optional, Set, Tuple
+import hashlib
+import re
+import threading
+
+from sqlalchemy import select, delete
+
+from config import settings
+from models.database import Memory, MemoryFingerprint, async_read_session
+from models.db_writer import db_writer
+from services.config_cache import config_cache
+from utils.logger import logger
+
+
+# SimHash位数与分段：64位分为4段，每段16位
+# 汉明距离不超过3的两个指纹至少有一段完全相同（抽屉原理），据此用分段做候选检索
+_SIMHASH_BITS = 64
+_BAND_COUNT = 4
+_BAND_BITS = _SIMHASH_BITS // _BAND_COUNT
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# 字符shingle长度（记忆多为较短的中文句子，使用二元组）
+_SHINGLE_SIZE = 2
+
+# 归一化时去除的字符：空白、标点、下划线
+_NORMALIZE_PATTERN = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    """
+    归一化文本：转小写并去除空白和标点
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        归一化后的文本
+    """
+    return _NORMALIZE_PATTERN.sub("", text.lower())
+
+
+def simhash(text: str) -> int:
+    """
+    计算文本的64位SimHash
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        64位无符号整数指纹
+    """
+    normalized = _normalize(text)
+    if len(normalized) <= _SHINGLE_SIZE:
+        shingles = [normalized] if normalized else []
+    else:
+        shingles = [normalized[i:i + _SHINGLE_SIZE] for i in range(len(normalized) - _SHINGLE_SIZE + 1)]
+
+    weights = [0] * _SIMHASH_BITS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(_SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """
+    计算两个指纹的汉明距离
+
+    Args:
+        a: 指纹a
+        b: 指纹b
+
+    Returns:
+        汉明距离
+    """
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(value: int) -> int:
+    """将64位无符号整数转换为有符号整数（SQLite INTEGER为有符号64位）"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    """将有符号整数还原为64位无符号整数"""
+    return value + (1 << 64) if value < 0 else value
+
+
+class MemoryDedupIndex:
+    """
+    记忆近重复索引
+
+    按记忆体在内存中维护SimHash分段索引，指纹持久化在memory_fingerprints表中（经写入队列写入）。
+    某个记忆体第一次被访问时从数据库加载，并为缺少指纹的历史记忆补算指纹
+    """
+
+    def __init__(
+        self,
+        max_distance: int = settings.MEMORY_SIMHASH_MAX_DISTANCE,
+        enabled: bool = settings.MEMORY_SIMHASH_DEDUP
+    ):
+        """
+        初始化索引
+
+        Args:
+            max_distance: 判定为重复的最大汉明距离（不超过分段数减一）
+            enabled: 是否在向量化之前用索引拦截重复记忆
+        """
+        self.enabled = enabled
+        self.max_distance = self._clamp_distance(max_distance)
+
+        # persona_id -> {memory_id: simhash}
+        self._fingerprints: Dict[str, Dict[str, int]] = {}
+        # persona_id -> 各段的 {段值: memory_id集合}
+        self._bands: Dict[str, List[Dict[int, Set[str]]]] = {}
+        # memory_id -> persona_id（仅已加载的记忆体）
+        self._memory_personas: Dict[str, str] = {}
+        # 正在加载的记忆体 -> 加载期间删除的记忆ID（加载结果中跳过这些记忆）
+        self._loading: Dict[str, Set[str]] = {}
+
+        self._lock = threading.RLock()
+
+        # 统计信息
+        self.lookups = 0
+        self.hits = 0
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者，分段与距离无关，无需重建索引）
+
+        Args:
+            config_key: 配置键（memory_system）
+            value: 配置值
+        """
+        self.enabled = value.get("simhash_dedup", self.enabled)
+        self.max_distance = self._clamp_distance(value.get("simhash_max_distance", self.max_distance))
+
+    @staticmethod
+    def _clamp_distance(max_distance: int) -> int:
+        """
+        将最大汉明距离限制在分段检索能保证召回的范围内
+
+        Args:
+            max_distance: 配置的最大汉明距离
+
+        Returns:
+            实际使用的最大汉明距离
+        """
+        limit = _BAND_COUNT - 1
+        if max_distance > limit:
+            logger.warning(
+                f"SimHash max distance {max_distance} exceeds what {_BAND_COUNT}-band lookup can find, using {limit}"
+            )
+            return limit
+        return max(0, max_distance)
+
+    async def find_duplicate(self, persona_id: str, content: str) -> Optional[str]:
+        """
+        查找与内容近乎相同的已有记忆
+
+        Args:
+            persona_id: 记忆体ID
+            content: 记忆内容
+
+        Returns:
+            重复记忆的ID，没有时返回None
+        """
+        fingerprint = simhash(content)
+        await self._ensure_loaded(persona_id)
+        with self._lock:
+            self.lookups += 1
+
+            fingerprints = self._fingerprints.get(persona_id, {})
+            for band, bucket in zip(self._band_values(fingerprint), self._bands.get(persona_id, ())):
+                for memory_id in bucket.get(band, ()):
+                    if hamming_distance(fingerprint, fingerprints[memory_id]) <= self.max_distance:
+                        self.hits += 1
+                        return memory_id
+        return None
+
+    async def add(self, persona_id: str, memory_id: str, content: str):
+        """
+        添加记忆指纹
+
+        Args:
+            persona_id: 记忆体ID
+            memory_id: 记忆ID
+            content: 记忆内容
+        """
+        await self.add_many(persona_id, [(memory_id, content)])
+
+    async def add_many(self, persona_id: str, items: List[Tuple[str, str]]):
+        """
+        批量添加记忆指纹（单个事务写入）
+
+        Args:
+            persona_id: 记忆体ID
+            items: (记忆ID, 记忆内容) 列表
+        """
+        if not items:
+            return
+
+        fingerprints = [(memory_id, simhash(content)) for memory_id, content in items]
+        await self._persist(persona_id, fingerprints)
+
+        with self._lock:
+            # 未加载的记忆体在首次访问时会从数据库加载，这里无需更新内存索引
+            if persona_id in self._fingerprints:
+                for memory_id, fingerprint in fingerprints:
+                    self._index(persona_id, memory_id, fingerprint)
+
+    async def update(self, persona_id: str, memory_id: str, content: str):
+        """
+        记忆内容变化后更新指纹
+
+        Args:
+            persona_id: 记忆体ID
+            memory_id: 记忆ID
+            content: 新的记忆内容
+        """
+        with self._lock:
+            self._unindex(memory_id)
+        await self.add(persona_id, memory_id, content)
+
+    async def remove(self, memory_id: str):
+        """
+        删除记忆指纹
+
+        Args:
+            memory_id: 记忆ID
+        """
+        await self.remove_many([memory_id])
+
+    async def remove_many(self, memory_ids: List[str]):
+        """
+        批量删除记忆指纹
+
+        Args:
+            memory_ids: 记忆ID列表
+        """
+        if not memory_ids:
+            return
+
+        with self._lock:
+            for memory_id in memory_ids:
+                self._unindex(memory_id)
+            for removed in self._loading.values():
+                removed.update(memory_ids)
+
+        try:
+            await db_writer.submit(lambda db: db.execute(
+                delete(MemoryFingerprint).where(MemoryFingerprint.memory_id.in_(memory_ids))
+            ))
+        except Exception as e:
+            logger.warning(f"Failed to delete {len(memory_ids)} memory fingerprints: {e}")
+
+    def drop_persona(self, persona_id: str):
+        """
+        丢弃记忆体的内存索引（不修改数据库）
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        with self._lock:
+            for memory_id in self._fingerprints.pop(persona_id, {}):
+                self._memory_personas.pop(memory_id, None)
+            self._bands.pop(persona_id, None)
+            self._loading.pop(persona_id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取统计信息
+
+        Returns:
+            统计信息字典
+        """
+        with self._lock:
+            return {
+                "personas": len(self._fingerprints),
+                "fingerprints": len(self._memory_personas),
+                "lookups": self.lookups,
+                "hits": self.hits,
+            }
+
+    @staticmethod
+    def _band_values(fingerprint: int) -> List[int]:
+        """
+        将指纹拆分为各段的值
+
+        Args:
+            fingerprint: 64位指纹
+
+        Returns:
+            各段的值
+        """
+        return [(fingerprint >> (i * _BAND_BITS)) & _BAND_MASK for i in range(_BAND_COUNT)]
+
+    def _index(self, persona_id: str, memory_id: str, fingerprint: int):
+        """将指纹加入内存索引（调用方持有锁）"""
+        self._unindex(memory_id)
+        self._fingerprints[persona_id][memory_id] = fingerprint
+        self._memory_personas[memory_id] = persona_id
+        for band, bucket in zip(self._band_values(fingerprint), self._bands[persona_id]):
+            bucket.setdefault(band, set()).add(memory_id)
+
+    def _unindex(self, memory_id: str):
+        """将指纹移出内存索引（调用方持有锁）"""
+        persona_id = self._memory_personas.pop(memory_id, None)
+        if persona_id is None:
+            return
+        fingerprint = self._fingerprints[persona_id].pop(memory_id, None)
+        if fingerprint is None:
+            return
+        for band, bucket in zip(self._band_values(fingerprint), self._bands[persona_id]):
+            members = bucket.get(band)
+            if members is not None:
+                members.discard(memory_id)
+                if not members:
+                    del bucket[band]
+
+    async def _ensure_loaded(self, persona_id: str):
+        """
+        确保记忆体的索引已加载
+
+        从数据库加载已有指纹，为缺少指纹的记忆补算并经写入队列写回。
+        加载期间新增的指纹直接进入索引，删除的记忆不会被加载结果重新加入
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        with self._lock:
+            if persona_id in self._fingerprints:
+                return
+            self._fingerprints[persona_id] = {}
+            self._bands[persona_id] = [{} for _ in range(_BAND_COUNT)]
+            self._loading[persona_id] = set()
+
+        try:
+            async with async_read_session() as db:
+                rows = (await db.execute(
+                    select(Memory.id, Memory.content, MemoryFingerprint.simhash).outerjoin(
+                        MemoryFingerprint, MemoryFingerprint.memory_id == Memory.id
+                    ).where(Memory.persona_id == persona_id)
+                )).all()
+        except Exception as e:
+            logger.warning(f"Failed to load dedup index for persona={persona_id}: {e}")
+            # 下次查找时重新加载
+            self.drop_persona(persona_id)
+            return
+
+        missing = []
+        loaded = []
+        for memory_id, content, stored in rows:
+            if stored is None:
+                fingerprint = simhash(content or "")
+                missing.append((memory_id, fingerprint))
+            else:
+                fingerprint = _to_unsigned(stored)
+            loaded.append((memory_id, fingerprint))
+
+        with self._lock:
+            removed = self._loading.pop(persona_id, None)
+            if removed is None:
+                # 加载期间记忆体被丢弃
+                return
+            for memory_id, fingerprint in loaded:
+                # 加载期间新增的指纹比读取结果新
+                if memory_id not in removed and memory_id not in self._memory_personas:
+                    self._index(persona_id, memory_id, fingerprint)
+
+        if missing:
+            await self._persist(persona_id, missing)
+            logger.info(f"Backfilled {len(missing)} memory fingerprints for persona={persona_id}")
+
+        logger.debug(f"Loaded dedup index for persona={persona_id}: {len(rows)} fingerprints")
+
+    async def _persist(self, persona_id: str, fingerprints: List[Tuple[str, int]]):
+        """
+        经写入队列将指纹写入数据库
+
+        Args:
+            persona_id: 记忆体ID
+            fingerprints: (记忆ID, 指纹) 列表
+        """
+        async def operation(db):
+            for memory_id, fingerprint in fingerprints:
+                await db.merge(MemoryFingerprint(memory_id=memory_id, persona_id=persona_id, simhash=_to_signed(fingerprint)))
+
+        try:
+            await db_writer.submit(operation)
+        except Exception as e:
+            logger.warning(f"Failed to persist memory fingerprints for persona={persona_id}: {e}")
+
+
+# 创建全局近重复索引实例
+memory_dedup_index = MemoryDedupIndex()
+config_cache.subscribe(memory_dedup_index.apply_configuration, ["memory_system"])
@@ -1,7 +1,7 @@
 """
 图谱存储 - KùzuDB操作
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 import kuzu
 import threading
 
@@ -597,6 +597,275 @@ class GraphStore:
             logger.error(f"Failed to update entity access: {e}")
             return False
     
+    def export_persona_graph(self, persona_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        逐条导出记忆体的实体和关系（先实体后关系）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Yields:
+            实体记录 {"kind": "entity", name, type, description, created_at, last_accessed_at}
+            或关系记录 {"kind": "relation", from, to, relation_type, weight, created_at}
+        """
+        # 实体ID为 name|persona_id；通过关系隐式创建的实体没有设置persona_id，按ID后缀匹配
+        suffix = f"|{persona_id}"
+
+        def name_of(entity_id: str, name: Optional[str]) -> str:
+            return name or entity_id[:-len(suffix)]
+
+        result = self.conn.execute(
+            f"""
+            MATCH (e:{settings.KUZU_NODE_TABLE_ENTITY})
+            WHERE e.persona_id = $persona_id OR e.id ENDS WITH $suffix
+            RETURN e.id, e.name, e.type, e.description, e.created_at, e.last_accessed_at
+            """,
+            {"persona_id": persona_id, "suffix": suffix}
+        )
+        while result.has_next():
+            entity_id, name, type, description, created_at, last_accessed_at = result.get_next()
+            yield {
+                "kind": "entity",
+                "name": name_of(entity_id, name),
+                "type": type,
+                "description": description,
+                "created_at": created_at,
+                "last_accessed_at": last_accessed_at,
+            }
+
+        result = self.conn.execute(
+            f"""
+            MATCH (e1:{settings.KUZU_NODE_TABLE_ENTITY})-[r:{settings.KUZU_REL_TABLE_RELATED_TO}]->(e2:{settings.KUZU_NODE_TABLE_ENTITY})
+            WHERE e1.id ENDS WITH $suffix
+            RETURN e1.id, e1.name, e2.id, e2.name, r.weight, r.created_at
+            """,
+            {"suffix": suffix}
+        )
+        while result.has_next():
+            from_id, from_name, to_id, to_name, weight, created_at = result.get_next()
+            yield {
+                "kind": "relation",
+                "from": name_of(from_id, from_name),
+                "to": name_of(to_id, to_name),
+                "relation_type": settings.KUZU_REL_TABLE_RELATED_TO,
+                "weight": weight,
+                "created_at": created_at,
+            }
+
+        result = self.conn.execute(
+            f"""
+            MATCH (e:{settings.KUZU_NODE_TABLE_ENTITY})-[r:{settings.KUZU_REL_TABLE_BELONGS_TO}]->(c:{settings.KUZU_NODE_TABLE_CONCEPT})
+            WHERE e.id ENDS WITH $suffix
+            RETURN e.id, e.name, c.name, r.created_at
+            """,
+            {"suffix": suffix}
+        )
+        while result.has_next():
+            entity_id, name, concept, created_at = result.get_next()
+            yield {
+                "kind": "relation",
+                "from": name_of(entity_id, name),
+                "to": concept,
+                "relation_type": settings.KUZU_REL_TABLE_BELONGS_TO,
+                "weight": None,
+                "created_at": created_at,
+            }
+
+    async def merge_entities(self, persona_id: str, entities: List[Dict[str, Any]]) -> int:
+        """
+        批量创建实体节点（一条 UNWIND ... MERGE 语句，已存在的实体不修改）
+
+        Args:
+            persona_id: 记忆体ID
+            entities: 实体列表，每项包含 name，可选 type, description, created_at, last_accessed_at
+
+        Returns:
+            提交的有效实体数
+        """
+        current_time = get_current_timestamp_ms()
+        rows = []
+        for entity in entities:
+            name = entity.get("name")
+            type = entity.get("type") or "unknown"
+            if not _validate_entity_name(name) or not _validate_entity_type(type):
+                logger.warning(f"Skipping invalid entity: {name}")
+                continue
+            rows.append({
+                "id": f"{name}|{persona_id}",
+                "name": name,
+                "type": type,
+                "description": _validate_description(entity.get("description")),
+                "created_at": int(entity.get("created_at") or current_time),
+                "last_accessed_at": int(entity.get("last_accessed_at") or current_time),
+            })
+        if not rows:
+            return 0
+
+        self.conn.execute(
+            f"""
+            UNWIND $rows AS row
+            MERGE (e:{settings.KUZU_NODE_TABLE_ENTITY} {{id: row.id}})
+            ON CREATE SET
+                e.name = row.name,
+                e.type = row.type,
+                e.description = row.description,
+                e.persona_id = $persona_id,
+                e.created_at = row.created_at,
+                e.last_accessed_at = row.last_accessed_at
+            """,
+            {"rows": rows, "persona_id": persona_id}
+        )
+
+        logger.debug(f"Merged {len(rows)} entities for persona: {persona_id}")
+        return len(rows)
+
+    async def merge_relations(self, persona_id: str, relations: List[Dict[str, Any]]) -> int:
+        """
+        批量创建关系（每种关系类型一条 UNWIND ... MERGE 语句）
+
+        Args:
+            persona_id: 记忆体ID
+            relations: 关系列表，每项包含 from, to，可选 relation_type, weight, created_at
+
+        Returns:
+            提交的有效关系数
+        """
+        current_time = get_current_timestamp_ms()
+        related_rows = []
+        belongs_rows = []
+        for relation in relations:
+            from_entity = relation.get("from")
+            to_entity = relation.get("to")
+            if not _validate_entity_name(from_entity) or not _validate_entity_name(to_entity):
+                logger.warning(f"Skipping invalid relation: {from_entity} -> {to_entity}")
+                continue
+            created_at = int(relation.get("created_at") or current_time)
+            if relation.get("relation_type") == settings.KUZU_REL_TABLE_BELONGS_TO:
+                belongs_rows.append({
+                    "from_id": f"{from_entity}|{persona_id}",
+                    "concept": to_entity,
+                    "created_at": created_at,
+                })
+            else:
+                # 与 create_relation 一致：未知的关系类型按 RELATED_TO 处理
+                related_rows.append({
+                    "from_id": f"{from_entity}|{persona_id}",
+                    "to_id": f"{to_entity}|{persona_id}",
+                    "weight": float(relation.get("weight") or 0.0),
+                    "created_at": created_at,
+                })
+
+        if related_rows:
+            self.conn.execute(
+                f"""
+                UNWIND $rows AS row
+                MERGE (e1:{settings.KUZU_NODE_TABLE_ENTITY} {{id: row.from_id}})
+                MERGE (e2:{settings.KUZU_NODE_TABLE_ENTITY} {{id: row.to_id}})
+                MERGE (e1)-[r:{settings.KUZU_REL_TABLE_RELATED_TO}]->(e2)
+                ON CREATE SET
+                    r.persona_id = $persona_id,
+                    r.weight = row.weight,
+                    r.created_at = row.created_at
+                """,
+                {"rows": related_rows, "persona_id": persona_id}
+            )
+
+        if belongs_rows:
+            self.conn.execute(
+                f"""
+                UNWIND $rows AS row
+                MERGE (e:{settings.KUZU_NODE_TABLE_ENTITY} {{id: row.from_id}})
+                MERGE (c:{settings.KUZU_NODE_TABLE_CONCEPT} {{name: row.concept}})
+                ON CREATE SET c.description = '', c.created_at = row.created_at
+                MERGE (e)-[r:{settings.KUZU_REL_TABLE_BELONGS_TO}]->(c)
+                ON CREATE SET r.created_at = row.created_at
+                """,
+                {"rows": belongs_rows}
+            )
+
+        logger.debug(f"Merged {len(related_rows) + len(belongs_rows)} relations for persona: {persona_id}")
+        return len(related_rows) + len(belongs_rows)
+
+    async def delete_persona(self, persona_id: str) -> int:
+        """
+        删除记忆体的全部实体及其关系（一条 DETACH DELETE 语句；概念节点为全局共享，不删除）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            删除的实体数
+        """
+        # 与导出一致：通过关系隐式创建的实体没有设置persona_id，按ID后缀匹配
+        result = self.conn.execute(
+            f"""
+            MATCH (e:{settings.KUZU_NODE_TABLE_ENTITY})
+            WHERE e.persona_id = $persona_id OR e.id ENDS WITH $suffix
+            WITH e, e.id AS id
+            DETACH DELETE e
+            RETURN count(id)
+            """,
+            {"persona_id": persona_id, "suffix": f"|{persona_id}"}
+        )
+        deleted = result.get_next()[0] if result.has_next() else 0
+
+        logger.info(f"Deleted graph entities of persona={persona_id}: {deleted}")
+        return deleted
+
+    def list_entity_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        """
+        按ID顺序分页列出实体ID（键集分页，用于与SQL记录按ID归并对账）
+
+        Args:
+            after: 上一页最后一个实体ID，为空时从头开始
+            limit: 每页数量
+
+        Returns:
+            按ID升序的实体ID列表
+        """
+        result = self.conn.execute(
+            f"""
+            MATCH (e:{settings.KUZU_NODE_TABLE_ENTITY})
+            WHERE e.id > $after
+            RETURN e.id
+            ORDER BY e.id
+            LIMIT $limit
+            """,
+            {"after": after or "", "limit": limit}
+        )
+        ids = []
+        while result.has_next():
+            ids.append(result.get_next()[0])
+        return ids
+
+    async def delete_entities(self, entity_ids: List[str]) -> int:
+        """
+        按ID批量删除实体及其关系（一条 DETACH DELETE 语句，不存在的ID忽略，可重复执行）
+
+        Args:
+            entity_ids: 实体ID列表
+
+        Returns:
+            删除的实体数
+        """
+        if not entity_ids:
+            return 0
+
+        result = self.conn.execute(
+            f"""
+            UNWIND $ids AS id
+            MATCH (e:{settings.KUZU_NODE_TABLE_ENTITY} {{id: id}})
+            WITH e, e.id AS deleted_id
+            DETACH DELETE e
+            RETURN count(deleted_id)
+            """,
+            {"ids": list(entity_ids)}
+        )
+        deleted = result.get_next()[0] if result.has_next() else 0
+
+        logger.debug(f"Deleted {deleted} graph entities")
+        return deleted
+
     def close(self):
         """关闭连接"""
         if self.conn:
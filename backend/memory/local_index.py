@@ -0,0 +1,525 @@
+"""
+进程内精确向量索引 - 小记忆体的本地检索
+每个记忆体一个内存映射的float32矩阵（行已归一化，余弦相似度即内积）和一个ID数组，
+检索只需一次矩阵向量乘法和argpartition，省去Milvus的调用开销
+"""
+from typing import List, Dict, Any, Optional, Callable
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+
+from config import settings
+from utils.logger import logger
+
+
+# 载荷加载函数：返回记忆体的 {向量ID: 检索结果中的其他字段}，记忆体过大时返回None
+PayloadLoader = Callable[[str], Optional[Dict[str, Dict[str, Any]]]]
+# 向量加载函数：按向量ID读取全精度向量（仅在索引文件缺失或过期时调用）
+EmbeddingLoader = Callable[[List[str]], Dict[str, List[float]]]
+
+# 文件扩容时的最小行数
+_MIN_CAPACITY = 256
+
+# 索引目录中的进程锁文件（持有者独占使用索引文件）和其他进程写入向量时更新的时间戳文件
+_OWNER_LOCK_FILE = ".owner.lock"
+_FOREIGN_WRITE_STAMP_FILE = ".foreign_writes"
+
+
+def _try_lock_exclusive(path: str):
+    """
+    以非阻塞方式获取文件的独占锁
+
+    Args:
+        path: 锁文件路径
+
+    Returns:
+        持有锁的文件对象（进程退出时自动释放）；已被其他进程持有时返回None
+    """
+    lock_file = open(path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return lock_file
+    except OSError:
+        lock_file.close()
+        return None
+
+
+class _PersonaIndex:
+    """单个记忆体的本地索引（调用方持有锁）"""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}  # 向量ID -> 行号
+        self.payloads: Dict[str, Dict[str, Any]] = {}  # 向量ID -> 检索结果中的其他字段
+        self.matrix: Optional[np.memmap] = None
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def open(self, count: int):
+        """打开（必要时扩容）矩阵文件，保证至少能容纳count行"""
+        if count <= self.capacity:
+            return
+
+        capacity = max(_MIN_CAPACITY, self.capacity)
+        while capacity < count:
+            capacity *= 2
+
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        with open(self.path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def load_existing(self) -> Optional[List[str]]:
+        """读取已有的矩阵文件和ID数组，不存在时返回None"""
+        ids_path = f"{self.path}.ids.npy"
+        if not (os.path.exists(self.path) and os.path.exists(ids_path)):
+            return None
+        ids = [str(id) for id in np.load(ids_path)]
+        capacity = os.path.getsize(self.path) // (self.dim * 4)
+        if capacity < len(ids):
+            return None
+        self.matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(max(capacity, 1), self.dim))
+        return ids
+
+    def save_ids(self):
+        """持久化ID数组（行号即数组下标）"""
+        if self.matrix is not None:
+            self.matrix.flush()
+        np.save(f"{self.path}.ids.npy", np.asarray(self.ids, dtype=str))
+
+    def drop(self):
+        """删除索引文件"""
+        self.matrix = None
+        for path in (self.path, f"{self.path}.ids.npy"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # Windows下其他进程仍映射着文件时无法删除，持有者发现时间戳变化后会自行删除
+                logger.warning(f"Failed to delete local index file {path}: {e}")
+
+
+class LocalVectorIndex:
+    """
+    进程内精确向量索引
+
+    记忆体第一次检索前在线程中从向量存储读取其全部记录的标量字段：记录数不超过阈值的记忆体走本地索引，
+    超过阈值的记忆体标记为大记忆体，继续使用Milvus。已有的索引文件只有在ID集合与向量存储一致时才复用，
+    否则读取全精度向量重建。之后的写入由VectorStore同步到已加载的记忆体；写入未加载的记忆体时删除其索引文件，
+    下次加载时重建，避免复用向量已变化的文件。
+
+    索引只能由一个进程使用：多个工作进程共用索引目录时，只有取得目录锁的进程使用本地索引，
+    其他进程照常使用Milvus，写入向量后删除相应记忆体的索引文件并更新时间戳文件；持有者检索前发现时间戳变化即丢弃全部已加载的索引，
+    之后按需重新加载，不会读到其他进程写入前的旧数据
+    """
+
+    def __init__(
+        self,
+        payload_loader: PayloadLoader,
+        embedding_loader: EmbeddingLoader,
+        base_dir: str = settings.MEMORY_LOCAL_INDEX_DIR,
+        max_vectors: int = settings.MEMORY_LOCAL_INDEX_MAX_VECTORS,
+        dim: int = settings.EMBEDDING_DIMENSIONS
+    ):
+        """
+        初始化本地索引
+
+        Args:
+            payload_loader: 载荷加载函数
+            embedding_loader: 向量加载函数
+            base_dir: 索引文件目录
+            max_vectors: 走本地索引的记忆体最大向量数
+            dim: 向量维度
+        """
+        self.payload_loader = payload_loader
+        self.embedding_loader = embedding_loader
+        self.base_dir = base_dir
+        self.max_vectors = max_vectors
+        self.dim = dim
+
+        self._personas: Dict[str, _PersonaIndex] = {}
+        self._large_personas = set()
+        self._vector_personas: Dict[str, str] = {}  # 向量ID -> 记忆体ID（仅已加载的记忆体）
+        self._lock = threading.RLock()
+        # 本进程的写入计数：加载期间发生写入时放弃加载结果
+        self._generation = 0
+        # 正在加载的记忆体（同一记忆体只有一个加载任务）
+        self._loading: Dict[str, asyncio.Future] = {}
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._stamp_path = os.path.join(self.base_dir, _FOREIGN_WRITE_STAMP_FILE)
+        self._owner_lock = _try_lock_exclusive(os.path.join(self.base_dir, _OWNER_LOCK_FILE))
+        self.owner = self._owner_lock is not None
+        self._seen_stamp = self._read_stamp()
+
+        if self.owner:
+            logger.info(f"LocalVectorIndex initialized: dir={self.base_dir}, max_vectors={self.max_vectors}")
+        else:
+            logger.warning(
+                f"Local index directory {self.base_dir} is owned by another process, "
+                f"searches in this process use Milvus"
+            )
+
+    async def ensure_loaded(self, persona_id: str):
+        """
+        检索前确保记忆体的本地索引已加载（读取向量存储和重建索引文件在线程中执行，不阻塞事件循环）
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        if not self.owner:
+            return
+        with self._lock:
+            self._check_foreign_writes()
+            if persona_id in self._personas or persona_id in self._large_personas:
+                return
+
+        pending = self._loading.get(persona_id)
+        if pending is None:
+            pending = asyncio.ensure_future(asyncio.to_thread(self._load, persona_id))
+            self._loading[persona_id] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(persona_id, None))
+        await asyncio.shield(pending)
+
+    def search(
+        self,
+        persona_id: str,
+        embedding: List[float],
+        top_k: int
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        在记忆体的本地索引中精确检索
+
+        Args:
+            persona_id: 记忆体ID
+            embedding: 查询向量
+            top_k: 返回结果数量
+
+        Returns:
+            检索结果（格式与VectorStore.search_knowledge一致）；记忆体不走本地索引或尚未加载时返回None
+        """
+        if not self.owner:
+            return None
+
+        with self._lock:
+            self._check_foreign_writes()
+            index = self._personas.get(persona_id)
+            if index is None:
+                return None
+
+            count = len(index.ids)
+            if count == 0:
+                return []
+
+            query = self._normalize(embedding)
+            scores = index.matrix[:count] @ query
+
+            k = min(top_k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [
+                dict(index.payloads[index.ids[i]], id=index.ids[i], similarity=float(scores[i]))
+                for i in top
+            ]
+
+    def add(self, items: List[Dict[str, Any]]):
+        """
+        同步新写入的向量（只更新已加载的记忆体）
+
+        Args:
+            items: 向量数据列表，每项包含 id, persona_id, embedding 及检索结果中的其他字段
+        """
+        if not self.owner:
+            for persona_id in {item["persona_id"] for item in items}:
+                self._new_index(persona_id).drop()
+            self._mark_foreign_write()
+            return
+
+        with self._lock:
+            self._generation += 1
+            by_persona: Dict[str, List[Dict[str, Any]]] = {}
+            for item in items:
+                if item["persona_id"] in self._personas:
+                    by_persona.setdefault(item["persona_id"], []).append(item)
+                else:
+                    # 未加载的记忆体的索引文件可能含有同ID的旧向量
+                    self._new_index(item["persona_id"]).drop()
+
+            for persona_id, persona_items in by_persona.items():
+                index = self._personas[persona_id]
+                new_items = [item for item in persona_items if item["id"] not in index.rows]
+                if len(index.ids) + len(new_items) > self.max_vectors:
+                    logger.info(f"Persona {persona_id} outgrew the local index, routing searches to Milvus")
+                    self._drop(persona_id)
+                    self._large_personas.add(persona_id)
+                    continue
+
+                index.open(len(index.ids) + len(new_items))
+                for item in persona_items:
+                    row = index.rows.get(item["id"])
+                    if row is None:
+                        row = len(index.ids)
+                        index.ids.append(item["id"])
+                        index.rows[item["id"]] = row
+                        self._vector_personas[item["id"]] = persona_id
+                    index.matrix[row] = self._normalize(item["embedding"])
+                    index.payloads[item["id"]] = self._payload(item)
+                index.save_ids()
+
+    def update(self, id: str, content: str, embedding: List[float], persona_id: Optional[str] = None):
+        """
+        同步向量和内容的更新
+
+        记忆体未加载时删除其索引文件（不知道所属记忆体时删除全部未加载记忆体的索引文件）
+
+        Args:
+            id: 向量ID
+            content: 新内容
+            embedding: 新向量
+            persona_id: 向量所属的记忆体ID
+        """
+        if not self.owner:
+            self._discard_unloaded_files(persona_id)
+            self._mark_foreign_write()
+            return
+
+        with self._lock:
+            self._generation += 1
+            loaded_persona_id = self._vector_personas.get(id)
+            if loaded_persona_id is None:
+                self._discard_unloaded_files(persona_id)
+                return
+            index = self._personas[loaded_persona_id]
+            index.matrix[index.rows[id]] = self._normalize(embedding)
+            index.payloads[id]["content"] = content
+            index.matrix.flush()
+
+    def remove(self, ids: List[str]):
+        """
+        同步向量的删除（末行移入被删除的行，保持矩阵连续）
+
+        Args:
+            ids: 向量ID列表
+        """
+        if not self.owner:
+            self._mark_foreign_write()
+            return
+
+        with self._lock:
+            self._generation += 1
+            changed = set()
+            for id in ids:
+                persona_id = self._vector_personas.pop(id, None)
+                if persona_id is None:
+                    continue
+                index = self._personas[persona_id]
+                row = index.rows.pop(id)
+                last = len(index.ids) - 1
+                if row != last:
+                    moved_id = index.ids[last]
+                    index.matrix[row] = index.matrix[last]
+                    index.ids[row] = moved_id
+                    index.rows[moved_id] = row
+                index.ids.pop()
+                index.payloads.pop(id, None)
+                changed.add(persona_id)
+
+            for persona_id in changed:
+                self._personas[persona_id].save_ids()
+
+    def drop_persona(self, persona_id: str):
+        """
+        移除记忆体的本地索引并删除索引文件（记忆体被删除时调用）
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        if not self.owner:
+            self._mark_foreign_write()
+            return
+
+        with self._lock:
+            self._generation += 1
+            self._drop(persona_id)
+            self._large_personas.discard(persona_id)
+            # 本进程未加载过的记忆体也可能留有索引文件
+            self._new_index(persona_id).drop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取统计信息
+
+        Returns:
+            统计信息字典
+        """
+        with self._lock:
+            return {
+                "local_personas": len(self._personas),
+                "local_vectors": len(self._vector_personas),
+                "large_personas": len(self._large_personas),
+                "max_vectors": self.max_vectors,
+                "owner": self.owner,
+            }
+
+    def _load(self, persona_id: str):
+        """
+        加载记忆体的本地索引（在线程中执行，读取和重建时不持有锁）
+
+        加载期间本进程有写入或发现其他进程的写入时放弃本次结果并删除重建的文件，下次检索前重新加载
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        with self._lock:
+            generation = self._generation
+
+        try:
+            payloads = self.payload_loader(persona_id)
+        except Exception as e:
+            logger.warning(f"Failed to load local index for persona={persona_id}: {e}")
+            return
+
+        if payloads is None:
+            with self._lock:
+                self._large_personas.add(persona_id)
+            return
+
+        index = self._new_index(persona_id)
+
+        existing_ids = index.load_existing()
+        if existing_ids is not None and set(existing_ids) == set(payloads):
+            # 文件与向量存储一致，直接复用
+            index.ids = existing_ids
+            logger.debug(f"Reusing local index file for persona={persona_id}: {len(existing_ids)} vectors")
+        else:
+            try:
+                embeddings = self.embedding_loader(list(payloads))
+            except Exception as e:
+                logger.warning(f"Failed to load vectors for local index of persona={persona_id}: {e}")
+                return
+
+            # 缺少全精度向量的记录无法放入本地索引，该记忆体改用Milvus
+            if len(embeddings) < len(payloads):
+                index.drop()
+                with self._lock:
+                    self._large_personas.add(persona_id)
+                return
+            index.drop()
+            index.ids = list(payloads)
+            index.open(len(index.ids))
+            if index.ids:
+                index.matrix[:len(index.ids)] = self._normalize_many([embeddings[id] for id in index.ids])
+            index.save_ids()
+            logger.info(f"Built local index for persona={persona_id}: {len(index.ids)} vectors")
+
+        with self._lock:
+            self._check_foreign_writes()
+            if self._generation != generation:
+                logger.debug(f"Vectors changed while loading local index for persona={persona_id}, discarding")
+                index.drop()
+                return
+
+            index.rows = {id: row for row, id in enumerate(index.ids)}
+            index.payloads = payloads
+            for id in index.ids:
+                self._vector_personas[id] = persona_id
+            self._personas[persona_id] = index
+
+    def _read_stamp(self) -> int:
+        """其他进程最近一次写入向量的时间戳（纳秒），没有写入过时为0"""
+        try:
+            return os.stat(self._stamp_path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _mark_foreign_write(self):
+        """记录本进程（非持有者）写入了向量"""
+        try:
+            with open(self._stamp_path, "a"):
+                pass
+            os.utime(self._stamp_path, ns=(time.time_ns(), time.time_ns()))
+        except OSError as e:
+            logger.warning(f"Failed to update local index write stamp: {e}")
+
+    def _check_foreign_writes(self):
+        """其他进程写入过向量时丢弃全部已加载的索引及其文件（调用方持有锁）"""
+        stamp = self._read_stamp()
+        if stamp == self._seen_stamp:
+            return
+        self._seen_stamp = stamp
+        self._generation += 1
+        for persona_id in list(self._personas):
+            self._drop(persona_id)
+        self._large_personas.clear()
+        logger.info("Vectors were written by another process, local indexes will be reloaded")
+
+    def _discard_unloaded_files(self, persona_id: Optional[str]):
+        """
+        删除未加载记忆体的索引文件（本进程是持有者时调用方持有锁）
+
+        Args:
+            persona_id: 记忆体ID，为空时删除全部未加载记忆体的索引文件
+        """
+        if persona_id is not None:
+            if persona_id not in self._personas:
+                self._new_index(persona_id).drop()
+            return
+
+        loaded_paths = {index.path for index in self._personas.values()}
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            if name.endswith(".f32") and path not in loaded_paths:
+                _PersonaIndex(path, self.dim).drop()
+
+    def _new_index(self, persona_id: str) -> _PersonaIndex:
+        """创建记忆体索引文件的句柄（不读取文件）"""
+        digest = hashlib.md5(persona_id.encode("utf-8")).hexdigest()
+        return _PersonaIndex(os.path.join(self.base_dir, f"{digest}.f32"), self.dim)
+
+    def _drop(self, persona_id: str):
+        """移除记忆体的本地索引（调用方持有锁）"""
+        index = self._personas.pop(persona_id, None)
+        if index is None:
+            return
+        for id in index.ids:
+            self._vector_personas.pop(id, None)
+        index.drop()
+
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        """归一化单个向量"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _normalize_many(self, embeddings: List[List[float]]) -> np.ndarray:
+        """按行归一化向量矩阵"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def _payload(item: Dict[str, Any]) -> Dict[str, Any]:
+        """提取检索结果中除ID、向量和相似度以外的字段"""
+        return {key: value for key, value in item.items() if key not in ("id", "embedding", "similarity")}
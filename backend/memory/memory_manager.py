@@ -1,38 +1,86 @@
 """
 记忆管理器
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timezone
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 import threading
 
 from config import settings
 from utils.logger import logger
-from utils.helpers import generate_id, get_current_timestamp_ms
-from models.database import SessionLocal, Memory
+from utils.helpers import generate_id, get_current_timestamp_ms, datetime_to_ms
+from models.database import Memory, StoreOutboxEntry, session_scope, async_read_session
+from models.db_writer import db_writer
+from repositories.memory_repository import MemoryRepository
+from repositories.outbox_repository import OutboxRepository
+from utils.tokenizer import fts_query
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """将原生SQL查询返回的时间（SQLite中为字符串）转换为datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
 
 
 @contextmanager
 def get_db():
-    """数据库会话上下文管理器"""
-    db = SessionLocal()
-    try:
+    """数据库会话上下文管理器（工作单元）"""
+    with session_scope() as db:
         yield db
-    finally:
-        db.close()
 
 
 class MemoryManager:
     """
     记忆管理器
     负责管理记忆的生命周期
+
+    不持有长期会话：写操作交给写入队列组提交，只读查询使用只读连接池的短生命周期异步会话
     """
 
     def __init__(self, db=None):
-        """初始化记忆管理器"""
-        self.db = db if db is not None else SessionLocal()
-        self._external_db = db is not None
+        """
+        初始化记忆管理器
+
+        Args:
+            db: 外部传入的异步会话（由调用方负责提交和关闭），为空时写操作交给写入队列
+        """
+        self._external_db = db
         logger.info("MemoryManager initialized")
+
+    async def _write(self, operation, outbox: Optional[List[StoreOutboxEntry]] = None):
+        """
+        执行写操作
+
+        Args:
+            operation: 接收记忆数据访问对象执行写入的异步函数（只flush不提交）
+            outbox: 与写操作在同一事务中提交的发件箱操作（写操作返回假值时不写入）
+
+        Returns:
+            写操作的返回值
+        """
+        async def run(repository: MemoryRepository):
+            result = await operation(repository)
+            if outbox and result:
+                await OutboxRepository(repository.session).add(outbox)
+            return result
+
+        if self._external_db is None:
+            return await db_writer.submit(lambda db: run(MemoryRepository(db)))
+        try:
+            return await run(MemoryRepository(self._external_db))
+        except Exception:
+            await self._external_db.rollback()
+            raise
+
+    @asynccontextmanager
+    async def _read(self):
+        """只读查询使用的记忆数据访问对象"""
+        if self._external_db is not None:
+            yield MemoryRepository(self._external_db)
+        else:
+            async with async_read_session() as db:
+                yield MemoryRepository(db)
     
     async def create_memory(
         self,
@@ -42,7 +90,8 @@ class MemoryManager:
         type: str,
         entity_id: Optional[str] = None,
         metadata: Optional[Dict[str, Any]] = None,
-        event_time: Optional[datetime] = None  # 新增参数
+        event_time: Optional[datetime] = None,  # 新增参数
+        outbox: Optional[List[StoreOutboxEntry]] = None
     ) -> Optional[Memory]:
         """
         创建记忆
@@ -55,6 +104,7 @@ class MemoryManager:
             entity_id: 实体ID
             metadata: 元数据
             event_time: 事件时间（LLM提取）
+            outbox: 与记忆记录在同一事务中提交的发件箱操作
 
         Returns:
             创建的记忆对象
@@ -76,18 +126,64 @@ class MemoryManager:
             if metadata:
                 memory.set_metadata(metadata)
 
-            self.db.add(memory)
-            self.db.commit()
-            self.db.refresh(memory)
+            await self._write(lambda repository: repository.add([memory]), outbox)
 
             logger.debug(f"Created memory: id={memory.id}, type={type}, persona_id={persona_id}")
             return memory
 
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to create memory: {e}")
             return None
     
+    async def create_memories_batch(
+        self,
+        items: List[Dict[str, Any]],
+        outbox: Optional[List[StoreOutboxEntry]] = None
+    ) -> List[Memory]:
+        """
+        批量创建记忆（单个事务）
+
+        Args:
+            items: 记忆数据列表，每项包含 vector_id, persona_id, content, type，
+                   可选 id, entity_id, metadata, event_time，
+                   以及导入时保留的 created_at, last_accessed_at, access_count
+            outbox: 与记忆记录在同一事务中提交的发件箱操作
+
+        Returns:
+            创建的记忆对象列表；失败时整体回滚并返回空列表
+        """
+        if not items:
+            return []
+
+        try:
+            now = datetime.now()  # 使用本地时间（北京时间）
+            memories = []
+            for item in items:
+                memory = Memory(
+                    id=item.get("id") or generate_id(),
+                    persona_id=item["persona_id"],
+                    vector_id=item["vector_id"],
+                    entity_id=item.get("entity_id"),
+                    type=item["type"],
+                    content=item["content"],
+                    created_at=item.get("created_at") or now,
+                    event_time=item.get("event_time"),
+                    last_accessed_at=item.get("last_accessed_at") or now,
+                    access_count=item.get("access_count") or 0
+                )
+                if item.get("metadata"):
+                    memory.set_metadata(item["metadata"])
+                memories.append(memory)
+
+            await self._write(lambda repository: repository.add(memories), outbox)
+
+            logger.debug(f"Created {len(memories)} memories in batch")
+            return memories
+
+        except Exception as e:
+            logger.error(f"Failed to create memories in batch: {e}")
+            return []
+
     async def get_memory(self, memory_id: str) -> Optional[Memory]:
         """
         获取记忆
@@ -99,8 +195,8 @@ class MemoryManager:
             记忆对象
         """
         try:
-            memory = self.db.query(Memory).filter(Memory.id == memory_id).first()
-            return memory
+            async with self._read() as repository:
+                return await repository.get(memory_id)
         except Exception as e:
             logger.error(f"Failed to get memory: {e}")
             return None
@@ -115,47 +211,81 @@ class MemoryManager:
         Returns:
             是否成功
         """
-        try:
-            memory = self.db.query(Memory).filter(Memory.id == memory_id).first()
-            if not memory:
-                return False
+        return await self.update_memories_access([memory_id]) > 0
 
-            memory.last_accessed_at = datetime.now()  # 使用本地时间（北京时间）
-            memory.access_count += 1
+    async def update_memories_access(self, memory_ids: List[str]) -> int:
+        """
+        批量更新记忆的访问信息（一条UPDATE语句，由写入队列与其他写入合并提交，不等待请求结束）
 
-            self.db.commit()
+        Args:
+            memory_ids: 记忆ID列表
+
+        Returns:
+            更新的记忆数
+        """
+        memory_ids = list(dict.fromkeys(memory_id for memory_id in memory_ids if memory_id))
+        if not memory_ids:
+            return 0
+
+        accessed_at = datetime.now()  # 使用本地时间（北京时间）
+        try:
+            updated = await self._write(lambda repository: repository.touch(memory_ids, accessed_at))
+
+            logger.debug(f"Updated memory access: {updated} memories")
+            return updated
 
-            logger.debug(f"Updated memory access: id={memory_id}, count={memory.access_count}")
-            return True
-            
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to update memory access: {e}")
-            return False
+            return 0
     
-    async def delete_memory(self, memory_id: str) -> bool:
+    async def update_memory(
+        self,
+        memory_id: str,
+        content: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        outbox: Optional[List[StoreOutboxEntry]] = None
+    ) -> Optional[Memory]:
+        """
+        更新记忆的内容和元数据
+
+        Args:
+            memory_id: 记忆ID
+            content: 新内容（为空时不修改）
+            metadata: 新元数据（为空时不修改）
+            outbox: 与更新在同一事务中提交的发件箱操作
+
+        Returns:
+            更新后的记忆对象，记忆不存在或更新失败时返回None
+        """
+        try:
+            memory = await self._write(lambda repository: repository.update(memory_id, content, metadata), outbox)
+            if memory:
+                logger.debug(f"Updated memory: id={memory_id}")
+            return memory
+
+        except Exception as e:
+            logger.error(f"Failed to update memory: {e}")
+            return None
+
+    async def delete_memory(self, memory_id: str, outbox: Optional[List[StoreOutboxEntry]] = None) -> bool:
         """
         删除记忆
         
         Args:
             memory_id: 记忆ID
+            outbox: 与删除在同一事务中提交的发件箱操作
         
         Returns:
             是否成功
         """
         try:
-            memory = self.db.query(Memory).filter(Memory.id == memory_id).first()
-            if not memory:
+            if not await self._write(lambda repository: repository.delete(memory_id), outbox):
                 return False
             
-            self.db.delete(memory)
-            self.db.commit()
-            
             logger.debug(f"Deleted memory: id={memory_id}")
             return True
             
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to delete memory: {e}")
             return False
     
@@ -175,12 +305,8 @@ class MemoryManager:
             记忆列表
         """
         try:
-            query = self.db.query(Memory)
-            
-            if type:
-                query = query.filter(Memory.type == type)
-            
-            memories = query.order_by(Memory.created_at.desc()).limit(limit).all()
+            async with self._read() as repository:
+                memories = await repository.list(type=type, limit=limit)
             
             logger.debug(f"Listed {len(memories)} memories")
             return memories
@@ -188,42 +314,117 @@ class MemoryManager:
         except Exception as e:
             logger.error(f"Failed to list memories: {e}")
             return []
-    
+
+    async def list_memories_page(
+        self,
+        persona_id: Optional[str] = None,
+        type: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        event_after: Optional[datetime] = None,
+        event_before: Optional[datetime] = None,
+        order_by: str = "created_at",
+        after: Optional[Tuple[datetime, str]] = None,
+        limit: int = 100
+    ) -> Tuple[List[Memory], bool]:
+        """
+        按键集分页列出记忆（过滤在SQL中完成）
+
+        Args:
+            persona_id: 记忆体ID过滤
+            type: 记忆类型过滤
+            created_after: 创建时间下界（含）
+            created_before: 创建时间上界（不含）
+            event_after: 事件时间下界（含）
+            event_before: 事件时间上界（不含）
+            order_by: 排序字段，'created_at' 或 'event_time'
+            after: 上一页最后一行的 (排序时间, id)
+            limit: 每页数量
+
+        Returns:
+            (本页记忆列表, 是否还有下一页)
+        """
+        try:
+            async with self._read() as repository:
+                # 多取一行判断是否还有下一页，不需要额外的COUNT查询
+                memories = await repository.list_page(
+                    persona_id=persona_id,
+                    type=type,
+                    created_after=created_after,
+                    created_before=created_before,
+                    event_after=event_after,
+                    event_before=event_before,
+                    order_by=order_by,
+                    after=after,
+                    limit=limit + 1
+                )
+
+            has_more = len(memories) > limit
+            memories = memories[:limit]
+            logger.debug(f"Listed memory page: persona_id={persona_id}, {len(memories)} memories, has_more={has_more}")
+            return memories, has_more
+
+        except Exception as e:
+            logger.error(f"Failed to list memory page: {e}")
+            return [], False
+
     async def search_memories(
         self,
         query: str,
         type: Optional[str] = None,
-        limit: int = 10
+        limit: int = 10,
+        persona_id: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
-        搜索记忆
-        
+        全文检索记忆（FTS5，按bm25排序）
+
         Args:
             query: 搜索查询
             type: 记忆类型过滤
             limit: 返回数量限制
-        
+            persona_id: 记忆体ID过滤
+
         Returns:
-            搜索结果列表
+            搜索结果列表，每项包含 memory_id, vector_id, content, created_at/last_accessed_at（毫秒时间戳）,
+            access_count, event_time, lexical_score（bm25，越小越相关）
         """
-        try:
-            # 这里应该调用向量存储进行搜索
-            # 由于向量存储还没有完全实现，这里先返回空列表
-            # TODO: 实现实际的记忆搜索逻辑
-            
-            logger.debug(f"Search memories: query={query}, type={type}")
+        match = fts_query(query)
+        if not match:
             return []
-            
+
+        try:
+            async with self._read() as repository:
+                rows = await repository.search_fts(match, type=type, limit=limit, persona_id=persona_id)
+
+            results = []
+            for row in rows:
+                created_at = _parse_datetime(row["created_at"])
+                event_time = _parse_datetime(row["event_time"]) or created_at
+                last_accessed_at = _parse_datetime(row["last_accessed_at"])
+                results.append({
+                    "memory_id": row["id"],
+                    "vector_id": row["vector_id"],
+                    "persona_id": row["persona_id"],
+                    "entity_id": row["entity_id"],
+                    "content": row["content"],
+                    "created_at": datetime_to_ms(created_at) or None,
+                    "last_accessed_at": datetime_to_ms(last_accessed_at) or None,
+                    "access_count": row["access_count"] or 0,
+                    "metadata": row["meta_data"],
+                    "event_time": event_time.isoformat() if event_time else None,
+                    "lexical_score": row["lexical_score"],
+                })
+
+            logger.debug(f"Full-text searched memories: query={query}, match={match}, found {len(results)}")
+            return results
+
         except Exception as e:
             logger.error(f"Failed to search memories: {e}")
             return []
     
     def close(self):
-        """关闭数据库连接"""
-        # 只关闭内部创建的数据库连接
-        if not self._external_db:
-            self.db.close()
-            logger.info("MemoryManager closed")
+        """关闭管理器（不持有长期会话，外部传入的会话由调用方关闭）"""
+        logger.info("MemoryManager closed")
 
 
 # 全局记忆管理器实例 - 使用懒加载
@@ -0,0 +1,82 @@
+"""
+向量量化工具
+提供float16和int8（逐向量缩放）两种低精度向量编码
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+# 支持的低精度编码
+VECTOR_DTYPES = ("float16", "int8")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    按行做L2归一化
+
+    Args:
+        vectors: 形状为 (n, dim) 的向量矩阵
+
+    Returns:
+        归一化后的float32矩阵
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    将向量编码为低精度表示
+
+    int8编码为对称线性量化：每个向量按自身的最大绝对值缩放到[-127, 127]
+
+    Args:
+        vectors: 形状为 (n, dim) 的float32向量矩阵
+        dtype: 编码类型，'float16' 或 'int8'
+
+    Returns:
+        (编码后的矩阵, 每个向量的缩放系数)；float16编码的缩放系数恒为1
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=-1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    raise ValueError(f"Unsupported vector dtype: {dtype}, expected one of {VECTOR_DTYPES}")
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    将低精度表示还原为float32向量
+
+    Args:
+        codes: 编码后的矩阵
+        scales: 每个向量的缩放系数
+
+    Returns:
+        float32向量矩阵
+    """
+    return codes.astype(np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def bytes_per_vector(dim: int, dtype: str) -> int:
+    """
+    计算单个向量编码后占用的字节数（不含缩放系数）
+
+    Args:
+        dim: 向量维度
+        dtype: 编码类型
+
+    Returns:
+        字节数
+    """
+    return dim * np.dtype(dtype).itemsize
@@ -6,10 +6,12 @@ import asyncio
 
 from config import settings
 from utils.logger import logger
-from utils.helpers import calculate_similarity_score, get_current_timestamp_ms
+from utils.helpers import calculate_similarity_score, cosine_similarity, get_current_timestamp_ms
 from memory.vector_store import vector_store
 from memory.graph_store import graph_store
 from memory.memory_manager import memory_manager
+from memory.cold_store import cold_store
+from services.config_cache import config_cache
 
 
 class RetrievalStrategy:
@@ -27,13 +29,38 @@ class RetrievalStrategy:
         self.recency_weight = settings.MEMORY_SCORE_RECENCY_WEIGHT
         self.graph_weight = settings.MEMORY_SCORE_GRAPH_WEIGHT
         self.lambda_decay = settings.MEMORY_RECENCY_DECAY_LAMBDA
+        # 混合检索（稠密向量 + FTS5全文检索）
+        self.hybrid_search = settings.MEMORY_HYBRID_SEARCH
+        self.rrf_k = settings.MEMORY_RRF_K
         logger.info("RetrievalStrategy initialized")
 
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者）
+
+        Args:
+            config_key: 配置键（memory_scoring, memory_system, milvus）
+            value: 配置值
+        """
+        if config_key == "memory_scoring":
+            self.similarity_weight = value.get("similarity_weight", self.similarity_weight)
+            self.access_weight = value.get("access_weight", self.access_weight)
+            self.recency_weight = value.get("recency_weight", self.recency_weight)
+            self.graph_weight = value.get("graph_weight", self.graph_weight)
+            self.lambda_decay = value.get("recency_decay_lambda", self.lambda_decay)
+        elif config_key == "memory_system":
+            self.hybrid_search = value.get("hybrid_search", self.hybrid_search)
+            self.rrf_k = value.get("rrf_k", self.rrf_k)
+        elif config_key == "milvus":
+            self.top_k = value.get("top_k", self.top_k)
+        logger.info(f"RetrievalStrategy reconfigured from '{config_key}'")
+
     async def retrieve(
         self,
         query_embedding: List[float],
         query_text: str,
-        persona_id: Optional[str] = None
+        persona_id: Optional[str] = None,
+        include_cold: bool = False
     ) -> List[Dict[str, Any]]:
         """
         检索记忆
@@ -42,6 +69,7 @@ class RetrievalStrategy:
             query_embedding: 查询向量
             query_text: 查询文本
             persona_id: 记忆体ID
+            include_cold: 是否同时检索冷存储
 
         Returns:
             长期记忆列表
@@ -51,7 +79,8 @@ class RetrievalStrategy:
         long_term_memories = await self._retrieve_long_term(
             query_embedding,
             query_text,
-            persona_id
+            persona_id,
+            include_cold
         )
 
         logger.info(f"[DEBUG] RetrievalStrategy retrieved {len(long_term_memories)} long-term memories")
@@ -62,7 +91,8 @@ class RetrievalStrategy:
         self,
         query_embedding: List[float],
         query_text: str,
-        persona_id: Optional[str] = None
+        persona_id: Optional[str] = None,
+        include_cold: bool = False
     ) -> List[Dict[str, Any]]:
         """
         检索长期记忆
@@ -71,6 +101,7 @@ class RetrievalStrategy:
             query_embedding: 查询向量
             query_text: 查询文本
             persona_id: 记忆体ID
+            include_cold: 是否同时检索冷存储（需要persona_id）
 
         Returns:
             长期记忆列表
@@ -89,6 +120,17 @@ class RetrievalStrategy:
             results = await self._enrich_with_event_time(results)
             logger.info(f"[DEBUG] After enrich_with_event_time: {len(results)} results")
 
+            # 与全文检索结果做倒数排名融合（RRF）
+            if self.hybrid_search and query_text:
+                results = await self._fuse_with_lexical(results, query_embedding, query_text, persona_id)
+                logger.info(f"[DEBUG] After fuse_with_lexical: {len(results)} results")
+
+            # 合并冷存储的精确检索结果
+            if include_cold and persona_id:
+                cold_results = await cold_store.search(persona_id, query_embedding, self.top_k)
+                logger.info(f"[DEBUG] cold_store.search returned {len(cold_results)} results")
+                results = results + cold_results
+
             # 增强结果：添加图谱信息
             enhanced_results = await self._enhance_with_graph(
                 results,
@@ -101,11 +143,15 @@ class RetrievalStrategy:
             scored_results = self._rescore_with_memory_score(enhanced_results)
             logger.info(f"[DEBUG] After rescore_with_memory_score: {len(scored_results)} results")
 
-            # 更新访问信息（使用memory_id）
-            for result in scored_results:
-                memory_id = result.get("memory_id")
-                if memory_id:
-                    await memory_manager.update_memory_access(memory_id)
+            if include_cold and persona_id:
+                scored_results = await self._promote_cold_hits(scored_results[:self.top_k])
+
+            # 批量更新访问信息（使用memory_id）
+            accessed_ids = [
+                result.get("memory_id") for result in scored_results
+                if not result.pop("skip_access_update", False)
+            ]
+            await memory_manager.update_memories_access(accessed_ids)
 
             return scored_results
 
@@ -262,6 +308,107 @@ class RetrievalStrategy:
 
         return graph_score
 
+    async def _fuse_with_lexical(
+        self,
+        results: List[Dict[str, Any]],
+        query_embedding: List[float],
+        query_text: str,
+        persona_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        用倒数排名融合（RRF）合并向量检索和全文检索的结果
+
+        融合分数 = Σ 1 / (k + 排名)，按融合分数取前top_k个候选进入后续的综合评分；
+        只被全文检索命中的记忆用其向量计算与查询的相似度，保证综合评分口径一致
+
+        Args:
+            results: 向量检索结果（已补充memory_id）
+            query_embedding: 查询向量
+            query_text: 查询文本
+            persona_id: 记忆体ID
+
+        Returns:
+            融合后的候选列表
+        """
+        lexical_results = await memory_manager.search_memories(
+            query_text,
+            limit=self.top_k,
+            persona_id=persona_id
+        )
+        if not lexical_results:
+            return results
+
+        fused: Dict[str, Dict[str, Any]] = {}
+        for rank, result in enumerate(results, 1):
+            key = result.get("memory_id") or result.get("vector_id") or result.get("id")
+            result["rrf_score"] = 1.0 / (self.rrf_k + rank)
+            fused[key] = result
+
+        lexical_only = []
+        for rank, result in enumerate(lexical_results, 1):
+            score = 1.0 / (self.rrf_k + rank)
+            existing = fused.get(result["memory_id"])
+            if existing is not None:
+                existing["rrf_score"] += score
+                existing["lexical_score"] = result["lexical_score"]
+            else:
+                result["rrf_score"] = score
+                fused[result["memory_id"]] = result
+                lexical_only.append(result)
+
+        # 只被全文检索命中的记忆：计算向量相似度
+        if lexical_only:
+            try:
+                embeddings = await vector_store.get_embeddings([result["vector_id"] for result in lexical_only])
+            except Exception as e:
+                logger.warning(f"Failed to fetch vectors for lexical hits: {e}")
+                embeddings = {}
+            for result in lexical_only:
+                embedding = embeddings.get(result["vector_id"])
+                result["similarity"] = cosine_similarity(query_embedding, embedding) if embedding else 0.0
+
+        fused_results = sorted(fused.values(), key=lambda r: r["rrf_score"], reverse=True)[:self.top_k]
+        logger.debug(
+            f"RRF fused {len(results)} dense and {len(lexical_results)} lexical results "
+            f"({len(lexical_only)} lexical-only) into {len(fused_results)}"
+        )
+        return fused_results
+
+    async def _promote_cold_hits(
+        self,
+        results: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        将进入最终结果的冷存储记忆恢复到热存储
+
+        Args:
+            results: 最终检索结果
+
+        Returns:
+            检索结果（恢复失败的冷记忆仍保留在结果中，但不更新访问信息）
+        """
+        cold_ids = [result["memory_id"] for result in results if result.get("tier") == "cold"]
+        if not cold_ids:
+            return results
+
+        try:
+            # 延迟导入，避免与core.memory_engine循环导入
+            from services.tiering_service import tiering_service
+            promoted = set(await tiering_service.promote(cold_ids))
+        except Exception as e:
+            logger.warning(f"Failed to promote cold memories: {e}")
+            promoted = set()
+
+        for result in results:
+            if result.get("tier") == "cold":
+                if result["memory_id"] in promoted:
+                    result["tier"] = "hot"
+                    result["promoted"] = True
+                else:
+                    result["skip_access_update"] = True
+
+        return results
+
     async def _enrich_with_event_time(
         self,
         results: List[Dict[str, Any]]
@@ -284,12 +431,12 @@ class RetrievalStrategy:
                 return results
             
             # 从数据库中查询event_time和memory_id
-            from models.database import SessionLocal, Memory
-            db = SessionLocal()
-            
-            try:
+            from models.database import async_read_session
+            from repositories.memory_repository import MemoryRepository
+
+            async with async_read_session() as db:
                 # 查询所有相关的记忆
-                memories = db.query(Memory).filter(Memory.vector_id.in_(vector_ids)).all()
+                memories = await MemoryRepository(db).get_by_vector_ids(vector_ids)
                 
                 # 创建vector_id到event_time和memory_id的映射
                 event_time_map = {}
@@ -325,9 +472,6 @@ class RetrievalStrategy:
                         del result["id"]
                 
                 logger.debug(f"Enriched {len(event_time_map)} results with event_time and memory_id")
-                
-            finally:
-                db.close()
             
             return results
             
@@ -339,3 +483,6 @@ class RetrievalStrategy:
 
 # 创建全局检索策略实例
 retrieval_strategy = RetrievalStrategy()
+
+# 配置接口修改评分权重、混合检索或top_k后即时生效
+config_cache.subscribe(retrieval_strategy.apply_configuration, ["memory_scoring", "memory_system", "milvus"])
@@ -1,7 +1,7 @@
 """
 向量存储 - Milvus Lite操作
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pymilvus import (
     connections,
     Collection,
@@ -12,11 +12,29 @@ from pymilvus import (
 )
 import threading
 
+import numpy as np
+from sqlalchemy import delete
+
 from config import settings
+from models.database import SessionLocal, FullPrecisionVector
+from models.db_writer import db_writer
+from memory.local_index import LocalVectorIndex
 from utils.logger import logger
 from utils.helpers import get_current_timestamp_ms
 
 
+# 支持的索引类型及其构建参数
+_INDEX_TYPES = ("FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ")
+
+# Milvus Lite（本地文件模式）支持的索引类型
+_LITE_INDEX_TYPES = {"float32": ("FLAT", "IVF_FLAT"), "float16": ("FLAT",)}
+
+# Milvus单次查询可返回的最大行数（offset + limit）
+_QUERY_WINDOW = 16384
+
+_SEARCH_OUTPUT_FIELDS = ["id", "persona_id", "content", "entity_id", "created_at", "last_accessed_at", "access_count", "score", "metadata"]
+
+
 class VectorStore:
     """
     向量存储类
@@ -28,13 +46,35 @@ class VectorStore:
         self.milvus_uri = settings.MILVUS_URI
         self.collection_knowledge = None
 
+        # 索引向量的存储精度
+        self.full_dim = settings.EMBEDDING_DIMENSIONS
+        self.index_dim = min(settings.MILVUS_INDEX_DIMENSIONS or self.full_dim, self.full_dim)
+        self.vector_dtype = settings.MILVUS_VECTOR_DTYPE
+        self.index_type = settings.MILVUS_INDEX_TYPE
+        # 有损存储时另存全精度向量，检索时多取候选再用全精度重排
+        self.lossy = (
+            self.vector_dtype != "float32"
+            or self.index_dim < self.full_dim
+            or self.index_type in ("IVF_SQ8", "IVF_PQ")
+        )
+        self.rescore_factor = max(settings.MILVUS_RESCORE_FACTOR, 1) if self.lossy else 1
+
         # 连接到Milvus
         self._connect()
 
         # 初始化集合
         self._init_collections()
 
-        logger.info(f"VectorStore initialized: uri={self.milvus_uri}")
+        # 小记忆体的进程内精确索引（超过阈值的记忆体仍使用Milvus）
+        self.local_index = LocalVectorIndex(
+            payload_loader=self._load_persona_payloads,
+            embedding_loader=self._fetch_embeddings
+        ) if settings.MEMORY_LOCAL_INDEX_ENABLED else None
+
+        logger.info(
+            f"VectorStore initialized: uri={self.milvus_uri}, dtype={self.vector_dtype}, "
+            f"index={self.index_type}, dim={self.index_dim}/{self.full_dim}, rescore_factor={self.rescore_factor}"
+        )
     
     def _connect(self):
         """连接到Milvus"""
@@ -61,6 +101,7 @@ class VectorStore:
         if utility.has_collection(collection_name):
             self.collection_knowledge = Collection(collection_name)
             logger.info(f"Knowledge collection '{collection_name}' already exists")
+            self._check_existing_schema()
             return
 
         # 定义字段
@@ -68,7 +109,11 @@ class VectorStore:
             FieldSchema(name="id", dtype=DataType.VARCHAR, is_primary=True, max_length=64),
             FieldSchema(name="persona_id", dtype=DataType.VARCHAR, max_length=64),
             FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=settings.EMBEDDING_DIMENSIONS),
+            FieldSchema(
+                name="embedding",
+                dtype=DataType.FLOAT16_VECTOR if self.vector_dtype == "float16" else DataType.FLOAT_VECTOR,
+                dim=self.index_dim
+            ),
             FieldSchema(name="entity_id", dtype=DataType.VARCHAR, max_length=64),
             FieldSchema(name="created_at", dtype=DataType.INT64),
             FieldSchema(name="last_accessed_at", dtype=DataType.INT64),
@@ -90,17 +135,238 @@ class VectorStore:
         )
 
         # 创建索引
-        index_params = {
-            "metric_type": "COSINE",
-            "index_type": "IVF_FLAT",
-            "params": {"nlist": 128}
-        }
+        self._create_index()
+
+        logger.info(f"Created knowledge collection '{collection_name}'")
+
+    def _create_index(self):
+        """按配置创建向量索引，Milvus Lite不支持的索引类型回退到其支持的类型"""
+        index_type = self.index_type if self.index_type in _INDEX_TYPES else "IVF_FLAT"
+
+        lite_types = _LITE_INDEX_TYPES.get(self.vector_dtype, ("FLAT",))
+        if self.milvus_uri.endswith(".db") and index_type not in lite_types:
+            fallback = "IVF_FLAT" if "IVF_FLAT" in lite_types else "FLAT"
+            logger.warning(
+                f"Milvus Lite does not support {index_type} for {self.vector_dtype} vectors, "
+                f"falling back to {fallback}; use a Milvus server for quantized indexes"
+            )
+            index_type = fallback
+
+        params = {}
+        if index_type.startswith("IVF_"):
+            params["nlist"] = settings.MILVUS_INDEX_NLIST
+        if index_type == "IVF_PQ":
+            params["m"] = settings.MILVUS_PQ_M
+            params["nbits"] = 8
+
         self.collection_knowledge.create_index(
             field_name="embedding",
-            index_params=index_params
+            index_params={"metric_type": "COSINE", "index_type": index_type, "params": params}
         )
+        self.index_type = index_type
+        logger.info(f"Created {index_type} index on knowledge embeddings (dim={self.index_dim}, dtype={self.vector_dtype})")
+
+    def _check_existing_schema(self):
+        """沿用已有集合的向量维度、类型和索引类型；与配置不一致时给出警告（修改存储精度需要重建集合）"""
+        field = next(f for f in self.collection_knowledge.schema.fields if f.name == "embedding")
+        dim = int(field.params.get("dim", self.full_dim))
+        dtype = "float16" if field.dtype == DataType.FLOAT16_VECTOR else "float32"
+        indexes = self.collection_knowledge.indexes
+        index_type = indexes[0].params.get("index_type", self.index_type) if indexes else self.index_type
+
+        if (dim, dtype, index_type) != (self.index_dim, self.vector_dtype, self.index_type):
+            logger.warning(
+                f"Existing knowledge collection uses {index_type} on {dtype}[{dim}] vectors but config requests "
+                f"{self.index_type} on {self.vector_dtype}[{self.index_dim}]; keeping the existing layout until the collection is rebuilt"
+            )
 
-        logger.info(f"Created knowledge collection '{collection_name}'")
+        self.index_dim = dim
+        self.vector_dtype = dtype
+        self.index_type = index_type
+        self.lossy = dtype != "float32" or dim < self.full_dim or index_type in ("IVF_SQ8", "IVF_PQ")
+        self.rescore_factor = max(settings.MILVUS_RESCORE_FACTOR, 1) if self.lossy else 1
+
+    def _to_index_vectors(self, embeddings: List[List[float]]) -> List[Any]:
+        """
+        将全精度向量转换为索引存储格式（截断维度并重新归一化、转换精度）
+
+        Args:
+            embeddings: 全精度向量列表
+
+        Returns:
+            可直接写入或检索Milvus的向量列表
+        """
+        if not self.lossy:
+            return embeddings
+
+        vectors = np.asarray(embeddings, dtype=np.float32)[:, :self.index_dim]
+        if self.index_dim < self.full_dim:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+
+        if self.vector_dtype == "float16":
+            return list(vectors.astype(np.float16))
+        return vectors.tolist()
+
+    def _decode_vector(self, value: Any) -> np.ndarray:
+        """
+        将Milvus返回的向量解码为float32数组（FLOAT16_VECTOR以字节形式返回）
+
+        Args:
+            value: Milvus返回的向量字段
+
+        Returns:
+            float32向量
+        """
+        if isinstance(value, list) and value and isinstance(value[0], bytes):
+            value = b"".join(value)
+        if isinstance(value, bytes):
+            return np.frombuffer(value, dtype=np.float16).astype(np.float32)
+        return np.asarray(value, dtype=np.float32)
+
+    async def _save_full_precision(self, ids: List[str], embeddings: List[List[float]]):
+        """
+        经写入队列保存全精度向量（仅有损存储时）
+
+        Args:
+            ids: 向量ID列表
+            embeddings: 全精度向量列表
+        """
+        if not self.lossy or not ids:
+            return
+
+        rows = [
+            FullPrecisionVector(vector_id=id, embedding=np.asarray(embedding, dtype=np.float32).tobytes())
+            for id, embedding in zip(ids, embeddings)
+        ]
+
+        async def operation(db):
+            for row in rows:
+                await db.merge(row)
+
+        try:
+            await db_writer.submit(operation)
+        except Exception as e:
+            logger.error(f"Failed to save {len(ids)} full-precision vectors: {e}")
+            raise
+
+    async def _save_full_precision_or_rollback(self, ids: List[str], embeddings: List[List[float]]):
+        """
+        保存刚插入的向量的全精度副本，失败时从Milvus删除这些向量后再抛出异常，
+        避免调用方认为写入失败时Milvus中仍留有向量
+
+        Args:
+            ids: 向量ID列表
+            embeddings: 全精度向量列表
+        """
+        try:
+            await self._save_full_precision(ids, embeddings)
+        except Exception:
+            try:
+                id_list = ", ".join(f"'{id}'" for id in ids)
+                self.collection_knowledge.delete(f"id in [{id_list}]")
+                self.collection_knowledge.flush()
+                logger.warning(f"Rolled back {len(ids)} inserted vectors after full-precision save failed")
+            except Exception as e:
+                logger.error(f"Failed to roll back {len(ids)} inserted vectors: {e}")
+            raise
+
+    def _load_full_precision(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """
+        读取全精度向量
+
+        Args:
+            ids: 向量ID列表
+
+        Returns:
+            向量ID到float32向量的映射（不存在的ID不包含在结果中）
+        """
+        if not self.lossy or not ids:
+            return {}
+
+        db = SessionLocal()
+        try:
+            rows = db.query(FullPrecisionVector).filter(FullPrecisionVector.vector_id.in_(ids)).all()
+            return {row.vector_id: np.frombuffer(row.embedding, dtype=np.float32) for row in rows}
+        finally:
+            db.close()
+
+    async def _delete_full_precision(self, ids: List[str]):
+        """
+        经写入队列删除全精度向量
+
+        Args:
+            ids: 向量ID列表
+        """
+        if not self.lossy or not ids:
+            return
+
+        try:
+            await db_writer.submit(lambda db: db.execute(
+                delete(FullPrecisionVector).where(FullPrecisionVector.vector_id.in_(ids))
+            ))
+        except Exception as e:
+            logger.warning(f"Failed to delete {len(ids)} full-precision vectors: {e}")
+
+    def _load_persona_payloads(self, persona_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        读取记忆体全部向量的标量字段供本地索引使用（不含向量本身）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            向量ID到其他字段的映射；向量数超过本地索引阈值时返回None
+        """
+        max_vectors = settings.MEMORY_LOCAL_INDEX_MAX_VECTORS
+
+        self.collection_knowledge.load()
+        rows = self.collection_knowledge.query(
+            expr=f"persona_id == '{persona_id}'",
+            output_fields=_SEARCH_OUTPUT_FIELDS,
+            limit=max_vectors + 1
+        )
+        if len(rows) > max_vectors:
+            return None
+
+        return {
+            row["id"]: {field: row.get(field) for field in _SEARCH_OUTPUT_FIELDS if field != "id"}
+            for row in rows
+        }
+
+    def _rescore(
+        self,
+        embedding: List[float],
+        hits: List[Dict[str, Any]],
+        top_k: int
+    ) -> List[Dict[str, Any]]:
+        """
+        用全精度向量重新计算候选的相似度并截取前top_k个
+
+        Args:
+            embedding: 全精度查询向量
+            hits: 有损索引返回的候选
+            top_k: 返回结果数量
+
+        Returns:
+            重排后的结果
+        """
+        if self.rescore_factor <= 1 or not hits:
+            return hits[:top_k]
+
+        vectors = self._load_full_precision([hit["id"] for hit in hits])
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query) or 1.0
+
+        for hit in hits:
+            vector = vectors.get(hit["id"])
+            if vector is not None:
+                # 缺少全精度向量的候选保留索引给出的相似度
+                hit["similarity"] = float(vector @ query / ((np.linalg.norm(vector) or 1.0) * query_norm))
+
+        hits.sort(key=lambda hit: hit["similarity"], reverse=True)
+        return hits[:top_k]
 
     async def insert_knowledge(
         self,
@@ -133,7 +399,7 @@ class VectorStore:
             [id],
             [persona_id],
             [content],
-            [embedding],
+            self._to_index_vectors([embedding]),
             [entity_id or ""],
             [current_time],
             [current_time],
@@ -145,12 +411,98 @@ class VectorStore:
         try:
             self.collection_knowledge.insert(data)
             self.collection_knowledge.flush()
+            await self._save_full_precision_or_rollback([id], [embedding])
+            if self.local_index is not None:
+                self.local_index.add([{
+                    "id": id,
+                    "persona_id": persona_id,
+                    "content": content,
+                    "embedding": embedding,
+                    "entity_id": entity_id or "",
+                    "created_at": current_time,
+                    "last_accessed_at": current_time,
+                    "access_count": 0,
+                    "score": 0.0,
+                    "metadata": data[-1][0]
+                }])
             logger.debug(f"Inserted knowledge vector: id={id}, persona_id={persona_id}")
             return True
         except Exception as e:
             logger.error(f"Failed to insert knowledge vector: {e}")
             return False
 
+    async def insert_knowledge_batch(
+        self,
+        items: List[Dict[str, Any]],
+        upsert: bool = False
+    ) -> bool:
+        """
+        批量插入知识向量（一次插入、一次flush）
+
+        Args:
+            items: 向量数据列表，每项包含 id, persona_id, content, embedding，
+                   可选 entity_id, metadata, created_at, last_accessed_at（毫秒时间戳）, access_count
+            upsert: 是否按ID覆盖已存在的向量（重复执行结果相同，用于发件箱补偿）
+
+        Returns:
+            是否成功
+        """
+        import json
+
+        if not items:
+            return True
+
+        current_time = get_current_timestamp_ms()
+
+        data = [
+            [item["id"] for item in items],
+            [item["persona_id"] for item in items],
+            [item["content"] for item in items],
+            self._to_index_vectors([item["embedding"] for item in items]),
+            [item.get("entity_id") or "" for item in items],
+            [item.get("created_at") or current_time for item in items],
+            [item.get("last_accessed_at") or current_time for item in items],
+            [item.get("access_count") or 0 for item in items],
+            [0.0] * len(items),
+            [json.dumps(item.get("metadata") or {}) for item in items]
+        ]
+
+        try:
+            if upsert:
+                self.collection_knowledge.upsert(data)
+            else:
+                self.collection_knowledge.insert(data)
+            self.collection_knowledge.flush()
+            ids = [item["id"] for item in items]
+            embeddings = [item["embedding"] for item in items]
+            if upsert:
+                # 覆盖写入无法回滚到旧值，失败时由发件箱重试整个upsert
+                await self._save_full_precision(ids, embeddings)
+            else:
+                await self._save_full_precision_or_rollback(ids, embeddings)
+            if self.local_index is not None:
+                self.local_index.add([
+                    {
+                        "id": item["id"],
+                        "persona_id": item["persona_id"],
+                        "content": item["content"],
+                        "embedding": item["embedding"],
+                        "entity_id": entity_id,
+                        "created_at": created_at,
+                        "last_accessed_at": last_accessed_at,
+                        "access_count": access_count,
+                        "score": 0.0,
+                        "metadata": metadata
+                    }
+                    for item, entity_id, created_at, last_accessed_at, access_count, metadata
+                    in zip(items, data[4], data[5], data[6], data[7], data[-1])
+                ])
+            logger.debug(f"{'Upserted' if upsert else 'Inserted'} {len(items)} knowledge vectors in batch")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to insert knowledge vectors in batch: {e}")
+            return False
+
     async def search_knowledge(
         self,
         embedding: List[float],
@@ -169,6 +521,15 @@ class VectorStore:
             搜索结果列表
         """
         logger.info(f"[DEBUG] VectorStore.search_knowledge: persona_id='{persona_id}', top_k={top_k}")
+
+        # 小记忆体走进程内精确索引
+        if persona_id and self.local_index is not None:
+            await self.local_index.ensure_loaded(persona_id)
+            local_results = self.local_index.search(persona_id, embedding, top_k)
+            if local_results is not None:
+                logger.info(f"[DEBUG] Local index returned {len(local_results)} knowledge vectors")
+                return local_results
+
         self.collection_knowledge.load()
 
         search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
@@ -179,12 +540,12 @@ class VectorStore:
 
         try:
             results = self.collection_knowledge.search(
-                data=[embedding],
+                data=self._to_index_vectors([embedding]),
                 anns_field="embedding",
                 param=search_params,
-                limit=top_k,
+                limit=top_k * self.rescore_factor,
                 expr=expr,
-                output_fields=["id", "persona_id", "content", "entity_id", "created_at", "last_accessed_at", "access_count", "score", "metadata"]
+                output_fields=_SEARCH_OUTPUT_FIELDS
             )
 
             logger.info(f"[DEBUG] Milvus search returned {len(results)} result groups")
@@ -209,6 +570,7 @@ class VectorStore:
                     "similarity": result.score
                 })
 
+            formatted_results = self._rescore(embedding, formatted_results, top_k)
             logger.info(f"[DEBUG] Formatted {len(formatted_results)} knowledge vectors")
             return formatted_results
 
@@ -216,6 +578,137 @@ class VectorStore:
             logger.error(f"Failed to search knowledge vectors: {e}")
             return []
 
+    async def search_knowledge_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int = 10,
+        persona_id: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量搜索知识向量（多个查询向量在一次检索中完成）
+
+        Args:
+            embeddings: 查询向量列表
+            top_k: 每个查询返回的结果数量
+            persona_id: 记忆体ID（可选，用于过滤）
+
+        Returns:
+            与查询向量一一对应的搜索结果列表
+        """
+        if not embeddings:
+            return []
+
+        # 小记忆体走进程内精确索引
+        if persona_id and self.local_index is not None:
+            await self.local_index.ensure_loaded(persona_id)
+            local_groups = [self.local_index.search(persona_id, embedding, top_k) for embedding in embeddings]
+            if all(group is not None for group in local_groups):
+                return local_groups
+
+        self.collection_knowledge.load()
+
+        search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
+        expr = f"persona_id == '{persona_id}'" if persona_id else None
+
+        try:
+            results = self.collection_knowledge.search(
+                data=self._to_index_vectors(embeddings),
+                anns_field="embedding",
+                param=search_params,
+                limit=top_k * self.rescore_factor,
+                expr=expr,
+                output_fields=_SEARCH_OUTPUT_FIELDS
+            )
+
+            formatted_groups = []
+            for embedding, hits in zip(embeddings, results):
+                formatted_groups.append(self._rescore(embedding, [
+                    {
+                        "id": hit.entity.get("id"),
+                        "persona_id": hit.entity.get("persona_id"),
+                        "content": hit.entity.get("content"),
+                        "entity_id": hit.entity.get("entity_id"),
+                        "created_at": hit.entity.get("created_at"),
+                        "last_accessed_at": hit.entity.get("last_accessed_at"),
+                        "access_count": hit.entity.get("access_count"),
+                        "score": hit.entity.get("score"),
+                        "metadata": hit.entity.get("metadata"),
+                        "similarity": hit.score
+                    }
+                    for hit in hits
+                ], top_k))
+
+            logger.debug(f"Batch searched {len(embeddings)} query vectors (persona_id={persona_id}, top_k={top_k})")
+            return formatted_groups
+
+        except Exception as e:
+            logger.error(f"Failed to batch search knowledge vectors: {e}")
+            return [[] for _ in embeddings]
+
+    async def get_embeddings(
+        self,
+        ids: List[str],
+        batch_size: int = 100
+    ) -> Dict[str, List[float]]:
+        """
+        按ID批量读取全精度向量
+
+        有损存储时优先读取另存的全精度向量；截断维度的索引向量无法还原，缺少全精度向量时不返回
+
+        Args:
+            ids: 向量ID列表
+            batch_size: 每次查询的ID数量（Milvus Lite返回向量字段的耗时随结果行数超线性增长，小批量更快）
+
+        Returns:
+            向量ID到向量的映射（不存在的ID不包含在结果中）
+        """
+        return self._fetch_embeddings(ids, batch_size)
+
+    def _fetch_embeddings(
+        self,
+        ids: List[str],
+        batch_size: int = 100
+    ) -> Dict[str, List[float]]:
+        """
+        按ID批量读取全精度向量（同步实现，供本地索引重建时调用）
+
+        Args:
+            ids: 向量ID列表
+            batch_size: 每次查询的ID数量
+
+        Returns:
+            向量ID到向量的映射
+        """
+        if not ids:
+            return {}
+
+        embeddings: Dict[str, List[float]] = {
+            id: vector.tolist() for id, vector in self._load_full_precision(ids).items()
+        }
+        missing = [id for id in ids if id not in embeddings]
+        if not missing or self.index_dim < self.full_dim:
+            return embeddings
+
+        self.collection_knowledge.load()
+
+        try:
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                id_list = ", ".join(f"'{id}'" for id in batch)
+                rows = self.collection_knowledge.query(
+                    expr=f"id in [{id_list}]",
+                    output_fields=["id", "embedding"]
+                )
+                for row in rows:
+                    embeddings[row["id"]] = self._decode_vector(row["embedding"]).tolist()
+
+            logger.debug(f"Fetched {len(embeddings)}/{len(ids)} vectors")
+            return embeddings
+
+        except Exception as e:
+            logger.error(f"Failed to fetch vectors: {e}")
+            raise
+
     async def update_access(
         self,
         id: str
@@ -279,6 +772,9 @@ class VectorStore:
             # 删除向量
             collection.delete(f"id == '{id}'")
             collection.flush()
+            await self._delete_full_precision([id])
+            if self.local_index is not None:
+                self.local_index.remove([id])
             logger.debug(f"Deleted vector: id={id}")
             return True
 
@@ -286,6 +782,99 @@ class VectorStore:
             logger.error(f"Failed to delete vector: {e}")
             return False
 
+    async def delete_vectors(
+        self,
+        ids: List[str]
+    ) -> bool:
+        """
+        批量删除向量
+
+        Args:
+            ids: 向量ID列表
+
+        Returns:
+            是否成功
+        """
+        if not ids:
+            return True
+
+        collection = self.collection_knowledge
+
+        try:
+            id_list = ", ".join(f"'{id}'" for id in ids)
+            collection.delete(f"id in [{id_list}]")
+            collection.flush()
+            await self._delete_full_precision(ids)
+            if self.local_index is not None:
+                self.local_index.remove(ids)
+            logger.debug(f"Deleted {len(ids)} vectors")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to delete vectors: {e}")
+            return False
+
+    def list_ids(self, prefix: str = "") -> List[Tuple[str, int]]:
+        """
+        列出ID以指定前缀开头的全部向量（不返回向量字段）
+
+        用于与SQL记录按ID分桶对账：ID为UUID时每个前缀桶的大小约为总数的 16^-len(prefix)；
+        单次查询结果超过Milvus查询窗口时按下一位十六进制字符拆分为16个子桶
+
+        Args:
+            prefix: ID前缀（只允许十六进制字符和连字符）
+
+        Returns:
+            按ID排序的 (向量ID, 创建时间毫秒时间戳) 列表
+        """
+        if any(char not in "0123456789abcdef-" for char in prefix):
+            raise ValueError(f"Invalid vector id prefix: {prefix}")
+
+        # Milvus Lite中空前缀的 like '%' 匹配不到任何行
+        rows = self.collection_knowledge.query(
+            expr=f"id like '{prefix}%'" if prefix else "id != ''",
+            output_fields=["id", "created_at"],
+            limit=_QUERY_WINDOW
+        )
+        if len(rows) < _QUERY_WINDOW:
+            return sorted((row["id"], row["created_at"]) for row in rows)
+
+        # 结果可能被截断：前缀本身（恰好等于前缀的ID）单独查询，其余按下一位拆分
+        result = [
+            (row["id"], row["created_at"])
+            for row in self.collection_knowledge.query(
+                expr=f"id == '{prefix}'",
+                output_fields=["id", "created_at"]
+            )
+        ]
+        for char in "-0123456789abcdef":
+            result.extend(self.list_ids(prefix + char))
+        result.sort()
+        return result
+
+    async def delete_persona(self, persona_id: str) -> int:
+        """
+        按记忆体删除全部向量（一次按表达式删除、一次flush，不逐个读取ID）
+
+        全精度向量随记忆记录在SQL中按记忆体删除
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            删除的向量数
+        """
+        collection = self.collection_knowledge
+        escaped_persona_id = persona_id.replace("\\", "\\\\").replace("'", "\\'")
+
+        result = collection.delete(f"persona_id == '{escaped_persona_id}'")
+        collection.flush()
+        if self.local_index is not None:
+            self.local_index.drop_persona(persona_id)
+
+        logger.info(f"Deleted vectors of persona={persona_id}: {result.delete_count}")
+        return result.delete_count
+
     async def update_vector(
         self,
         id: str,
@@ -311,10 +900,14 @@ class VectorStore:
                 id,
                 {
                     "content": content,
-                    "embedding": embedding
+                    "embedding": self._to_index_vectors([embedding])[0]
                 }
             )
             collection.flush()
+            await self._save_full_precision([id], [embedding])
+            if self.local_index is not None:
+                rows = collection.query(expr=f"id == '{id}'", output_fields=["persona_id"])
+                self.local_index.update(id, content, embedding, rows[0]["persona_id"] if rows else None)
             logger.debug(f"Updated vector: id={id}")
             return True
 
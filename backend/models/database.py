@@ -1,22 +1,272 @@
 """
 数据库模型定义 - SQLite
 """
-from sqlalchemy import create_engine, Column, String, Integer, Float, Text, DateTime, ForeignKey, Index
+from sqlalchemy import create_engine, event, text, Column, String, Integer, Float, Text, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator, Optional, Tuple
+import asyncio
 import json
+import threading
 
 from config import settings
+from utils.tokenizer import fts_tokens
 
 # 创建数据库引擎
 engine = create_engine(
     f"sqlite:///{settings.SQLITE_DB_PATH}",
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    pool_size=settings.SQLITE_POOL_SIZE,
+    max_overflow=settings.SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=settings.SQLITE_POOL_TIMEOUT
 )
 
-# 创建会话工厂
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# 只读引擎：查询走独立的只读连接池，WAL模式下不会等待写事务
+read_engine = create_engine(
+    f"sqlite:///file:{settings.SQLITE_DB_PATH}?mode=ro&uri=true",
+    connect_args={"check_same_thread": False},
+    pool_size=settings.SQLITE_READ_POOL_SIZE,
+    max_overflow=settings.SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=settings.SQLITE_POOL_TIMEOUT
+)
+
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    """
+    设置连接级的存储调优参数
+
+    Args:
+        dbapi_connection: sqlite3连接
+        read_only: 是否为只读连接（只读连接不能修改日志模式）
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        if not read_only:
+            # 日志模式保存在数据库文件中，对所有连接生效
+            cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_SIZE_KB)}")  # 负数表示KB
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+@event.listens_for(engine, "connect")
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    """
+    在每个连接上注册全文索引触发器使用的分词函数并设置存储调优参数
+
+    注意：触发器依赖该函数，在未注册该函数的连接（如sqlite3命令行）中修改memories表会报错
+    """
+    dbapi_connection.create_function("fts_tokens", 1, fts_tokens, deterministic=True)
+    _apply_pragmas(dbapi_connection, read_only=False)
+
+
+@event.listens_for(read_engine, "connect")
+def _configure_read_connection(dbapi_connection, connection_record):
+    """设置只读连接的存储调优参数"""
+    _apply_pragmas(dbapi_connection, read_only=True)
+
+
+# 异步引擎（aiosqlite）：事件循环中的数据库访问使用异步会话，等待数据库时不阻塞其他请求
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{settings.SQLITE_DB_PATH}",
+    pool_size=settings.SQLITE_POOL_SIZE,
+    max_overflow=settings.SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=settings.SQLITE_POOL_TIMEOUT
+)
+async_read_engine = create_async_engine(
+    f"sqlite+aiosqlite:///file:{settings.SQLITE_DB_PATH}?mode=ro&uri=true",
+    pool_size=settings.SQLITE_READ_POOL_SIZE,
+    max_overflow=settings.SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=settings.SQLITE_POOL_TIMEOUT
+)
+
+# 异步引擎的连接与同步引擎使用相同的分词函数和调优参数
+event.listen(async_engine.sync_engine, "connect", _register_sqlite_functions)
+event.listen(async_read_engine.sync_engine, "connect", _configure_read_connection)
+
+# 创建会话工厂（提交后不使对象过期，会话关闭后返回给调用方的对象仍可读取）
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=read_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+# 当前上下文的工作单元：(会话, 所属的任务或线程)
+_current_unit_of_work: ContextVar[Optional[Tuple[Session, object]]] = ContextVar("current_unit_of_work", default=None)
+_current_async_unit_of_work: ContextVar[Optional[Tuple[AsyncSession, object]]] = ContextVar(
+    "current_async_unit_of_work", default=None
+)
+
+
+def _unit_of_work_owner() -> object:
+    """当前的asyncio任务，不在事件循环中时为当前线程"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task if task is not None else threading.get_ident()
+
+
+def _active_session(unit_of_work: ContextVar = _current_unit_of_work):
+    """当前任务或线程中已打开的工作单元会话"""
+    current = unit_of_work.get()
+    if current is not None and current[1] == _unit_of_work_owner():
+        return current[0]
+    return None
+
+
+@contextmanager
+def session_scope(detached: bool = False) -> Iterator[Session]:
+    """
+    工作单元会话
+
+    同一任务（或线程）中嵌套的工作单元共用最外层的会话，由最外层在正常退出时统一提交、异常时回滚。
+    上下文变量会被子任务继承，但会话只在打开它的任务中复用，后台任务总是得到自己的会话
+
+    Args:
+        detached: 是否总是打开独立的工作单元并在退出时立即提交（用于不应等待请求结束的写入，如访问统计）
+
+    Yields:
+        数据库会话
+    """
+    if not detached:
+        active = _active_session()
+        if active is not None:
+            yield active
+            return
+
+    db = SessionLocal()
+    token = _current_unit_of_work.set((db, _unit_of_work_owner()))
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        _current_unit_of_work.reset(token)
+        db.close()
+
+
+@contextmanager
+def read_session() -> Iterator[Session]:
+    """
+    只读查询会话
+
+    已在工作单元中时复用其会话（可读到本请求尚未提交的写入），否则从只读连接池打开一个短生命周期的会话，
+    用完立即归还连接
+
+    Yields:
+        数据库会话
+    """
+    active = _active_session()
+    if active is not None:
+        yield active
+        return
+
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        # close会归还连接并结束事务，但不会像rollback那样使已加载的对象过期
+        db.close()
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    异步工作单元会话（语义与session_scope相同，在请求中即为请求的工作单元）
+
+    Yields:
+        异步数据库会话
+    """
+    active = _active_session(_current_async_unit_of_work)
+    if active is not None:
+        yield active
+        return
+
+    db = AsyncSessionLocal()
+    token = _current_async_unit_of_work.set((db, _unit_of_work_owner()))
+    try:
+        yield db
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        _current_async_unit_of_work.reset(token)
+        await db.close()
+
+
+@asynccontextmanager
+async def async_read_session() -> AsyncIterator[AsyncSession]:
+    """
+    异步只读查询会话（语义与read_session相同）
+
+    Yields:
+        异步数据库会话
+    """
+    active = _active_session(_current_async_unit_of_work)
+    if active is not None:
+        yield active
+        return
+
+    db = AsyncReadSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+class UnitOfWorkMiddleware:
+    """
+    请求级工作单元中间件（ASGI）
+
+    每个HTTP请求打开一个异步工作单元，请求内的服务调用共用同一会话；在响应头发出前提交
+    （状态码不低于400时回滚），流式响应期间不持有写事务
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        db = AsyncSessionLocal()
+        token = _current_async_unit_of_work.set((db, _unit_of_work_owner()))
+        finished = False
+
+        async def send_wrapper(message):
+            nonlocal finished
+            if message["type"] == "http.response.start" and not finished:
+                finished = True
+                if message["status"] < 400:
+                    await db.commit()
+                else:
+                    await db.rollback()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+            if not finished:
+                await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        finally:
+            _current_async_unit_of_work.reset(token)
+            await db.close()
 
 # 创建基类
 Base = declarative_base()
@@ -52,7 +302,9 @@ class Memory(Base):
     # 添加复合索引
     __table_args__ = (
         Index('idx_persona_type', 'persona_id', 'type'),
-        Index('idx_persona_created', 'persona_id', 'created_at'),
+        # 记忆体内按 (时间, id) 键集分页倒序列出记忆时按索引范围扫描，无需排序
+        Index('idx_persona_created_id', 'persona_id', 'created_at', 'id'),
+        Index('idx_persona_event_time', 'persona_id', 'event_time', 'id'),
         Index('idx_vector_entity', 'vector_id', 'entity_id'),
         Index('idx_event_time_persona', 'event_time', 'persona_id'),
     )
@@ -96,17 +348,200 @@ class Configuration(Base):
         self.config_value = json.dumps(value)
 
 
+class ConfigurationVersion(Base):
+    """配置版本表 - 单行计数器，每次写入配置时递增，供各进程低成本地检查配置是否变化"""
+    __tablename__ = "configuration_version"
+
+    id = Column(Integer, primary_key=True)  # 固定为1
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(), onupdate=lambda: datetime.now())  # 使用本地时间（北京时间）
+
+
+class MemoryFingerprint(Base):
+    """记忆指纹表 - 记忆内容的SimHash，用于本地近重复检测"""
+    __tablename__ = "memory_fingerprints"
+
+    memory_id = Column(String, ForeignKey("memories.id"), primary_key=True)  # 关联到记忆
+    persona_id = Column(String, nullable=False, index=True)  # 冗余存储，按记忆体加载索引
+    simhash = Column(Integer, nullable=False)  # 64位SimHash（按有符号整数存储）
+
+
+class FullPrecisionVector(Base):
+    """全精度向量表 - 向量索引使用有损存储（float16、截断维度、SQ8/PQ）时，保存原始float32向量用于重排"""
+    __tablename__ = "full_precision_vectors"
+
+    vector_id = Column(String, primary_key=True)  # Milvus向量ID
+    embedding = Column(LargeBinary, nullable=False)  # float32向量的原始字节
+
+
+class ColdMemory(Base):
+    """冷存储记忆表 - 长期未访问的记忆归档（向量以低精度存放在内存映射文件中）"""
+    __tablename__ = "cold_memories"
+
+    id = Column(String, primary_key=True, index=True)  # 与归档前的记忆ID相同
+    persona_id = Column(String, nullable=False, index=True)
+    vector_id = Column(String, nullable=False)  # 归档前的Milvus向量ID（恢复时复用）
+    entity_id = Column(String, nullable=True)
+    type = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    event_time = Column(DateTime, nullable=True)
+    last_accessed_at = Column(DateTime, nullable=True)
+    access_count = Column(Integer, default=0)
+    meta_data = Column(Text, nullable=True)
+    slot = Column(Integer, nullable=False)  # 向量在该记忆体冷存储文件中的行号
+    scale = Column(Float, nullable=False, default=1.0)  # int8量化的缩放系数（float16为1）
+    archived_at = Column(DateTime, default=lambda: datetime.now())  # 使用本地时间（北京时间）
+
+    # 添加复合索引
+    __table_args__ = (
+        Index('idx_cold_persona_slot', 'persona_id', 'slot'),
+    )
+
+
+class BackgroundJob(Base):
+    """后台任务表 - 持久化的任务队列"""
+    __tablename__ = "background_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    kind = Column(String, nullable=False, index=True)  # 任务类型，如 'memory_extraction'
+    serial_key = Column(String, nullable=True, index=True)  # 串行键，同一键的任务不会并发执行（通常为persona_id）
+    payload = Column(Text, nullable=False)  # 任务参数（JSON格式）
+    status = Column(String, nullable=False, default="pending", index=True)  # 'pending', 'running', 'succeeded', 'failed'
+    attempts = Column(Integer, default=0)  # 已执行次数
+    max_attempts = Column(Integer, default=3)  # 最大执行次数
+    progress = Column(Text, nullable=True)  # 任务进度/结果（JSON格式）
+    last_error = Column(Text, nullable=True)  # 最近一次失败的错误信息
+    next_run_at = Column(DateTime, default=lambda: datetime.now(), index=True)  # 下次可执行时间（用于延迟和退避重试）
+    created_at = Column(DateTime, default=lambda: datetime.now())  # 使用本地时间（北京时间）
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    worker_id = Column(String, nullable=True)  # 执行中任务所属的进程
+    lease_expires_at = Column(DateTime, nullable=True)  # 执行中任务的租约到期时间，所属进程定期续约
+
+    # 添加复合索引
+    __table_args__ = (
+        Index('idx_job_status_run', 'status', 'next_run_at'),
+        Index('idx_job_kind_status', 'kind', 'status'),
+    )
+
+    def get_payload(self) -> dict:
+        """获取任务参数"""
+        if self.payload is not None:
+            return json.loads(str(self.payload))
+        return {}
+
+    def get_progress(self) -> dict:
+        """获取任务进度"""
+        if self.progress is not None:
+            return json.loads(str(self.progress))
+        return {}
+
+
+class StoreOutboxEntry(Base):
+    """跨存储写入发件箱 - 记忆记录变更时在同一事务中写入的向量库/图谱待执行操作"""
+    __tablename__ = "store_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)  # 自增ID，按写入顺序执行
+    op = Column(String, nullable=False)  # 'vector_upsert', 'vector_delete', 'entity_release'
+    target_id = Column(String, nullable=False, index=True)  # 向量ID或实体ID
+    persona_id = Column(String, nullable=True)
+    payload = Column(Text, nullable=True)  # 操作参数（JSON格式）
+    embedding = Column(LargeBinary, nullable=True)  # vector_upsert的float32向量原始字节（为空时执行时重新向量化）
+    attempts = Column(Integer, default=0)  # 已执行失败的次数
+    last_error = Column(Text, nullable=True)  # 最近一次失败的错误信息
+    next_run_at = Column(DateTime, default=lambda: datetime.now(), index=True)  # 后台补偿的下次执行时间
+    created_at = Column(DateTime, default=lambda: datetime.now())  # 使用本地时间（北京时间）
+
+    def get_payload(self) -> dict:
+        """获取操作参数"""
+        if self.payload is not None:
+            return json.loads(str(self.payload))
+        return {}
+
+
+# 记忆内容全文索引：rowid与memories表一致，内容为fts_tokens分词后的文本，由触发器保持同步
+_MEMORY_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+        tokens, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+        INSERT INTO memories_fts(rowid, tokens) VALUES (new.rowid, fts_tokens(new.content));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+        DELETE FROM memories_fts WHERE rowid = old.rowid;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF content ON memories BEGIN
+        UPDATE memories_fts SET tokens = fts_tokens(new.content) WHERE rowid = old.rowid;
+    END""",
+]
+
+
+def _init_memory_fts():
+    """创建记忆全文索引；首次创建或索引与memories表的行不一致时重建（VACUUM可能重排memories表的rowid，使索引错位，不应对该库执行VACUUM）"""
+    with engine.begin() as conn:
+        for ddl in _MEMORY_FTS_DDL:
+            conn.execute(text(ddl))
+
+        memory_count = conn.execute(text("SELECT count(*) FROM memories")).scalar()
+        indexed_count = conn.execute(text("SELECT count(*) FROM memories_fts")).scalar()
+        mismatched = conn.execute(text(
+            "SELECT count(*) FROM memories m LEFT JOIN memories_fts f ON f.rowid = m.rowid WHERE f.rowid IS NULL"
+        )).scalar() if memory_count == indexed_count else 1
+
+        if mismatched:
+            conn.execute(text("DELETE FROM memories_fts"))
+            conn.execute(text(
+                "INSERT INTO memories_fts(rowid, tokens) SELECT rowid, fts_tokens(content) FROM memories"
+            ))
+
+
+# 已有表上后来新增的列：create_all不会修改已存在的表，启动时补齐
+_ADDED_COLUMNS = {
+    "background_jobs": {
+        "worker_id": "VARCHAR",
+        "lease_expires_at": "DATETIME",
+    },
+}
+
+
+# 已被新索引取代的旧索引
+_DROPPED_INDEXES = [
+    "idx_persona_created",  # 由 idx_persona_created_id 取代
+]
+
+
+def _add_missing_columns():
+    """为旧版本创建的表补齐新增的列"""
+    with engine.begin() as conn:
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def _sync_indexes():
+    """为旧版本创建的表补齐新增的索引并删除被取代的索引（create_all 不会修改已存在的表）"""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        for name in _DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
 # 创建所有表
 def init_db():
     """初始化数据库"""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _sync_indexes()
+    _init_memory_fts()
 
 
 # 数据库依赖
-def get_db():
-    """获取数据库会话"""
-    db = SessionLocal()
-    try:
+async def get_db():
+    """获取异步数据库会话（在请求的工作单元中运行时即为请求会话）"""
+    async with async_session_scope() as db:
         yield db
-    finally:
-        db.close()
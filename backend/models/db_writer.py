@@ -0,0 +1,200 @@
+"""
+SQLite写入队列 - 单写者组提交
+所有热路径写入（记忆写入、删除、访问统计）排队交给一个后台任务执行，
+同一批的多个操作在一个事务中提交，只获取一次数据库写锁、只做一次日志同步
+"""
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, TypeVar
+import asyncio
+import threading
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.database import AsyncSessionLocal
+from utils.logger import logger
+
+
+T = TypeVar("T")
+
+# 写操作：接收异步会话执行写入（不提交），返回值透传给调用方
+WriteOperation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class DatabaseWriter:
+    """
+    单写者组提交队列
+
+    写操作使用异步会话执行（等待数据库时不阻塞事件循环），同一时刻只有一个写事务。
+    一批操作整体提交；批量提交失败时回滚，再逐个单独提交，只有出错的操作收到异常
+    """
+
+    def __init__(
+        self,
+        max_batch: int = settings.SQLITE_WRITER_MAX_BATCH,
+        group_window_ms: float = settings.SQLITE_WRITER_GROUP_WINDOW_MS
+    ):
+        """
+        初始化写入队列
+
+        Args:
+            max_batch: 单次组提交的最大操作数
+            group_window_ms: 收到第一个操作后等待更多操作的时间（毫秒）
+        """
+        self.max_batch = max(1, max_batch)
+        self.group_window = max(0.0, group_window_ms) / 1000
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._batches = 0
+        self._operations = 0
+        self._fallbacks = 0
+
+        logger.info(f"DatabaseWriter initialized: max_batch={self.max_batch}, group_window={group_window_ms}ms")
+
+    async def submit(self, operation: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        """
+        提交写操作并等待其所在的批次提交
+
+        Args:
+            operation: 异步写操作，接收会话执行写入，不要自行提交
+
+        Returns:
+            写操作的返回值（提交后返回）
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def stop(self):
+        """处理完已排队的操作后停止写入任务"""
+        if self._task is None or self._task.done():
+            self._task = None
+            return
+        # 停止标记排在已提交的操作之后
+        self._queue.put_nowait(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("DatabaseWriter stopped")
+
+    def get_stats(self) -> dict:
+        """
+        获取统计信息
+
+        Returns:
+            统计信息字典
+        """
+        return {
+            "batches": self._batches,
+            "operations": self._operations,
+            "avg_batch_size": self._operations / self._batches if self._batches else 0.0,
+            "fallbacks": self._fallbacks,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def _ensure_started(self):
+        """在当前事件循环中启动写入任务（事件循环变化时重建队列）"""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        """写入任务主循环：取出一批操作执行并提交，遇到停止标记时处理完本批后退出"""
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            if self.group_window > 0 and batch[0] is not None:
+                await asyncio.sleep(self.group_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            stopping = None in batch
+            batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            try:
+                outcomes = await self._execute([operation for operation, _ in batch])
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    async def _execute(self, operations: List[WriteOperation]) -> List[Tuple[bool, Any]]:
+        """
+        在一个事务中执行一批写操作（失败时逐个重试）
+
+        Args:
+            operations: 写操作列表
+
+        Returns:
+            每个操作的 (是否成功, 返回值或异常)
+        """
+        self._batches += 1
+        self._operations += len(operations)
+
+        db = AsyncSessionLocal()
+        try:
+            results = [await operation(db) for operation in operations]
+            await db.commit()
+            return [(True, result) for result in results]
+        except Exception as e:
+            await db.rollback()
+            if len(operations) == 1:
+                return [(False, e)]
+        finally:
+            await db.close()
+
+        # 批量提交失败：逐个单独提交，避免一个出错的操作拖累同批的其他操作
+        self._fallbacks += 1
+        logger.warning(f"Group commit of {len(operations)} writes failed, retrying individually")
+        outcomes = []
+        for operation in operations:
+            db = AsyncSessionLocal()
+            try:
+                result = await operation(db)
+                await db.commit()
+                outcomes.append((True, result))
+            except Exception as e:
+                await db.rollback()
+                outcomes.append((False, e))
+            finally:
+                await db.close()
+        return outcomes
+
+
+# 全局写入队列实例 - 使用懒加载
+_db_writer = None
+_db_writer_lock = threading.Lock()
+
+
+def get_db_writer() -> DatabaseWriter:
+    """获取写入队列实例（线程安全的懒加载）"""
+    global _db_writer
+    if _db_writer is None:
+        with _db_writer_lock:
+            if _db_writer is None:  # 双重检查锁定
+                _db_writer = DatabaseWriter()
+    return _db_writer
+
+
+# 向后兼容的属性访问器
+class DatabaseWriterProxy:
+    """写入队列代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_db_writer(), name)
+
+
+db_writer = DatabaseWriterProxy()
@@ -152,6 +152,7 @@ class MemorySearchRequest(BaseModel):
     top_k: Optional[int] = 10
     memory_type: Optional[str] = None  # 'long_term', None (all)
     metadata: Optional[Dict[str, Any]] = None  # 搜索元数据，如 user_id
+    include_cold: bool = False  # 是否同时检索冷存储（需要在metadata中指定persona_id）
 
 
 class MemorySearchResult(BaseModel):
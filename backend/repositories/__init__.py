@@ -0,0 +1,3 @@
+"""
+数据访问模块（基于SQLAlchemy异步会话）
+"""
@@ -0,0 +1,130 @@
+"""
+配置数据访问
+"""
+from typing import List, Optional
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import Configuration, ConfigurationVersion
+
+
+class ConfigurationRepository:
+    """
+    配置表的异步数据访问
+
+    只执行语句和flush，提交由调用方（工作单元）负责
+    """
+
+    def __init__(self, session: AsyncSession):
+        """
+        初始化配置数据访问
+
+        Args:
+            session: 异步数据库会话
+        """
+        self.session = session
+
+    async def get(self, user_id: str, config_key: str) -> Optional[Configuration]:
+        """
+        按用户和配置键获取配置
+
+        Args:
+            user_id: 用户ID
+            config_key: 配置键
+
+        Returns:
+            配置对象
+        """
+        result = await self.session.execute(
+            select(Configuration).where(
+                Configuration.user_id == user_id,
+                Configuration.config_key == config_key
+            )
+        )
+        return result.scalars().first()
+
+    async def get_by_id(self, config_id: str) -> Optional[Configuration]:
+        """
+        按ID获取配置
+
+        Args:
+            config_id: 配置ID
+
+        Returns:
+            配置对象
+        """
+        return await self.session.get(Configuration, config_id)
+
+    async def list(self, user_id: Optional[str] = None) -> List[Configuration]:
+        """
+        列出配置
+
+        Args:
+            user_id: 用户ID过滤，为空时列出全部
+
+        Returns:
+            配置列表
+        """
+        statement = select(Configuration)
+        if user_id:
+            statement = statement.where(Configuration.user_id == user_id)
+        result = await self.session.execute(statement)
+        return list(result.scalars())
+
+    async def add(self, config: Configuration) -> Configuration:
+        """
+        写入配置
+
+        Args:
+            config: 配置对象
+
+        Returns:
+            写入的配置对象
+        """
+        self.session.add(config)
+        await self.session.flush()
+        return config
+
+    async def delete(self, config_id: str) -> bool:
+        """
+        删除配置
+
+        Args:
+            config_id: 配置ID
+
+        Returns:
+            是否删除
+        """
+        result = await self.session.execute(delete(Configuration).where(Configuration.id == config_id))
+        return result.rowcount > 0
+
+    async def get_version(self) -> int:
+        """
+        获取配置版本号
+
+        Returns:
+            版本号（从未写入过配置时为0）
+        """
+        result = await self.session.execute(
+            select(ConfigurationVersion.version).where(ConfigurationVersion.id == 1)
+        )
+        return result.scalar() or 0
+
+    async def bump_version(self) -> int:
+        """
+        递增配置版本号（与配置写入在同一事务中提交）
+
+        Returns:
+            递增后的版本号
+        """
+        result = await self.session.execute(
+            update(ConfigurationVersion).where(ConfigurationVersion.id == 1).values(
+                version=ConfigurationVersion.version + 1
+            )
+        )
+        if result.rowcount == 0:
+            self.session.add(ConfigurationVersion(id=1, version=1))
+            await self.session.flush()
+            return 1
+        return await self.get_version()
@@ -0,0 +1,233 @@
+"""
+后台任务数据访问
+"""
+from typing import Dict, List, Optional
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import BackgroundJob
+
+
+class JobRepository:
+    """
+    后台任务表的异步数据访问
+
+    只执行语句和flush，提交由调用方（写入队列）负责
+    """
+
+    def __init__(self, session: AsyncSession):
+        """
+        初始化后台任务数据访问
+
+        Args:
+            session: 异步数据库会话
+        """
+        self.session = session
+
+    async def get(self, job_id: str) -> Optional[BackgroundJob]:
+        """
+        按ID获取任务
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            任务对象
+        """
+        return await self.session.get(BackgroundJob, job_id)
+
+    async def add(self, job: BackgroundJob) -> BackgroundJob:
+        """
+        写入任务
+
+        Args:
+            job: 任务对象
+
+        Returns:
+            写入的任务对象
+        """
+        self.session.add(job)
+        await self.session.flush()
+        return job
+
+    async def count_pending(self, kind: str) -> int:
+        """
+        统计某类型排队中的任务数
+
+        Args:
+            kind: 任务类型
+
+        Returns:
+            排队中的任务数
+        """
+        result = await self.session.execute(
+            select(func.count(BackgroundJob.id)).where(
+                BackgroundJob.kind == kind,
+                BackgroundJob.status == "pending"
+            )
+        )
+        return result.scalar_one()
+
+    async def claim_next(
+        self,
+        kinds: List[str],
+        now: datetime,
+        worker_id: str,
+        lease_expires_at: datetime,
+        limit: int = 10
+    ) -> Optional[BackgroundJob]:
+        """
+        领取下一个可执行的任务（串行键已有任务在执行中的任务会被跳过）
+
+        Args:
+            kinds: 可执行的任务类型
+            now: 当前时间
+            worker_id: 领取任务的进程ID
+            lease_expires_at: 租约到期时间
+            limit: 每次检查的候选任务数
+
+        Returns:
+            已标记为running的任务，没有可执行任务时返回None
+        """
+        busy_keys = select(BackgroundJob.serial_key).where(
+            BackgroundJob.status == "running",
+            BackgroundJob.serial_key.isnot(None)
+        )
+        result = await self.session.execute(
+            select(BackgroundJob).where(
+                BackgroundJob.status == "pending",
+                BackgroundJob.next_run_at <= now,
+                BackgroundJob.kind.in_(kinds),
+                (BackgroundJob.serial_key.is_(None)) | (BackgroundJob.serial_key.notin_(busy_keys))
+            ).order_by(BackgroundJob.next_run_at, BackgroundJob.created_at).limit(limit)
+        )
+
+        for job in result.scalars().all():
+            # 条件更新，防止多个进程重复领取
+            claimed = await self.session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.id == job.id, BackgroundJob.status == "pending")
+                .values(
+                    status="running",
+                    started_at=now,
+                    attempts=BackgroundJob.attempts + 1,
+                    worker_id=worker_id,
+                    lease_expires_at=lease_expires_at
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if claimed.rowcount:
+                await self.session.refresh(job)
+                return job
+        return None
+
+    async def set_progress(self, job_id: str, progress: str) -> int:
+        """
+        更新任务进度
+
+        Args:
+            job_id: 任务ID
+            progress: 进度（JSON格式）
+
+        Returns:
+            更新的记录数
+        """
+        result = await self.session.execute(
+            update(BackgroundJob).where(BackgroundJob.id == job_id).values(progress=progress)
+        )
+        return result.rowcount
+
+    async def renew_leases(self, worker_id: str, lease_expires_at: datetime) -> int:
+        """
+        为进程执行中的任务续约
+
+        Args:
+            worker_id: 进程ID
+            lease_expires_at: 新的租约到期时间
+
+        Returns:
+            续约的任务数
+        """
+        result = await self.session.execute(
+            update(BackgroundJob).where(
+                BackgroundJob.status == "running",
+                BackgroundJob.worker_id == worker_id
+            ).values(lease_expires_at=lease_expires_at)
+        )
+        return result.rowcount
+
+    async def requeue_expired(self, now: datetime, legacy_started_before: datetime) -> int:
+        """
+        将租约已过期的running任务放回队列（所属进程已退出）
+
+        Args:
+            now: 当前时间（同时作为下次执行时间）
+            legacy_started_before: 没有租约的旧任务在该时间之前开始时才回收
+
+        Returns:
+            放回的任务数
+        """
+        result = await self.session.execute(
+            update(BackgroundJob).where(
+                BackgroundJob.status == "running",
+                (BackgroundJob.lease_expires_at < now) | (
+                    BackgroundJob.lease_expires_at.is_(None) & (BackgroundJob.started_at < legacy_started_before)
+                )
+            ).values(status="pending", next_run_at=now, worker_id=None, lease_expires_at=None)
+        )
+        return result.rowcount
+
+    async def purge_finished(self, finished_before: datetime) -> int:
+        """
+        删除过期的已结束任务
+
+        Args:
+            finished_before: 结束时间早于该时间的任务会被删除
+
+        Returns:
+            删除的任务数
+        """
+        result = await self.session.execute(
+            delete(BackgroundJob).where(
+                BackgroundJob.status.in_(["succeeded", "failed"]),
+                BackgroundJob.finished_at < finished_before
+            )
+        )
+        return result.rowcount
+
+    async def count_active(self) -> Dict[str, Dict[str, int]]:
+        """
+        按类型统计排队中和执行中的任务数
+
+        Returns:
+            {任务类型: {"pending": 数量, "running": 数量}}
+        """
+        result = await self.session.execute(
+            select(BackgroundJob.kind, BackgroundJob.status, func.count(BackgroundJob.id))
+            .where(BackgroundJob.status.in_(["pending", "running"]))
+            .group_by(BackgroundJob.kind, BackgroundJob.status)
+        )
+        depth: Dict[str, Dict[str, int]] = {}
+        for kind, job_status, count in result.all():
+            depth.setdefault(kind, {"pending": 0, "running": 0})[job_status] = count
+        return depth
+
+    async def oldest_due(self, now: datetime) -> Optional[datetime]:
+        """
+        最早一个已到期但仍未执行的任务的计划执行时间
+
+        Args:
+            now: 当前时间
+
+        Returns:
+            计划执行时间，没有到期任务时返回None
+        """
+        result = await self.session.execute(
+            select(func.min(BackgroundJob.next_run_at)).where(
+                BackgroundJob.status == "pending",
+                BackgroundJob.next_run_at <= now
+            )
+        )
+        return result.scalar()
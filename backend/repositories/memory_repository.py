@@ -0,0 +1,319 @@
+"""
+记忆数据访问
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, func, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import Memory, MemoryFingerprint, FullPrecisionVector
+
+
+class MemoryRepository:
+    """
+    记忆表的异步数据访问
+
+    只执行语句和flush，提交由调用方（工作单元或写入队列）负责
+    """
+
+    def __init__(self, session: AsyncSession):
+        """
+        初始化记忆数据访问
+
+        Args:
+            session: 异步数据库会话
+        """
+        self.session = session
+
+    async def get(self, memory_id: str) -> Optional[Memory]:
+        """
+        按ID获取记忆
+
+        Args:
+            memory_id: 记忆ID
+
+        Returns:
+            记忆对象
+        """
+        return await self.session.get(Memory, memory_id)
+
+    async def get_many(self, memory_ids: List[str]) -> List[Memory]:
+        """
+        按ID批量获取记忆
+
+        Args:
+            memory_ids: 记忆ID列表
+
+        Returns:
+            记忆列表（不存在的ID被忽略）
+        """
+        if not memory_ids:
+            return []
+        result = await self.session.execute(select(Memory).where(Memory.id.in_(memory_ids)))
+        return list(result.scalars())
+
+    async def get_by_vector_ids(self, vector_ids: List[str]) -> List[Memory]:
+        """
+        按向量ID批量获取记忆
+
+        Args:
+            vector_ids: 向量ID列表
+
+        Returns:
+            记忆列表
+        """
+        if not vector_ids:
+            return []
+        result = await self.session.execute(select(Memory).where(Memory.vector_id.in_(vector_ids)))
+        return list(result.scalars())
+
+    async def list(self, type: Optional[str] = None, limit: int = 100) -> List[Memory]:
+        """
+        按创建时间倒序列出记忆
+
+        Args:
+            type: 记忆类型过滤
+            limit: 返回数量限制
+
+        Returns:
+            记忆列表
+        """
+        statement = select(Memory)
+        if type:
+            statement = statement.where(Memory.type == type)
+        result = await self.session.execute(statement.order_by(Memory.created_at.desc()).limit(limit))
+        return list(result.scalars())
+
+    async def list_page(
+        self,
+        persona_id: Optional[str] = None,
+        type: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        event_after: Optional[datetime] = None,
+        event_before: Optional[datetime] = None,
+        order_by: str = "created_at",
+        after: Optional[Tuple[datetime, str]] = None,
+        limit: int = 100
+    ) -> List[Memory]:
+        """
+        按键集分页倒序列出记忆（过滤条件全部下推到SQL）
+
+        按 (排序时间, id) 倒序，翻页条件为 (排序时间, id) < 上一页最后一行，
+        按记忆体过滤时配合 idx_persona_created_id / idx_persona_event_time 按索引范围扫描，翻页代价与页码无关
+
+        Args:
+            persona_id: 记忆体ID过滤
+            type: 记忆类型过滤
+            created_after: 创建时间下界（含）
+            created_before: 创建时间上界（不含）
+            event_after: 事件时间下界（含）
+            event_before: 事件时间上界（不含）
+            order_by: 排序字段，'created_at' 或 'event_time'（按事件时间排序时不返回无事件时间的记忆）
+            after: 上一页最后一行的 (排序时间, id)，为空时从第一页开始
+            limit: 返回数量限制
+
+        Returns:
+            记忆列表
+        """
+        sort_column = Memory.event_time if order_by == "event_time" else Memory.created_at
+
+        statement = select(Memory)
+        if persona_id:
+            statement = statement.where(Memory.persona_id == persona_id)
+        if type:
+            statement = statement.where(Memory.type == type)
+        if created_after is not None:
+            statement = statement.where(Memory.created_at >= created_after)
+        if created_before is not None:
+            statement = statement.where(Memory.created_at < created_before)
+        if event_after is not None:
+            statement = statement.where(Memory.event_time >= event_after)
+        if event_before is not None:
+            statement = statement.where(Memory.event_time < event_before)
+        if order_by == "event_time":
+            statement = statement.where(Memory.event_time.isnot(None))
+        if after is not None:
+            statement = statement.where(tuple_(sort_column, Memory.id) < after)
+
+        statement = statement.order_by(sort_column.desc(), Memory.id.desc()).limit(limit)
+        result = await self.session.execute(statement)
+        return list(result.scalars())
+
+    async def list_by_persona(self, persona_id: str) -> List[Memory]:
+        """
+        列出记忆体的全部记忆
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            记忆列表
+        """
+        result = await self.session.execute(select(Memory).where(Memory.persona_id == persona_id))
+        return list(result.scalars())
+
+    async def count_by_persona(self, persona_id: str) -> int:
+        """
+        统计记忆体的记忆数
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            记忆数
+        """
+        result = await self.session.execute(
+            select(func.count()).select_from(Memory).where(Memory.persona_id == persona_id)
+        )
+        return result.scalar_one()
+
+    async def add(self, memories: List[Memory]) -> List[Memory]:
+        """
+        写入记忆
+
+        Args:
+            memories: 记忆对象列表
+
+        Returns:
+            写入的记忆对象列表
+        """
+        self.session.add_all(memories)
+        await self.session.flush()
+        return memories
+
+    async def update(
+        self,
+        memory_id: str,
+        content: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Optional[Memory]:
+        """
+        更新记忆的内容和元数据
+
+        Args:
+            memory_id: 记忆ID
+            content: 新内容（为空时不修改）
+            metadata: 新元数据（为空时不修改）
+
+        Returns:
+            更新后的记忆对象，不存在时返回None
+        """
+        memory = await self.get(memory_id)
+        if memory is None:
+            return None
+        if content is not None:
+            memory.content = content
+        if metadata is not None:
+            memory.set_metadata(metadata)
+        await self.session.flush()
+        return memory
+
+    async def touch(self, memory_ids: List[str], accessed_at: datetime) -> int:
+        """
+        批量更新访问时间并累加访问次数（一条UPDATE语句）
+
+        Args:
+            memory_ids: 记忆ID列表
+            accessed_at: 访问时间
+
+        Returns:
+            更新的记忆数
+        """
+        if not memory_ids:
+            return 0
+        result = await self.session.execute(
+            update(Memory).where(Memory.id.in_(memory_ids)).values(
+                last_accessed_at=accessed_at,
+                access_count=Memory.access_count + 1
+            )
+        )
+        return result.rowcount
+
+    async def delete(self, memory_id: str) -> bool:
+        """
+        删除记忆
+
+        Args:
+            memory_id: 记忆ID
+
+        Returns:
+            是否删除（记忆不存在时返回False）
+        """
+        result = await self.session.execute(delete(Memory).where(Memory.id == memory_id))
+        return result.rowcount > 0
+
+    async def delete_many(self, memory_ids: List[str]) -> int:
+        """
+        批量删除记忆（一条DELETE语句）
+
+        Args:
+            memory_ids: 记忆ID列表
+
+        Returns:
+            删除的记忆数
+        """
+        if not memory_ids:
+            return 0
+        result = await self.session.execute(delete(Memory).where(Memory.id.in_(memory_ids)))
+        return result.rowcount
+
+    async def delete_by_persona(self, persona_id: str) -> int:
+        """
+        删除记忆体的全部记忆及其指纹和全精度向量（每张表一条按记忆体过滤的DELETE，不逐行加载）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            删除的记忆数
+        """
+        await self.session.execute(
+            delete(MemoryFingerprint).where(MemoryFingerprint.persona_id == persona_id)
+        )
+        await self.session.execute(
+            delete(FullPrecisionVector).where(FullPrecisionVector.vector_id.in_(
+                select(Memory.vector_id).where(Memory.persona_id == persona_id)
+            ))
+        )
+        result = await self.session.execute(delete(Memory).where(Memory.persona_id == persona_id))
+        return result.rowcount
+
+    async def search_fts(
+        self,
+        match: str,
+        type: Optional[str] = None,
+        limit: int = 10,
+        persona_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        全文检索（FTS5，按bm25排序）
+
+        Args:
+            match: FTS5 MATCH表达式
+            type: 记忆类型过滤
+            limit: 返回数量限制
+            persona_id: 记忆体ID过滤
+
+        Returns:
+            原始行（字段名与memories表一致，另含 lexical_score，越小越相关）
+        """
+        sql = """
+            SELECT m.id, m.vector_id, m.persona_id, m.entity_id, m.content, m.created_at, m.event_time,
+                   m.last_accessed_at, m.access_count, m.meta_data, bm25(memories_fts) AS lexical_score
+            FROM memories_fts
+            JOIN memories m ON m.rowid = memories_fts.rowid
+            WHERE memories_fts MATCH :match
+        """
+        params: Dict[str, Any] = {"match": match, "limit": limit}
+        if persona_id:
+            sql += " AND m.persona_id = :persona_id"
+            params["persona_id"] = persona_id
+        if type:
+            sql += " AND m.type = :type"
+            params["type"] = type
+        sql += " ORDER BY lexical_score LIMIT :limit"
+
+        result = await self.session.execute(text(sql), params)
+        return [dict(row) for row in result.mappings()]
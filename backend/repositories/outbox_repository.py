@@ -0,0 +1,126 @@
+"""
+跨存储写入发件箱数据访问
+"""
+from typing import List, Set
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import StoreOutboxEntry
+
+
+class OutboxRepository:
+    """
+    发件箱表的异步数据访问
+
+    只执行语句和flush，提交由调用方（工作单元或写入队列）负责
+    """
+
+    def __init__(self, session: AsyncSession):
+        """
+        初始化发件箱数据访问
+
+        Args:
+            session: 异步数据库会话
+        """
+        self.session = session
+
+    async def add(self, entries: List[StoreOutboxEntry]) -> List[StoreOutboxEntry]:
+        """
+        写入待执行操作（flush后entries获得自增ID）
+
+        Args:
+            entries: 发件箱记录列表
+
+        Returns:
+            写入的发件箱记录列表
+        """
+        if entries:
+            self.session.add_all(entries)
+            await self.session.flush()
+        return entries
+
+    async def list_due(self, now: datetime, limit: int) -> List[StoreOutboxEntry]:
+        """
+        按写入顺序列出到期的待执行操作
+
+        Args:
+            now: 当前时间
+            limit: 返回数量限制
+
+        Returns:
+            发件箱记录列表
+        """
+        result = await self.session.execute(
+            select(StoreOutboxEntry)
+            .where(StoreOutboxEntry.next_run_at <= now)
+            .order_by(StoreOutboxEntry.id)
+            .limit(limit)
+        )
+        return list(result.scalars())
+
+    async def pending_targets(self, target_ids: List[str]) -> Set[str]:
+        """
+        查询仍有待执行操作的目标ID
+
+        Args:
+            target_ids: 向量ID或实体ID列表
+
+        Returns:
+            有待执行操作的目标ID集合
+        """
+        if not target_ids:
+            return set()
+        result = await self.session.execute(
+            select(StoreOutboxEntry.target_id).where(StoreOutboxEntry.target_id.in_(target_ids)).distinct()
+        )
+        return set(result.scalars())
+
+    async def count(self) -> int:
+        """
+        统计待执行操作数
+
+        Returns:
+            待执行操作数
+        """
+        result = await self.session.execute(select(func.count()).select_from(StoreOutboxEntry))
+        return result.scalar_one()
+
+    async def delete(self, entry_ids: List[int]) -> int:
+        """
+        删除已执行的操作
+
+        Args:
+            entry_ids: 发件箱记录ID列表
+
+        Returns:
+            删除的记录数
+        """
+        if not entry_ids:
+            return 0
+        result = await self.session.execute(delete(StoreOutboxEntry).where(StoreOutboxEntry.id.in_(entry_ids)))
+        return result.rowcount
+
+    async def defer(self, entry_ids: List[int], error: str, next_run_at: datetime) -> int:
+        """
+        记录执行失败并推迟到下次补偿
+
+        Args:
+            entry_ids: 发件箱记录ID列表
+            error: 错误信息
+            next_run_at: 下次执行时间
+
+        Returns:
+            更新的记录数
+        """
+        if not entry_ids:
+            return 0
+        result = await self.session.execute(
+            update(StoreOutboxEntry).where(StoreOutboxEntry.id.in_(entry_ids)).values(
+                attempts=StoreOutboxEntry.attempts + 1,
+                last_error=error[:1000],
+                next_run_at=next_run_at
+            )
+        )
+        return result.rowcount
@@ -0,0 +1,81 @@
+"""
+记忆体数据访问
+"""
+from typing import List, Optional
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import Persona
+
+
+class PersonaRepository:
+    """
+    记忆体表的异步数据访问
+
+    只执行语句和flush，提交由调用方（工作单元）负责
+    """
+
+    def __init__(self, session: AsyncSession):
+        """
+        初始化记忆体数据访问
+
+        Args:
+            session: 异步数据库会话
+        """
+        self.session = session
+
+    async def get(self, persona_id: str) -> Optional[Persona]:
+        """
+        按ID获取记忆体
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            记忆体对象
+        """
+        return await self.session.get(Persona, persona_id)
+
+    async def list(self, limit: Optional[int] = None) -> List[Persona]:
+        """
+        按更新时间倒序列出记忆体
+
+        Args:
+            limit: 返回数量限制，为空时不限制
+
+        Returns:
+            记忆体列表
+        """
+        statement = select(Persona).order_by(Persona.updated_at.desc())
+        if limit is not None:
+            statement = statement.limit(limit)
+        result = await self.session.execute(statement)
+        return list(result.scalars())
+
+    async def add(self, persona: Persona) -> Persona:
+        """
+        写入记忆体
+
+        Args:
+            persona: 记忆体对象
+
+        Returns:
+            写入的记忆体对象
+        """
+        self.session.add(persona)
+        await self.session.flush()
+        return persona
+
+    async def delete(self, persona_id: str) -> bool:
+        """
+        删除记忆体记录（不含其记忆）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            是否删除
+        """
+        result = await self.session.execute(delete(Persona).where(Persona.id == persona_id))
+        return result.rowcount > 0
@@ -0,0 +1,232 @@
+"""
+向量存储精度基准测试
+比较不同存储精度（float16、int8、PQ、截断维度）相对float32的内存节省和召回损失，
+以及按 top_k × rescore_factor 取候选后用全精度重排的效果
+
+用法（在backend目录下运行）:
+    python scripts/benchmark_vector_precision.py                       # 合成数据
+    python scripts/benchmark_vector_precision.py --persona <persona_id> # 使用记忆体的真实向量
+    python scripts/benchmark_vector_precision.py --dims 768,512,256 --top-k 10 --rescore-factor 4
+"""
+from typing import List, Callable, Tuple
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory.quantization import normalize, quantize, dequantize, bytes_per_vector
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    生成带聚类结构的合成向量（近似真实嵌入向量的分布）
+
+    Args:
+        count: 向量数量
+        dim: 向量维度
+        clusters: 聚类数量
+        seed: 随机种子
+
+    Returns:
+        归一化后的向量矩阵
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(count, dim)).astype(np.float32)
+    return normalize(vectors)
+
+
+def load_persona_vectors(persona_id: str) -> np.ndarray:
+    """
+    读取记忆体的全部全精度向量
+
+    Args:
+        persona_id: 记忆体ID
+
+    Returns:
+        归一化后的向量矩阵
+    """
+    from models.database import SessionLocal, Memory
+    from memory.vector_store import vector_store
+
+    db = SessionLocal()
+    try:
+        vector_ids = [row[0] for row in db.query(Memory.vector_id).filter(Memory.persona_id == persona_id).all()]
+    finally:
+        db.close()
+
+    embeddings = asyncio.run(vector_store.get_embeddings(vector_ids))
+    return normalize(np.asarray(list(embeddings.values()), dtype=np.float32))
+
+
+def train_pq(vectors: np.ndarray, m: int, iterations: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    训练乘积量化码本并编码（每个子空间256个中心，即每个子向量1字节）
+
+    Args:
+        vectors: 向量矩阵
+        m: 子空间数量（需整除维度）
+        iterations: k-means迭代次数
+        seed: 随机种子
+
+    Returns:
+        (码本 [m, 256, dsub], 编码 [n, m])
+    """
+    rng = np.random.default_rng(seed)
+    n, dim = vectors.shape
+    dsub = dim // m
+    k = min(256, n)
+
+    codebooks = np.zeros((m, k, dsub), dtype=np.float32)
+    codes = np.zeros((n, m), dtype=np.uint8)
+    for j in range(m):
+        sub = vectors[:, j * dsub:(j + 1) * dsub]
+        centers = sub[rng.choice(n, size=k, replace=False)].copy()
+        for _ in range(iterations):
+            distances = (sub ** 2).sum(1)[:, None] - 2 * sub @ centers.T + (centers ** 2).sum(1)[None, :]
+            assignment = distances.argmin(1)
+            for c in range(k):
+                members = sub[assignment == c]
+                if len(members):
+                    centers[c] = members.mean(0)
+        codebooks[j] = centers
+        codes[:, j] = assignment
+    return codebooks, codes
+
+
+def pq_decode(codebooks: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    用码本还原PQ编码的向量
+
+    Args:
+        codebooks: 码本
+        codes: 编码
+
+    Returns:
+        还原后的向量矩阵
+    """
+    return np.concatenate([codebooks[j][codes[:, j]] for j in range(codebooks.shape[0])], axis=1)
+
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """截取前dim维并重新归一化（Matryoshka）"""
+    return normalize(vectors[:, :dim])
+
+
+def recall_at_k(exact: np.ndarray, approx: np.ndarray) -> float:
+    """
+    计算召回率
+
+    Args:
+        exact: 精确检索的结果ID矩阵 [queries, k]
+        approx: 近似检索的结果ID矩阵 [queries, k]
+
+    Returns:
+        平均召回率
+    """
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact, approx))
+    return hits / exact.size
+
+
+def top_k_ids(queries: np.ndarray, base: np.ndarray, k: int) -> np.ndarray:
+    """按内积取每个查询的前k个ID"""
+    scores = queries @ base.T
+    k = min(k, base.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def rescored_ids(
+    queries: np.ndarray,
+    base: np.ndarray,
+    approx_base: np.ndarray,
+    approx_queries: np.ndarray,
+    k: int,
+    factor: int
+) -> np.ndarray:
+    """
+    在有损向量上取 k × factor 个候选，再用全精度向量重排取前k个
+
+    Returns:
+        结果ID矩阵
+    """
+    candidates = top_k_ids(approx_queries, approx_base, k * factor)
+    results = []
+    for query, ids in zip(queries, candidates):
+        scores = base[ids] @ query
+        results.append(ids[np.argsort(-scores)[:k]])
+    return np.asarray(results)
+
+
+def run(args: argparse.Namespace):
+    """运行基准测试并打印结果表"""
+    if args.persona:
+        vectors = load_persona_vectors(args.persona)
+        source = f"persona={args.persona}"
+    else:
+        vectors = synthetic_vectors(args.count, args.dim)
+        source = f"synthetic count={args.count}"
+
+    n, dim = vectors.shape
+    if n <= args.top_k:
+        print(f"Not enough vectors ({n}) for top_k={args.top_k}")
+        return
+
+    # 查询：随机选取的向量加噪声（模拟与已有记忆相近的提问）
+    rng = np.random.default_rng(1)
+    picked = vectors[rng.choice(n, size=min(args.queries, n), replace=False)]
+    queries = normalize(picked + 0.3 * rng.normal(size=picked.shape).astype(np.float32) / np.sqrt(dim))
+    exact = top_k_ids(queries, vectors, args.top_k)
+
+    configs: List[Tuple[str, int, Callable[[], Tuple[np.ndarray, np.ndarray]]]] = [
+        ("float32", bytes_per_vector(dim, "float32"), lambda: (vectors, queries)),
+        ("float16", bytes_per_vector(dim, "float16"), lambda: (dequantize(*quantize(vectors, "float16")), queries)),
+        ("int8 (~IVF_SQ8)", bytes_per_vector(dim, "int8") + 4, lambda: (dequantize(*quantize(vectors, "int8")), queries)),
+    ]
+    if dim % args.pq_m == 0 and n >= 256:
+        def pq():
+            codebooks, codes = train_pq(vectors, args.pq_m)
+            return pq_decode(codebooks, codes), queries
+        configs.append((f"PQ m={args.pq_m}", args.pq_m, pq))
+    for d in args.dims:
+        if 0 < d < dim:
+            configs.append((f"truncate {d}", bytes_per_vector(d, "float32"), lambda d=d: (truncate(vectors, d), truncate(queries, d))))
+            configs.append((f"truncate {d} + float16", bytes_per_vector(d, "float16"),
+                            lambda d=d: (dequantize(*quantize(truncate(vectors, d), "float16")), truncate(queries, d))))
+
+    baseline = bytes_per_vector(dim, "float32")
+    print(f"Source: {source}, vectors={n}, dim={dim}, queries={len(queries)}, top_k={args.top_k}, rescore_factor={args.rescore_factor}")
+    print(f"{'config':<26}{'bytes/vec':>10}{'saving':>9}{'recall':>9}{'rescored':>10}{'time(s)':>9}")
+
+    for name, size, build in configs:
+        started = time.time()
+        approx_base, approx_queries = build()
+        recall = recall_at_k(exact, top_k_ids(approx_queries, approx_base, args.top_k))
+        rescored = recall_at_k(exact, rescored_ids(queries, vectors, approx_base, approx_queries, args.top_k, args.rescore_factor))
+        print(f"{name:<26}{size:>10}{baseline / size:>8.1f}x{recall:>9.3f}{rescored:>10.3f}{time.time() - started:>9.2f}")
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Benchmark reduced-precision vector storage against float32")
+    parser.add_argument("--persona", help="use the stored vectors of this persona instead of synthetic data")
+    parser.add_argument("--count", type=int, default=20000, help="number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=1024, help="dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--pq-m", type=int, default=64, help="PQ sub-quantizers (must divide dim)")
+    parser.add_argument("--dims", type=lambda s: [int(x) for x in s.split(",") if x], default=[512, 256],
+                        help="comma separated Matryoshka truncation dimensions")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -2,20 +2,59 @@
 自动记忆提取服务
 在对话结束后自动提取并保存重要记忆
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from fastapi import BackgroundTasks
+import json
+import re
 import threading
 
 from config import settings
-from models.schemas import MemoryCreate
 from services.memory_service import get_memory_service
-from core.llm_client import memory_extraction_llm_client
+from services.job_queue import job_queue
+from core.llm_client import llm_client, memory_extraction_llm_client
 from core.embedding_client import embedding_client
 from memory.graph_store import graph_store
 from memory.vector_store import vector_store
+from memory.dedup_index import memory_dedup_index
+from services.config_cache import config_cache
 from utils.logger import logger
-from utils.helpers import generate_id
+from utils.helpers import cosine_similarity
+
+
+# 记忆提取任务在任务队列中的类型
+EXTRACTION_JOB_KIND = "memory_extraction"
+
+# 明确包含值得记忆信息的模式（命中时无需LLM判断，直接提取）
+_EXPLICIT_MEMORY_PATTERN = re.compile(
+    r"记住|记一下|别忘|不要忘|remember|我叫|我的名字|生日|电话|手机|邮箱|地址|住在|"
+    r"喜欢|讨厌|不喜欢|爱吃|过敏|工作于|在.{0,6}工作|"
+    r"[\w.+-]+@[\w-]+\.[\w.]+|\d{7,}",
+    re.IGNORECASE
+)
+
+# 无信息量的寒暄/应答（完整匹配时直接跳过提取）
+_TRIVIAL_MESSAGE_PATTERN = re.compile(
+    r"^(你好|您好|嗨|哈喽|谢谢|多谢|谢了|好的|好|嗯+|哦+|啊+|行|可以|对|是的|没问题|再见|拜拜|晚安|早安|"
+    r"哈+|呵+|ok|okay|hi|hello|hey|thanks|thank you|bye|yes|no)[\s!！。.,，~？?]*$",
+    re.IGNORECASE
+)
+
+
+def _char_bigrams(text: str) -> set:
+    """
+    提取文本的字符二元组（适用于中文）
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        二元组集合
+    """
+    text = "".join(text.split()).lower()
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
 
 
 class AutoMemoryService:
@@ -29,52 +68,397 @@ class AutoMemoryService:
         self.memory_service = get_memory_service()
         # 记忆去重的相似度阈值（从配置中读取）
         self.dedup_similarity_threshold = settings.MEMORY_DEDUP_THRESHOLD
-        logger.info(f"AutoMemoryService initialized: dedup_threshold={self.dedup_similarity_threshold}")
+        # 提取前的本地预过滤规则
+        self.prefilter_enabled = settings.MEMORY_EXTRACTION_PREFILTER
+        self.prefilter_min_length = settings.MEMORY_EXTRACTION_MIN_LENGTH
+        self.novelty_threshold = settings.MEMORY_EXTRACTION_NOVELTY_THRESHOLD
+        logger.info(f"AutoMemoryService initialized: dedup_threshold={self.dedup_similarity_threshold}, prefilter={self.prefilter_enabled}")
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者）
+
+        Args:
+            config_key: 配置键（memory_extraction, memory_system）
+            value: 配置值
+        """
+        if config_key == "memory_extraction":
+            self.prefilter_enabled = value.get("prefilter", self.prefilter_enabled)
+            self.prefilter_min_length = value.get("min_length", self.prefilter_min_length)
+            self.novelty_threshold = value.get("novelty_threshold", self.novelty_threshold)
+        elif config_key == "memory_system":
+            self.dedup_similarity_threshold = value.get("dedup_threshold", self.dedup_similarity_threshold)
+        logger.info(f"AutoMemoryService reconfigured from '{config_key}': dedup_threshold={self.dedup_similarity_threshold}, prefilter={self.prefilter_enabled}")
+
+    async def _filter_duplicate_memories(
+        self,
+        contents: List[str],
+        persona_id: str
+    ) -> Tuple[List[int], List[Optional[List[float]]]]:
+        """
+        批量检查重复记忆
+
+        先用SimHash在本地拦截近乎原样的重复，其余记忆再一次批量向量化、
+        一次多向量检索完成与已有记忆的语义去重，最后在本批次内部两两比较去重
+
+        Args:
+            contents: 记忆内容列表
+            persona_id: 记忆体ID
+
+        Returns:
+            (保留的记忆下标列表, 与contents一一对应的向量列表，被本地拦截的记忆为None)
+        """
+        candidate_indices = list(range(len(contents)))
+        if memory_dedup_index.enabled:
+            candidate_indices = []
+            for i, content in enumerate(contents):
+                duplicate_id = await memory_dedup_index.find_duplicate(persona_id, content)
+                if duplicate_id:
+                    logger.info(f"Near-verbatim duplicate memory detected locally: duplicate_of={duplicate_id}, content='{content[:50]}...'")
+                    continue
+                candidate_indices.append(i)
+
+            if not candidate_indices:
+                return [], [None] * len(contents)
+
+        embeddings: List[Optional[List[float]]] = [None] * len(contents)
+        candidate_embeddings = await embedding_client.embed_batch([contents[i] for i in candidate_indices])
+        for i, embedding in zip(candidate_indices, candidate_embeddings):
+            embeddings[i] = embedding
+
+        # 与已有记忆去重
+        similar_groups = await vector_store.search_knowledge_batch(
+            embeddings=candidate_embeddings,
+            top_k=5,
+            persona_id=persona_id
+        )
 
-    async def _is_duplicate_memory(
+        kept_indices = []
+        for i, similar_memories in zip(candidate_indices, similar_groups):
+            content = contents[i]
+            best = max((memory.get('similarity', 0) for memory in similar_memories), default=0)
+            if best > self.dedup_similarity_threshold:
+                logger.info(f"Duplicate memory detected: similarity={best:.4f}, content='{content[:50]}...'")
+                continue
+
+            # 与本批次中已保留的记忆去重
+            duplicate_of = next(
+                (j for j in kept_indices
+                 if cosine_similarity(embeddings[i], embeddings[j]) > self.dedup_similarity_threshold),
+                None
+            )
+            if duplicate_of is not None:
+                logger.info(f"Duplicate memory within batch: content='{content[:50]}...', duplicate_of='{contents[duplicate_of][:50]}...'")
+                continue
+
+            kept_indices.append(i)
+
+        return kept_indices, embeddings
+
+    async def _save_extracted_memories(
         self,
-        content: str,
+        extracted_memories: List[Dict[str, Any]],
         persona_id: str
+    ) -> List[str]:
+        """
+        去重并批量保存提取的记忆
+
+        Args:
+            extracted_memories: LLM提取的记忆列表
+            persona_id: 记忆体ID
+
+        Returns:
+            保存的记忆ID列表
+        """
+        memories = []
+        for memory_content in extracted_memories:
+            content = (memory_content.get("content") or "").strip()
+            if not content:
+                continue
+
+            # 解析event_time
+            event_time_str = memory_content.get("event_time")
+            event_time = None
+            if event_time_str:
+                try:
+                    event_time = datetime.fromisoformat(event_time_str)
+                except ValueError:
+                    logger.warning(f"Failed to parse event_time: {event_time_str}")
+
+            memories.append({"content": content, "event_time": event_time})
+
+        if not memories:
+            return []
+
+        kept_indices, embeddings = await self._filter_duplicate_memories(
+            [memory["content"] for memory in memories],
+            persona_id
+        )
+        if not kept_indices:
+            return []
+
+        saved_memory_ids = await self.memory_service.create_memories_batch(
+            persona_id=persona_id,
+            memories=[memories[i] for i in kept_indices],
+            embeddings=[embeddings[i] for i in kept_indices]
+        )
+
+        for memory_id, i in zip(saved_memory_ids, kept_indices):
+            event_time = memories[i]["event_time"]
+            event_time_str = event_time.isoformat() if event_time else "None"
+            logger.info(f"Auto-saved memory: id={memory_id}, persona_id={persona_id}, event_time={event_time_str}")
+
+        return saved_memory_ids
+
+    def _prefilter_extraction(
+        self,
+        user_message: str,
+        injected_memories: List[Dict[str, Any]]
+    ) -> Optional[bool]:
+        """
+        本地预过滤：用廉价的启发式规则决定是否需要LLM判断
+
+        Args:
+            user_message: 用户消息
+            injected_memories: 已注入的记忆
+
+        Returns:
+            True表示直接提取，False表示直接跳过，None表示需要LLM判断
+        """
+        if not self.prefilter_enabled:
+            return None
+
+        text = (user_message or "").strip()
+
+        # 1. 明确包含个人信息/偏好/记忆请求
+        if _EXPLICIT_MEMORY_PATTERN.search(text):
+            return True
+
+        # 2. 过短或纯寒暄
+        if len(text) < self.prefilter_min_length or _TRIVIAL_MESSAGE_PATTERN.match(text):
+            return False
+
+        # 3. 新颖度检查：用户消息几乎完全被已注入的记忆覆盖
+        message_bigrams = _char_bigrams(text)
+        if message_bigrams and injected_memories:
+            for memory in injected_memories:
+                memory_bigrams = _char_bigrams(memory.get("content", "") or "")
+                overlap = len(message_bigrams & memory_bigrams) / len(message_bigrams)
+                if overlap >= self.novelty_threshold:
+                    return False
+
+        return None
+
+    async def should_extract_memory(
+        self,
+        user_message: str,
+        assistant_response: str,
+        injected_memories: List[Dict[str, Any]]
     ) -> bool:
         """
-        检查是否为重复记忆
+        结合已注入的记忆，使用LLM判断是否需要提取新记忆
 
         Args:
-            content: 记忆内容
+            user_message: 用户消息
+            assistant_response: 助手响应
+            injected_memories: 已注入到system prompt中的记忆
+
+        Returns:
+            是否需要提取记忆
+        """
+        # 构建已有记忆的摘要
+        if injected_memories:
+            memory_lines = []
+            for i, memory in enumerate(injected_memories, 1):
+                content = memory.get('content', '')
+                event_time = memory.get('event_time')
+                time_str = f" ({event_time})" if event_time else ""
+                memory_lines.append(f"{i}. {content}{time_str}")
+            memory_summary = "\n".join(memory_lines)
+        else:
+            memory_summary = "（无）"
+
+        # 构建判断提示词
+        judgment_prompt = f"""请判断以下最新对话是否包含值得记住的新信息。
+
+【已有记忆】
+{memory_summary}
+
+【最新对话】
+用户: {user_message}
+助手: {assistant_response}
+
+【判断标准】
+1. 最新对话中是否包含用户的个人信息（如姓名、电话、邮箱、地址、生日等）
+2. 最新对话中是否包含用户的偏好（如喜欢/不喜欢的东西）
+3. 最新对话中是否包含用户明确要求记住的信息
+4. 最新对话中的信息是否与已有记忆有冲突、补充或更新
+5. 最新对话中是否包含对未来对话有帮助的关键信息
+
+【回答格式】
+请以JSON格式回答，包含以下字段：
+{{
+  "should_extract": true/false,
+  "reason": "简短说明原因（1-2句话）"
+}}
+
+请只返回JSON，不要有其他内容。"""
+
+        # 使用低温度、少token的快速判断
+        try:
+            response = await llm_client.chat_completion(
+                messages=[{"role": "user", "content": judgment_prompt}],
+                temperature=0.1,
+                max_tokens=100,
+                stream=False,
+                response_format={"type": "json_object"}
+            )
+
+            result_text = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+            # 解析JSON结果
+            result = json.loads(result_text)
+            should_extract = result.get("should_extract", False)
+            reason = result.get("reason", "")
+
+            logger.info(f"Memory extraction judgment: should_extract={should_extract}, reason='{reason}'")
+            return should_extract
+
+        except Exception as e:
+            logger.error(f"Error in memory extraction judgment: {e}")
+            # 出错时保守处理，仍然提取
+            return True
+
+    async def judge_and_extract_memories(
+        self,
+        messages: List[Dict[str, str]],
+        persona_id: str,
+        auto_save_enabled: bool = True,
+        user_message: Optional[str] = None,
+        assistant_response: Optional[str] = None,
+        injected_memories: Optional[List[Dict[str, Any]]] = None,
+        raise_errors: bool = False,
+        max_messages: Optional[int] = 5
+    ) -> List[str]:
+        """
+        判断并提取记忆（作为一个后台任务整体执行，不占用响应路径）
+
+        先经过本地预过滤，必要时再调用LLM判断，最后执行记忆提取
+
+        Args:
+            messages: 对话消息列表
             persona_id: 记忆体ID
+            auto_save_enabled: 是否启用自动保存
+            user_message: 用户消息（用于判断）
+            assistant_response: 助手响应（用于判断）
+            injected_memories: 已注入的记忆（用于判断）
+            raise_errors: 出错时是否抛出异常（任务队列据此重试）
+            max_messages: 提取时最多使用最近多少条消息（None表示全部）
 
         Returns:
-            是否为重复记忆
+            保存的记忆ID列表
         """
+        if not auto_save_enabled:
+            logger.debug("Auto memory save is disabled")
+            return []
+
         try:
-            # 转换为向量
-            embedding = await embedding_client.embed(content)
-
-            # 检索相似记忆
-            similar_memories = await vector_store.search_knowledge(
-                embedding=embedding,
-                top_k=5,
-                persona_id=persona_id
+            if user_message and assistant_response is not None:
+                should_extract = self._prefilter_extraction(user_message, injected_memories or [])
+                if should_extract is None:
+                    should_extract = await self.should_extract_memory(
+                        user_message=user_message,
+                        assistant_response=assistant_response,
+                        injected_memories=injected_memories or []
+                    )
+                else:
+                    logger.info(f"Memory extraction prefilter decided: should_extract={should_extract} (persona={persona_id})")
+
+                if not should_extract:
+                    logger.info(f"Skipping memory extraction (no new information) for persona={persona_id}")
+                    return []
+            else:
+                # 如果没有用户消息或助手响应，保守处理，仍然提取
+                logger.info(f"Missing user_message or assistant_response, extracting memory (persona={persona_id})")
+
+            return await self.extract_and_save_memories(
+                messages=messages,
+                persona_id=persona_id,
+                auto_save_enabled=auto_save_enabled,
+                raise_errors=raise_errors,
+                max_messages=max_messages
             )
 
-            # 如果有相似度超过阈值的记忆，认为是重复
-            for memory in similar_memories:
-                similarity = memory.get('similarity', 0)
-                if similarity > self.dedup_similarity_threshold:
-                    logger.info(f"Duplicate memory detected: similarity={similarity:.4f}, content='{content[:50]}...'")
-                    return True
+        except Exception as e:
+            logger.error(f"Error in memory judgment and extraction: {e}")
+            if raise_errors:
+                raise
+            return []
 
-            return False
+    async def enqueue_extraction(
+        self,
+        messages: List[Dict[str, str]],
+        persona_id: str,
+        auto_save_enabled: bool = True,
+        user_message: Optional[str] = None,
+        assistant_response: Optional[str] = None,
+        injected_memories: Optional[List[Dict[str, Any]]] = None,
+        max_messages: Optional[int] = 5
+    ) -> Optional[str]:
+        """
+        将记忆判断和提取提交到持久化任务队列
+
+        同一记忆体的提取任务串行执行，队列积压超过上限时丢弃新任务
 
+        Args:
+            messages: 对话消息列表
+            persona_id: 记忆体ID
+            auto_save_enabled: 是否启用自动保存
+            user_message: 用户消息（用于判断）
+            assistant_response: 助手响应（用于判断）
+            injected_memories: 已注入的记忆（用于判断）
+            max_messages: 提取时最多使用最近多少条消息（None表示全部）
+
+        Returns:
+            任务ID；未启用自动保存或任务被丢弃时返回None
+        """
+        if not auto_save_enabled:
+            logger.debug("Auto memory save is disabled")
+            return None
+
+        # 判断只用到记忆的内容和时间，其余字段不写入任务参数
+        trimmed_memories = [
+            {
+                "content": memory.get("content", ""),
+                "event_time": str(memory["event_time"]) if memory.get("event_time") else None
+            }
+            for memory in (injected_memories or [])
+        ]
+
+        try:
+            return await job_queue.enqueue(
+                kind=EXTRACTION_JOB_KIND,
+                payload={
+                    "messages": messages,
+                    "persona_id": persona_id,
+                    "user_message": user_message,
+                    "assistant_response": assistant_response,
+                    "injected_memories": trimmed_memories,
+                    "max_messages": max_messages,
+                },
+                serial_key=persona_id
+            )
         except Exception as e:
-            logger.warning(f"Error checking duplicate memory: {e}")
-            return False
+            logger.error(f"Failed to enqueue memory extraction for persona={persona_id}: {e}")
+            return None
 
     async def extract_and_save_memories(
         self,
         messages: List[Dict[str, str]],
         persona_id: str,
-        auto_save_enabled: bool = True
+        auto_save_enabled: bool = True,
+        raise_errors: bool = False,
+        max_messages: Optional[int] = 5
     ) -> List[str]:
         """
         从对话中自动提取并保存记忆
@@ -83,6 +467,8 @@ class AutoMemoryService:
             messages: 对话消息列表
             persona_id: 记忆体ID
             auto_save_enabled: 是否启用自动保存
+            raise_errors: 出错时是否抛出异常（任务队列据此重试）
+            max_messages: 提取时最多使用最近多少条消息（None表示全部）
 
         Returns:
             保存的记忆ID列表
@@ -96,7 +482,7 @@ class AutoMemoryService:
             logger.info(f"Starting auto memory extraction for persona={persona_id}")
 
             # 构建提取提示词
-            extraction_prompt = self._build_extraction_prompt(messages)
+            extraction_prompt = self._build_extraction_prompt(messages, max_messages=max_messages)
 
             # 打印提取提示词
             logger.info(f"Memory extraction prompt (persona={persona_id}):\n{extraction_prompt}")
@@ -144,49 +530,8 @@ class AutoMemoryService:
                 for i, relation in enumerate(extracted_relations, 1):
                     logger.info(f"  {i}. {relation.get('from', '')} --{relation.get('type', '')}--> {relation.get('to', '')}")
 
-            # 保存提取的记忆
-            saved_memory_ids = []
-            for memory_content in extracted_memories:
-                try:
-                    content = memory_content.get("content", "")
-
-                    # 检查是否为重复记忆
-                    is_duplicate = await self._is_duplicate_memory(content, persona_id)
-                    if is_duplicate:
-                        logger.info(f"Skipping duplicate memory: {content[:50]}...")
-                        continue
-
-                    vector_id = generate_id()
-
-                    # 解析event_time
-                    event_time_str = memory_content.get("event_time")
-                    event_time = None
-                    if event_time_str:
-                        try:
-                            event_time = datetime.fromisoformat(event_time_str)
-                        except ValueError:
-                            logger.warning(f"Failed to parse event_time: {event_time_str}")
-
-                    memory_data = MemoryCreate(
-                        persona_id=persona_id,
-                        vector_id=vector_id,
-                        type="long_term",
-                        content=content
-                    )
-
-                    memory = await self.memory_service.create_memory(
-                        memory_data=memory_data,
-                        content=content,
-                        event_time=event_time  # 传递event_time
-                    )
-
-                    if memory:
-                        saved_memory_ids.append(memory.id)
-                        event_time_str = event_time.isoformat() if event_time else "None"
-                        logger.info(f"Auto-saved memory: id={memory.id}, persona_id={persona_id}, event_time={event_time_str}")
-
-                except Exception as e:
-                    logger.error(f"Failed to save auto-extracted memory: {e}")
+            # 批量去重并保存提取的记忆
+            saved_memory_ids = await self._save_extracted_memories(extracted_memories, persona_id)
 
             logger.info(f"Auto-saved {len(saved_memory_ids)} memories from conversation")
 
@@ -222,21 +567,29 @@ class AutoMemoryService:
 
         except Exception as e:
             logger.error(f"Error in auto memory extraction: {e}")
+            if raise_errors:
+                raise
             return []
 
-    def _build_extraction_prompt(self, messages: List[Dict[str, str]]) -> str:
+    def _build_extraction_prompt(
+        self,
+        messages: List[Dict[str, str]],
+        max_messages: Optional[int] = 5
+    ) -> str:
         """
         构建记忆提取提示词
 
         Args:
             messages: 对话消息列表
+            max_messages: 最多使用最近多少条消息（None表示使用全部消息，用于按批提取未处理的轮次）
 
         Returns:
             提取提示词
         """
         # 提取完整对话（包括用户和助手）
         conversation_lines = []
-        for msg in messages[-5:]:  # 最近5条消息（包括用户和助手）
+        recent_messages = messages[-max_messages:] if max_messages else messages
+        for msg in recent_messages:
             role = msg.get("role", "")
             content = msg.get("content", "")
             if role == "user":
@@ -269,8 +622,6 @@ class AutoMemoryService:
         Returns:
             提取结果字典，包含memories、entities、relations
         """
-        import json
-
         try:
             # 尝试直接解析JSON
             data = json.loads(result)
@@ -348,3 +699,33 @@ class AutoMemoryServiceProxy:
 
 
 auto_memory_service = AutoMemoryServiceProxy()
+config_cache.subscribe(auto_memory_service.apply_configuration, ["memory_extraction", "memory_system"])
+
+
+async def _run_extraction_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    任务队列中记忆提取任务的处理函数
+
+    Args:
+        payload: 任务参数
+
+    Returns:
+        任务结果
+    """
+    saved_memory_ids = await get_auto_memory_service().judge_and_extract_memories(
+        messages=payload.get("messages", []),
+        persona_id=payload["persona_id"],
+        user_message=payload.get("user_message"),
+        assistant_response=payload.get("assistant_response"),
+        injected_memories=payload.get("injected_memories"),
+        raise_errors=True,
+        max_messages=payload.get("max_messages", 5)
+    )
+    return {"saved_memory_ids": saved_memory_ids}
+
+
+job_queue.register_handler(
+    EXTRACTION_JOB_KIND,
+    _run_extraction_job,
+    max_pending=settings.MEMORY_EXTRACTION_QUEUE_MAX_DEPTH
+)
@@ -0,0 +1,257 @@
+"""
+配置缓存
+启动时将配置表整体加载到内存，读取配置不再访问数据库；
+经配置接口写入时递增配置版本号、刷新缓存并通知订阅者，其他工作进程定期比较版本号感知变化
+"""
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple, FrozenSet
+from datetime import datetime
+import asyncio
+import copy
+import json
+import threading
+
+from config import settings, get_default_configurations
+from models.database import Configuration, ConfigurationVersion, SessionLocal, async_read_session
+from models.db_writer import db_writer
+from repositories.configuration_repository import ConfigurationRepository
+from utils.logger import logger
+from utils.helpers import generate_id
+
+
+# 订阅者：接收 (配置键, 新配置值)，配置被删除时配置值为默认值
+ConfigSubscriber = Callable[[str, Dict[str, Any]], None]
+
+
+class ConfigurationCache:
+    """
+    配置缓存
+
+    缓存以 (user_id, config_key) 为键保存解析后的配置值，读取时返回副本。
+    配置表上的每次写入都在同一事务中递增 configuration_version 表中的版本号；
+    本进程写入后立即刷新，其他进程的写入由定期的版本号检查（一次单行查询）发现后整体重新加载。
+    刷新后只通知值发生变化的系统级配置键的订阅者
+    """
+
+    def __init__(self, poll_interval: float = settings.CONFIG_CACHE_POLL_INTERVAL):
+        """
+        初始化配置缓存
+
+        Args:
+            poll_interval: 检查配置版本号的间隔（秒）
+        """
+        self.poll_interval = max(0.1, poll_interval)
+        self._values: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self._subscribers: List[Tuple[Optional[FrozenSet[str]], ConfigSubscriber]] = []
+        self._task: Optional[asyncio.Task] = None
+
+        logger.info(f"ConfigurationCache initialized: poll_interval={self.poll_interval}s")
+
+    @property
+    def version(self) -> Optional[int]:
+        """当前缓存对应的配置版本号（尚未加载时为None）"""
+        return self._version
+
+    def get(self, config_key: str, user_id: str = "system") -> Optional[Dict[str, Any]]:
+        """
+        获取配置（不访问数据库，首次调用时加载）
+
+        Args:
+            config_key: 配置键
+            user_id: 用户ID
+
+        Returns:
+            配置值的副本；数据库中不存在时返回系统默认值，没有默认值时返回None
+        """
+        if self._version is None:
+            self.load()
+
+        value = self._values.get((user_id, config_key))
+        if value is not None:
+            return copy.deepcopy(value)
+
+        if user_id == "system":
+            default_configs = get_default_configurations()
+            if config_key in default_configs:
+                return default_configs[config_key]["value"]
+        return None
+
+    def subscribe(self, callback: ConfigSubscriber, keys: Optional[Iterable[str]] = None):
+        """
+        订阅配置变化（首次加载时也会收到数据库中的配置）
+
+        Args:
+            callback: 变化时调用的函数，接收配置键和新配置值
+            keys: 关注的系统级配置键，为空时关注全部
+        """
+        self._subscribers.append((frozenset(keys) if keys is not None else None, callback))
+        # 订阅晚于加载时补发当前配置
+        if self._version is not None:
+            for config_key in (keys or [key for user_id, key in self._values if user_id == "system"]):
+                self._notify_one(callback, config_key, self.get(config_key) or {})
+
+    def load(self):
+        """从数据库同步加载全部配置（启动时调用）"""
+        db = SessionLocal()
+        try:
+            rows = db.query(Configuration).all()
+            version_row = db.get(ConfigurationVersion, 1)
+            version = version_row.version if version_row else 0
+        finally:
+            db.close()
+        self._replace(rows, version)
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        版本号变化时重新加载全部配置
+
+        Args:
+            force: 是否忽略版本号强制重新加载
+
+        Returns:
+            是否重新加载
+        """
+        async with async_read_session() as db:
+            configs = ConfigurationRepository(db)
+            version = await configs.get_version()
+            if version == self._version and not force:
+                return False
+            rows = await configs.list()
+        self._replace(rows, version)
+        return True
+
+    async def set(self, config_key: str, config_value: Dict[str, Any], user_id: str = "system") -> bool:
+        """
+        写入配置（立即提交并递增版本号），随后刷新缓存并通知订阅者
+
+        Args:
+            config_key: 配置键
+            config_value: 配置值
+            user_id: 用户ID
+
+        Returns:
+            是否成功
+        """
+        async def operation(db):
+            configs = ConfigurationRepository(db)
+            config = await configs.get(user_id, config_key)
+            if config:
+                config.set_value(config_value)
+                config.updated_at = datetime.now()  # 使用本地时间（北京时间）
+                await db.flush()
+            else:
+                default_configs = get_default_configurations()
+                await configs.add(Configuration(
+                    id=generate_id(),
+                    user_id=user_id,
+                    config_key=config_key,
+                    config_value=json.dumps(config_value),
+                    description=default_configs.get(config_key, {}).get("description", ""),
+                    created_at=datetime.now(),  # 使用本地时间（北京时间）
+                    updated_at=datetime.now()  # 使用本地时间（北京时间）
+                ))
+            return await configs.bump_version()
+
+        try:
+            # 经写入队列立即提交：请求的工作单元在响应开始时才提交，刷新缓存时读不到未提交的写入
+            version = await db_writer.submit(operation)
+        except Exception as e:
+            logger.error(f"Failed to update configuration '{config_key}': {e}")
+            return False
+
+        await self.refresh()
+        logger.info(f"Updated configuration: {config_key} (version={version})")
+        return True
+
+    def start(self):
+        """启动版本号检查"""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._poll_loop())
+        logger.info(f"Configuration version polling started: interval={self.poll_interval}s")
+
+    async def stop(self):
+        """停止版本号检查"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _poll_loop(self):
+        """定期检查配置版本号"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await self.refresh():
+                    logger.info(f"Reloaded configurations changed by another process: version={self._version}")
+            except Exception as e:
+                logger.error(f"Failed to refresh configurations: {e}")
+
+    def _replace(self, rows: List[Configuration], version: int):
+        """
+        替换缓存内容并通知值发生变化的配置键
+
+        Args:
+            rows: 配置表的全部记录
+            version: 对应的版本号
+        """
+        values = {}
+        for row in rows:
+            try:
+                values[(row.user_id, row.config_key)] = row.get_value()
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Skipping unreadable configuration '{row.config_key}': {e}")
+
+        with self._lock:
+            previous = self._values
+            self._values = values
+            self._version = version
+
+        changed = sorted(
+            config_key for user_id, config_key in set(previous) | set(values)
+            if user_id == "system" and previous.get((user_id, config_key)) != values.get((user_id, config_key))
+        )
+        for config_key in changed:
+            value = self.get(config_key) or {}
+            for keys, callback in self._subscribers:
+                if keys is None or config_key in keys:
+                    self._notify_one(callback, config_key, value)
+
+        if changed:
+            logger.debug(f"Configuration cache replaced: version={version}, changed={changed}")
+
+    @staticmethod
+    def _notify_one(callback: ConfigSubscriber, config_key: str, value: Dict[str, Any]):
+        """调用单个订阅者（订阅者的异常不影响其他订阅者）"""
+        try:
+            callback(config_key, copy.deepcopy(value))
+        except Exception as e:
+            logger.error(f"Configuration subscriber failed for '{config_key}': {e}")
+
+
+# 全局配置缓存实例 - 使用懒加载
+_config_cache = None
+_config_cache_lock = threading.Lock()
+
+
+def get_config_cache() -> ConfigurationCache:
+    """获取配置缓存实例（线程安全的懒加载）"""
+    global _config_cache
+    if _config_cache is None:
+        with _config_cache_lock:
+            if _config_cache is None:  # 双重检查锁定
+                _config_cache = ConfigurationCache()
+    return _config_cache
+
+
+# 向后兼容的属性访问器
+class ConfigurationCacheProxy:
+    """配置缓存代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_config_cache(), name)
+
+
+config_cache = ConfigurationCacheProxy()
@@ -4,7 +4,8 @@
 from typing import Dict, Any, Optional
 from datetime import datetime, timezone
 
-from models.database import SessionLocal, Configuration
+from models.database import Configuration, async_session_scope, async_read_session
+from repositories.configuration_repository import ConfigurationRepository
 from models.schemas import ConfigurationCreate, ConfigurationResponse
 from utils.logger import logger
 from utils.helpers import generate_id
@@ -17,8 +18,7 @@ class ConfigService:
     """
     
     def __init__(self):
-        """初始化配置服务"""
-        self.db = SessionLocal()
+        """初始化配置服务（不持有长期会话，写操作使用当前工作单元的会话，查询使用短生命周期会话）"""
         logger.info("ConfigService initialized")
     
     async def create_config(
@@ -35,34 +35,36 @@ class ConfigService:
             创建的配置对象
         """
         try:
-            # 检查配置是否已存在
-            existing_config = self.db.query(Configuration).filter(
-                Configuration.user_id == config_data.user_id,
-                Configuration.config_key == config_data.config_key
-            ).first()
-            
-            if existing_config:
-                logger.warning(f"Configuration '{config_data.config_key}' already exists for user '{config_data.user_id}'")
-                return None
-            
-            # 创建新配置
-            config = Configuration(
-                id=generate_id(),
-                user_id=config_data.user_id,
-                config_key=config_data.config_key,
-                config_value=config_data.config_value,
-                description=config_data.description,
-            )
-            
-            self.db.add(config)
-            self.db.commit()
-            self.db.refresh(config)
+            async with async_session_scope() as db:
+                configs = ConfigurationRepository(db)
+
+                # 检查配置是否已存在
+                existing_config = await configs.get(config_data.user_id, config_data.config_key)
+
+                if existing_config:
+                    logger.warning(f"Configuration '{config_data.config_key}' already exists for user '{config_data.user_id}'")
+                    return None
+
+                # 创建新配置
+                config = Configuration(
+                    id=generate_id(),
+                    user_id=config_data.user_id,
+                    config_key=config_data.config_key,
+                    config_value=config_data.config_value,
+                    description=config_data.description,
+                )
+
+                try:
+                    await configs.add(config)
+                    await configs.bump_version()
+                except Exception:
+                    await db.rollback()
+                    raise
             
             logger.info(f"Created config: key={config_data.config_key}, user_id={config_data.user_id}")
             return config
             
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to create config: {e}")
             return None
     
@@ -82,12 +84,8 @@ class ConfigService:
             配置对象
         """
         try:
-            config = self.db.query(Configuration).filter(
-                Configuration.user_id == user_id,
-                Configuration.config_key == config_key
-            ).first()
-            
-            return config
+            async with async_read_session() as db:
+                return await ConfigurationRepository(db).get(user_id, config_key)
             
         except Exception as e:
             logger.error(f"Failed to get config: {e}")
@@ -111,33 +109,33 @@ class ConfigService:
             更新后的配置对象
         """
         try:
-            config = self.db.query(Configuration).filter(
-                Configuration.user_id == user_id,
-                Configuration.config_key == config_key
-            ).first()
-            
-            if not config:
-                # 创建新配置
-                config = Configuration(
-                    id=generate_id(),
-                    user_id=user_id,
-                    config_key=config_key,
-                    config_value=config_value,
-                )
-                self.db.add(config)
-            else:
-                # 更新现有配置
-                config.set_value(config_value)
-                config.updated_at = datetime.now()  # 使用本地时间（北京时间）
+            async with async_session_scope() as db:
+                configs = ConfigurationRepository(db)
+                config = await configs.get(user_id, config_key)
 
-            self.db.commit()
-            self.db.refresh(config)
+                try:
+                    if not config:
+                        # 创建新配置
+                        config = await configs.add(Configuration(
+                            id=generate_id(),
+                            user_id=user_id,
+                            config_key=config_key,
+                            config_value=config_value,
+                        ))
+                    else:
+                        # 更新现有配置
+                        config.set_value(config_value)
+                        config.updated_at = datetime.now()  # 使用本地时间（北京时间）
+                        await db.flush()
+                    await configs.bump_version()
+                except Exception:
+                    await db.rollback()
+                    raise
             
             logger.info(f"Updated config: key={config_key}, user_id={user_id}")
             return config
             
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to update config: {e}")
             return None
     
@@ -157,22 +155,24 @@ class ConfigService:
             是否成功
         """
         try:
-            config = self.db.query(Configuration).filter(
-                Configuration.user_id == user_id,
-                Configuration.config_key == config_key
-            ).first()
-            
-            if not config:
-                return False
-            
-            self.db.delete(config)
-            self.db.commit()
+            async with async_session_scope() as db:
+                configs = ConfigurationRepository(db)
+                config = await configs.get(user_id, config_key)
+
+                if not config:
+                    return False
+
+                try:
+                    await configs.delete(config.id)
+                    await configs.bump_version()
+                except Exception:
+                    await db.rollback()
+                    raise
             
             logger.info(f"Deleted config: key={config_key}, user_id={user_id}")
             return True
             
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to delete config: {e}")
             return False
     
@@ -190,9 +190,8 @@ class ConfigService:
             配置列表
         """
         try:
-            configs = self.db.query(Configuration).filter(
-                Configuration.user_id == user_id
-            ).all()
+            async with async_read_session() as db:
+                configs = await ConfigurationRepository(db).list(user_id)
             
             logger.debug(f"Listed {len(configs)} configs for user {user_id}")
             return configs
@@ -202,8 +201,7 @@ class ConfigService:
             return []
     
     def close(self):
-        """关闭数据库连接"""
-        self.db.close()
+        """关闭服务（不持有长期会话）"""
         logger.info("ConfigService closed")
 
 
@@ -0,0 +1,430 @@
+"""
+记忆合并服务
+离线聚类记忆体的记忆向量，将近重复的记忆合并为一条规范记忆
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+import asyncio
+import threading
+
+import numpy as np
+from sqlalchemy import func
+
+from config import settings
+from models.database import SessionLocal, Memory, Persona, StoreOutboxEntry, async_read_session
+from models.db_writer import db_writer
+from repositories.memory_repository import MemoryRepository
+from repositories.outbox_repository import OutboxRepository
+from memory.vector_store import vector_store
+from memory.dedup_index import memory_dedup_index
+from core.memory_engine import memory_context_renderer
+from services.config_cache import config_cache
+from services.job_queue import job_queue
+from services.store_outbox import store_outbox, vector_delete_entry, entity_release_entry
+from utils.logger import logger
+
+
+# 记忆合并任务在任务队列中的类型
+CONSOLIDATION_JOB_KIND = "memory_consolidation"
+
+# 每个SQL事务提交的簇数量（提交后即为已完成的进度，中断后重新聚类即可继续）
+_CLUSTERS_PER_COMMIT = 100
+
+# 分块计算相似度时每块矩阵的最大元素数（float32约16MB）
+_SIMILARITY_BLOCK_ELEMENTS = 4 * 1024 * 1024
+
+
+def _cluster_vectors(vectors: List[List[float]], threshold: float) -> List[Tuple[int, List[int]]]:
+    """
+    按与簇中心的余弦相似度做阈值聚类（在线程中执行）
+
+    向量已按重要性排序，依次作为簇中心吸收尚未分配、相似度不低于阈值的向量。
+    一次计算一块簇中心与全部向量的相似度（一次矩阵乘法），块内的簇中心按顺序处理
+
+    Args:
+        vectors: 已按重要性排序的向量列表
+        threshold: 相似度阈值
+
+    Returns:
+        [(簇中心下标, 被合并的下标列表)]，只包含有成员的簇
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+
+    count = len(matrix)
+    block_size = max(1, _SIMILARITY_BLOCK_ELEMENTS // count)
+    assigned = np.zeros(count, dtype=bool)
+    groups = []
+
+    for block_start in range(0, count, block_size):
+        leaders = np.arange(block_start, min(block_start + block_size, count))
+        leaders = leaders[~assigned[leaders]]
+        if leaders.size == 0:
+            continue
+
+        block = matrix[leaders] @ matrix.T
+        for row, leader in enumerate(leaders):
+            if assigned[leader]:
+                continue
+            assigned[leader] = True
+            members = np.nonzero((block[row] >= threshold) & ~assigned)[0]
+            if members.size:
+                assigned[members] = True
+                groups.append((int(leader), members.tolist()))
+
+    return groups
+
+
+class ConsolidationService:
+    """
+    记忆合并服务
+
+    按与簇中心的余弦相似度做阈值聚类：记忆按重要性（访问次数多、创建时间早）排序，
+    依次作为簇中心吸收相似度不低于阈值的其余记忆。簇中心即规范记忆，
+    合并后继承整个簇的访问次数、最早的事件时间和创建时间。
+    合并过程是幂等的：中断后重新执行会对剩余记忆重新聚类
+    """
+
+    def __init__(self):
+        """初始化记忆合并服务"""
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self.threshold = settings.MEMORY_CONSOLIDATION_THRESHOLD
+        logger.info(f"ConsolidationService initialized: threshold={self.threshold}")
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者，只影响之后生成的合并计划）
+
+        Args:
+            config_key: 配置键（memory_system）
+            value: 配置值
+        """
+        self.threshold = value.get("consolidation_threshold", self.threshold)
+
+    async def plan(
+        self,
+        persona_id: str,
+        threshold: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        对记忆体的记忆聚类，生成合并计划
+
+        Args:
+            persona_id: 记忆体ID
+            threshold: 相似度阈值（默认使用配置）
+
+        Returns:
+            合并计划：clusters为 [{"canonical": 规范记忆, "members": 被合并的记忆列表}]
+        """
+        threshold = threshold if threshold is not None else self.threshold
+
+        async with async_read_session() as db:
+            rows = await MemoryRepository(db).list_by_persona(persona_id)
+
+        memories = [
+            {
+                "id": row.id,
+                "vector_id": row.vector_id,
+                "content": row.content,
+                "access_count": row.access_count or 0,
+                "created_at": row.created_at,
+                "event_time": row.event_time,
+                "entity_id": row.entity_id,
+            }
+            for row in rows
+        ]
+
+        embeddings = await vector_store.get_embeddings([memory["vector_id"] for memory in memories])
+
+        # 缺少向量的记忆不参与聚类
+        memories = [memory for memory in memories if memory["vector_id"] in embeddings]
+
+        # 按重要性排序：访问次数多的优先，其次创建时间早的优先
+        memories.sort(key=lambda m: (-m["access_count"], m["created_at"] or datetime.min, m["id"]))
+
+        clusters = []
+        if len(memories) > 1:
+            # 聚类是O(n²·d)的计算，放到线程中执行，不阻塞事件循环
+            groups = await asyncio.to_thread(
+                _cluster_vectors,
+                [embeddings[memory["vector_id"]] for memory in memories],
+                threshold
+            )
+            clusters = [
+                {"canonical": memories[leader], "members": [memories[i] for i in members]}
+                for leader, members in groups
+            ]
+
+        merged_count = sum(len(cluster["members"]) for cluster in clusters)
+        logger.info(
+            f"Consolidation plan for persona={persona_id}: memories={len(memories)}, "
+            f"clusters={len(clusters)}, to_merge={merged_count}, threshold={threshold}"
+        )
+
+        return {
+            "persona_id": persona_id,
+            "threshold": threshold,
+            "total_memories": len(memories),
+            "clusters": clusters,
+        }
+
+    async def dry_run(
+        self,
+        persona_id: str,
+        threshold: Optional[float] = None,
+        sample_size: int = 10
+    ) -> Dict[str, Any]:
+        """
+        预览合并效果，不修改任何数据
+
+        Args:
+            persona_id: 记忆体ID
+            threshold: 相似度阈值（默认使用配置）
+            sample_size: 返回的示例簇数量
+
+        Returns:
+            预计节省的记忆数、向量和存储空间
+        """
+        plan = await self.plan(persona_id, threshold)
+        members = [member for cluster in plan["clusters"] for member in cluster["members"]]
+
+        return {
+            "persona_id": persona_id,
+            "dry_run": True,
+            "threshold": plan["threshold"],
+            "total_memories": plan["total_memories"],
+            "clusters": len(plan["clusters"]),
+            "memories_to_merge": len(members),
+            "projected_memories": plan["total_memories"] - len(members),
+            "projected_vector_bytes_saved": len(members) * settings.EMBEDDING_DIMENSIONS * 4,
+            "projected_content_bytes_saved": sum(len((member["content"] or "").encode("utf-8")) for member in members),
+            "sample_clusters": [
+                {
+                    "canonical": {"id": cluster["canonical"]["id"], "content": cluster["canonical"]["content"]},
+                    "members": [{"id": member["id"], "content": member["content"]} for member in cluster["members"]],
+                }
+                for cluster in plan["clusters"][:sample_size]
+            ],
+        }
+
+    async def consolidate(
+        self,
+        persona_id: str,
+        threshold: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        执行合并
+
+        每批簇经写入队列在一个SQL事务中更新规范记忆、删除被合并的记忆并写入发件箱，提交后再执行发件箱中的向量和实体删除
+
+        Args:
+            persona_id: 记忆体ID
+            threshold: 相似度阈值（默认使用配置）
+
+        Returns:
+            合并结果统计
+        """
+        plan = await self.plan(persona_id, threshold)
+        clusters = plan["clusters"]
+
+        merged_total = 0
+        for start in range(0, len(clusters), _CLUSTERS_PER_COMMIT):
+            batch = clusters[start:start + _CLUSTERS_PER_COMMIT]
+            merged_ids, outbox = await db_writer.submit(lambda db, batch=batch: self._apply_clusters(db, batch))
+
+            # 被合并记忆的向量和不再被引用的图谱实体与SQL删除在同一事务中写入发件箱，
+            # 提交后立即执行，失败时由后台补偿继续执行
+            await store_outbox.apply(outbox)
+
+            await memory_dedup_index.remove_many(merged_ids)
+            for cluster in batch:
+                memory_context_renderer.invalidate(cluster["canonical"]["id"])
+            for memory_id in merged_ids:
+                memory_context_renderer.invalidate(memory_id)
+
+            merged_total += len(merged_ids)
+            await job_queue.report_progress({
+                "persona_id": persona_id,
+                "clusters_done": min(start + _CLUSTERS_PER_COMMIT, len(clusters)),
+                "clusters_total": len(clusters),
+                "memories_merged": merged_total,
+            })
+
+        result = {
+            "persona_id": persona_id,
+            "dry_run": False,
+            "threshold": plan["threshold"],
+            "total_memories": plan["total_memories"],
+            "clusters": len(clusters),
+            "memories_merged": merged_total,
+            "remaining_memories": plan["total_memories"] - merged_total,
+        }
+        logger.info(f"Consolidated memories for persona={persona_id}: merged={merged_total}, clusters={len(clusters)}")
+        return result
+
+    async def enqueue(self, persona_id: str, threshold: Optional[float] = None) -> Optional[str]:
+        """
+        提交合并任务到任务队列（与该记忆体的提取任务串行执行）
+
+        Args:
+            persona_id: 记忆体ID
+            threshold: 相似度阈值（默认使用配置）
+
+        Returns:
+            任务ID
+        """
+        return await job_queue.enqueue(
+            kind=CONSOLIDATION_JOB_KIND,
+            payload={"persona_id": persona_id, "threshold": threshold},
+            serial_key=persona_id
+        )
+
+    async def enqueue_all(self) -> List[str]:
+        """
+        为记忆数达到下限的所有记忆体提交合并任务
+
+        Returns:
+            任务ID列表
+        """
+        db = SessionLocal()
+        try:
+            rows = db.query(Memory.persona_id, func.count(Memory.id)).join(
+                Persona, Persona.id == Memory.persona_id
+            ).group_by(Memory.persona_id).all()
+        finally:
+            db.close()
+
+        job_ids = []
+        for persona_id, count in rows:
+            if count >= settings.MEMORY_CONSOLIDATION_MIN_MEMORIES:
+                job_id = await self.enqueue(persona_id)
+                if job_id:
+                    job_ids.append(job_id)
+
+        logger.info(f"Enqueued {len(job_ids)} scheduled consolidation jobs")
+        return job_ids
+
+    def start_scheduler(self):
+        """启动定期合并（MEMORY_CONSOLIDATION_INTERVAL_HOURS 大于0时生效）"""
+        if settings.MEMORY_CONSOLIDATION_INTERVAL_HOURS <= 0 or self._scheduler_task is not None:
+            return
+        self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+        logger.info(f"Consolidation scheduler started: interval={settings.MEMORY_CONSOLIDATION_INTERVAL_HOURS}h")
+
+    async def stop_scheduler(self):
+        """停止定期合并"""
+        if self._scheduler_task is None:
+            return
+        self._scheduler_task.cancel()
+        await asyncio.gather(self._scheduler_task, return_exceptions=True)
+        self._scheduler_task = None
+
+    async def _scheduler_loop(self):
+        """定期提交合并任务"""
+        interval = settings.MEMORY_CONSOLIDATION_INTERVAL_HOURS * 3600
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.enqueue_all()
+            except Exception as e:
+                logger.error(f"Failed to enqueue scheduled consolidation jobs: {e}")
+
+    @staticmethod
+    async def _apply_clusters(db, clusters: List[Dict[str, Any]]) -> Tuple[List[str], List[StoreOutboxEntry]]:
+        """
+        合并一批簇（写入队列中的写操作，由写入队列在一个事务中提交）
+
+        Args:
+            db: 异步数据库会话
+            clusters: 簇列表
+
+        Returns:
+            (被合并的记忆ID列表, 已写入的发件箱记录列表)
+        """
+        memories = MemoryRepository(db)
+        merged_ids = []
+        outbox = []
+        for cluster in clusters:
+            canonical = await memories.get(cluster["canonical"]["id"])
+            members = await memories.get_many([member["id"] for member in cluster["members"]])
+
+            # 规划之后记录被删除（如用户手动删除），跳过该簇，下次重新聚类
+            if canonical is None or not members:
+                continue
+
+            group = [canonical] + members
+            canonical.access_count = sum(memory.access_count or 0 for memory in group)
+            created_times = [memory.created_at for memory in group if memory.created_at]
+            if created_times:
+                canonical.created_at = min(created_times)
+            event_times = [memory.event_time for memory in group if memory.event_time]
+            if event_times:
+                canonical.event_time = min(event_times)
+            last_accessed = [memory.last_accessed_at for memory in group if memory.last_accessed_at]
+            if last_accessed:
+                canonical.last_accessed_at = max(last_accessed)
+            if not canonical.entity_id:
+                canonical.entity_id = next((memory.entity_id for memory in members if memory.entity_id), None)
+
+            metadata = canonical.get_metadata()
+            metadata["consolidated_from"] = metadata.get("consolidated_from", []) + [memory.id for memory in members]
+            canonical.set_metadata(metadata)
+
+            for memory in members:
+                merged_ids.append(memory.id)
+                outbox.append(vector_delete_entry(memory.vector_id, memory.persona_id))
+                if memory.entity_id and memory.entity_id != canonical.entity_id:
+                    outbox.append(entity_release_entry(memory.entity_id, memory.persona_id))
+                await db.delete(memory)
+
+        await db.flush()
+        await OutboxRepository(db).add(outbox)
+        return merged_ids, outbox
+
+
+# 全局记忆合并服务实例 - 使用懒加载
+_consolidation_service = None
+_consolidation_service_lock = threading.Lock()
+
+
+def get_consolidation_service() -> ConsolidationService:
+    """获取记忆合并服务实例（线程安全的懒加载）"""
+    global _consolidation_service
+    if _consolidation_service is None:
+        with _consolidation_service_lock:
+            if _consolidation_service is None:  # 双重检查锁定
+                _consolidation_service = ConsolidationService()
+    return _consolidation_service
+
+
+# 向后兼容的属性访问器
+class ConsolidationServiceProxy:
+    """记忆合并服务代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_consolidation_service(), name)
+
+
+consolidation_service = ConsolidationServiceProxy()
+config_cache.subscribe(consolidation_service.apply_configuration, ["memory_system"])
+
+
+async def _run_consolidation_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    任务队列中记忆合并任务的处理函数
+
+    Args:
+        payload: 任务参数
+
+    Returns:
+        任务结果
+    """
+    return await get_consolidation_service().consolidate(
+        persona_id=payload["persona_id"],
+        threshold=payload.get("threshold")
+    )
+
+
+job_queue.register_handler(CONSOLIDATION_JOB_KIND, _run_consolidation_job)
@@ -0,0 +1,324 @@
+"""
+对话级记忆提取调度器
+按对话累积多轮后合并提取，只提交水位线之后尚未处理过的消息
+"""
+from typing import List, Dict, Any, Optional, Set
+from collections import OrderedDict
+import asyncio
+import hashlib
+import time
+
+from config import settings
+from services.auto_memory_service import get_auto_memory_service
+from services.config_cache import config_cache
+from utils.logger import logger
+
+
+# 参与提取的消息角色（提取提示词只使用用户和助手消息）
+_EXTRACTION_ROLES = ("user", "assistant")
+
+
+def conversation_fingerprint(
+    persona_id: str,
+    messages: List[Dict[str, Any]],
+    conversation_id: Optional[str] = None
+) -> str:
+    """
+    计算对话指纹
+
+    客户端提供对话ID时按对话ID归并；否则按对话开头归并：客户端每轮都会发送完整的历史消息，
+    首条用户消息及其之前的全部消息在同一对话中保持不变。
+    开头相同的不同对话会得到相同的指纹，由调用方比较历史消息区分
+
+    Args:
+        persona_id: 记忆体ID
+        messages: 本轮请求的消息列表
+        conversation_id: 客户端提供的对话ID
+
+    Returns:
+        对话指纹
+    """
+    if conversation_id:
+        raw = f"{persona_id}\x00id\x00{conversation_id}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    digest = hashlib.sha1(persona_id.encode("utf-8"))
+    for msg in messages:
+        digest.update(f"\x00{msg.get('role')}\x00{msg.get('content') or ''}".encode("utf-8"))
+        if msg.get("role") == "user":
+            break
+    return digest.hexdigest()
+
+
+def _is_prefix(transcript: List[Dict[str, Any]], messages: List[Dict[str, Any]]) -> bool:
+    """
+    判断已记录的对话历史是否为本轮消息的前缀（按角色和去除首尾空白的内容比较）
+
+    Args:
+        transcript: 已记录的对话历史（含上一轮助手响应）
+        messages: 本轮请求的消息列表
+
+    Returns:
+        是否为前缀
+    """
+    if len(transcript) > len(messages):
+        return False
+    return all(
+        old.get("role") == new.get("role") and (old.get("content") or "").strip() == (new.get("content") or "").strip()
+        for old, new in zip(transcript, messages)
+    )
+
+
+class ConversationExtractionScheduler:
+    """
+    对话级记忆提取调度器
+
+    每个对话维护一个水位线（已提交提取的消息数）。每轮对话结束后累积轮次，
+    达到批量轮次或空闲超时后，把水位线之后的消息作为一个提取任务提交到任务队列
+    """
+
+    def __init__(
+        self,
+        batch_turns: int = settings.MEMORY_EXTRACTION_BATCH_TURNS,
+        idle_seconds: float = settings.MEMORY_EXTRACTION_IDLE_SECONDS,
+        max_conversations: int = settings.MEMORY_EXTRACTION_MAX_CONVERSATIONS
+    ):
+        """
+        初始化调度器
+
+        Args:
+            batch_turns: 累计多少轮后提取一次
+            idle_seconds: 对话空闲多少秒后提取
+            max_conversations: 最多跟踪的对话数
+        """
+        self.batch_turns = max(1, batch_turns)
+        self.idle_seconds = idle_seconds
+        self.max_conversations = max(1, max_conversations)
+
+        # 对话指纹 -> 对话状态，按最近活动时间排序
+        self._conversations: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 正在执行的空闲提交（持有引用，避免任务执行完之前被回收）
+        self._idle_tasks: Set[asyncio.Task] = set()
+
+        # 统计信息
+        self._stats: Dict[str, int] = {
+            "turns": 0,
+            "flushes": 0,
+            "flushed_turns": 0,
+            "watermark_resets": 0,
+        }
+
+        logger.info(
+            f"ConversationExtractionScheduler initialized: batch_turns={self.batch_turns}, "
+            f"idle_seconds={self.idle_seconds}"
+        )
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者，已在计时的空闲提取保持原来的超时）
+
+        Args:
+            config_key: 配置键（memory_extraction）
+            value: 配置值
+        """
+        self.batch_turns = max(1, value.get("batch_turns", self.batch_turns))
+        self.idle_seconds = value.get("idle_seconds", self.idle_seconds)
+        logger.info(
+            f"ConversationExtractionScheduler reconfigured: batch_turns={self.batch_turns}, "
+            f"idle_seconds={self.idle_seconds}"
+        )
+
+    async def add_turn(
+        self,
+        messages: List[Dict[str, Any]],
+        assistant_response: str,
+        persona_id: str,
+        auto_save_enabled: bool = True,
+        injected_memories: Optional[List[Dict[str, Any]]] = None,
+        conversation_id: Optional[str] = None
+    ):
+        """
+        记录一轮已完成的对话
+
+        Args:
+            messages: 本轮请求的消息列表（完整历史）
+            assistant_response: 本轮助手响应
+            persona_id: 记忆体ID
+            auto_save_enabled: 是否启用自动保存
+            injected_memories: 本轮注入的记忆（用于提取判断）
+            conversation_id: 客户端提供的对话ID
+        """
+        if not auto_save_enabled:
+            logger.debug("Auto memory save is disabled")
+            return
+
+        fingerprint = conversation_fingerprint(persona_id, messages, conversation_id)
+        transcript = list(messages) + [{"role": "assistant", "content": assistant_response}]
+
+        state = self._conversations.get(fingerprint)
+        if state is None:
+            # 首次见到的对话：之前的历史已在以前的请求（或重启前）处理过，只处理本轮消息
+            state = {
+                "persona_id": persona_id,
+                "watermark": max(0, len(messages) - 1),
+                "pending_turns": 0,
+                "timer": None,
+            }
+            self._conversations[fingerprint] = state
+            await self._evict_if_needed()
+        elif not _is_prefix(state["transcript"], messages):
+            # 开头相同的另一个对话，或对话被编辑、重新生成：先提交已记录的对话中待处理的轮次，再从本轮消息重新开始
+            await self.flush(fingerprint)
+            self._stats["watermark_resets"] += 1
+            state["watermark"] = max(0, len(messages) - 1)
+            logger.debug(f"Extraction watermark reset for conversation {fingerprint[:8]} (persona={persona_id})")
+
+        self._conversations.move_to_end(fingerprint)
+        state["transcript"] = transcript
+        state["injected_memories"] = injected_memories or []
+        state["pending_turns"] += 1
+        state["last_activity"] = time.monotonic()
+        self._stats["turns"] += 1
+
+        if state["pending_turns"] >= self.batch_turns:
+            await self.flush(fingerprint)
+        else:
+            self._schedule_idle_flush(fingerprint, state)
+            logger.debug(
+                f"Memory extraction deferred: conversation={fingerprint[:8]}, "
+                f"pending_turns={state['pending_turns']}/{self.batch_turns} (persona={persona_id})"
+            )
+
+    async def flush(self, fingerprint: str) -> Optional[str]:
+        """
+        提交对话中水位线之后的消息进行提取
+
+        Args:
+            fingerprint: 对话指纹
+
+        Returns:
+            任务ID；没有待处理消息或任务被丢弃时返回None
+        """
+        state = self._conversations.get(fingerprint)
+        if not state:
+            return None
+
+        timer = state.get("timer")
+        if timer is not None:
+            timer.cancel()
+            state["timer"] = None
+
+        if state["pending_turns"] == 0:
+            return None
+
+        transcript = state["transcript"]
+        new_messages = [
+            msg for msg in transcript[state["watermark"]:]
+            if msg.get("role") in _EXTRACTION_ROLES and msg.get("content")
+        ]
+        pending_turns = state["pending_turns"]
+
+        # 无论是否提交成功都推进水位线，避免同样的内容被反复提交
+        state["watermark"] = len(transcript)
+        state["pending_turns"] = 0
+
+        if not new_messages:
+            return None
+
+        user_message = "\n".join(msg["content"] for msg in new_messages if msg["role"] == "user")
+        assistant_response = "\n".join(msg["content"] for msg in new_messages if msg["role"] == "assistant")
+
+        job_id = await get_auto_memory_service().enqueue_extraction(
+            messages=new_messages,
+            persona_id=state["persona_id"],
+            user_message=user_message,
+            assistant_response=assistant_response,
+            injected_memories=state["injected_memories"],
+            max_messages=None
+        )
+
+        self._stats["flushes"] += 1
+        self._stats["flushed_turns"] += pending_turns
+        logger.info(
+            f"Memory extraction batch enqueued: job_id={job_id}, turns={pending_turns}, "
+            f"messages={len(new_messages)} (persona={state['persona_id']})"
+        )
+        return job_id
+
+    async def flush_all(self):
+        """提交所有对话中待处理的消息（关闭服务前调用）"""
+        for fingerprint in list(self._conversations.keys()):
+            try:
+                await self.flush(fingerprint)
+            except Exception as e:
+                logger.error(f"Failed to flush memory extraction batch: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取统计信息
+
+        Returns:
+            统计信息字典
+        """
+        flushes = self._stats["flushes"]
+        return {
+            **self._stats,
+            "conversations": len(self._conversations),
+            "pending_turns": sum(state["pending_turns"] for state in self._conversations.values()),
+            "avg_turns_per_flush": self._stats["flushed_turns"] / flushes if flushes else 0.0,
+        }
+
+    def _schedule_idle_flush(self, fingerprint: str, state: Dict[str, Any]):
+        """
+        (重新)安排空闲超时后的提取
+
+        Args:
+            fingerprint: 对话指纹
+            state: 对话状态
+        """
+        timer = state.get("timer")
+        if timer is not None:
+            timer.cancel()
+
+        state["timer"] = asyncio.get_running_loop().call_later(self.idle_seconds, self._start_idle_flush, fingerprint)
+
+    def _start_idle_flush(self, fingerprint: str):
+        """
+        空闲超时回调：在后台提交对话
+
+        Args:
+            fingerprint: 对话指纹
+        """
+        task = asyncio.get_running_loop().create_task(self._on_idle(fingerprint))
+        self._idle_tasks.add(task)
+        task.add_done_callback(self._idle_tasks.discard)
+
+    async def _on_idle(self, fingerprint: str):
+        """
+        空闲超时后提交对话
+
+        Args:
+            fingerprint: 对话指纹
+        """
+        try:
+            state = self._conversations.get(fingerprint)
+            if state is not None:
+                state["timer"] = None
+            await self.flush(fingerprint)
+        except Exception as e:
+            logger.error(f"Failed to flush idle conversation {fingerprint[:8]}: {e}")
+
+    async def _evict_if_needed(self):
+        """跟踪的对话数超出上限时，提取并移除最久未活动的对话"""
+        while len(self._conversations) > self.max_conversations:
+            fingerprint = next(iter(self._conversations))
+            try:
+                await self.flush(fingerprint)
+            except Exception as e:
+                logger.error(f"Failed to flush evicted conversation {fingerprint[:8]}: {e}")
+            self._conversations.pop(fingerprint, None)
+
+
+# 创建全局调度器实例
+extraction_scheduler = ConversationExtractionScheduler()
+config_cache.subscribe(extraction_scheduler.apply_configuration, ["memory_extraction"])
@@ -0,0 +1,494 @@
+"""
+后台任务队列
+基于SQLite持久化的任务队列，提供worker池、串行键、削峰、退避重试和队列指标
+"""
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+from datetime import datetime, timedelta
+import asyncio
+import contextvars
+import json
+import time
+
+from config import settings
+from models.database import BackgroundJob, async_read_session
+from models.db_writer import db_writer
+from repositories.job_repository import JobRepository
+from utils.logger import logger
+from utils.helpers import generate_id
+
+
+# 任务处理函数：接收任务参数，返回任务结果（写入progress），失败时抛出异常
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+# 当前正在执行的任务ID（供处理函数上报进度）
+_current_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job_id", default=None)
+
+
+class JobQueue:
+    """
+    后台任务队列
+    任务先写入SQLite再由worker池执行。领取的任务带有进程ID和租约，执行期间定期续约；
+    多个进程共用任务表时只回收租约已过期（所属进程已退出）的任务，不会重复执行其他进程正在执行的任务
+    """
+
+    def __init__(
+        self,
+        workers: int = settings.JOB_QUEUE_WORKERS,
+        poll_interval: float = settings.JOB_QUEUE_POLL_INTERVAL
+    ):
+        """
+        初始化任务队列
+
+        Args:
+            workers: worker数量
+            poll_interval: 空闲时轮询任务表的间隔（秒）
+        """
+        self.worker_count = max(1, workers)
+        self.poll_interval = poll_interval
+        self.worker_id = generate_id()
+        self.lease_seconds = max(settings.JOB_QUEUE_LEASE_SECONDS, 3)
+
+        self._handlers: Dict[str, Dict[str, Any]] = {}
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+        self._last_maintenance = 0.0
+
+        # 进程内计数器
+        self._counters: Dict[str, int] = {
+            "enqueued": 0,
+            "shed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+        }
+        # 最近任务的排队等待时间（秒，指数滑动平均）
+        self._wait_seconds_ema: Optional[float] = None
+
+        logger.info(
+            f"JobQueue initialized: workers={self.worker_count}, poll_interval={self.poll_interval}, "
+            f"worker_id={self.worker_id}"
+        )
+
+    def register_handler(
+        self,
+        kind: str,
+        handler: JobHandler,
+        max_pending: Optional[int] = None,
+        max_attempts: Optional[int] = None
+    ):
+        """
+        注册任务处理函数
+
+        Args:
+            kind: 任务类型
+            handler: 处理函数
+            max_pending: 该类型任务的最大排队数（None表示不限制）
+            max_attempts: 该类型任务的最大执行次数
+        """
+        self._handlers[kind] = {
+            "handler": handler,
+            "max_pending": max_pending,
+            "max_attempts": max_attempts or settings.JOB_QUEUE_MAX_ATTEMPTS,
+        }
+        logger.info(f"Registered job handler: kind={kind}, max_pending={max_pending}")
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        serial_key: Optional[str] = None,
+        run_at: Optional[datetime] = None
+    ) -> Optional[str]:
+        """
+        提交任务（经写入队列写入任务表）
+
+        Args:
+            kind: 任务类型
+            payload: 任务参数（必须可JSON序列化）
+            serial_key: 串行键，同一键的任务不会并发执行
+            run_at: 最早执行时间（默认立即执行）
+
+        Returns:
+            任务ID；队列已满被丢弃时返回None
+        """
+        handler_info = self._handlers.get(kind)
+        if handler_info is None:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+
+        job_id = generate_id()
+        payload_json = json.dumps(payload, ensure_ascii=False, default=str)
+        max_pending = handler_info["max_pending"]
+
+        async def operation(db) -> Optional[int]:
+            jobs = JobRepository(db)
+            # 削峰：排队数超过上限时直接丢弃
+            if max_pending is not None:
+                pending = await jobs.count_pending(kind)
+                if pending >= max_pending:
+                    return pending
+
+            now = datetime.now()
+            await jobs.add(BackgroundJob(
+                id=job_id,
+                kind=kind,
+                serial_key=serial_key,
+                payload=payload_json,
+                status="pending",
+                attempts=0,
+                max_attempts=handler_info["max_attempts"],
+                next_run_at=run_at or now,
+                created_at=now
+            ))
+            return None
+
+        try:
+            pending = await db_writer.submit(operation)
+        except Exception as e:
+            logger.error(f"Failed to enqueue job (kind={kind}): {e}")
+            raise
+
+        if pending is not None:
+            self._counters["shed"] += 1
+            logger.warning(f"Job queue full, shedding job: kind={kind}, pending={pending}, max_pending={max_pending}")
+            return None
+
+        self._counters["enqueued"] += 1
+        logger.info(f"Enqueued job: id={job_id}, kind={kind}, serial_key={serial_key}")
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def start(self):
+        """启动worker池"""
+        if self._running:
+            return
+
+        self._running = True
+        self._wakeup = asyncio.Event()
+        await self._requeue_expired_jobs()
+
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        for i in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker_loop(i)))
+
+        logger.info(f"JobQueue started with {self.worker_count} workers")
+
+    async def stop(self):
+        """停止worker池（正在执行的任务会被取消，重启后重新调度）"""
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        for worker in self._workers:
+            worker.cancel()
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        # 任务放回队列后再停止续约
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
+        logger.info("JobQueue stopped")
+
+    async def report_progress(self, progress: Dict[str, Any]):
+        """
+        上报当前任务的进度（在任务处理函数中调用）
+
+        Args:
+            progress: 进度信息
+        """
+        job_id = _current_job_id.get()
+        if job_id is None:
+            return
+
+        progress_json = json.dumps(progress, ensure_ascii=False, default=str)
+        try:
+            await db_writer.submit(lambda db: JobRepository(db).set_progress(job_id, progress_json))
+        except Exception as e:
+            logger.warning(f"Failed to report job progress (id={job_id}): {e}")
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取任务状态
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            任务信息字典，不存在时返回None
+        """
+        async with async_read_session() as db:
+            job = await JobRepository(db).get(job_id)
+            if not job:
+                return None
+            return self._job_to_dict(job)
+
+    async def get_metrics(self) -> Dict[str, Any]:
+        """
+        获取队列指标
+
+        Returns:
+            指标字典：各类型/状态的任务数、排队延迟、进程内计数器
+        """
+        now = datetime.now()
+        async with async_read_session() as db:
+            jobs = JobRepository(db)
+            depth = await jobs.count_active()
+            # 排队延迟：最早一个已到期但仍未执行的任务等待了多久
+            oldest_due = await jobs.oldest_due(now)
+        lag_seconds = (now - oldest_due).total_seconds() if oldest_due else 0.0
+
+        return {
+            "workers": self.worker_count,
+            "running": self._running,
+            "depth": depth,
+            "pending_total": sum(d["pending"] for d in depth.values()),
+            "running_total": sum(d["running"] for d in depth.values()),
+            "lag_seconds": lag_seconds,
+            "avg_wait_seconds": self._wait_seconds_ema,
+            "counters": dict(self._counters),
+        }
+
+    async def _worker_loop(self, worker_index: int):
+        """
+        worker主循环
+
+        Args:
+            worker_index: worker编号
+        """
+        logger.debug(f"Job worker {worker_index} started")
+        while self._running:
+            try:
+                await self._maybe_run_maintenance()
+
+                job = await self._claim_next_job()
+                if job is None:
+                    # 没有可执行的任务，等待唤醒或超时后重新轮询
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self._run_job(job)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_index} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _claim_next_job(self) -> Optional[Dict[str, Any]]:
+        """
+        领取下一个可执行的任务
+
+        跳过串行键已有任务在执行中的任务，保证同一persona的任务串行执行；
+        领取经写入队列执行，同一进程的worker不会争抢写锁
+
+        Returns:
+            任务信息字典，没有可执行任务时返回None
+        """
+        now = datetime.now()
+        kinds = list(self._handlers.keys())
+        lease_expires_at = now + timedelta(seconds=self.lease_seconds)
+
+        async def operation(db):
+            job = await JobRepository(db).claim_next(kinds, now, self.worker_id, lease_expires_at)
+            return self._job_to_dict(job) if job else None
+
+        try:
+            job = await db_writer.submit(operation)
+        except Exception as e:
+            logger.error(f"Failed to claim job: {e}")
+            return None
+
+        if job is not None:
+            wait_seconds = (now - datetime.fromisoformat(job["next_run_at"])).total_seconds()
+            if self._wait_seconds_ema is None:
+                self._wait_seconds_ema = wait_seconds
+            else:
+                self._wait_seconds_ema = 0.8 * self._wait_seconds_ema + 0.2 * wait_seconds
+        return job
+
+    async def _run_job(self, job: Dict[str, Any]):
+        """
+        执行任务并记录结果
+
+        Args:
+            job: 任务信息字典
+        """
+        handler_info = self._handlers.get(job["kind"])
+        if handler_info is None:
+            await self._finish_job(job, error=f"No handler registered for job kind: {job['kind']}", retry=False)
+            return
+
+        started = time.monotonic()
+        token = _current_job_id.set(job["id"])
+        try:
+            progress = await asyncio.wait_for(
+                handler_info["handler"](job["payload"]),
+                timeout=settings.JOB_QUEUE_JOB_TIMEOUT
+            )
+            await self._finish_job(job, progress=progress)
+            logger.info(f"Job succeeded: id={job['id']}, kind={job['kind']}, elapsed={time.monotonic() - started:.2f}s")
+
+        except asyncio.CancelledError:
+            # 进程关闭时被取消，放回队列等待重启后执行
+            await self._finish_job(job, error="cancelled", retry=True, count_attempt=False)
+            raise
+        except Exception as e:
+            logger.error(f"Job failed: id={job['id']}, kind={job['kind']}, attempt={job['attempts']}: {e}")
+            await self._finish_job(job, error=str(e) or type(e).__name__, retry=True)
+        finally:
+            _current_job_id.reset(token)
+
+    async def _finish_job(
+        self,
+        job: Dict[str, Any],
+        progress: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        retry: bool = False,
+        count_attempt: bool = True
+    ):
+        """
+        更新任务的结束状态
+
+        Args:
+            job: 任务信息字典
+            progress: 任务结果
+            error: 错误信息（None表示成功）
+            retry: 失败时是否允许重试
+            count_attempt: 本次执行是否计入执行次数
+        """
+        async def operation(db) -> Optional[str]:
+            record = await JobRepository(db).get(job["id"])
+            if not record:
+                return None
+            if record.status != "running" or record.worker_id != self.worker_id:
+                # 租约过期后任务已被回收（可能正由其他进程执行），不覆盖其状态
+                logger.warning(f"Job lease was lost before finishing: id={record.id}")
+                return None
+            record.worker_id = None
+            record.lease_expires_at = None
+
+            now = datetime.now()
+            if error is None:
+                record.status = "succeeded"
+                record.finished_at = now
+                record.last_error = None
+                if progress is not None:
+                    record.progress = json.dumps(progress, ensure_ascii=False, default=str)
+                await db.flush()
+                return "succeeded"
+
+            record.last_error = error
+            if not count_attempt:
+                record.attempts = max(0, (record.attempts or 1) - 1)
+
+            if retry and (record.attempts or 0) < (record.max_attempts or 1):
+                # 指数退避
+                delay = min(
+                    settings.JOB_QUEUE_RETRY_BASE_SECONDS * (2 ** max(0, (record.attempts or 1) - 1)),
+                    settings.JOB_QUEUE_RETRY_MAX_SECONDS
+                ) if count_attempt else 0
+                record.status = "pending"
+                record.next_run_at = now + timedelta(seconds=delay)
+                await db.flush()
+                if count_attempt:
+                    logger.info(f"Job scheduled for retry: id={record.id}, attempts={record.attempts}, delay={delay:.1f}s")
+                    return "retried"
+                return None
+
+            record.status = "failed"
+            record.finished_at = now
+            await db.flush()
+            return "failed"
+
+        try:
+            # 计数器在提交后更新，写入队列逐个重试时操作会被重复执行
+            outcome = await db_writer.submit(operation)
+        except Exception as e:
+            logger.error(f"Failed to update job status (id={job['id']}): {e}")
+            return
+        if outcome is not None:
+            self._counters[outcome] += 1
+
+    async def _maybe_run_maintenance(self):
+        """定期维护：回收租约过期的running任务，清理过期的已结束任务"""
+        now = time.monotonic()
+        if now - self._last_maintenance < max(self.poll_interval * 30, 30):
+            return
+        self._last_maintenance = now
+
+        await self._requeue_expired_jobs()
+
+        cutoff = datetime.now() - timedelta(hours=settings.JOB_QUEUE_RETENTION_HOURS)
+        try:
+            deleted = await db_writer.submit(lambda db: JobRepository(db).purge_finished(cutoff))
+            if deleted:
+                logger.info(f"Purged {deleted} finished jobs older than {settings.JOB_QUEUE_RETENTION_HOURS}h")
+        except Exception as e:
+            logger.error(f"Failed to purge finished jobs: {e}")
+
+    async def _heartbeat_loop(self):
+        """定期为本进程执行中的任务续约（每个租约周期续约三次）"""
+        interval = self.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            lease_expires_at = datetime.now() + timedelta(seconds=self.lease_seconds)
+            try:
+                await db_writer.submit(lambda db: JobRepository(db).renew_leases(self.worker_id, lease_expires_at))
+            except Exception as e:
+                logger.error(f"Failed to renew job leases: {e}")
+
+    async def _requeue_expired_jobs(self):
+        """将租约过期（所属进程已退出）的running任务放回队列"""
+        now = datetime.now()
+        # 升级前领取、没有租约的任务按开始时间判断
+        legacy_cutoff = now - timedelta(seconds=settings.JOB_QUEUE_JOB_TIMEOUT * 2)
+        try:
+            requeued = await db_writer.submit(lambda db: JobRepository(db).requeue_expired(now, legacy_cutoff))
+            if requeued:
+                logger.warning(f"Requeued {requeued} jobs with expired leases")
+        except Exception as e:
+            logger.error(f"Failed to requeue expired jobs: {e}")
+
+    @staticmethod
+    def _job_to_dict(job: BackgroundJob) -> Dict[str, Any]:
+        """
+        将任务记录转换为字典
+
+        Args:
+            job: 任务记录
+
+        Returns:
+            任务信息字典
+        """
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "serial_key": job.serial_key,
+            "payload": job.get_payload(),
+            "status": job.status,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "progress": job.get_progress(),
+            "last_error": job.last_error,
+            "next_run_at": job.next_run_at.isoformat() if job.next_run_at else None,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+            "worker_id": job.worker_id,
+            "lease_expires_at": job.lease_expires_at.isoformat() if job.lease_expires_at else None,
+        }
+
+
+# 创建全局任务队列实例
+job_queue = JobQueue()
@@ -1,32 +1,36 @@
 """
 记忆服务
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 import threading
 
-from models.database import SessionLocal, Memory
+from models.database import Memory, async_session_scope
 from models.schemas import MemoryCreate, MemoryUpdate, MemoryResponse, MemorySearchRequest
-from memory.vector_store import vector_store
-from memory.graph_store import graph_store
 from memory.memory_manager import memory_manager, MemoryManager, get_db
 from memory.retrieval import retrieval_strategy
+from memory.dedup_index import memory_dedup_index
 from core.embedding_client import embedding_client
+from core.memory_engine import memory_context_renderer
+from services.store_outbox import store_outbox, vector_upsert_entry, vector_delete_entry, entity_release_entry
 from utils.logger import logger
-from utils.helpers import generate_id
+from utils.helpers import generate_id, encode_cursor, decode_cursor, datetime_to_ms
 
 
-@contextmanager
-def get_memory_manager():
-    """获取记忆管理器的上下文管理器"""
-    db = SessionLocal()
-    try:
-        manager = MemoryManager(db=db)
-        yield manager
-    finally:
-        db.close()
-        logger.info("MemoryManager context closed")
+def _to_local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """将带时区的时间转换为数据库中使用的本地无时区时间"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+@asynccontextmanager
+async def get_memory_manager():
+    """获取绑定到同一工作单元的记忆管理器（退出时统一提交）"""
+    async with async_session_scope() as db:
+        yield MemoryManager(db=db)
+    logger.info("MemoryManager context closed")
 
 
 class MemoryService:
@@ -36,8 +40,7 @@ class MemoryService:
     """
 
     def __init__(self):
-        """初始化记忆服务"""
-        self.db = SessionLocal()
+        """初始化记忆服务（不持有长期会话，数据库操作使用当前工作单元的会话）"""
         logger.info("MemoryService initialized")
     
     async def create_memory(
@@ -47,7 +50,10 @@ class MemoryService:
         event_time: Optional[datetime] = None  # 新增参数
     ) -> Optional[Memory]:
         """
-        创建记忆（带事务保护和回滚机制）
+        创建记忆
+
+        记忆记录与写入向量的发件箱操作在同一事务中提交，提交后立即写入向量库；
+        向量库写入失败时记忆记录保留，由发件箱后台补偿
 
         Args:
             memory_data: 记忆数据
@@ -57,27 +63,19 @@ class MemoryService:
         Returns:
             创建的记忆对象
         """
-        embedding = None
-        vector_id = None
-        memory = None
-
         try:
             # 将内容转换为向量
             embedding = await embedding_client.embed(content)
 
-            # 插入向量存储
             vector_id = generate_id()
-            success = await vector_store.insert_knowledge(
-                id=vector_id,
+            outbox = [vector_upsert_entry(
+                vector_id=vector_id,
                 persona_id=memory_data.persona_id,
                 content=content,
                 embedding=embedding,
                 entity_id=memory_data.entity_id,
                 metadata=memory_data.metadata
-            )
-
-            if not success:
-                raise Exception("Failed to insert vector")
+            )]
 
             # 创建记忆记录（包含event_time）
             memory = await memory_manager.create_memory(
@@ -87,37 +85,88 @@ class MemoryService:
                 type=memory_data.type,
                 entity_id=memory_data.entity_id,
                 metadata=memory_data.metadata,
-                event_time=event_time  # 新增
+                event_time=event_time,  # 新增
+                outbox=outbox
             )
 
             if not memory:
                 raise Exception("Failed to create memory record")
 
+            await store_outbox.apply(outbox)
+            await memory_dedup_index.add(memory_data.persona_id, memory.id, content)
+
             logger.info(f"Created memory: id={memory.id}, type={memory_data.type}, persona_id={memory_data.persona_id}, event_time={event_time}")
             return memory
 
         except Exception as e:
-            # 回滚已执行的操作
-            logger.error(f"Failed to create memory, rolling back: {e}")
-
-            # 回滚向量存储
-            if vector_id:
-                try:
-                    await vector_store.delete_vector(vector_id)
-                    logger.info(f"Rolled back vector: {vector_id}")
-                except Exception as rollback_error:
-                    logger.error(f"Failed to rollback vector: {rollback_error}")
-
-            # 回滚图谱数据（如果需要）
-            if memory_data.entity_id:
-                try:
-                    # KùzuDB可能不支持删除，这里需要根据实际情况处理
-                    logger.warning(f"Graph data rollback not implemented for entity: {memory_data.entity_id}")
-                except Exception as rollback_error:
-                    logger.error(f"Failed to rollback graph data: {rollback_error}")
-
+            logger.error(f"Failed to create memory: {e}")
             return None
-    
+
+    async def create_memories_batch(
+        self,
+        persona_id: str,
+        memories: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+        type: str = "long_term"
+    ) -> List[str]:
+        """
+        批量创建记忆（一个SQL事务 + 一次向量写入）
+
+        记忆记录与写入向量的发件箱操作在同一事务中提交，向量库写入失败时由发件箱后台补偿
+
+        Args:
+            persona_id: 记忆体ID
+            memories: 记忆数据列表，每项包含 content，可选 event_time, entity_id, metadata，
+                      以及导入时保留的 created_at, last_accessed_at, access_count
+            embeddings: 与记忆一一对应的向量（调用方已批量计算）
+            type: 记忆类型
+
+        Returns:
+            创建的记忆ID列表
+        """
+        if not memories:
+            return []
+
+        outbox = []
+        memory_items = []
+        for memory_data, embedding in zip(memories, embeddings):
+            vector_id = generate_id()
+            outbox.append(vector_upsert_entry(
+                vector_id=vector_id,
+                persona_id=persona_id,
+                content=memory_data["content"],
+                embedding=embedding,
+                entity_id=memory_data.get("entity_id"),
+                metadata=memory_data.get("metadata")
+            ))
+            memory_items.append({
+                "id": generate_id(),
+                "vector_id": vector_id,
+                "persona_id": persona_id,
+                "content": memory_data["content"],
+                "type": type,
+                "entity_id": memory_data.get("entity_id"),
+                "metadata": memory_data.get("metadata"),
+                "event_time": memory_data.get("event_time"),
+                "created_at": memory_data.get("created_at"),
+                "last_accessed_at": memory_data.get("last_accessed_at"),
+                "access_count": memory_data.get("access_count")
+            })
+
+        created = await memory_manager.create_memories_batch(memory_items, outbox=outbox)
+        if not created:
+            raise Exception("Failed to create memory records")
+
+        await store_outbox.apply(outbox)
+
+        memory_ids = [item["id"] for item in memory_items]
+        await memory_dedup_index.add_many(
+            persona_id,
+            [(item["id"], item["content"]) for item in memory_items]
+        )
+        logger.info(f"Created {len(memory_ids)} memories in batch: persona_id={persona_id}")
+        return memory_ids
+
     async def get_memory(self, memory_id: str) -> Optional[Memory]:
         """
         获取记忆
@@ -141,7 +190,7 @@ class MemoryService:
         memory_data: MemoryUpdate
     ) -> Optional[Memory]:
         """
-        更新记忆（带事务保护）
+        更新记忆（内容变化时向量随记录更新经发件箱写入向量库）
 
         Args:
             memory_id: 记忆ID
@@ -155,44 +204,49 @@ class MemoryService:
             if not memory:
                 return None
 
-            # 更新内容
+            outbox = []
             if memory_data.content is not None:
                 # 重新计算向量
                 embedding = await embedding_client.embed(memory_data.content)
-
-                # 更新向量存储中的向量和内容
-                await vector_store.update_vector(
-                    id=memory.vector_id,
+                outbox.append(vector_upsert_entry(
+                    vector_id=memory.vector_id,
+                    persona_id=memory.persona_id,
                     content=memory_data.content,
-                    embedding=embedding
-                )
-
-                # 更新记忆记录
-                memory.content = memory_data.content
+                    embedding=embedding,
+                    entity_id=memory.entity_id,
+                    metadata=memory_data.metadata if memory_data.metadata is not None else memory.get_metadata(),
+                    created_at=datetime_to_ms(memory.created_at) or None,
+                    last_accessed_at=datetime_to_ms(memory.last_accessed_at) or None,
+                    access_count=memory.access_count or 0
+                ))
+
+            # 更新记忆记录（内容和元数据）
+            memory = await memory_manager.update_memory(
+                memory_id,
+                content=memory_data.content,
+                metadata=memory_data.metadata,
+                outbox=outbox
+            )
+            if not memory:
+                raise Exception("Failed to update memory record")
 
-            # 更新元数据
-            if memory_data.metadata is not None:
-                memory.set_metadata(memory_data.metadata)
+            await store_outbox.apply(outbox)
 
-            # 使用try-finally确保事务正确处理
-            try:
-                self.db.commit()
-                self.db.refresh(memory)
-            except Exception as commit_error:
-                self.db.rollback()
-                raise commit_error
+            # 记忆内容已变化，使渲染缓存失效
+            memory_context_renderer.invalidate(memory_id)
+            if memory_data.content is not None:
+                await memory_dedup_index.update(memory.persona_id, memory_id, memory_data.content)
 
             logger.info(f"Updated memory: id={memory_id}")
             return memory
 
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to update memory: {e}")
             return None
     
     async def delete_memory(self, memory_id: str) -> bool:
         """
-        删除记忆（带完整清理）
+        删除记忆（向量和不再被引用的图谱实体经发件箱删除）
 
         Args:
             memory_id: 记忆ID
@@ -206,38 +260,18 @@ class MemoryService:
             if not memory:
                 return False
 
-            vector_id = memory.vector_id
-            entity_id = memory.entity_id
-
-            # 1. 删除向量存储中的数据
-            vector_deleted = await vector_store.delete_vector(vector_id)
-            if not vector_deleted:
-                logger.warning(f"Failed to delete vector: {vector_id}")
-
-            # 2. 删除图谱中的实体和关系（如果存在）
-            if entity_id:
-                try:
-                    # 注意：KùzuDB的删除语法需要根据实际情况调整
-                    # 这里假设有delete_entity方法
-                    # await graph_store.delete_entity(entity_id)
-                    logger.info(f"Would delete graph entity: {entity_id} (not implemented)")
-                except Exception as graph_error:
-                    logger.warning(f"Failed to delete graph entity: {graph_error}")
+            outbox = [vector_delete_entry(memory.vector_id, memory.persona_id)]
+            if memory.entity_id:
+                outbox.append(entity_release_entry(memory.entity_id, memory.persona_id))
 
-            # 3. 删除记忆记录
-            success = await memory_manager.delete_memory(memory_id)
+            # 删除记忆记录，同一事务中记录需要删除的向量和实体
+            success = await memory_manager.delete_memory(memory_id, outbox=outbox)
 
             if success:
+                await store_outbox.apply(outbox)
+                memory_context_renderer.invalidate(memory_id)
+                await memory_dedup_index.remove(memory_id)
                 logger.info(f"Deleted memory: id={memory_id}")
-            else:
-                # 如果数据库删除失败，尝试回滚向量删除
-                logger.error(f"Failed to delete memory record, attempting rollback")
-                try:
-                    # 重新插入向量（简化处理）
-                    # 实际应用中需要更复杂的恢复逻辑
-                    pass
-                except Exception as rollback_error:
-                    logger.error(f"Rollback failed: {rollback_error}")
 
             return success
 
@@ -266,14 +300,12 @@ class MemoryService:
             results = await retrieval_strategy.retrieve(
                 query_embedding=query_embedding,
                 query_text=search_request.query,
-                persona_id=search_request.metadata.get("persona_id") if search_request.metadata else None
+                persona_id=search_request.metadata.get("persona_id") if search_request.metadata else None,
+                include_cold=search_request.include_cold
             )
 
-            # 更新访问信息（使用memory_id）
-            for result in results:
-                memory_id = result.get("memory_id")
-                if memory_id:
-                    await memory_manager.update_memory_access(memory_id)
+            # 批量更新访问信息（使用memory_id）
+            await memory_manager.update_memories_access([result.get("memory_id") for result in results])
             
             logger.info(f"Searched memories: query={search_request.query}, found {len(results)} results")
 
@@ -310,10 +342,77 @@ class MemoryService:
         except Exception as e:
             logger.error(f"Failed to list memories: {e}")
             return []
-    
+
+    async def list_memories_page(
+        self,
+        persona_id: Optional[str] = None,
+        type: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        event_after: Optional[datetime] = None,
+        event_before: Optional[datetime] = None,
+        order_by: str = "created_at",
+        cursor: Optional[str] = None,
+        limit: int = 100
+    ) -> Tuple[List[Memory], Optional[str]]:
+        """
+        按游标分页列出记忆
+
+        Args:
+            persona_id: 记忆体ID过滤
+            type: 记忆类型过滤
+            created_after: 创建时间下界（含）
+            created_before: 创建时间上界（不含）
+            event_after: 事件时间下界（含）
+            event_before: 事件时间上界（不含）
+            order_by: 排序字段，'created_at' 或 'event_time'
+            cursor: 上一页返回的游标，为空时从第一页开始
+            limit: 每页数量
+
+        Returns:
+            (本页记忆列表, 下一页游标)，没有下一页时游标为None
+
+        Raises:
+            ValueError: 排序字段或游标无效
+        """
+        if order_by not in ("created_at", "event_time"):
+            raise ValueError(f"Invalid order_by: {order_by}")
+
+        after = None
+        if cursor:
+            position = decode_cursor(cursor)
+            # 游标只能用于生成它的排序方式
+            if not position or position.get("order_by") != order_by or "value" not in position or "id" not in position:
+                raise ValueError("Invalid cursor")
+            try:
+                after = (datetime.fromisoformat(position["value"]), position["id"])
+            except (TypeError, ValueError):
+                raise ValueError("Invalid cursor")
+
+        memories, has_more = await memory_manager.list_memories_page(
+            persona_id=persona_id,
+            type=type,
+            created_after=_to_local_naive(created_after),
+            created_before=_to_local_naive(created_before),
+            event_after=_to_local_naive(event_after),
+            event_before=_to_local_naive(event_before),
+            order_by=order_by,
+            after=after,
+            limit=limit
+        )
+
+        next_cursor = None
+        if has_more and memories:
+            last = memories[-1]
+            next_cursor = encode_cursor({
+                "order_by": order_by,
+                "value": getattr(last, order_by).isoformat(),
+                "id": last.id,
+            })
+        return memories, next_cursor
+
     def close(self):
-        """关闭数据库连接"""
-        self.db.close()
+        """关闭服务（不持有长期会话）"""
         logger.info("MemoryService closed")
 
 
@@ -0,0 +1,299 @@
+"""
+记忆工具服务
+在服务端执行LLM发起的记忆工具调用（save_memory, update_memory, delete_memory, search_memories），
+对话接口据此在一次客户端请求内完成 工具调用 -> 工具结果 -> 继续补全 的循环
+"""
+from typing import List, Dict, Any, Optional
+import json
+import threading
+
+from config import settings
+from models.schemas import MemoryCreate, MemoryUpdate, MemorySearchRequest
+from services.config_cache import config_cache
+from services.memory_service import memory_service
+from utils.helpers import generate_id
+from utils.logger import logger
+from utils.memory_tools import get_memory_tools
+
+
+class ToolCallCollector:
+    """
+    流式响应中的工具调用收集器
+
+    按 index 合并各chunk中 delta.tool_calls 的片段（id、函数名、参数字符串分多次下发）
+    """
+
+    def __init__(self):
+        """初始化收集器"""
+        self._calls: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, deltas: List[Dict[str, Any]]):
+        """
+        合并一个chunk中的工具调用片段
+
+        Args:
+            deltas: delta.tool_calls 列表
+        """
+        for delta in deltas:
+            call = self._calls.setdefault(delta.get("index", 0), {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if delta.get("id"):
+                call["id"] = delta["id"]
+            function = delta.get("function") or {}
+            if function.get("name"):
+                call["function"]["name"] += function["name"]
+            if function.get("arguments"):
+                call["function"]["arguments"] += function["arguments"]
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        """按 index 排列的完整工具调用列表"""
+        return [self._calls[index] for index in sorted(self._calls)]
+
+
+class MemoryToolService:
+    """
+    记忆工具服务
+
+    工具参数错误时抛出 ValueError，记忆不存在（或不属于指定记忆体）时抛出 LookupError，
+    写入失败时抛出 RuntimeError；在对话循环中这些错误作为工具结果返回给LLM，由LLM决定如何继续
+    """
+
+    def __init__(self):
+        """初始化记忆工具服务"""
+        self.execution_default = settings.MEMORY_TOOL_EXECUTION
+        self.max_rounds = max(1, settings.MEMORY_TOOL_MAX_ROUNDS)
+        self._handlers = {
+            "save_memory": self._save_memory,
+            "update_memory": self._update_memory,
+            "delete_memory": self._delete_memory,
+            "search_memories": self._search_memories,
+        }
+        logger.info(f"MemoryToolService initialized: execution_default={self.execution_default}, max_rounds={self.max_rounds}")
+
+    def apply_configuration(self, config_key: str, value: Dict[str, Any]):
+        """
+        应用配置变化（配置缓存的订阅者）
+
+        Args:
+            config_key: 配置键（memory_system）
+            value: 配置值
+        """
+        self.execution_default = value.get("tool_execution", self.execution_default)
+        self.max_rounds = max(1, value.get("tool_max_rounds", self.max_rounds))
+
+    def has_tool(self, tool_name: str) -> bool:
+        """
+        是否为记忆工具
+
+        Args:
+            tool_name: 工具名称
+
+        Returns:
+            是否为记忆工具
+        """
+        return tool_name in self._handlers
+
+    def merge_tools(self, tools: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        在请求的工具列表中补充缺少的记忆工具定义
+
+        Args:
+            tools: 请求中的工具列表
+
+        Returns:
+            合并后的工具列表
+        """
+        tools = list(tools or [])
+        names = {tool.get("function", {}).get("name") for tool in tools}
+        tools.extend(tool for tool in get_memory_tools() if tool["function"]["name"] not in names)
+        return tools
+
+    async def call_tool(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        persona_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        执行一个记忆工具
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+            persona_id: 记忆体ID；为空时保存和搜索使用默认记忆体，更新和删除不校验记忆所属的记忆体
+
+        Returns:
+            工具执行结果
+
+        Raises:
+            ValueError: 工具不存在或参数错误
+            LookupError: 记忆不存在
+            RuntimeError: 写入失败
+        """
+        handler = self._handlers.get(tool_name)
+        if handler is None:
+            raise ValueError(f"Tool not found: {tool_name}")
+        return await handler(arguments, persona_id)
+
+    async def execute_tool_calls(
+        self,
+        tool_calls: List[Dict[str, Any]],
+        persona_id: str
+    ) -> List[Dict[str, Any]]:
+        """
+        按顺序执行一轮工具调用，返回追加到对话中的 tool 消息
+
+        Args:
+            tool_calls: assistant 消息中的工具调用列表（均为记忆工具）
+            persona_id: 当前对话的记忆体ID
+
+        Returns:
+            tool 消息列表（与工具调用一一对应）
+        """
+        messages = []
+        for call in tool_calls:
+            function = call.get("function") or {}
+            tool_name = function.get("name", "")
+            try:
+                arguments = json.loads(function.get("arguments") or "{}")
+                if not isinstance(arguments, dict):
+                    raise ValueError("arguments must be a JSON object")
+                result = await self.call_tool(tool_name, arguments, persona_id)
+                if tool_name == "search_memories":
+                    result = {**result, "results": [
+                        {
+                            "memory_id": item.get("memory_id"),
+                            "content": item.get("content"),
+                            "event_time": item.get("event_time"),
+                            "score": item.get("final_score"),
+                        }
+                        for item in result["results"]
+                    ]}
+            except (ValueError, LookupError, RuntimeError) as e:
+                result = {"success": False, "error": str(e)}
+            except Exception as e:
+                logger.error(f"Memory tool {tool_name} failed: {e}")
+                result = {"success": False, "error": f"Tool execution failed: {e}"}
+
+            logger.info(f"Executed memory tool in-process: {tool_name} (persona={persona_id}, success={result.get('success')})")
+            messages.append({
+                "role": "tool",
+                "tool_call_id": call.get("id"),
+                "content": json.dumps(result, ensure_ascii=False, default=str)
+            })
+        return messages
+
+    async def _save_memory(self, arguments: Dict[str, Any], persona_id: Optional[str]) -> Dict[str, Any]:
+        """保存记忆"""
+        content = arguments.get("content")
+        if not content:
+            raise ValueError("content is required")
+
+        memory = await memory_service.create_memory(
+            memory_data=MemoryCreate(
+                persona_id=persona_id or settings.DEFAULT_PERSONA_ID,
+                vector_id=generate_id(),
+                type="long_term",
+                content=content,
+                entity_id=arguments.get("entity_id"),
+                metadata={"importance": arguments.get("importance", 5)}
+            ),
+            content=content
+        )
+        if not memory:
+            raise RuntimeError("Failed to create memory")
+
+        return {"success": True, "memory_id": memory.id, "message": "记忆已保存"}
+
+    async def _update_memory(self, arguments: Dict[str, Any], persona_id: Optional[str]) -> Dict[str, Any]:
+        """更新记忆"""
+        memory_id = arguments.get("memory_id")
+        new_content = arguments.get("new_content")
+        if not memory_id or not new_content:
+            raise ValueError("memory_id and new_content are required")
+
+        await self._check_owner(memory_id, persona_id)
+        memory = await memory_service.update_memory(
+            memory_id=memory_id,
+            memory_data=MemoryUpdate(content=new_content)
+        )
+        if not memory:
+            raise LookupError(f"Memory not found: {memory_id}")
+
+        return {"success": True, "memory_id": memory_id, "message": "记忆已更新"}
+
+    async def _delete_memory(self, arguments: Dict[str, Any], persona_id: Optional[str]) -> Dict[str, Any]:
+        """删除记忆"""
+        memory_id = arguments.get("memory_id")
+        if not memory_id:
+            raise ValueError("memory_id is required")
+
+        await self._check_owner(memory_id, persona_id)
+        if not await memory_service.delete_memory(memory_id):
+            raise LookupError(f"Memory not found: {memory_id}")
+
+        return {"success": True, "memory_id": memory_id, "message": "记忆已删除"}
+
+    async def _search_memories(self, arguments: Dict[str, Any], persona_id: Optional[str]) -> Dict[str, Any]:
+        """搜索记忆"""
+        query = arguments.get("query")
+        if not query:
+            raise ValueError("query is required")
+
+        results = await memory_service.search_memories(MemorySearchRequest(
+            query=query,
+            top_k=10,
+            metadata={"persona_id": persona_id or settings.DEFAULT_PERSONA_ID}
+        ))
+        return {"success": True, "results": results, "count": len(results)}
+
+    @staticmethod
+    async def _check_owner(memory_id: str, persona_id: Optional[str]):
+        """
+        校验记忆属于指定的记忆体（对话中LLM只能修改当前记忆体的记忆）
+
+        Args:
+            memory_id: 记忆ID
+            persona_id: 记忆体ID，为空时不校验
+
+        Raises:
+            LookupError: 记忆不存在或不属于该记忆体
+        """
+        if persona_id is None:
+            return
+        memory = await memory_service.get_memory(memory_id)
+        if memory is None or memory.persona_id != persona_id:
+            raise LookupError(f"Memory not found: {memory_id}")
+
+
+# 全局记忆工具服务实例 - 使用懒加载
+_memory_tool_service = None
+_memory_tool_service_lock = threading.Lock()
+
+
+def get_memory_tool_service() -> MemoryToolService:
+    """获取记忆工具服务实例（线程安全的懒加载）"""
+    global _memory_tool_service
+    if _memory_tool_service is None:
+        with _memory_tool_service_lock:
+            if _memory_tool_service is None:  # 双重检查锁定
+                _memory_tool_service = MemoryToolService()
+    return _memory_tool_service
+
+
+# 向后兼容的属性访问器
+class MemoryToolServiceProxy:
+    """记忆工具服务代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_memory_tool_service(), name)
+
+
+memory_tool_service = MemoryToolServiceProxy()
+
+# 配置接口修改 tool_execution / tool_max_rounds 后即时生效
+config_cache.subscribe(memory_tool_service.apply_configuration, ["memory_system"])
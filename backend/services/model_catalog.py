@@ -0,0 +1,173 @@
+"""
+模型列表目录
+缓存LLM供应商的模型列表（过期后在后台刷新，刷新期间继续返回旧列表），
+并预先生成记忆体与LLM模型组合后的模型列表快照（响应体与ETag），/models 请求不访问数据库和LLM供应商
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+from config import settings
+from core.llm_client import llm_client
+from services.config_cache import config_cache
+from services.persona_registry import persona_registry
+from utils.logger import logger
+
+
+# 获取模型列表失败时的重试间隔（秒）
+_FAILURE_RETRY_SECONDS = 30
+
+
+class ModelCatalog:
+    """
+    模型列表目录
+
+    快照以 (记忆体注册表版本, LLM模型列表版本) 为键，任一变化时在下一次请求时重建；
+    快照中保存完整列表的响应体和ETag，以及按模型ID定位分页起点的索引
+    """
+
+    def __init__(self, ttl: int = settings.MODELS_CACHE_TTL):
+        """
+        初始化模型列表目录
+
+        Args:
+            ttl: LLM供应商模型列表的缓存时间（秒）
+        """
+        self.ttl = max(1, ttl)
+        self._llm_models: Optional[List[Dict[str, Any]]] = None
+        self._llm_models_version = 0
+        self._expires_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._fetch_lock: Optional[asyncio.Lock] = None
+
+        self._snapshot_key: Optional[Tuple[int, int]] = None
+        self._data: List[Dict[str, Any]] = []
+        self._index: Dict[str, int] = {}
+        self._body = b""
+        self._etag = ""
+
+        logger.info(f"ModelCatalog initialized: ttl={self.ttl}s")
+
+    async def get_llm_models(self) -> List[Dict[str, Any]]:
+        """
+        获取LLM供应商的模型列表
+
+        首次调用时同步获取；过期后立即返回旧列表，并在后台刷新
+
+        Returns:
+            模型列表
+        """
+        if self._llm_models is None:
+            await self._fetch()
+        elif time.monotonic() >= self._expires_at and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return self._llm_models
+
+    def invalidate(self, config_key: str = "llm", value: Optional[Dict[str, Any]] = None):
+        """
+        丢弃缓存的LLM模型列表（LLM配置变化时调用，下一次请求重新获取）
+
+        Args:
+            config_key: 变化的配置键
+            value: 新配置值
+        """
+        self._llm_models = None
+        self._expires_at = 0.0
+
+    async def _fetch(self):
+        """从LLM供应商获取模型列表，失败时保留旧列表（没有旧列表时使用默认模型）"""
+        if self._fetch_lock is None:
+            self._fetch_lock = asyncio.Lock()
+
+        async with self._fetch_lock:
+            # 等待锁期间其他请求已经获取
+            if self._llm_models is not None and time.monotonic() < self._expires_at:
+                return
+
+            try:
+                models = await llm_client.list_models()
+                logger.info(f"Retrieved {len(models)} models from LLM provider")
+                expires_in = self.ttl
+            except Exception as e:
+                logger.warning(f"Failed to retrieve models from LLM provider: {e}")
+                # 如果无法获取LLM模型列表，使用默认模型
+                models = self._llm_models or [{
+                    "id": settings.LLM_MODEL,
+                    "object": "model",
+                    "created": int(datetime.now(timezone.utc).timestamp()),
+                    "owned_by": "llm_provider"
+                }]
+                expires_in = min(self.ttl, _FAILURE_RETRY_SECONDS)
+
+            if models != self._llm_models:
+                self._llm_models = models
+                self._llm_models_version += 1
+            self._expires_at = time.monotonic() + expires_in
+
+    async def snapshot(self) -> Tuple[List[Dict[str, Any]], Dict[str, int], bytes, str]:
+        """
+        获取模型列表快照（需要时重建）
+
+        Returns:
+            (模型列表, 模型ID到位置的索引, 完整列表的响应体, ETag)
+        """
+        llm_models = await self.get_llm_models()
+        personas = await persona_registry.list()
+        key = (persona_registry.version, self._llm_models_version)
+        if key == self._snapshot_key:
+            return self._data, self._index, self._body, self._etag
+
+        # 将记忆体与LLM模型组合
+        data = []
+        for persona in personas:
+            created = int(persona.created_at.timestamp()) if persona.created_at else 0
+            for llm_model in llm_models:
+                data.append({
+                    "id": f"{persona.id}/{llm_model['id']}",
+                    "object": "model",
+                    "created": created,
+                    "owned_by": "you"
+                })
+
+        body = json.dumps({"object": "list", "data": data, "has_more": False}, ensure_ascii=False).encode("utf-8")
+        self._data = data
+        self._index = {model["id"]: position for position, model in enumerate(data)}
+        self._body = body
+        self._etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self._snapshot_key = key
+
+        logger.info(f"Rebuilt models snapshot: {len(data)} combined models ({len(personas)} personas × {len(llm_models)} LLM models)")
+        return self._data, self._index, self._body, self._etag
+
+
+# 全局模型列表目录实例 - 使用懒加载
+_model_catalog = None
+_model_catalog_lock = threading.Lock()
+
+
+def get_model_catalog() -> ModelCatalog:
+    """获取模型列表目录实例（线程安全的懒加载）"""
+    global _model_catalog
+    if _model_catalog is None:
+        with _model_catalog_lock:
+            if _model_catalog is None:  # 双重检查锁定
+                _model_catalog = ModelCatalog()
+    return _model_catalog
+
+
+# 向后兼容的属性访问器
+class ModelCatalogProxy:
+    """模型列表目录代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_model_catalog(), name)
+
+
+model_catalog = ModelCatalogProxy()
+
+# LLM配置修改后（base_url、api_key可能已经指向其他供应商）重新获取模型列表
+config_cache.subscribe(model_catalog.invalidate, ["llm"])
@@ -0,0 +1,175 @@
+"""
+记忆体注册表
+进程内缓存全部记忆体，对话热路径读取记忆体（system_prompt）不再访问数据库；
+记忆体的增删改经记忆体服务写穿更新注册表，其他工作进程的修改由定期整体重新加载感知
+"""
+from typing import Dict, List, Optional
+from datetime import datetime
+import asyncio
+import threading
+
+from config import settings
+from models.database import Persona, async_read_session
+from repositories.persona_repository import PersonaRepository
+from utils.logger import logger
+
+
+def _detach(persona: Persona) -> Persona:
+    """复制为不关联会话的记忆体对象（注册表中的对象不会被会话过期或修改）"""
+    return Persona(
+        id=persona.id,
+        description=persona.description,
+        system_prompt=persona.system_prompt,
+        created_at=persona.created_at,
+        updated_at=persona.updated_at
+    )
+
+
+class PersonaRegistry:
+    """
+    记忆体注册表
+
+    注册表内容每次变化时递增 version，模型列表快照据此判断是否需要重建。
+    注册表中不存在的记忆体会回源查询一次（其他工作进程刚创建的记忆体无需等待下一次整体刷新）
+    """
+
+    def __init__(self, refresh_interval: float = settings.PERSONA_REGISTRY_REFRESH_SECONDS):
+        """
+        初始化记忆体注册表
+
+        Args:
+            refresh_interval: 整体重新加载的间隔（秒）
+        """
+        self.refresh_interval = max(1.0, refresh_interval)
+        self.version = 0
+        self._personas: Dict[str, Persona] = {}
+        self._loaded = False
+        self._writes = 0
+        self._task: Optional[asyncio.Task] = None
+
+        logger.info(f"PersonaRegistry initialized: refresh_interval={self.refresh_interval}s")
+
+    async def get(self, persona_id: str) -> Optional[Persona]:
+        """
+        获取记忆体（命中注册表时不访问数据库）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            记忆体对象（只读副本），不存在时返回None
+        """
+        if not self._loaded:
+            await self.load()
+
+        persona = self._personas.get(persona_id)
+        if persona is not None:
+            return persona
+
+        async with async_read_session() as db:
+            persona = await PersonaRepository(db).get(persona_id)
+        if persona is None:
+            return None
+        self.put(persona)
+        return self._personas[persona_id]
+
+    async def list(self) -> List[Persona]:
+        """
+        按更新时间倒序列出全部记忆体
+
+        Returns:
+            记忆体列表（只读副本）
+        """
+        if not self._loaded:
+            await self.load()
+        return sorted(self._personas.values(), key=lambda persona: persona.updated_at or datetime.min, reverse=True)
+
+    def put(self, persona: Persona):
+        """
+        写入或覆盖记忆体（记忆体创建、更新后调用）
+
+        Args:
+            persona: 记忆体对象
+        """
+        self._personas[persona.id] = _detach(persona)
+        self._writes += 1
+        self.version += 1
+
+    def remove(self, persona_id: str):
+        """
+        移除记忆体（记忆体删除后调用）
+
+        Args:
+            persona_id: 记忆体ID
+        """
+        self._writes += 1
+        if self._personas.pop(persona_id, None) is not None:
+            self.version += 1
+
+    async def load(self):
+        """从数据库整体加载记忆体（加载期间有写穿更新时放弃本次结果，等待下一次刷新）"""
+        writes = self._writes
+        async with async_read_session() as db:
+            personas = await PersonaRepository(db).list()
+
+        if self._loaded and writes != self._writes:
+            return
+
+        personas = {persona.id: _detach(persona) for persona in personas}
+        if personas.keys() != self._personas.keys() or any(
+            persona.updated_at != self._personas[persona_id].updated_at
+            for persona_id, persona in personas.items()
+        ):
+            self.version += 1
+        self._personas = personas
+        self._loaded = True
+
+    def start(self):
+        """启动定期重新加载"""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._refresh_loop())
+        logger.info(f"Persona registry refresh started: interval={self.refresh_interval}s")
+
+    async def stop(self):
+        """停止定期重新加载"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _refresh_loop(self):
+        """定期整体重新加载记忆体"""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Failed to refresh persona registry: {e}")
+
+
+# 全局记忆体注册表实例 - 使用懒加载
+_persona_registry = None
+_persona_registry_lock = threading.Lock()
+
+
+def get_persona_registry() -> PersonaRegistry:
+    """获取记忆体注册表实例（线程安全的懒加载）"""
+    global _persona_registry
+    if _persona_registry is None:
+        with _persona_registry_lock:
+            if _persona_registry is None:  # 双重检查锁定
+                _persona_registry = PersonaRegistry()
+    return _persona_registry
+
+
+# 向后兼容的属性访问器
+class PersonaRegistryProxy:
+    """记忆体注册表代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_persona_registry(), name)
+
+
+persona_registry = PersonaRegistryProxy()
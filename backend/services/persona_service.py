@@ -1,14 +1,26 @@
 """
 记忆体服务
 """
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime, timezone
 
-from models.database import SessionLocal, Persona, Memory
+from models.database import Persona, async_session_scope, async_read_session
+from models.db_writer import db_writer
+from repositories.persona_repository import PersonaRepository
+from repositories.memory_repository import MemoryRepository
 from models.schemas import PersonaCreate, PersonaUpdate, PersonaResponse
 from utils.logger import logger
 from utils.helpers import generate_id
 from memory.vector_store import vector_store
+from memory.graph_store import graph_store
+from memory.cold_store import cold_store
+from memory.dedup_index import memory_dedup_index
+from services.job_queue import job_queue
+from services.persona_registry import persona_registry
+
+
+# 记忆体删除任务在任务队列中的类型
+PERSONA_DELETION_JOB_KIND = "persona_deletion"
 
 
 class PersonaService:
@@ -18,8 +30,7 @@ class PersonaService:
     """
 
     def __init__(self):
-        """初始化记忆体服务"""
-        self.db = SessionLocal()
+        """初始化记忆体服务（不持有长期会话，写操作使用当前工作单元的会话，查询使用短生命周期会话）"""
         logger.info("PersonaService initialized")
 
     async def create_persona(self, persona_data: PersonaCreate) -> Optional[Persona]:
@@ -39,31 +50,33 @@ class PersonaService:
                 system_prompt=persona_data.system_prompt
             )
 
-            self.db.add(persona)
-            self.db.commit()
-            self.db.refresh(persona)
+            async with async_session_scope() as db:
+                try:
+                    await PersonaRepository(db).add(persona)
+                except Exception:
+                    await db.rollback()
+                    raise
 
+            persona_registry.put(persona)
             logger.info(f"Created persona: id={persona.id}")
             return persona
 
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to create persona: {e}")
             return None
 
     async def get_persona(self, persona_id: str) -> Optional[Persona]:
         """
-        获取记忆体
+        获取记忆体（从记忆体注册表读取，命中时不访问数据库）
 
         Args:
             persona_id: 记忆体ID
 
         Returns:
-            记忆体对象
+            记忆体对象（只读副本）
         """
         try:
-            persona = self.db.query(Persona).filter(Persona.id == persona_id).first()
-            return persona
+            return await persona_registry.get(persona_id)
         except Exception as e:
             logger.error(f"Failed to get persona: {e}")
             return None
@@ -79,9 +92,8 @@ class PersonaService:
             记忆体列表
         """
         try:
-            personas = self.db.query(Persona).order_by(
-                Persona.updated_at.desc()
-            ).limit(limit).all()
+            async with async_read_session() as db:
+                personas = await PersonaRepository(db).list(limit=limit)
 
             logger.debug(f"Listed {len(personas)} personas")
             return personas
@@ -102,71 +114,102 @@ class PersonaService:
             更新后的记忆体对象
         """
         try:
-            persona = self.db.query(Persona).filter(Persona.id == persona_id).first()
+            async with async_session_scope() as db:
+                persona = await PersonaRepository(db).get(persona_id)
 
-            if not persona:
-                return None
+                if not persona:
+                    return None
 
-            # 更新字段
-            if persona_data.description is not None:
-                persona.description = persona_data.description
-            if persona_data.system_prompt is not None:
-                persona.system_prompt = persona_data.system_prompt
+                # 更新字段
+                if persona_data.description is not None:
+                    persona.description = persona_data.description
+                if persona_data.system_prompt is not None:
+                    persona.system_prompt = persona_data.system_prompt
 
-            persona.updated_at = datetime.now()  # 使用本地时间（北京时间）
+                persona.updated_at = datetime.now()  # 使用本地时间（北京时间）
 
-            self.db.commit()
-            self.db.refresh(persona)
+                try:
+                    await db.flush()
+                except Exception:
+                    await db.rollback()
+                    raise
 
+            persona_registry.put(persona)
             logger.info(f"Updated persona: id={persona_id}")
             return persona
 
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Failed to update persona: {e}")
             return None
 
-    async def delete_persona(self, persona_id: str) -> bool:
+    async def delete_persona(self, persona_id: str) -> Optional[Dict[str, Any]]:
         """
-        删除记忆体（包括相关的记忆和向量）
+        删除记忆体及其全部数据（包括记忆、向量、冷存储归档和图谱实体）
+
+        每种存储一条按记忆体过滤的批量删除，不逐条加载记忆；记忆体记录最后删除，
+        中途失败时任务重试会从头再执行一遍（各步骤均可重复执行）
 
         Args:
             persona_id: 记忆体ID
 
         Returns:
-            是否成功
+            删除统计，记忆体不存在时返回None
         """
-        try:
-            persona = self.db.query(Persona).filter(Persona.id == persona_id).first()
+        async with async_read_session() as db:
+            persona = await PersonaRepository(db).get(persona_id)
+        if not persona:
+            return None
 
-            if not persona:
-                return False
+        result: Dict[str, Any] = {"persona_id": persona_id}
 
-            # 删除相关的记忆和向量
-            memories = self.db.query(Memory).filter(Memory.persona_id == persona_id).all()
+        async def report(stage: str):
+            await job_queue.report_progress({**result, "stage": stage})
 
-            for memory in memories:
-                # 删除向量存储中的向量
-                await vector_store.delete_vector(memory.vector_id)
+        # 1. 向量：一次按表达式删除，同时移除本地索引文件
+        result["vectors_deleted"] = await vector_store.delete_persona(persona_id)
+        await report("vectors")
 
-                # 删除记忆记录
-                self.db.delete(memory)
+        # 2. 记忆、指纹、全精度向量：一个事务中每张表一条DELETE
+        result["memories_deleted"] = await db_writer.submit(
+            lambda db: MemoryRepository(db).delete_by_persona(persona_id)
+        )
+        await report("memories")
 
-            # 删除人格记录
-            self.db.delete(persona)
-            self.db.commit()
+        # 3. 冷存储归档及其向量文件
+        result["cold_memories_deleted"] = await cold_store.delete_persona(persona_id)
+        await report("cold_store")
 
-            logger.info(f"Deleted persona: id={persona_id}, memories={len(memories)}")
-            return True
+        # 4. 图谱实体及其关系
+        result["entities_deleted"] = await graph_store.delete_persona(persona_id)
+        await report("graph")
 
-        except Exception as e:
-            self.db.rollback()
-            logger.error(f"Failed to delete persona: {e}")
-            return False
+        # 5. 进程内去重索引和记忆体记录
+        memory_dedup_index.drop_persona(persona_id)
+        await db_writer.submit(lambda db: PersonaRepository(db).delete(persona_id))
+        persona_registry.remove(persona_id)
+        await report("done")
+
+        logger.info(f"Deleted persona: {result}")
+        return result
+
+    async def enqueue_deletion(self, persona_id: str) -> Optional[str]:
+        """
+        提交记忆体删除任务到任务队列（与该记忆体的其他任务串行执行）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            任务ID
+        """
+        return await job_queue.enqueue(
+            kind=PERSONA_DELETION_JOB_KIND,
+            payload={"persona_id": persona_id},
+            serial_key=persona_id
+        )
 
     def close(self):
-        """关闭数据库连接"""
-        self.db.close()
+        """关闭服务（不持有长期会话）"""
         logger.info("PersonaService closed")
 
 
@@ -191,3 +234,22 @@ class PersonaServiceProxy:
 
 
 persona_service = PersonaServiceProxy()
+
+
+async def _run_persona_deletion_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    任务队列中记忆体删除任务的处理函数
+
+    Args:
+        payload: 任务参数
+
+    Returns:
+        任务结果
+    """
+    result = await get_persona_service().delete_persona(payload["persona_id"])
+    if result is None:
+        return {"persona_id": payload["persona_id"], "stage": "not_found"}
+    return {**result, "stage": "done"}
+
+
+job_queue.register_handler(PERSONA_DELETION_JOB_KIND, _run_persona_deletion_job)
@@ -0,0 +1,392 @@
+"""
+跨存储对账服务
+以SQLite中的记忆记录为准，按ID有序归并扫描比对向量库（Milvus）和图谱（KùzuDB），
+补写缺失的向量、回收孤立的向量和实体
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import threading
+
+from sqlalchemy import select
+
+from config import settings
+from models.database import Memory, Persona, StoreOutboxEntry, async_read_session
+from models.db_writer import db_writer
+from repositories.outbox_repository import OutboxRepository
+from memory.vector_store import vector_store
+from memory.graph_store import graph_store
+from services.job_queue import job_queue
+from services.store_outbox import store_outbox, vector_upsert_entry, vector_delete_entry
+from utils.helpers import get_current_timestamp_ms, datetime_to_ms
+from utils.logger import logger
+
+
+# 跨存储对账任务在任务队列中的类型
+RECONCILE_JOB_KIND = "store_reconcile"
+
+
+def _bucket_prefixes(length: int) -> List[str]:
+    """向量ID（UUID）的前缀分桶，length为0时只有一个覆盖全部ID的桶"""
+    length = max(0, min(length, 4))
+    if length == 0:
+        return [""]
+    return [format(index, f"0{length}x") for index in range(16 ** length)]
+
+
+class ReconcileService:
+    """
+    跨存储对账服务
+
+    向量：按向量ID前缀分桶，每桶从SQL按 vector_id 顺序读取热存储记忆、从Milvus读取同前缀的ID并排序，
+    归并扫描得到只在SQL中的记忆（补写向量）和只在Milvus中的向量（回收），内存占用只与单桶大小有关。
+    图谱：按实体ID顺序分页读取，与SQL中的记忆体和记忆引用的实体ID归并比对，回收所属记忆体已不存在的实体。
+    修复和回收都经发件箱执行，与正常写入路径使用相同的幂等操作；宽限期内新写入的记录和仍有待执行发件箱操作的ID不处理
+    """
+
+    def __init__(self, batch_size: int = settings.MEMORY_RECONCILE_BATCH_SIZE):
+        """
+        初始化对账服务
+
+        Args:
+            batch_size: 每批修复或回收的记录数
+        """
+        self.batch_size = max(1, batch_size)
+        self._scheduler_task: Optional[asyncio.Task] = None
+        logger.info(f"ReconcileService initialized: batch_size={self.batch_size}")
+
+    async def reconcile(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        比对三个存储并修复差异
+
+        Args:
+            dry_run: 是否只统计差异（不修改数据）
+
+        Returns:
+            对账结果：buckets, memories_checked, vectors_checked, missing_vectors, orphan_vectors,
+            entities_checked, orphan_entities, dangling_entity_refs, repaired, collected
+        """
+        stats = {
+            "dry_run": dry_run,
+            "buckets": 0,
+            "memories_checked": 0,
+            "vectors_checked": 0,
+            "missing_vectors": 0,
+            "orphan_vectors": 0,
+            "entities_checked": 0,
+            "orphan_entities": 0,
+            "dangling_entity_refs": 0,
+            "repaired": 0,
+            "collected": 0,
+        }
+
+        await self._reconcile_vectors(stats, dry_run)
+        await self._reconcile_entities(stats, dry_run)
+
+        logger.info(f"Store reconciliation finished: {stats}")
+        return stats
+
+    async def _reconcile_vectors(self, stats: Dict[str, Any], dry_run: bool):
+        """
+        按前缀分桶归并比对SQL记忆记录和Milvus向量
+
+        Args:
+            stats: 对账统计（原地累加）
+            dry_run: 是否只统计差异
+        """
+        grace = settings.MEMORY_RECONCILE_GRACE_SECONDS
+        cutoff = datetime.now() - timedelta(seconds=grace)
+        cutoff_ms = get_current_timestamp_ms() - int(grace * 1000)
+
+        prefixes = _bucket_prefixes(settings.MEMORY_RECONCILE_PREFIX_LENGTH)
+        missing: List[str] = []
+        orphans: List[str] = []
+
+        for prefix in prefixes:
+            statement = select(Memory.vector_id, Memory.created_at).order_by(Memory.vector_id)
+            if prefix:
+                # 范围条件可以使用vector_id索引（LIKE在SQLite中默认不区分大小写，不走索引）
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                statement = statement.where(Memory.vector_id >= prefix, Memory.vector_id < upper)
+            async with async_read_session() as db:
+                sql_rows: List[Tuple[str, Optional[datetime]]] = (await db.execute(statement)).all()
+            vector_rows = vector_store.list_ids(prefix)
+
+            stats["buckets"] += 1
+            stats["memories_checked"] += len(sql_rows)
+            stats["vectors_checked"] += len(vector_rows)
+
+            # 两侧都按ID升序，一次归并得到差集
+            i = j = 0
+            while i < len(sql_rows) or j < len(vector_rows):
+                if j == len(vector_rows) or (i < len(sql_rows) and sql_rows[i][0] < vector_rows[j][0]):
+                    vector_id, created_at = sql_rows[i]
+                    if created_at is None or created_at < cutoff:
+                        missing.append(vector_id)
+                    i += 1
+                elif i == len(sql_rows) or vector_rows[j][0] < sql_rows[i][0]:
+                    vector_id, created_at_ms = vector_rows[j]
+                    if not created_at_ms or created_at_ms < cutoff_ms:
+                        orphans.append(vector_id)
+                    j += 1
+                else:
+                    vector_id = sql_rows[i][0]
+                    while i < len(sql_rows) and sql_rows[i][0] == vector_id:
+                        i += 1
+                    j += 1
+
+            if len(missing) >= self.batch_size:
+                await self._repair_vectors(missing, stats, dry_run)
+                missing = []
+            if len(orphans) >= self.batch_size:
+                await self._collect_vectors(orphans, stats, dry_run)
+                orphans = []
+
+            await job_queue.report_progress({
+                "stage": "vectors",
+                "buckets_done": stats["buckets"],
+                "buckets_total": len(prefixes),
+                "missing_vectors": stats["missing_vectors"],
+                "orphan_vectors": stats["orphan_vectors"],
+            })
+
+        await self._repair_vectors(missing, stats, dry_run)
+        await self._collect_vectors(orphans, stats, dry_run)
+
+    async def _repair_vectors(self, vector_ids: List[str], stats: Dict[str, Any], dry_run: bool):
+        """
+        为缺少向量的记忆补写向量（优先复用保存的全精度向量，否则执行时重新向量化）
+
+        Args:
+            vector_ids: 缺少向量的向量ID列表
+            stats: 对账统计（原地累加）
+            dry_run: 是否只统计差异
+        """
+        vector_ids = await self._skip_pending(vector_ids)
+        stats["missing_vectors"] += len(vector_ids)
+        if dry_run or not vector_ids:
+            return
+
+        for start in range(0, len(vector_ids), self.batch_size):
+            batch = vector_ids[start:start + self.batch_size]
+            async with async_read_session() as db:
+                memories = list((await db.execute(select(Memory).where(Memory.vector_id.in_(batch)))).scalars())
+            embeddings = await vector_store.get_embeddings([memory.vector_id for memory in memories])
+            entries = [
+                vector_upsert_entry(
+                    vector_id=memory.vector_id,
+                    persona_id=memory.persona_id,
+                    content=memory.content,
+                    embedding=embeddings.get(memory.vector_id),
+                    entity_id=memory.entity_id,
+                    metadata=memory.get_metadata(),
+                    created_at=datetime_to_ms(memory.created_at) or None,
+                    last_accessed_at=datetime_to_ms(memory.last_accessed_at) or None,
+                    access_count=memory.access_count or 0
+                )
+                for memory in memories
+            ]
+            if await self._submit(entries):
+                stats["repaired"] += len(entries)
+
+    async def _collect_vectors(self, vector_ids: List[str], stats: Dict[str, Any], dry_run: bool):
+        """
+        回收没有对应记忆记录的向量
+
+        Args:
+            vector_ids: 孤立的向量ID列表
+            stats: 对账统计（原地累加）
+            dry_run: 是否只统计差异
+        """
+        vector_ids = await self._skip_pending(vector_ids)
+        stats["orphan_vectors"] += len(vector_ids)
+        if dry_run or not vector_ids:
+            return
+
+        for start in range(0, len(vector_ids), self.batch_size):
+            entries = [vector_delete_entry(vector_id) for vector_id in vector_ids[start:start + self.batch_size]]
+            if await self._submit(entries):
+                stats["collected"] += len(entries)
+
+    async def _reconcile_entities(self, stats: Dict[str, Any], dry_run: bool):
+        """
+        按实体ID顺序比对图谱实体和SQL中的记忆体、记忆引用
+
+        实体ID为 '名称|记忆体ID'，所属记忆体已不存在的实体为孤立实体；
+        记忆引用但图谱中不存在的实体只统计，不修改记忆
+
+        Args:
+            stats: 对账统计（原地累加）
+            dry_run: 是否只统计差异
+        """
+        async with async_read_session() as db:
+            persona_ids = set((await db.execute(select(Persona.id))).scalars())
+            referenced = list((await db.execute(
+                select(Memory.entity_id).where(Memory.entity_id.isnot(None)).distinct().order_by(Memory.entity_id)
+            )).scalars())
+
+        orphans: List[str] = []
+        ref_index = 0
+        after = None
+        while True:
+            entity_ids = graph_store.list_entity_ids(after, self.batch_size)
+            if not entity_ids:
+                break
+            stats["entities_checked"] += len(entity_ids)
+
+            for entity_id in entity_ids:
+                # 记忆引用的实体ID与图谱实体ID同序归并
+                while ref_index < len(referenced) and referenced[ref_index] < entity_id:
+                    stats["dangling_entity_refs"] += 1
+                    ref_index += 1
+                if ref_index < len(referenced) and referenced[ref_index] == entity_id:
+                    ref_index += 1
+
+                _, separator, persona_id = entity_id.rpartition("|")
+                if separator and persona_id not in persona_ids:
+                    orphans.append(entity_id)
+
+            if len(orphans) >= self.batch_size:
+                await self._collect_entities(orphans, stats, dry_run)
+                orphans = []
+            after = entity_ids[-1]
+
+            await job_queue.report_progress({
+                "stage": "entities",
+                "entities_checked": stats["entities_checked"],
+                "orphan_entities": stats["orphan_entities"],
+            })
+
+        stats["dangling_entity_refs"] += len(referenced) - ref_index
+        await self._collect_entities(orphans, stats, dry_run)
+
+    async def _collect_entities(self, entity_ids: List[str], stats: Dict[str, Any], dry_run: bool):
+        """
+        回收所属记忆体已不存在的实体及其关系
+
+        Args:
+            entity_ids: 孤立的实体ID列表
+            stats: 对账统计（原地累加）
+            dry_run: 是否只统计差异
+        """
+        stats["orphan_entities"] += len(entity_ids)
+        if dry_run or not entity_ids:
+            return
+        stats["collected"] += await graph_store.delete_entities(entity_ids)
+
+    async def _skip_pending(self, target_ids: List[str]) -> List[str]:
+        """
+        去掉仍有待执行发件箱操作的ID（由发件箱补偿处理，不重复修复）
+
+        Args:
+            target_ids: 目标ID列表
+
+        Returns:
+            没有待执行操作的目标ID列表
+        """
+        if not target_ids:
+            return []
+        pending = set()
+        async with async_read_session() as db:
+            repository = OutboxRepository(db)
+            for start in range(0, len(target_ids), self.batch_size):
+                pending |= await repository.pending_targets(target_ids[start:start + self.batch_size])
+        return [target_id for target_id in target_ids if target_id not in pending]
+
+    async def _submit(self, entries: List[StoreOutboxEntry]) -> bool:
+        """
+        写入发件箱并立即执行（失败的操作由发件箱后台补偿）
+
+        Args:
+            entries: 发件箱记录列表
+
+        Returns:
+            是否全部执行成功
+        """
+        if not entries:
+            return True
+        await db_writer.submit(lambda db: OutboxRepository(db).add(entries))
+        return await store_outbox.apply(entries)
+
+    async def enqueue(self, dry_run: bool = False) -> Optional[str]:
+        """
+        提交对账任务到任务队列（对账任务之间串行执行）
+
+        Args:
+            dry_run: 是否只统计差异
+
+        Returns:
+            任务ID
+        """
+        return await job_queue.enqueue(
+            kind=RECONCILE_JOB_KIND,
+            payload={"dry_run": dry_run},
+            serial_key=RECONCILE_JOB_KIND
+        )
+
+    def start_scheduler(self):
+        """启动定期对账（MEMORY_RECONCILE_INTERVAL_HOURS 大于0时生效）"""
+        if settings.MEMORY_RECONCILE_INTERVAL_HOURS <= 0 or self._scheduler_task is not None:
+            return
+        self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+        logger.info(f"Reconcile scheduler started: interval={settings.MEMORY_RECONCILE_INTERVAL_HOURS}h")
+
+    async def stop_scheduler(self):
+        """停止定期对账"""
+        if self._scheduler_task is None:
+            return
+        self._scheduler_task.cancel()
+        await asyncio.gather(self._scheduler_task, return_exceptions=True)
+        self._scheduler_task = None
+
+    async def _scheduler_loop(self):
+        """定期提交对账任务"""
+        interval = settings.MEMORY_RECONCILE_INTERVAL_HOURS * 3600
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.enqueue()
+            except Exception as e:
+                logger.error(f"Failed to enqueue scheduled reconcile job: {e}")
+
+
+# 全局对账服务实例 - 使用懒加载
+_reconcile_service = None
+_reconcile_service_lock = threading.Lock()
+
+
+def get_reconcile_service() -> ReconcileService:
+    """获取对账服务实例（线程安全的懒加载）"""
+    global _reconcile_service
+    if _reconcile_service is None:
+        with _reconcile_service_lock:
+            if _reconcile_service is None:  # 双重检查锁定
+                _reconcile_service = ReconcileService()
+    return _reconcile_service
+
+
+# 向后兼容的属性访问器
+class ReconcileServiceProxy:
+    """对账服务代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_reconcile_service(), name)
+
+
+reconcile_service = ReconcileServiceProxy()
+
+
+async def _run_reconcile_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    任务队列中跨存储对账任务的处理函数
+
+    Args:
+        payload: 任务参数
+
+    Returns:
+        任务结果
+    """
+    return await get_reconcile_service().reconcile(dry_run=bool(payload.get("dry_run")))
+
+
+job_queue.register_handler(RECONCILE_JOB_KIND, _run_reconcile_job)
@@ -0,0 +1,386 @@
+"""
+跨存储写入发件箱
+记忆记录的变更与对应的向量库/图谱操作在同一个SQL事务中提交（SQLite为权威数据源），
+提交后立即执行这些操作；执行失败的操作留在发件箱中，由后台补偿任务按退避间隔重试
+"""
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+import asyncio
+import json
+import threading
+
+import numpy as np
+from sqlalchemy import select
+
+from config import settings
+from models.database import StoreOutboxEntry, Memory, ColdMemory, async_read_session
+from models.db_writer import db_writer
+from repositories.outbox_repository import OutboxRepository
+from memory.vector_store import vector_store
+from memory.graph_store import graph_store
+from core.embedding_client import embedding_client
+from utils.logger import logger
+
+
+# 发件箱操作类型
+OUTBOX_VECTOR_UPSERT = "vector_upsert"  # 按向量ID写入或覆盖向量
+OUTBOX_VECTOR_DELETE = "vector_delete"  # 按向量ID删除向量
+OUTBOX_ENTITY_RELEASE = "entity_release"  # 实体不再被任何记忆引用时删除实体及其关系
+
+
+def _retry_at(attempts: int = 0) -> datetime:
+    """第attempts次失败后的下次补偿时间（指数退避，最长约1小时）"""
+    delay = settings.MEMORY_OUTBOX_RETRY_SECONDS * (2 ** min(attempts, 7))
+    return datetime.now() + timedelta(seconds=min(delay, 3600))
+
+
+def vector_upsert_entry(
+    vector_id: str,
+    persona_id: str,
+    content: str,
+    embedding: Optional[List[float]] = None,
+    entity_id: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    created_at: Optional[int] = None,
+    last_accessed_at: Optional[int] = None,
+    access_count: int = 0
+) -> StoreOutboxEntry:
+    """
+    构造写入向量的发件箱操作
+
+    Args:
+        vector_id: 向量ID
+        persona_id: 记忆体ID
+        content: 内容
+        embedding: 向量（为空时执行时重新向量化）
+        entity_id: 实体ID
+        metadata: 元数据
+        created_at: 创建时间（毫秒时间戳）
+        last_accessed_at: 最近访问时间（毫秒时间戳）
+        access_count: 访问次数
+
+    Returns:
+        发件箱记录（未写入数据库）
+    """
+    return StoreOutboxEntry(
+        op=OUTBOX_VECTOR_UPSERT,
+        target_id=vector_id,
+        persona_id=persona_id,
+        payload=json.dumps({
+            "content": content,
+            "entity_id": entity_id,
+            "metadata": metadata,
+            "created_at": created_at,
+            "last_accessed_at": last_accessed_at,
+            "access_count": access_count,
+        }),
+        embedding=np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None,
+        next_run_at=_retry_at()
+    )
+
+
+def vector_delete_entry(vector_id: str, persona_id: Optional[str] = None) -> StoreOutboxEntry:
+    """
+    构造删除向量的发件箱操作
+
+    Args:
+        vector_id: 向量ID
+        persona_id: 记忆体ID
+
+    Returns:
+        发件箱记录（未写入数据库）
+    """
+    return StoreOutboxEntry(
+        op=OUTBOX_VECTOR_DELETE,
+        target_id=vector_id,
+        persona_id=persona_id,
+        next_run_at=_retry_at()
+    )
+
+
+def entity_release_entry(entity_id: str, persona_id: Optional[str] = None) -> StoreOutboxEntry:
+    """
+    构造释放实体的发件箱操作（执行时实体仍被其他记忆引用则保留）
+
+    Args:
+        entity_id: 实体ID
+        persona_id: 记忆体ID
+
+    Returns:
+        发件箱记录（未写入数据库）
+    """
+    return StoreOutboxEntry(
+        op=OUTBOX_ENTITY_RELEASE,
+        target_id=entity_id,
+        persona_id=persona_id,
+        next_run_at=_retry_at()
+    )
+
+
+class StoreOutbox:
+    """
+    跨存储写入发件箱
+
+    操作按发件箱ID（即SQL提交顺序）执行，相邻的同类操作合并为一次向量库/图谱调用；
+    所有操作都按ID幂等（upsert、按ID删除），立即执行与后台补偿重复执行时结果相同。
+    新写入的操作在一个重试间隔后才对后台补偿可见，正常情况下只由写入方立即执行一次
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.MEMORY_OUTBOX_BATCH_SIZE,
+        poll_interval: float = settings.MEMORY_OUTBOX_POLL_INTERVAL
+    ):
+        """
+        初始化发件箱
+
+        Args:
+            batch_size: 后台补偿每批执行的操作数
+            poll_interval: 后台补偿检查发件箱的间隔（秒）
+        """
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = max(0.1, poll_interval)
+        self._task: Optional[asyncio.Task] = None
+        self._drain_lock: Optional[asyncio.Lock] = None
+
+        self._applied = 0
+        self._failed = 0
+
+        logger.info(f"StoreOutbox initialized: batch_size={self.batch_size}, poll_interval={self.poll_interval}s")
+
+    async def apply(self, entries: List[StoreOutboxEntry]) -> bool:
+        """
+        执行已提交的发件箱操作，成功的从发件箱删除
+
+        某一组操作失败时，它和其后的操作都推迟到后台补偿，保证同一目标的操作按提交顺序执行
+
+        Args:
+            entries: 已写入数据库（带自增ID）的发件箱记录
+
+        Returns:
+            是否全部执行成功
+        """
+        if not entries:
+            return True
+
+        entries = sorted(entries, key=lambda entry: entry.id)
+        done: List[int] = []
+        failed: List[StoreOutboxEntry] = []
+        error = None
+
+        start = 0
+        while start < len(entries):
+            end = start
+            while end < len(entries) and entries[end].op == entries[start].op:
+                end += 1
+            run = entries[start:end]
+            try:
+                await self._apply_run(run[0].op, run)
+                done.extend(entry.id for entry in run)
+            except Exception as e:
+                error = f"{run[0].op}: {e}"
+                failed = entries[start:]
+                break
+            start = end
+
+        self._applied += len(done)
+        self._failed += len(failed)
+
+        async def settle(db):
+            repository = OutboxRepository(db)
+            await repository.delete(done)
+            if failed:
+                await repository.defer(
+                    [entry.id for entry in failed],
+                    error,
+                    _retry_at(max(entry.attempts or 0 for entry in failed) + 1)
+                )
+
+        await db_writer.submit(settle)
+
+        if failed:
+            logger.warning(f"Deferred {len(failed)} outbox operations: {error}")
+        return not failed
+
+    async def _apply_run(self, op: str, entries: List[StoreOutboxEntry]):
+        """
+        执行一组相邻的同类操作
+
+        Args:
+            op: 操作类型
+            entries: 发件箱记录列表
+
+        Raises:
+            Exception: 向量库或图谱操作失败
+        """
+        if op == OUTBOX_VECTOR_UPSERT:
+            await self._upsert_vectors(entries)
+        elif op == OUTBOX_VECTOR_DELETE:
+            if not await vector_store.delete_vectors(list(dict.fromkeys(entry.target_id for entry in entries))):
+                raise RuntimeError("vector delete failed")
+        elif op == OUTBOX_ENTITY_RELEASE:
+            await self._release_entities(entries)
+        else:
+            logger.warning(f"Dropping {len(entries)} outbox operations of unknown type: {op}")
+
+    async def _upsert_vectors(self, entries: List[StoreOutboxEntry]):
+        """
+        写入或覆盖向量（记忆记录已被删除的跳过，避免补偿时复活已删除的向量）
+
+        Args:
+            entries: vector_upsert 发件箱记录列表
+        """
+        # 同一向量有多次写入时只保留最后一次
+        latest = {entry.target_id: entry for entry in entries}
+        async with async_read_session() as db:
+            result = await db.execute(select(Memory.vector_id).where(Memory.vector_id.in_(list(latest))))
+            alive = set(result.scalars())
+        entries = [entry for vector_id, entry in latest.items() if vector_id in alive]
+        if not entries:
+            return
+
+        payloads = [entry.get_payload() for entry in entries]
+        embeddings = [
+            np.frombuffer(entry.embedding, dtype=np.float32).tolist() if entry.embedding else None
+            for entry in entries
+        ]
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            vectors = await embedding_client.embed_batch([payloads[index]["content"] for index in missing])
+            for index, vector in zip(missing, vectors):
+                embeddings[index] = vector
+
+        items = [
+            {
+                "id": entry.target_id,
+                "persona_id": entry.persona_id,
+                "content": payload["content"],
+                "embedding": embedding,
+                "entity_id": payload.get("entity_id"),
+                "metadata": payload.get("metadata"),
+                "created_at": payload.get("created_at"),
+                "last_accessed_at": payload.get("last_accessed_at"),
+                "access_count": payload.get("access_count") or 0,
+            }
+            for entry, payload, embedding in zip(entries, payloads, embeddings)
+        ]
+        if not await vector_store.insert_knowledge_batch(items, upsert=True):
+            raise RuntimeError("vector upsert failed")
+
+    async def _release_entities(self, entries: List[StoreOutboxEntry]):
+        """
+        删除不再被任何记忆（含冷存储中的记忆）引用的实体
+
+        Args:
+            entries: entity_release 发件箱记录列表
+        """
+        entity_ids = list(dict.fromkeys(entry.target_id for entry in entries))
+        async with async_read_session() as db:
+            referenced = set((await db.execute(
+                select(Memory.entity_id).where(Memory.entity_id.in_(entity_ids))
+            )).scalars())
+            referenced |= set((await db.execute(
+                select(ColdMemory.entity_id).where(ColdMemory.entity_id.in_(entity_ids))
+            )).scalars())
+
+        released = [entity_id for entity_id in entity_ids if entity_id not in referenced]
+        if released:
+            await graph_store.delete_entities(released)
+
+    async def drain(self) -> int:
+        """
+        执行发件箱中到期的操作（后台补偿）
+
+        Returns:
+            执行成功的操作数
+        """
+        if self._drain_lock is None:
+            self._drain_lock = asyncio.Lock()
+
+        applied = 0
+        async with self._drain_lock:
+            while True:
+                async with async_read_session() as db:
+                    entries = await OutboxRepository(db).list_due(datetime.now(), self.batch_size)
+                if not entries:
+                    break
+                if not await self.apply(entries):
+                    # 有失败的操作时等待下一轮，避免在下游不可用时空转
+                    break
+                applied += len(entries)
+                if len(entries) < self.batch_size:
+                    break
+
+        if applied:
+            logger.info(f"Outbox drained: {applied} operations applied")
+        return applied
+
+    async def pending_count(self) -> int:
+        """
+        统计发件箱中尚未执行成功的操作数
+
+        Returns:
+            操作数
+        """
+        async with async_read_session() as db:
+            return await OutboxRepository(db).count()
+
+    def get_metrics(self) -> Dict[str, int]:
+        """
+        获取发件箱执行统计
+
+        Returns:
+            统计信息：applied（执行成功的操作数）, failed（推迟重试的操作数）
+        """
+        return {"applied": self._applied, "failed": self._failed}
+
+    def start(self):
+        """启动后台补偿"""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._dispatch_loop())
+        logger.info(f"Outbox dispatcher started: interval={self.poll_interval}s")
+
+    async def stop(self):
+        """停止后台补偿（未执行的操作保留在发件箱中，下次启动时继续）"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Outbox dispatcher stopped")
+
+    async def _dispatch_loop(self):
+        """定期执行发件箱中到期的操作"""
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"Failed to drain outbox: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+# 全局发件箱实例 - 使用懒加载
+_store_outbox = None
+_store_outbox_lock = threading.Lock()
+
+
+def get_store_outbox() -> StoreOutbox:
+    """获取发件箱实例（线程安全的懒加载）"""
+    global _store_outbox
+    if _store_outbox is None:
+        with _store_outbox_lock:
+            if _store_outbox is None:  # 双重检查锁定
+                _store_outbox = StoreOutbox()
+    return _store_outbox
+
+
+# 向后兼容的属性访问器
+class StoreOutboxProxy:
+    """发件箱代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_store_outbox(), name)
+
+
+store_outbox = StoreOutboxProxy()
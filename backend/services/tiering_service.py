@@ -0,0 +1,369 @@
+"""
+记忆分层服务
+按访问次数和最近访问时间将长期不用的记忆从热存储（Milvus）降级到冷存储，检索命中后再恢复到热存储
+"""
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+import asyncio
+import json
+import math
+import threading
+
+from sqlalchemy import func
+
+from config import settings
+from models.database import SessionLocal, Memory, Persona, async_read_session
+from models.db_writer import db_writer
+from repositories.memory_repository import MemoryRepository
+from memory.vector_store import vector_store
+from memory.cold_store import cold_store
+from memory.quantization import bytes_per_vector
+from memory.dedup_index import memory_dedup_index
+from core.memory_engine import memory_context_renderer
+from services.job_queue import job_queue
+from utils.logger import logger
+
+
+# 记忆降级任务在任务队列中的类型
+TIERING_JOB_KIND = "memory_tiering"
+
+# 每批降级的记忆数量（每批一次向量读取、一次归档、一个SQL事务）
+_DEMOTE_BATCH_SIZE = 500
+
+
+class TieringService:
+    """
+    记忆分层服务
+
+    热度评分 = (访问权重 × 访问评分 + 时效权重 × 时效评分) / (访问权重 + 时效权重)，
+    其中访问评分为访问次数相对记忆体内最大访问次数的比例，时效评分按最近访问时间指数衰减，
+    权重和衰减系数与检索时的综合评分一致。
+    热度低于阈值且超过最短闲置天数的记忆被降级；冷存储中的记忆在检索命中时恢复原ID和向量ID
+    """
+
+    def __init__(self):
+        """初始化记忆分层服务"""
+        self._scheduler_task: Optional[asyncio.Task] = None
+        logger.info(
+            f"TieringService initialized: demote_score={settings.MEMORY_COLD_DEMOTE_SCORE}, "
+            f"min_age_days={settings.MEMORY_COLD_MIN_AGE_DAYS}"
+        )
+
+    def plan(self, persona_id: str) -> List[Dict[str, Any]]:
+        """
+        选出记忆体中需要降级的记忆
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            待降级记忆列表（按热度升序），每项包含 id, vector_id, heat
+        """
+        now = datetime.now()
+        cutoff = now - timedelta(days=settings.MEMORY_COLD_MIN_AGE_DAYS)
+
+        db = SessionLocal()
+        try:
+            max_access = db.query(func.max(Memory.access_count)).filter(
+                Memory.persona_id == persona_id
+            ).scalar() or 0
+
+            # 创建时间和最近访问时间都早于闲置期限的记忆才是候选
+            rows = db.query(
+                Memory.id, Memory.vector_id, Memory.access_count, Memory.created_at, Memory.last_accessed_at
+            ).filter(
+                Memory.persona_id == persona_id,
+                Memory.created_at < cutoff,
+                func.coalesce(Memory.last_accessed_at, Memory.created_at) < cutoff
+            ).all()
+        finally:
+            db.close()
+
+        access_weight = settings.MEMORY_SCORE_ACCESS_WEIGHT
+        recency_weight = settings.MEMORY_SCORE_RECENCY_WEIGHT
+        total_weight = (access_weight + recency_weight) or 1.0
+
+        candidates = []
+        for row in rows:
+            access_score = min((row.access_count or 0) / max(max_access, 1), 1.0)
+            idle_ms = (now - (row.last_accessed_at or row.created_at)).total_seconds() * 1000
+            recency_score = math.exp(-settings.MEMORY_RECENCY_DECAY_LAMBDA * idle_ms)
+            heat = (access_weight * access_score + recency_weight * recency_score) / total_weight
+
+            if heat < settings.MEMORY_COLD_DEMOTE_SCORE:
+                candidates.append({"id": row.id, "vector_id": row.vector_id, "heat": heat})
+
+        candidates.sort(key=lambda c: c["heat"])
+        return candidates
+
+    async def demote(self, persona_id: str, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        将记忆体中的冷记忆降级到冷存储
+
+        每批先归档到冷存储，再在一个SQL事务中删除记忆记录，最后批量删除向量
+
+        Args:
+            persona_id: 记忆体ID
+            dry_run: 是否只返回计划，不修改数据
+
+        Returns:
+            降级结果统计
+        """
+        candidates = self.plan(persona_id)
+        if dry_run:
+            return {
+                "persona_id": persona_id,
+                "dry_run": True,
+                "memories_to_demote": len(candidates),
+                "projected_vector_bytes_saved": len(candidates) * (
+                    settings.EMBEDDING_DIMENSIONS * 4
+                    - bytes_per_vector(settings.EMBEDDING_DIMENSIONS, settings.MEMORY_COLD_VECTOR_DTYPE)
+                ),
+            }
+
+        demoted_total = 0
+        for start in range(0, len(candidates), _DEMOTE_BATCH_SIZE):
+            batch_ids = [c["id"] for c in candidates[start:start + _DEMOTE_BATCH_SIZE]]
+            demoted_total += await self._demote_batch(persona_id, batch_ids)
+            await job_queue.report_progress({
+                "persona_id": persona_id,
+                "memories_done": min(start + _DEMOTE_BATCH_SIZE, len(candidates)),
+                "memories_total": len(candidates),
+                "memories_demoted": demoted_total,
+            })
+
+        logger.info(f"Demoted {demoted_total} memories to cold store: persona_id={persona_id}")
+        return {
+            "persona_id": persona_id,
+            "dry_run": False,
+            "memories_demoted": demoted_total,
+            "cold_memories": (await cold_store.get_stats(persona_id))["memories"],
+        }
+
+    async def promote(self, memory_ids: List[str]) -> List[str]:
+        """
+        将冷存储中的记忆恢复到热存储（保留原记忆ID和向量ID）
+
+        Args:
+            memory_ids: 记忆ID列表
+
+        Returns:
+            恢复成功的记忆ID列表
+        """
+        archived = await cold_store.get(memory_ids)
+        if not archived:
+            return []
+
+        vector_items = [
+            {
+                "id": memory["vector_id"],
+                "persona_id": memory["persona_id"],
+                "content": memory["content"],
+                "embedding": memory["embedding"],
+                "entity_id": memory["entity_id"],
+                "metadata": json.loads(memory["meta_data"]) if memory["meta_data"] else None,
+            }
+            for memory in archived
+        ]
+        if not await vector_store.insert_knowledge_batch(vector_items):
+            logger.error(f"Failed to promote {len(archived)} memories: vector insert failed")
+            return []
+
+        def build_memories() -> List[Memory]:
+            return [
+                Memory(
+                    id=memory["id"],
+                    vector_id=memory["vector_id"],
+                    persona_id=memory["persona_id"],
+                    entity_id=memory["entity_id"],
+                    type=memory["type"],
+                    content=memory["content"],
+                    created_at=memory["created_at"],
+                    event_time=memory["event_time"],
+                    last_accessed_at=memory["last_accessed_at"],
+                    access_count=memory["access_count"],
+                    meta_data=memory["meta_data"]
+                )
+                for memory in archived
+            ]
+
+        try:
+            await db_writer.submit(lambda db: MemoryRepository(db).add(build_memories()))
+        except Exception as e:
+            logger.error(f"Failed to promote {len(archived)} memories, rolling back vectors: {e}")
+            await vector_store.delete_vectors([item["id"] for item in vector_items])
+            return []
+
+        promoted_ids = [memory["id"] for memory in archived]
+        await cold_store.delete(promoted_ids)
+
+        by_persona: Dict[str, List] = {}
+        for memory in archived:
+            by_persona.setdefault(memory["persona_id"], []).append((memory["id"], memory["content"]))
+        for persona_id, items in by_persona.items():
+            await memory_dedup_index.add_many(persona_id, items)
+
+        logger.info(f"Promoted {len(promoted_ids)} memories from cold store")
+        return promoted_ids
+
+    async def enqueue(self, persona_id: str) -> Optional[str]:
+        """
+        提交降级任务到任务队列（与该记忆体的其他任务串行执行）
+
+        Args:
+            persona_id: 记忆体ID
+
+        Returns:
+            任务ID
+        """
+        return await job_queue.enqueue(
+            kind=TIERING_JOB_KIND,
+            payload={"persona_id": persona_id},
+            serial_key=persona_id
+        )
+
+    async def enqueue_all(self) -> List[str]:
+        """
+        为所有有记忆的记忆体提交降级任务
+
+        Returns:
+            任务ID列表
+        """
+        db = SessionLocal()
+        try:
+            persona_ids = [row[0] for row in db.query(Memory.persona_id).join(
+                Persona, Persona.id == Memory.persona_id
+            ).distinct().all()]
+        finally:
+            db.close()
+
+        job_ids = [job_id for job_id in [await self.enqueue(persona_id) for persona_id in persona_ids] if job_id]
+        logger.info(f"Enqueued {len(job_ids)} scheduled tiering jobs")
+        return job_ids
+
+    def start_scheduler(self):
+        """启动定期降级（MEMORY_TIERING_INTERVAL_HOURS 大于0时生效）"""
+        if settings.MEMORY_TIERING_INTERVAL_HOURS <= 0 or self._scheduler_task is not None:
+            return
+        self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+        logger.info(f"Tiering scheduler started: interval={settings.MEMORY_TIERING_INTERVAL_HOURS}h")
+
+    async def stop_scheduler(self):
+        """停止定期降级"""
+        if self._scheduler_task is None:
+            return
+        self._scheduler_task.cancel()
+        await asyncio.gather(self._scheduler_task, return_exceptions=True)
+        self._scheduler_task = None
+
+    async def _scheduler_loop(self):
+        """定期提交降级任务"""
+        interval = settings.MEMORY_TIERING_INTERVAL_HOURS * 3600
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.enqueue_all()
+            except Exception as e:
+                logger.error(f"Failed to enqueue scheduled tiering jobs: {e}")
+
+    async def _demote_batch(self, persona_id: str, memory_ids: List[str]) -> int:
+        """
+        降级一批记忆
+
+        Args:
+            persona_id: 记忆体ID
+            memory_ids: 记忆ID列表
+
+        Returns:
+            降级的记忆数
+        """
+        try:
+            async with async_read_session() as db:
+                memories = await MemoryRepository(db).get_many(memory_ids)
+            embeddings = await vector_store.get_embeddings([memory.vector_id for memory in memories])
+
+            # 缺少向量的记忆无法在冷存储中检索，保留在热存储
+            memories = [memory for memory in memories if memory.vector_id in embeddings]
+            if not memories:
+                return 0
+
+            # 先归档再删除热存储记录；上次在两步之间中断遗留的归档记录先清理掉
+            await cold_store.delete([memory.id for memory in memories])
+            await cold_store.archive(
+                [
+                    {
+                        "id": memory.id,
+                        "persona_id": memory.persona_id,
+                        "vector_id": memory.vector_id,
+                        "entity_id": memory.entity_id,
+                        "type": memory.type,
+                        "content": memory.content,
+                        "created_at": memory.created_at,
+                        "event_time": memory.event_time,
+                        "last_accessed_at": memory.last_accessed_at,
+                        "access_count": memory.access_count,
+                        "meta_data": memory.meta_data,
+                    }
+                    for memory in memories
+                ],
+                [embeddings[memory.vector_id] for memory in memories]
+            )
+
+            demoted_ids = [memory.id for memory in memories]
+            vector_ids = [memory.vector_id for memory in memories]
+            await db_writer.submit(lambda db: MemoryRepository(db).delete_many(demoted_ids))
+
+        except Exception as e:
+            logger.error(f"Failed to demote memory batch for persona={persona_id}: {e}")
+            raise
+
+        if not await vector_store.delete_vectors(vector_ids):
+            logger.warning(f"Failed to delete {len(vector_ids)} demoted vectors for persona={persona_id}")
+
+        await memory_dedup_index.remove_many(demoted_ids)
+        for memory_id in demoted_ids:
+            memory_context_renderer.invalidate(memory_id)
+
+        return len(demoted_ids)
+
+
+# 全局记忆分层服务实例 - 使用懒加载
+_tiering_service = None
+_tiering_service_lock = threading.Lock()
+
+
+def get_tiering_service() -> TieringService:
+    """获取记忆分层服务实例（线程安全的懒加载）"""
+    global _tiering_service
+    if _tiering_service is None:
+        with _tiering_service_lock:
+            if _tiering_service is None:  # 双重检查锁定
+                _tiering_service = TieringService()
+    return _tiering_service
+
+
+# 向后兼容的属性访问器
+class TieringServiceProxy:
+    """记忆分层服务代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_tiering_service(), name)
+
+
+tiering_service = TieringServiceProxy()
+
+
+async def _run_tiering_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    任务队列中记忆降级任务的处理函数
+
+    Args:
+        payload: 任务参数
+
+    Returns:
+        任务结果
+    """
+    return await get_tiering_service().demote(persona_id=payload["persona_id"])
+
+
+job_queue.register_handler(TIERING_JOB_KIND, _run_tiering_job)
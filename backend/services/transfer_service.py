@@ -0,0 +1,400 @@
+"""
+记忆体导入导出服务 - NDJSON流
+"""
+from typing import AsyncIterator, Dict, Any, List, Optional
+from datetime import datetime
+import json
+import threading
+
+from config import settings
+from models.database import Persona, async_read_session
+from models.db_writer import db_writer
+from repositories.memory_repository import MemoryRepository
+from repositories.persona_repository import PersonaRepository
+from memory.vector_store import vector_store
+from memory.cold_store import cold_store
+from memory.graph_store import graph_store
+from core.embedding_client import embedding_client
+from services.memory_service import memory_service
+from services.persona_service import persona_service
+from services.persona_registry import persona_registry
+from utils.logger import logger
+
+
+# 导出流的格式标识（首行header中的format字段）
+EXPORT_FORMAT = "mempoint.persona.v1"
+
+
+def _dump_line(record: Dict[str, Any]) -> str:
+    """将一条记录序列化为NDJSON的一行"""
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """解析导出记录中的ISO时间，无效时返回None"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _load_metadata(value: Optional[str]) -> Dict[str, Any]:
+    """解析归档记忆中以JSON文本存放的元数据，无效时返回空字典"""
+    if not value:
+        return {}
+    try:
+        metadata = json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    将请求体的字节块切分为行（只缓存未结束的一行）
+
+    Args:
+        chunks: 请求体字节块
+
+    Yields:
+        去掉首尾空白的非空行
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line.decode("utf-8")
+    buffer = buffer.strip()
+    if buffer:
+        yield buffer.decode("utf-8")
+
+
+class PersonaTransferService:
+    """
+    记忆体导入导出服务类
+
+    导出按页读取记忆和向量、逐行输出，内存占用与记忆总数无关；
+    导入按批向量化（向量随导出附带且模型一致时跳过）、批量写入向量库和数据库，图谱用 UNWIND 批量写入
+    """
+
+    def __init__(self, batch_size: int = settings.MEMORY_TRANSFER_BATCH_SIZE):
+        """
+        初始化导入导出服务
+
+        Args:
+            batch_size: 导出每页读取、导入每批写入的记忆数
+        """
+        self.batch_size = max(1, batch_size)
+        logger.info(f"PersonaTransferService initialized: batch_size={self.batch_size}")
+
+    async def export_persona(self, persona_id: str, include_vectors: bool = True) -> AsyncIterator[str]:
+        """
+        以NDJSON流导出记忆体
+
+        首行为header，其后依次为 memory（先热存储、后冷存储归档）、entity、relation 记录，
+        末行为包含各类记录数的footer（memory_count 含归档记忆，cold_memory_count 为其中的归档记忆数）
+
+        Args:
+            persona_id: 记忆体ID
+            include_vectors: 是否附带向量（热存储为全精度，冷存储为反量化后的低精度向量；导入到同一Embedding模型时可跳过向量化）
+
+        Yields:
+            NDJSON行
+        """
+        persona = await persona_service.get_persona(persona_id)
+        yield _dump_line({
+            "kind": "header",
+            "format": EXPORT_FORMAT,
+            "persona_id": persona_id,
+            "description": persona.description if persona else None,
+            "system_prompt": persona.system_prompt if persona else None,
+            "embedding_model": settings.EMBEDDING_MODEL,
+            "embedding_dimensions": settings.EMBEDDING_DIMENSIONS,
+            "exported_at": datetime.now().isoformat(),
+        })
+
+        counts = {"memory": 0, "cold_memory": 0, "entity": 0, "relation": 0}
+        after = None
+        while True:
+            # 每页使用独立的短生命周期会话，不在输出过程中占用连接
+            async with async_read_session() as db:
+                memories = await MemoryRepository(db).list_page(
+                    persona_id=persona_id,
+                    after=after,
+                    limit=self.batch_size
+                )
+            if not memories:
+                break
+
+            embeddings = {}
+            if include_vectors:
+                embeddings = await vector_store.get_embeddings([memory.vector_id for memory in memories])
+
+            for memory in memories:
+                record = {
+                    "kind": "memory",
+                    "id": memory.id,
+                    "type": memory.type,
+                    "content": memory.content,
+                    "entity_id": memory.entity_id,
+                    "created_at": memory.created_at.isoformat() if memory.created_at else None,
+                    "event_time": memory.event_time.isoformat() if memory.event_time else None,
+                    "last_accessed_at": memory.last_accessed_at.isoformat() if memory.last_accessed_at else None,
+                    "access_count": memory.access_count or 0,
+                    "metadata": memory.get_metadata(),
+                }
+                embedding = embeddings.get(memory.vector_id)
+                if embedding is not None:
+                    record["embedding"] = embedding
+                yield _dump_line(record)
+
+            counts["memory"] += len(memories)
+            if len(memories) < self.batch_size:
+                break
+            after = (memories[-1].created_at, memories[-1].id)
+
+        # 冷存储中的归档记忆同样以 memory 记录导出（tier为'cold'），导入时写入热存储
+        after_id = None
+        while True:
+            cold_memories = await cold_store.list_page(
+                persona_id=persona_id,
+                after=after_id,
+                limit=self.batch_size,
+                include_vectors=include_vectors
+            )
+            if not cold_memories:
+                break
+
+            for memory in cold_memories:
+                record = {
+                    "kind": "memory",
+                    "tier": "cold",
+                    "id": memory["id"],
+                    "type": memory["type"],
+                    "content": memory["content"],
+                    "entity_id": memory["entity_id"],
+                    "created_at": memory["created_at"].isoformat() if memory["created_at"] else None,
+                    "event_time": memory["event_time"].isoformat() if memory["event_time"] else None,
+                    "last_accessed_at": memory["last_accessed_at"].isoformat() if memory["last_accessed_at"] else None,
+                    "access_count": memory["access_count"] or 0,
+                    "metadata": _load_metadata(memory["meta_data"]),
+                }
+                if "embedding" in memory:
+                    record["embedding"] = memory["embedding"]
+                yield _dump_line(record)
+
+            counts["memory"] += len(cold_memories)
+            counts["cold_memory"] += len(cold_memories)
+            if len(cold_memories) < self.batch_size:
+                break
+            after_id = cold_memories[-1]["id"]
+
+        for record in graph_store.export_persona_graph(persona_id):
+            counts[record["kind"]] += 1
+            yield _dump_line(record)
+
+        yield _dump_line({"kind": "footer", **{f"{kind}_count": count for kind, count in counts.items()}})
+        logger.info(f"Exported persona: id={persona_id}, {counts}")
+
+    async def import_persona(self, persona_id: str, chunks: AsyncIterator[bytes]) -> Dict[str, int]:
+        """
+        导入 export_persona 生成的NDJSON流到记忆体（记忆体不存在时按header创建）
+
+        记忆总是以新ID写入，可以导入到其他记忆体或重复导入为副本；冷存储的归档记忆导入到热存储，之后由分层任务重新归档
+
+        Args:
+            persona_id: 目标记忆体ID
+            chunks: 请求体字节块
+
+        Returns:
+            导入统计：memories, embedded（重新向量化的记忆数）, reused_vectors, entities, relations, skipped
+
+        Raises:
+            ValueError: 首行不是有效的header
+        """
+        stats = {"memories": 0, "embedded": 0, "reused_vectors": 0, "entities": 0, "relations": 0, "skipped": 0}
+        header = None
+        source_suffix = None
+        reuse_vectors = False
+        memories: List[Dict[str, Any]] = []
+        entities: List[Dict[str, Any]] = []
+        relations: List[Dict[str, Any]] = []
+
+        async for line in _iter_lines(chunks):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            if not isinstance(record, dict):
+                if header is None:
+                    raise ValueError("Import stream must start with a JSON header line")
+                stats["skipped"] += 1
+                continue
+
+            kind = record.get("kind")
+            if header is None:
+                if kind != "header" or record.get("format") != EXPORT_FORMAT:
+                    raise ValueError(f"Import stream must start with a '{EXPORT_FORMAT}' header line")
+                header = record
+                source_suffix = f"|{header.get('persona_id')}"
+                # 同一Embedding模型和维度导出的向量可直接复用
+                reuse_vectors = (
+                    header.get("embedding_model") == settings.EMBEDDING_MODEL
+                    and header.get("embedding_dimensions") == settings.EMBEDDING_DIMENSIONS
+                )
+                await self._ensure_persona(persona_id, header)
+                continue
+
+            if kind == "memory":
+                if not isinstance(record.get("content"), str) or not record["content"]:
+                    stats["skipped"] += 1
+                    continue
+                memories.append(record)
+                if len(memories) >= self.batch_size:
+                    await self._import_memories(persona_id, memories, source_suffix, reuse_vectors, stats)
+                    memories = []
+            elif kind == "entity":
+                entities.append(record)
+                if len(entities) >= self.batch_size:
+                    stats["entities"] += await graph_store.merge_entities(persona_id, entities)
+                    entities = []
+            elif kind == "relation":
+                relations.append(record)
+                if len(relations) >= self.batch_size:
+                    # 先写入实体，避免关系隐式创建的空实体占用ID导致实体属性丢失
+                    stats["entities"] += await graph_store.merge_entities(persona_id, entities)
+                    stats["relations"] += await graph_store.merge_relations(persona_id, relations)
+                    entities = []
+                    relations = []
+            elif kind != "footer":
+                stats["skipped"] += 1
+
+        if header is None:
+            raise ValueError("Import stream is empty")
+
+        await self._import_memories(persona_id, memories, source_suffix, reuse_vectors, stats)
+        stats["entities"] += await graph_store.merge_entities(persona_id, entities)
+        stats["relations"] += await graph_store.merge_relations(persona_id, relations)
+
+        logger.info(f"Imported persona: id={persona_id}, source={header.get('persona_id')}, {stats}")
+        return stats
+
+    async def _ensure_persona(self, persona_id: str, header: Dict[str, Any]):
+        """
+        目标记忆体不存在时按header中的描述和系统提示词创建
+
+        Args:
+            persona_id: 目标记忆体ID
+            header: 导出流的header
+        """
+        if await persona_service.get_persona(persona_id):
+            return
+        persona = Persona(
+            id=persona_id,
+            description=header.get("description"),
+            system_prompt=header.get("system_prompt")
+        )
+        # 经写入队列立即提交：请求的工作单元在响应开始时才提交，其持有的写锁会阻塞后续的批量写入
+        await db_writer.submit(lambda db: PersonaRepository(db).add(persona))
+        persona_registry.put(persona)
+        logger.info(f"Created persona for import: id={persona_id}")
+
+    async def _import_memories(
+        self,
+        persona_id: str,
+        records: List[Dict[str, Any]],
+        source_suffix: Optional[str],
+        reuse_vectors: bool,
+        stats: Dict[str, int]
+    ):
+        """
+        导入一批记忆（缺少可用向量的记忆分批向量化，按类型一次向量插入 + 一次SQL事务）
+
+        Args:
+            persona_id: 目标记忆体ID
+            records: 导出流中的 memory 记录
+            source_suffix: 源记忆体实体ID的后缀（|源记忆体ID），导入时替换为目标记忆体
+            reuse_vectors: 是否复用记录中附带的向量
+            stats: 导入统计（原地累加）
+        """
+        if not records:
+            return
+
+        embeddings: List[Optional[List[float]]] = []
+        for record in records:
+            embedding = record.get("embedding") if reuse_vectors else None
+            if isinstance(embedding, list) and len(embedding) == settings.EMBEDDING_DIMENSIONS:
+                embeddings.append(embedding)
+            else:
+                embeddings.append(None)
+
+        pending = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        embed_batch_size = max(1, settings.MEMORY_IMPORT_EMBED_BATCH_SIZE)
+        for start in range(0, len(pending), embed_batch_size):
+            indices = pending[start:start + embed_batch_size]
+            vectors = await embedding_client.embed_batch([records[index]["content"] for index in indices])
+            for index, vector in zip(indices, vectors):
+                embeddings[index] = vector
+        stats["embedded"] += len(pending)
+        stats["reused_vectors"] += len(records) - len(pending)
+
+        groups: Dict[str, Dict[str, list]] = {}
+        for record, embedding in zip(records, embeddings):
+            entity_id = record.get("entity_id")
+            if entity_id and source_suffix and entity_id.endswith(source_suffix):
+                entity_id = entity_id[:-len(source_suffix)] + f"|{persona_id}"
+            group = groups.setdefault(record.get("type") or "long_term", {"memories": [], "embeddings": []})
+            group["memories"].append({
+                "content": record["content"],
+                "entity_id": entity_id,
+                "metadata": record.get("metadata") if isinstance(record.get("metadata"), dict) else None,
+                "event_time": _parse_datetime(record.get("event_time")),
+                "created_at": _parse_datetime(record.get("created_at")),
+                "last_accessed_at": _parse_datetime(record.get("last_accessed_at")),
+                "access_count": record.get("access_count") if isinstance(record.get("access_count"), int) else 0,
+            })
+            group["embeddings"].append(embedding)
+
+        for type, group in groups.items():
+            created = await memory_service.create_memories_batch(
+                persona_id=persona_id,
+                memories=group["memories"],
+                embeddings=group["embeddings"],
+                type=type
+            )
+            stats["memories"] += len(created)
+
+    def close(self):
+        """关闭服务"""
+        logger.info("PersonaTransferService closed")
+
+
+# 全局导入导出服务实例 - 使用懒加载
+_transfer_service = None
+_transfer_service_lock = threading.Lock()
+
+
+def get_transfer_service() -> PersonaTransferService:
+    """获取导入导出服务实例（线程安全的懒加载）"""
+    global _transfer_service
+    if _transfer_service is None:
+        with _transfer_service_lock:
+            if _transfer_service is None:  # 双重检查锁定
+                _transfer_service = PersonaTransferService()
+    return _transfer_service
+
+
+# 向后兼容的属性访问器
+class PersonaTransferServiceProxy:
+    """导入导出服务代理类，支持懒加载"""
+
+    def __getattr__(self, name):
+        return getattr(get_transfer_service(), name)
+
+
+transfer_service = PersonaTransferServiceProxy()
@@ -47,6 +47,25 @@ def get_current_timestamp_ms() -> int:
     return int(time.time() * 1000)
 
 
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    """
+    计算两个向量的余弦相似度
+
+    Args:
+        a: 向量a
+        b: 向量b
+
+    Returns:
+        余弦相似度
+    """
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if norm_a == 0 or norm_b == 0:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
 def calculate_similarity_score(
     similarity: float,
     access_count: int,
@@ -195,3 +214,40 @@ def truncate_text(text: str, max_length: int = 1000, suffix: str = "...") -> str
     if len(text) <= max_length:
         return text
     return text[:max_length - len(suffix)] + suffix
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    """
+    将分页位置编码为不透明的游标字符串（URL安全的base64）
+
+    Args:
+        data: 分页位置（可JSON序列化）
+
+    Returns:
+        游标字符串
+    """
+    import base64
+    import json
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Dict[str, Any]]:
+    """
+    解码游标字符串
+
+    Args:
+        cursor: encode_cursor 生成的游标
+
+    Returns:
+        分页位置，游标无效时返回None
+    """
+    import base64
+    import binascii
+    import json
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw.decode("utf-8"))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
@@ -0,0 +1,79 @@
+"""
+全文检索分词工具
+将中日韩文字切分为重叠的二元组，其余文字按单词切分，供SQLite FTS5（unicode61分词器按空格切分）使用
+"""
+from typing import List
+import re
+
+
+# 中日韩文字（CJK统一汉字及扩展A、兼容汉字、日文假名、韩文音节）连续片段，或其他文字/数字组成的单词
+_CJK_RANGES = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(
+    rf"([{_CJK_RANGES}]+)|([^\W_{_CJK_RANGES}]+)",
+    re.UNICODE
+)
+
+# 查询中最多使用的词元数量（避免超长查询生成过大的MATCH表达式）
+_MAX_QUERY_TOKENS = 32
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为词元
+
+    中日韩文字片段切分为重叠的二元组（单字片段保留单字），其他单词转为小写后整体保留，
+    这样 "张三的电话是13800138000" 会得到 张三、三的、的电、电话、话是、13800138000
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        词元列表
+    """
+    tokens = []
+    for cjk, word in _TOKEN_PATTERN.findall(text or ""):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def fts_tokens(text: str) -> str:
+    """
+    生成写入FTS5索引的文本（词元以空格分隔）
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        空格分隔的词元
+    """
+    return " ".join(tokenize(text))
+
+
+def fts_query(text: str) -> str:
+    """
+    生成FTS5 MATCH查询表达式：各词元以OR连接，由bm25按命中的词元数量和稀有程度排序
+
+    单个中日韩字符使用前缀匹配（索引中只有二元组）
+
+    Args:
+        text: 查询文本
+
+    Returns:
+        MATCH表达式，没有可用词元时返回空字符串
+    """
+    terms = []
+    for token in dict.fromkeys(tokenize(text)):
+        escaped = token.replace('"', '""')
+        if len(token) == 1 and not token.isascii():
+            terms.append(f'"{escaped}"*')
+        else:
+            terms.append(f'"{escaped}"')
+        if len(terms) >= _MAX_QUERY_TOKENS:
+            break
+    return " OR ".join(terms)